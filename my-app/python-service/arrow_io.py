@@ -0,0 +1,252 @@
+"""Arrow IPC transport for IPD in and out of the service
+
+JSON stays the default. Clients that send `Accept: application/vnd.apache.arrow.stream`
+get record batches streamed straight from the parquet files, and fit endpoints accept
+Arrow stream bodies, which are loaded into the dataset store without building
+per-row Python objects.
+"""
+import json
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qsl
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from dataset_store import datasets
+
+ARROW_STREAM_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+IPD_SCHEMA = pa.schema([
+    ('patient_id', pa.int64()),
+    ('time', pa.float64()),
+    ('event', pa.int8()),
+    ('arm', pa.string()),
+])
+
+# End-of-stream marker of the Arrow IPC streaming format
+_END_OF_STREAM = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+# Routes whose Arrow bodies are converted to dataset handles
+_SINGLE_ARM_ROUTES = {'/fit-one-piece', '/detect-cutpoint', '/detect-cutpoints', '/fit-piecewise', '/fit-spline'}
+_PAIR_ROUTES = {'/fit-km', '/test-ph'}
+_GRID_ROUTE = '/fit-grid'
+_DATASETS_ROUTE = '/datasets'
+_GRID_LIST_PARAMS = {'approaches', 'distributions', 'scales', 'knots'}
+
+
+def wants_arrow(accept_header: Optional[str]) -> bool:
+    return bool(accept_header) and ARROW_STREAM_MEDIA_TYPE in accept_header
+
+
+def _normalise_batch(batch: pa.RecordBatch, arm: str, id_offset: int) -> pa.RecordBatch:
+    """Project a parquet batch onto IPD_SCHEMA, labelling every row with the arm"""
+    n = batch.num_rows
+    names = batch.schema.names
+    if 'patient_id' in names:
+        patient_id = batch.column(names.index('patient_id')).cast(pa.int64())
+    else:
+        patient_id = pa.array(np.arange(id_offset + 1, id_offset + n + 1, dtype=np.int64))
+    return pa.RecordBatch.from_arrays(
+        [
+            patient_id,
+            batch.column(names.index('time')).cast(pa.float64()),
+            batch.column(names.index('event')).cast(pa.int8()),
+            pa.array([arm] * n, type=pa.string()) if n else pa.array([], type=pa.string()),
+        ],
+        schema=IPD_SCHEMA
+    )
+
+
+def stream_parquet_ipd(
+    sources: Iterable[Tuple[str, str]],
+    metadata: Optional[Dict[str, str]] = None
+) -> Iterator[bytes]:
+    """Arrow IPC stream of (path, arm) parquet sources, one record batch at a time.
+
+    Files are opened up-front so a missing file fails the request rather than the stream,
+    and closed once the stream is exhausted or abandoned.
+    """
+    schema = IPD_SCHEMA.with_metadata(metadata) if metadata else IPD_SCHEMA
+    files = []
+    try:
+        for path, arm in sources:
+            files.append((pq.ParquetFile(path), arm))
+    except Exception:
+        _close_files(files)
+        raise
+
+    def generate():
+        try:
+            yield schema.serialize().to_pybytes()
+            for parquet_file, arm in files:
+                offset = 0
+                for batch in parquet_file.iter_batches(columns=_available_columns(parquet_file)):
+                    yield _normalise_batch(batch, arm, offset).serialize().to_pybytes()
+                    offset += batch.num_rows
+            yield _END_OF_STREAM
+        finally:
+            _close_files(files)
+
+    return generate()
+
+
+def _close_files(files: List[Tuple[pq.ParquetFile, str]]) -> None:
+    for parquet_file, _ in files:
+        parquet_file.close()
+
+
+def _available_columns(parquet_file: pq.ParquetFile) -> List[str]:
+    names = parquet_file.schema_arrow.names
+    return [name for name in ('patient_id', 'time', 'event') if name in names]
+
+
+def stream_arrays(columns: Dict[str, np.ndarray], metadata: Optional[Dict[str, str]] = None) -> bytes:
+    """Serialise in-memory columns as a single-batch Arrow IPC stream"""
+    batch = pa.RecordBatch.from_pydict({name: pa.array(values) for name, values in columns.items()})
+    schema = batch.schema.with_metadata(metadata) if metadata else batch.schema
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        writer.write_batch(batch.replace_schema_metadata(schema.metadata))
+    return sink.getvalue().to_pybytes()
+
+
+def read_arrow_table(body: bytes) -> pa.Table:
+    """Parse an Arrow IPC stream body"""
+    return pa.ipc.open_stream(pa.py_buffer(body)).read_all()
+
+
+def store_arrow_datasets(table: pa.Table) -> Dict[str, Dict]:
+    """Load an Arrow table into the dataset store, split by its optional 'arm' column"""
+    if 'time' not in table.column_names or 'event' not in table.column_names:
+        raise ValueError("Arrow body must have 'time' and 'event' columns")
+    time_values = table.column('time').to_numpy()
+    event_values = table.column('event').to_numpy()
+
+    if 'arm' not in table.column_names:
+        return {None: datasets.put(time_values, event_values)}
+
+    # Dictionary-encode the arm column: integer codes per row, one Python string per arm
+    arm_column = table.column('arm')
+    if pa.types.is_dictionary(arm_column.type):
+        arm_column = arm_column.cast(arm_column.type.value_type)
+    encoded = arm_column.combine_chunks().dictionary_encode()
+    codes = pc.fill_null(encoded.indices, -1).to_numpy()
+    labels = encoded.dictionary.to_pylist()
+    stored = {}
+    # Arms in order of first appearance; code -1 collects rows without an arm
+    distinct, first_rows = np.unique(codes, return_index=True)
+    for code in distinct[np.argsort(first_rows)]:
+        arm = labels[code] if code >= 0 else None
+        mask = codes == code
+        stored[arm] = datasets.put(time_values[mask], event_values[mask], label=arm)
+    return stored
+
+
+def arrow_body_to_json(path: str, body: bytes, query_string: bytes) -> Dict:
+    """Translate an Arrow request body on a fit route into the equivalent JSON payload.
+
+    The table is stored once in the dataset store and the handler receives dataset ids;
+    other request fields come from the query string (list fields comma-separated).
+    """
+    stored = store_arrow_datasets(read_arrow_table(body))
+    params = dict(parse_qsl(query_string.decode('latin-1')))
+
+    if path == _DATASETS_ROUTE:
+        if len(stored) == 1:
+            return next(iter(stored.values()))
+        return {"datasets": {arm: info for arm, info in stored.items()}}
+
+    if path in _SINGLE_ARM_ROUTES:
+        arm = params.get('arm')
+        if arm in stored:
+            info = stored[arm]
+        elif len(stored) == 1:
+            # A single uploaded arm is the one being fitted, whatever its label
+            info = next(iter(stored.values()))
+        else:
+            labels = ', '.join(str(label) for label in stored)
+            raise ValueError(f"Arrow body has arms {labels}; pass ?arm= naming one of them")
+        return {**params, "dataset_id": info['dataset_id'], "arm": arm or info['label'] or 'arm'}
+
+    if path in _PAIR_ROUTES:
+        if 'chemo' not in stored or 'pembro' not in stored:
+            raise ValueError("Arrow body must have an 'arm' column with 'chemo' and 'pembro' rows")
+        return {
+            "chemo_dataset_id": stored['chemo']['dataset_id'],
+            "pembro_dataset_id": stored['pembro']['dataset_id']
+        }
+
+    if path == _GRID_ROUTE:
+        payload = {key: value for key, value in params.items() if key not in _GRID_LIST_PARAMS}
+        for key in _GRID_LIST_PARAMS & params.keys():
+            payload[key] = [item for item in params[key].split(',') if item]
+        payload["dataset_ids"] = {arm: info['dataset_id'] for arm, info in stored.items() if arm is not None}
+        return payload
+
+    raise ValueError(f"Arrow bodies are not supported on {path}")
+
+
+def _is_arrow_route(path: str) -> bool:
+    return path in _SINGLE_ARM_ROUTES or path in _PAIR_ROUTES or path in (_GRID_ROUTE, _DATASETS_ROUTE)
+
+
+async def _send_json(send, status: int, body: bytes) -> None:
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class ArrowBodyMiddleware:
+    """ASGI middleware converting Arrow stream request bodies into dataset handles"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] != 'POST' or not _is_arrow_route(scope['path']):
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope['headers'])
+        content_type = headers.get(b'content-type', b'').decode('latin-1')
+        if ARROW_STREAM_MEDIA_TYPE not in content_type:
+            return await self.app(scope, receive, send)
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            body.extend(message.get('body', b''))
+            more_body = message.get('more_body', False)
+
+        try:
+            payload = json.dumps(arrow_body_to_json(scope['path'], bytes(body), scope['query_string'])).encode('utf-8')
+        except Exception as e:
+            error = json.dumps({"detail": f"Invalid Arrow body: {e}"}).encode('utf-8')
+            return await _send_json(send, 400, error)
+
+        if scope['path'] == _DATASETS_ROUTE:
+            # The upload is complete once stored; answer without a JSON round trip
+            return await _send_json(send, 200, payload)
+
+        new_headers = [
+            (key, value) for key, value in scope['headers']
+            if key not in (b'content-type', b'content-length')
+        ]
+        new_headers += [(b'content-type', b'application/json'), (b'content-length', str(len(payload)).encode())]
+        scope = dict(scope, headers=new_headers)
+
+        sent = False
+
+        async def json_receive():
+            nonlocal sent
+            if not sent:
+                sent = True
+                return {'type': 'http.request', 'body': payload, 'more_body': False}
+            return await receive()
+
+        await self.app(scope, json_receive, send)
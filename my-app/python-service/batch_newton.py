@@ -0,0 +1,115 @@
+"""Damped Newton maximisation run in lock-step over a batch of parameter sets
+
+Used where many small likelihoods share one data set, such as bootstrap
+replicates or subgroups written as rows of a (B, n) weight matrix. Each row
+has its own parameters, step length and convergence flag, but every
+iteration is a handful of array operations over the whole batch.
+"""
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+# log_likelihood(theta_rows, rows, order) -> (ll,), (ll, gradient) or (ll, gradient, hessian)
+# for the parameter sets theta_rows (k, p) of the batch rows `rows`
+LogLikelihood = Callable[[np.ndarray, np.ndarray, int], Tuple[np.ndarray, ...]]
+
+
+def maximise(
+    log_likelihood: LogLikelihood,
+    theta: np.ndarray,
+    tolerance,
+    max_iter: int = 100,
+    max_step: Optional[float] = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Maximise B independent likelihoods from starting points theta (B, p).
+
+    Args:
+        log_likelihood: Batch log-likelihood with derivatives (see LogLikelihood)
+        theta: Starting parameters, one row per batch member
+        tolerance: Per-row (or scalar) bound on the largest absolute gradient component
+        max_step: Optional cap on any parameter's change per iteration, which keeps
+            rows from jumping into regions where the likelihood is numerically degenerate
+
+    Returns:
+        (theta, ll, hessian, iterations, converged) with one row per batch member
+    """
+    theta = np.array(theta, dtype=np.float64)
+    rows = np.arange(len(theta))
+    tolerance = np.broadcast_to(np.asarray(tolerance, dtype=np.float64), rows.shape)
+    ll, gradient, hess = log_likelihood(theta, rows, 2)
+    iterations = np.zeros(len(theta), dtype=int)
+    active = np.ones(len(theta), dtype=bool)
+    failed = np.zeros(len(theta), dtype=bool)
+
+    for _ in range(max_iter):
+        # Rows whose derivatives are no longer finite cannot take another step
+        failed |= ~(np.all(np.isfinite(gradient), axis=1) & np.all(np.isfinite(hess), axis=(1, 2)))
+        active &= ~failed & ~(np.max(np.abs(gradient), axis=1) <= tolerance)
+        if not active.any():
+            break
+        rows = np.flatnonzero(active)
+        step = _ascent_direction(hess[rows], gradient[rows])
+        if max_step is not None:
+            step *= np.minimum(1.0, max_step / np.maximum(np.max(np.abs(step), axis=1), 1e-300))[:, np.newaxis]
+
+        # Halve the step until the likelihood does not decrease
+        scale = np.ones(len(rows))
+        for _ in range(30):
+            new_ll = log_likelihood(theta[rows] + scale[:, np.newaxis] * step, rows, 0)[0]
+            improved = np.isfinite(new_ll) & (new_ll >= ll[rows] - 1e-10 * np.abs(ll[rows]))
+            if improved.all():
+                break
+            scale = np.where(improved, scale, scale / 2)
+        theta[rows] = theta[rows] + scale[:, np.newaxis] * step
+        iterations[rows] += 1
+        ll[rows], gradient[rows], hess[rows] = log_likelihood(theta[rows], rows, 2)
+    return theta, ll, hess, iterations, ~active & ~failed
+
+
+def _ascent_direction(hess: np.ndarray, gradient: np.ndarray) -> np.ndarray:
+    """Newton step, with the Hessian shifted to be negative definite where it is not"""
+    largest = np.linalg.eigvalsh(hess)[:, -1]
+    shift = np.where(largest >= 0, 1.1 * largest + 1e-8 * (1 + np.abs(largest)), 0.0)
+    shifted = hess - shift[:, np.newaxis, np.newaxis] * np.eye(hess.shape[1])
+    return np.linalg.solve(shifted, -gradient[..., np.newaxis])[..., 0]
+
+
+def numeric_derivatives(value: Callable[[np.ndarray, np.ndarray], np.ndarray], step: float = 1e-4) -> LogLikelihood:
+    """Turn value(theta_rows, rows) -> ll into a LogLikelihood by central differences"""
+
+    def log_likelihood(theta, rows, order):
+        ll = value(theta, rows)
+        if order == 0:
+            return (ll,)
+        p = theta.shape[1]
+        h = step * np.maximum(1.0, np.abs(theta))
+        plus = np.empty((len(theta), p))
+        minus = np.empty((len(theta), p))
+        for j in range(p):
+            shift = np.zeros_like(theta)
+            shift[:, j] = h[:, j]
+            plus[:, j] = value(theta + shift, rows)
+            minus[:, j] = value(theta - shift, rows)
+        with np.errstate(invalid='ignore'):
+            gradient = (plus - minus) / (2 * h)
+        if order == 1:
+            return ll, gradient
+
+        hess = np.empty((len(theta), p, p))
+        for j in range(p):
+            with np.errstate(invalid='ignore'):
+                hess[:, j, j] = (plus[:, j] - 2 * ll + minus[:, j]) / h[:, j] ** 2
+            for k in range(j + 1, p):
+                corners = []
+                for sj, sk in ((1, 1), (1, -1), (-1, 1), (-1, -1)):
+                    shift = np.zeros_like(theta)
+                    shift[:, j] = sj * h[:, j]
+                    shift[:, k] = sk * h[:, k]
+                    corners.append(value(theta + shift, rows))
+                with np.errstate(invalid='ignore'):
+                    hess[:, j, k] = hess[:, k, j] = (
+                        corners[0] - corners[1] - corners[2] + corners[3]
+                    ) / (4 * h[:, j] * h[:, k])
+        return ll, gradient, hess
+
+    return log_likelihood
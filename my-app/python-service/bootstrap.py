@@ -0,0 +1,453 @@
+"""Nonparametric bootstrap of fitted survival extrapolations
+
+Replicates are rows of a multinomial weight matrix over the original IPD, not
+resampled DataFrames, and every model is refitted on a whole chunk of
+replicates at once, warm-started from its point estimate:
+
+- exponential: closed form
+- Gompertz: custom_gompertz.fit_weighted (analytic batch Newton)
+- Weibull, log-normal, log-logistic, generalized gamma: batch Newton on the
+  survival_predictor closed forms
+- Royston-Parmar splines: weighted refits on the point estimate's knots
+
+Chunks are spread across one long-lived process pool shared by every request,
+with a cap on the replicates in flight across all of them, and percentile
+bands of S(t) are emitted model by model as soon as all of a model's chunks
+are in.
+"""
+import os
+import threading
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+import survival_predictor
+from batch_newton import maximise, numeric_derivatives
+from custom_gompertz import fit_weighted as fit_gompertz_weighted
+from custom_spline_models import RoystonParmarFitter, spline_basis
+from model_grid import DEFAULT_DISTRIBUTIONS, DEFAULT_KNOTS, DEFAULT_SCALES, build_grid_tasks
+from survival_models import MILESTONE_TIMES, fit_one_piece_model, fit_spline_model
+
+BOOTSTRAP_WORKERS = int(os.environ.get('BOOTSTRAP_WORKERS', os.cpu_count() or 1))
+# Replicates per pool task; together with the seed it fixes every replicate's weights
+BOOTSTRAP_CHUNK_SIZE = int(os.environ.get('BOOTSTRAP_CHUNK_SIZE', '100'))
+# Replicates being refitted at once across every request; further chunks wait for room
+BOOTSTRAP_MAX_REPLICATES = int(os.environ.get(
+    'BOOTSTRAP_MAX_REPLICATES', 2 * max(1, BOOTSTRAP_WORKERS) * BOOTSTRAP_CHUNK_SIZE
+))
+DEFAULT_PERCENTILES = [2.5, 50.0, 97.5]
+
+# Working parameters of the batch-Newton families: (lifelines name, fitted on the log scale)
+_WORKING_PARAMETERS = {
+    'weibull': [('lambda_', True), ('rho_', True)],
+    'log-normal': [('mu_', False), ('sigma_', True)],
+    'log-logistic': [('alpha_', True), ('beta_', True)],
+    'generalized-gamma': [('mu_', False), ('ln_sigma_', False), ('lambda_', False)],
+}
+
+# Largest departure of a replicate's working parameters from the point estimate
+_MAX_DEPARTURE = 5.0
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_replicates_in_flight = 0
+_replicates_free = threading.Condition()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=max(1, BOOTSTRAP_WORKERS))
+        return _pool
+
+
+def shutdown_bootstrap_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def _reserve_replicates(size: int) -> int:
+    """Block until `size` replicates fit under BOOTSTRAP_MAX_REPLICATES; returns the amount reserved"""
+    global _replicates_in_flight
+    limit = max(1, BOOTSTRAP_MAX_REPLICATES)
+    size = min(size, limit)
+    with _replicates_free:
+        _replicates_free.wait_for(lambda: _replicates_in_flight + size <= limit)
+        _replicates_in_flight += size
+    return size
+
+
+def _release_replicates(size: int) -> None:
+    global _replicates_in_flight
+    with _replicates_free:
+        _replicates_in_flight -= size
+        _replicates_free.notify_all()
+
+
+def bootstrap_weights(n: int, size: int, seed: int, arm_index: int, chunk_index: int) -> np.ndarray:
+    """Multinomial resampling counts, shape (size, n).
+
+    Seeded by (seed, arm, chunk), so every model of an arm is refitted on the same replicates.
+    """
+    rng = np.random.default_rng([seed, arm_index, chunk_index])
+    return rng.multinomial(n, np.full(n, 1.0 / n), size=size).astype(np.float64)
+
+
+def _refit_parametric(distribution: str, t: np.ndarray, d: np.ndarray, weights: np.ndarray, point: Dict):
+    """Refit a one-piece model on every row of weights; returns (parameter arrays, failed mask)"""
+    if distribution == 'exponential':
+        events = weights @ d
+        with np.errstate(divide='ignore'):
+            return {'lambda_': (weights @ t) / events}, ~(events > 0)
+    if distribution == 'gompertz':
+        fit = fit_gompertz_weighted(t, d, weights)
+        return {'lambda_': fit['lambda_'], 'gamma_': fit['gamma_']}, ~fit['converged']
+    if distribution not in _WORKING_PARAMETERS:
+        raise ValueError(f"Bootstrap not supported for distribution: {distribution}")
+
+    names = _WORKING_PARAMETERS[distribution]
+
+    def params_of(theta):
+        return {name: np.exp(theta[:, j]) if log else theta[:, j] for j, (name, log) in enumerate(names)}
+
+    start = np.array([np.log(point[name]) if log else point[name] for name, log in names])
+
+    def value(theta, rows):
+        with np.errstate(invalid='ignore', over='ignore', divide='ignore'):
+            cumulative, log_hazard = survival_predictor.hazard_terms(distribution, params_of(theta), t)
+            ll = np.sum(weights[rows] * (d * log_hazard - cumulative), axis=1)
+        # Far from the point estimate the closed forms lose precision and can reward
+        # drifting off to infinity; such replicates stall at the bound and count as failed
+        inside = np.max(np.abs(theta - start), axis=1) <= _MAX_DEPARTURE
+        return np.where(np.isfinite(ll) & inside, ll, -np.inf)
+
+    theta = np.tile(start, (len(weights), 1))
+    tolerance = 1e-6 * np.maximum(1.0, weights @ d)
+    theta, ll, _, _, converged = maximise(numeric_derivatives(value), theta, tolerance, max_step=1.0)
+    return params_of(theta), ~(converged & np.isfinite(ll))
+
+
+def _refit_spline(t: np.ndarray, d: np.ndarray, weights: np.ndarray, point: Dict):
+    """Refit a Royston-Parmar model on every row of weights with the point estimate's knots"""
+    fitter = RoystonParmarFitter(scale=point['scale'], knots=len(point['knots']))
+    fitter.log_t = np.log(t)
+    fitter.knots_ = np.asarray(point['knots'], dtype=np.float64)
+    fitter.boundary_knots_ = np.asarray(point['boundary_knots'], dtype=np.float64)
+    X, fitter.X_deriv = spline_basis(fitter.log_t, fitter.knots_, fitter.boundary_knots_, derivative=True)
+
+    start = np.asarray(point['coeffs'], dtype=np.float64)
+    coeffs = np.full((len(weights), len(start)), np.nan)
+    for row, w in enumerate(weights):
+        fitter._optimise(X, d, init_params=start, weights=w)
+        if fitter.converged_:
+            coeffs[row] = fitter.params_
+    params = {key: point[key] for key in ('knots', 'boundary_knots', 'scale')}
+    return {**params, 'coeffs': coeffs}, ~np.all(np.isfinite(coeffs), axis=1)
+
+
+def _run_chunk(task: Dict, data: Dict) -> Dict:
+    """Refit one model on one chunk of replicates and evaluate S(t) for each replicate"""
+    started = time.perf_counter()
+    t = np.array(data['time'], dtype=np.float64)
+    t[t <= 0] = 1e-5
+    d = np.asarray(data['event'], dtype=np.float64)
+    weights = bootstrap_weights(len(t), task['size'], task['seed'], task['arm_index'], task['chunk_index'])
+    # Tied (time, event) rows share a likelihood term, so refit on the distinct rows only
+    distinct, inverse = np.unique(np.column_stack([t, d]), axis=0, return_inverse=True)
+    t, d = distinct[:, 0], distinct[:, 1]
+    # Sum each replicate's weights per distinct row, without an n x n_distinct indicator matrix
+    collapsed = np.zeros((len(weights), len(distinct)))
+    np.add.at(collapsed, (slice(None), inverse.ravel()), weights)
+    weights = collapsed
+
+    model = task['model']
+    if model['approach'] == 'spline':
+        family = 'royston-parmar'
+        params, failed = _refit_spline(t, d, weights, model['parameters'])
+    else:
+        family = model['distribution']
+        params, failed = _refit_parametric(family, t, d, weights, model['parameters'])
+
+    with np.errstate(invalid='ignore', over='ignore'):
+        survival = survival_predictor.evaluate(family, params, task['times'], 'survival')
+    survival = np.atleast_2d(survival)
+    survival[failed] = np.nan
+    return {
+        "key": task['key'],
+        "chunk_index": task['chunk_index'],
+        "survival": survival,
+        "seconds": time.perf_counter() - started
+    }
+
+
+def _trapezoid(values: np.ndarray, times: np.ndarray) -> np.ndarray:
+    return np.sum((values[..., 1:] + values[..., :-1]) / 2 * np.diff(times), axis=-1)
+
+
+def summarise_replicates(survival: np.ndarray, point: np.ndarray, grid: np.ndarray, percentiles: List[float]) -> Dict:
+    """Percentile bands of S(t), the milestones and restricted mean survival over the grid"""
+    n_grid = len(grid)
+    valid = np.all(np.isfinite(survival), axis=1)
+    replicates = survival[valid]
+
+    def bands(values: np.ndarray) -> Dict[str, object]:
+        if not len(values):
+            return {str(p): None for p in percentiles}
+        result = np.percentile(values, percentiles, axis=0)
+        return {str(p): value.tolist() for p, value in zip(percentiles, result)}
+
+    milestones = {}
+    for j, milestone in enumerate(MILESTONE_TIMES):
+        milestones[str(milestone)] = {"estimate": float(point[n_grid + j]), **bands(replicates[:, n_grid + j])}
+
+    return {
+        "n_replicates": int(len(survival)),
+        "n_failed": int((~valid).sum()),
+        "survival_bands": bands(replicates[:, :n_grid]),
+        "milestones": milestones,
+        "restricted_mean_survival": {
+            "horizon": float(grid[-1]),
+            "estimate": float(_trapezoid(point[:n_grid], grid)),
+            **bands(_trapezoid(replicates[:, :n_grid], grid))
+        }
+    }
+
+
+def bootstrap_tasks(
+    datasets: Dict[str, Dict],
+    approaches: Optional[List[str]] = None,
+    distributions: Optional[List[str]] = None,
+    scales: Optional[List[str]] = None,
+    knots: Optional[List[int]] = None
+) -> List[Dict]:
+    """The grid tasks to bootstrap ('one-piece' and 'spline' only, default one-piece models)"""
+    return build_grid_tasks(
+        list(datasets.keys()), approaches or ['one-piece'], distributions or DEFAULT_DISTRIBUTIONS,
+        scales or DEFAULT_SCALES, knots or DEFAULT_KNOTS, {}
+    )
+
+
+def fit_point_estimate(data: Dict, task: Dict) -> Dict:
+    """
+    Fit one task's point estimate, the warm start of its replicate fits.
+
+    Returns the fit result with its 'fit_seconds', or {'error': ...} when the
+    model cannot be fitted or bootstrapped.
+    """
+    started = time.perf_counter()
+    try:
+        if task['approach'] == 'spline':
+            result = fit_spline_model(data, task['arm'], task['scale'], task['knots'])
+        elif task['approach'] == 'one-piece':
+            result = fit_one_piece_model(data, task['arm'], task['distribution'])
+        else:
+            raise ValueError(f"Bootstrap supports 'one-piece' and 'spline' models, not '{task['approach']}'")
+        if result.get('error') or result.get('model_handle') is None:
+            raise ValueError(result.get('error') or "point fit failed")
+    except Exception as e:
+        return {"error": str(e)}
+    return {**result, "fit_seconds": time.perf_counter() - started}
+
+
+def stream_bootstrap(
+    datasets: Dict[str, Dict],
+    approaches: Optional[List[str]] = None,
+    distributions: Optional[List[str]] = None,
+    scales: Optional[List[str]] = None,
+    knots: Optional[List[int]] = None,
+    n_replicates: int = 1000,
+    seed: int = 0,
+    times=None,
+    percentiles: Optional[List[float]] = None,
+    max_workers: Optional[int] = None
+) -> Iterator[Dict]:
+    """Bootstrap every requested model, yielding one JSON-ready message per model.
+
+    Args:
+        datasets: Mapping of arm name to {'time': [...], 'event': [...]}
+        approaches, distributions, scales, knots: Model grid (as in fit_model_grid;
+            'one-piece' and 'spline' only, default one-piece models)
+        n_replicates: Bootstrap replicates per arm, shared by all models of the arm
+        seed: Seed of the multinomial weights
+        times: Grid for the S(t) bands (default survival_predictor.PREDICTION_GRID)
+        percentiles: Percentiles reported for every band (default 2.5, 50, 97.5)
+        max_workers: Chunks of this run in flight on the bootstrap pool at once
+            (defaults to BOOTSTRAP_WORKERS; 0 or 1 runs in-process)
+
+    Yields:
+        A 'header' message, one 'model' message per model (in completion order)
+        with its bands, milestones, restricted mean survival and compute time (point fit
+        plus all chunks), and a final 'summary'.
+    """
+    started = time.perf_counter()
+    tasks = bootstrap_tasks(datasets, approaches, distributions, scales, knots)
+    point_fits = [fit_point_estimate(datasets[task['arm']], task) for task in tasks]
+    yield from stream_replicates(
+        datasets, tasks, point_fits, n_replicates, seed, times, percentiles, max_workers, started
+    )
+
+
+def stream_replicates(
+    datasets: Dict[str, Dict],
+    tasks: List[Dict],
+    point_fits: List[Dict],
+    n_replicates: int = 1000,
+    seed: int = 0,
+    times=None,
+    percentiles: Optional[List[float]] = None,
+    max_workers: Optional[int] = None,
+    started: Optional[float] = None
+) -> Iterator[Dict]:
+    """
+    stream_bootstrap from point estimates fitted elsewhere.
+
+    For callers that schedule the point fits on a pool of their own (the API's
+    shared executor): point_fits are fit_point_estimate's results, in the order
+    of tasks. `started` is the perf_counter() the summary's elapsed time counts from.
+    """
+    start = time.perf_counter() if started is None else started
+    grid = survival_predictor.PREDICTION_GRID if times is None else np.asarray(times, dtype=np.float64)
+    evaluation_times = np.concatenate([grid, MILESTONE_TIMES])
+    percentiles = percentiles or DEFAULT_PERCENTILES
+    arms = list(datasets.keys())
+
+    yield {
+        "type": "header",
+        "times": grid.tolist(),
+        "percentiles": percentiles,
+        "n_replicates": n_replicates,
+        "seed": seed,
+        "n_models": len(tasks),
+        "chunk_size": BOOTSTRAP_CHUNK_SIZE
+    }
+
+    # Point estimates are the warm starts of every replicate fit
+    models, chunk_tasks, failed_models = {}, [], 0
+    for key, (task, result) in enumerate(zip(tasks, point_fits)):
+        if result.get('error'):
+            failed_models += 1
+            yield {"type": "model", "task": task, "error": result['error']}
+            continue
+        model = {"approach": task['approach'], "distribution": task.get('distribution'), "parameters": result['parameters']}
+        models[key] = {"task": task, "result": result, "chunks": {}, "seconds": result.get('fit_seconds', 0.0)}
+        for chunk_index, offset in enumerate(range(0, n_replicates, BOOTSTRAP_CHUNK_SIZE)):
+            chunk_tasks.append({
+                "key": key,
+                "arm": task['arm'],
+                "arm_index": arms.index(task['arm']),
+                "chunk_index": chunk_index,
+                "size": min(BOOTSTRAP_CHUNK_SIZE, n_replicates - offset),
+                "seed": seed,
+                "model": model,
+                "times": evaluation_times
+            })
+    n_chunks = {key: sum(1 for c in chunk_tasks if c['key'] == key) for key in models}
+
+    def finish(chunk: Dict) -> Optional[Dict]:
+        entry = models.get(chunk['key'])
+        if entry is None:  # an earlier chunk of this model failed
+            return None
+        entry['chunks'][chunk['chunk_index']] = chunk['survival']
+        entry['seconds'] += chunk['seconds']
+        if len(entry['chunks']) < n_chunks[chunk['key']]:
+            return None
+        del models[chunk['key']]
+        survival = np.vstack([entry['chunks'][i] for i in sorted(entry['chunks'])])
+        result = entry['result']
+        family = survival_predictor.record_family({"spec": entry['task']})
+        point = survival_predictor.survival(family, result['parameters'], evaluation_times)
+        return {
+            "type": "model",
+            "task": entry['task'],
+            "model_id": result['model_id'],
+            "model_handle": result['model_handle'],
+            **summarise_replicates(survival, point, grid, percentiles),
+            "elapsed_seconds": entry['seconds']
+        }
+
+    def failure(chunk_task: Dict, error: Exception) -> Optional[Dict]:
+        nonlocal failed_models
+        print(f"[Bootstrap] Chunk {chunk_task['chunk_index']} of {chunk_task['model']} failed: "
+              f"{error}\n{traceback.format_exc()}")
+        entry = models.pop(chunk_task['key'], None)
+        if entry is None:
+            return None
+        failed_models += 1
+        return {"type": "model", "task": entry['task'], "error": str(error)}
+
+    workers = BOOTSTRAP_WORKERS if max_workers is None else max_workers
+    workers = max(0, min(workers, len(chunk_tasks)))
+    if workers <= 1:
+        for chunk_task in chunk_tasks:
+            if chunk_task['key'] not in models:  # the model already failed
+                continue
+            reserved = _reserve_replicates(chunk_task['size'])
+            try:
+                message = finish(_run_chunk(chunk_task, datasets[chunk_task['arm']]))
+            except Exception as e:
+                message = failure(chunk_task, e)
+            finally:
+                _release_replicates(reserved)
+            if message:
+                yield message
+    else:
+        # At most `workers` chunks of this request are on the shared pool at once
+        queued = iter(chunk_tasks)
+        pending = {}
+
+        def submit_next() -> List[Dict]:
+            """Put the next live chunk on the pool; failures to submit come back as messages"""
+            messages = []
+            for chunk_task in queued:
+                if chunk_task['key'] not in models:  # the model already failed
+                    continue
+                reserved = _reserve_replicates(chunk_task['size'])
+                try:
+                    future = _get_pool().submit(_run_chunk, chunk_task, datasets[chunk_task['arm']])
+                except Exception as e:
+                    _release_replicates(reserved)
+                    if isinstance(e, BrokenProcessPool):
+                        shutdown_bootstrap_pool()
+                    messages.append(failure(chunk_task, e))
+                    continue
+                future.add_done_callback(lambda _, reserved=reserved: _release_replicates(reserved))
+                pending[future] = chunk_task
+                break
+            return [message for message in messages if message]
+
+        try:
+            for _ in range(workers):
+                yield from submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk_task = pending.pop(future)
+                    try:
+                        message = finish(future.result())
+                    except Exception as e:
+                        if isinstance(e, BrokenProcessPool):
+                            shutdown_bootstrap_pool()
+                        message = failure(chunk_task, e)
+                    if message:
+                        yield message
+                    yield from submit_next()
+        finally:
+            # A client that disconnects mid-stream must not keep replicates reserved
+            for future in pending:
+                future.cancel()
+
+    yield {
+        "type": "summary",
+        "n_models": len(tasks),
+        "n_failed_models": failed_models,
+        "workers": workers,
+        "elapsed_seconds": time.perf_counter() - start
+    }
@@ -1,91 +1,189 @@
 import numpy as np
-from scipy.optimize import minimize
+import pandas as pd
+from scipy import special
+
+import survival_predictor
+from batch_newton import maximise
+
+# Below this |gamma * t| the derivative kernels use their power series (Horner, 8 terms)
+_SERIES_LIMIT = 0.1
+_SERIES_ORDERS = np.arange(8)
+_G1_COEFFS = (_SERIES_ORDERS + 1) / special.factorial(_SERIES_ORDERS + 2)
+_G2_COEFFS = (_SERIES_ORDERS + 1) * (_SERIES_ORDERS + 2) / special.factorial(_SERIES_ORDERS + 3)
+
+
+def _horner(coeffs, x):
+    result = np.full_like(x, coeffs[-1])
+    for c in coeffs[-2::-1]:
+        result = result * x + c
+    return result
+
+
+def _kernels(x):
+    """g1(x) = (x e^x - e^x + 1) / x^2 and g1'(x), the gamma-derivative kernels of t * exprel(gamma t).
+
+    Both are evaluated from their power series near zero, where the closed forms cancel.
+    """
+    small = np.abs(x) < _SERIES_LIMIT
+    xs = np.where(small, x, 0.0)
+    xl = np.where(small, 1.0, x)
+    with np.errstate(over='ignore', invalid='ignore'):
+        ex = np.exp(xl)
+        g1 = (xl * ex - ex + 1) / xl ** 2
+        g2 = (xl ** 2 * ex - 2 * xl * ex + 2 * ex - 2) / xl ** 3
+    return np.where(small, _horner(_G1_COEFFS, xs), g1), np.where(small, _horner(_G2_COEFFS, xs), g2)
+
+
+def _log_likelihood(theta, t, d, weights, order=2):
+    """Weighted Gompertz log-likelihood in theta = (log lambda, gamma) for B parameter sets.
+
+    theta has shape (B, 2) and weights (B, n); returns ll (B,) and, up to `order`,
+    the gradient (B, 2) and Hessian (B, 2, 2). -ll is convex in theta.
+    """
+    log_lambda, gamma = theta[:, :1], theta[:, 1:]
+    lambda_ = np.exp(log_lambda)
+    x = gamma * t
+    with np.errstate(over='ignore', invalid='ignore'):
+        cumulative = lambda_ * t * special.exprel(x)
+        ll = np.sum(weights * (d * (log_lambda + x) - cumulative), axis=1)
+        if order == 0:
+            return (ll,)
+
+        g1, g2 = _kernels(x)
+        dH_dgamma = lambda_ * t ** 2 * g1
+        gradient = np.column_stack([
+            np.sum(weights * (d - cumulative), axis=1),
+            np.sum(weights * (d * t - dH_dgamma), axis=1)
+        ])
+        if order == 1:
+            return ll, gradient
+        hess = np.empty((len(theta), 2, 2))
+        hess[:, 0, 0] = -np.sum(weights * cumulative, axis=1)
+        hess[:, 0, 1] = hess[:, 1, 0] = -np.sum(weights * dH_dgamma, axis=1)
+        hess[:, 1, 1] = -np.sum(weights * lambda_ * t ** 3 * g2, axis=1)
+    return ll, gradient, hess
+
+
+def _newton(t, d, weights, theta):
+    """Newton iterations in lock-step for every row of weights (see batch_newton.maximise)"""
+    def log_likelihood(theta_rows, rows, order):
+        return _log_likelihood(theta_rows, t, d, weights[rows], order)
+
+    tolerance = 1e-8 * np.maximum(1.0, np.sum(weights * d, axis=1))
+    return maximise(log_likelihood, theta, tolerance)
+
+
+def _start(t, d, weights):
+    # Exponential rate with gamma = 0
+    rate = np.sum(weights * d, axis=1) / np.sum(weights * t, axis=1)
+    return np.column_stack([np.log(np.maximum(rate, 1e-12)), np.zeros(len(weights))])
+
+
+def _prepare(durations, event_observed):
+    durations = np.array(durations, dtype=np.float64)
+    event_observed = np.array(event_observed, dtype=np.float64)
+    # Handle zeros
+    durations[durations <= 0] = 1e-5
+    return durations, event_observed
+
+
+def fit_weighted(durations, event_observed, weights):
+    """Fit one Gompertz model per row of a (B, n) weight matrix in a single vectorised Newton run.
+
+    Rows may be bootstrap multinomial counts or 0/1 subgroup indicators.
+
+    Returns:
+        Dict of (B,) arrays: 'lambda_', 'gamma_', 'log_likelihood', 'iterations', 'converged'.
+        'lambda_'/'gamma_' can be passed straight to survival_predictor for (B, n_times) curves.
+    """
+    t, d = _prepare(durations, event_observed)
+    weights = np.atleast_2d(np.asarray(weights, dtype=np.float64))
+    if weights.shape[1] != len(t):
+        raise ValueError("weights must have one column per observation")
+    theta, ll, _, iterations, converged = _newton(t, d, weights, _start(t, d, weights))
+    return {
+        "lambda_": np.exp(theta[:, 0]),
+        "gamma_": theta[:, 1],
+        "log_likelihood": ll,
+        "iterations": iterations,
+        "converged": converged
+    }
+
 
 class GompertzFitter:
+    """Gompertz model h(t) = lambda * exp(gamma * t) fitted by Newton's method on (log lambda, gamma)"""
+
     def __init__(self):
         self.params_ = None
         self.AIC_ = None
         self.BIC_ = None
         self.log_likelihood_ = None
+        self.variance_matrix_ = None
+        self.n_iterations_ = None
 
-    def fit(self, durations, event_observed):
-        durations = np.array(durations)
-        event_observed = np.array(event_observed)
-        
-        # Handle zeros
-        durations[durations <= 0] = 1e-5
-        
-        # Initial guess: lambda (scale) and gamma (shape)
-        # Hazard h(t) = lambda * exp(gamma * t)
-        # Log hazard = log(lambda) + gamma * t
-        # Crude guess: lambda = events/time, gamma = 0
-        rate = np.sum(event_observed) / np.sum(durations)
-        init_params = [np.log(rate), 0.0] # working with log(lambda) for stability
-        
-        try:
-            res = minimize(
-                self._neg_log_likelihood,
-                init_params,
-                args=(durations, event_observed),
-                method='Nelder-Mead' # Robust for simple 2-param
+    def fit(self, durations, event_observed, weights=None):
+        """Fit one model, optionally with one weight per observation.
+
+        A (B, n) matrix of replicate or subgroup weights is fitted with fit_weighted instead.
+        """
+        durations, event_observed = _prepare(durations, event_observed)
+        weights = np.ones((1, len(durations))) if weights is None else np.atleast_2d(np.asarray(weights, dtype=np.float64))
+        if weights.shape != (1, len(durations)):
+            raise ValueError(
+                f"weights must hold one value per observation, got shape {weights.shape}; "
+                "fit a weight matrix with custom_gompertz.fit_weighted"
             )
-            
-            self.params_ = res.x
-            self.log_likelihood_ = -res.fun
-            self.AIC_ = 2 * len(self.params_) - 2 * self.log_likelihood_
-            self.BIC_ = len(self.params_) * np.log(len(durations)) - 2 * self.log_likelihood_
-            
+
+        # Initial guess: lambda = events/time, gamma = 0, working with log(lambda) for stability
+        init_params = _start(durations, event_observed, weights)
+
+        try:
+            theta, ll, hess, iterations, converged = _newton(durations, event_observed, weights, init_params.copy())
+            if not converged[0]:
+                print("Gompertz optimization did not converge; using the last iterate")
+
+            self.params_ = theta[0]
+            self.log_likelihood_ = float(ll[0])
+            self.n_iterations_ = int(iterations[0])
+            self.AIC_ = 2 * len(self._params) - 2 * self.log_likelihood_
+            self.BIC_ = len(self._params) * np.log(np.sum(weights)) - 2 * self.log_likelihood_
+
+            # Covariance of (lambda_, gamma_) by the delta method from (log lambda, gamma)
+            jacobian = np.diag([np.exp(self._params[0]), 1.0])
+            covariance = jacobian @ np.linalg.inv(-hess[0]) @ jacobian
+            self.variance_matrix_ = pd.DataFrame(covariance, index=['lambda_', 'gamma_'], columns=['lambda_', 'gamma_'])
+
         except Exception as e:
             print(f"Gompertz optimization failed: {e}")
-            self.params_ = init_params
+            self.params_ = init_params[0]
             self.AIC_ = None
             self.BIC_ = None
-            
+
         return self
 
-    def _neg_log_likelihood(self, params, t, e):
-        log_lambda, gamma = params
-        lambda_ = np.exp(log_lambda)
-        
-        # Hazard: h(t) = lambda * exp(gamma * t)
-        # Cumulative Hazard: H(t) = (lambda/gamma) * (exp(gamma * t) - 1)
-        # If gamma is close to 0, H(t) -> lambda * t (Exponential)
-        
-        if abs(gamma) < 1e-9:
-            H_t = lambda_ * t
-        else:
-            H_t = (lambda_ / gamma) * (np.exp(gamma * t) - 1)
-            
-        # Log-likelihood = sum( e * log(h(t)) - H(t) )
-        # log(h(t)) = log(lambda) + gamma * t
-        
-        log_h_t = log_lambda + gamma * t
-        ll = np.sum(e * log_h_t - H_t)
-        
-        return -ll
+    @property
+    def standard_errors_(self):
+        if self.variance_matrix_ is None:
+            return None
+        return pd.Series(np.sqrt(np.diag(self.variance_matrix_)), index=self.variance_matrix_.index)
 
     def predict_survival(self, times):
         if self._params is None:
-            return np.zeros_like(times)
-            
-        log_lambda, gamma = self._params
-        lambda_ = np.exp(log_lambda)
-        times = np.array(times, dtype=float)
-        
-        if abs(gamma) < 1e-9:
-            H_t = lambda_ * times
-        else:
-            H_t = (lambda_ / gamma) * (np.exp(gamma * times) - 1)
-            
-        return np.exp(-H_t)
-        
+            return np.zeros_like(np.asarray(times, dtype=float))
+        return survival_predictor.survival('gompertz', self.params_, times)
+
+    def predict_hazard(self, times):
+        if self._params is None:
+            return np.zeros_like(np.asarray(times, dtype=float))
+        return survival_predictor.hazard('gompertz', self.params_, times)
+
     @property
     def params_(self):
         # Return dict for consistency with lifelines
         if self._params is None:
             return {}
-        return {'lambda_': np.exp(self._params[0]), 'gamma_': self._params[1]}
-    
+        return {'lambda_': float(np.exp(self._params[0])), 'gamma_': float(self._params[1])}
+
     @params_.setter
     def params_(self, value):
-        self._params = value
+        self._params = None if value is None else np.asarray(value, dtype=np.float64)
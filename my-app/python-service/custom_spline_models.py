@@ -1,8 +1,153 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
 import numpy as np
 import pandas as pd
 from scipy.optimize import minimize
+from scipy.special import expit
 from scipy.stats import norm
-import patsy
+
+import survival_predictor
+
+
+def spline_basis(log_t, knots, boundary_knots, derivative=False):
+    """Royston-Parmar design matrix in log time: intercept, log t and one restricted cubic term per interior knot.
+
+    The restricted cubic spline (Royston & Parmar 2002, as in stpm2/flexsurv) is linear
+    beyond the boundary knots. Cubic terms are divided by the squared boundary range to
+    keep the columns on the scale of log t. With derivative=True also returns the exact
+    d(X)/d(log t), used for the hazard.
+    """
+    x = np.atleast_1d(np.asarray(log_t, dtype=np.float64))
+    knots = np.asarray(knots, dtype=np.float64).ravel()
+    k_min, k_max = float(boundary_knots[0]), float(boundary_knots[1])
+    span = max(k_max - k_min, 1e-8)
+    lambdas = (k_max - knots) / span
+
+    columns = [np.ones_like(x), x]
+    derivatives = [np.zeros_like(x), np.ones_like(x)]
+    below = np.maximum(x - k_min, 0.0)
+    above = np.maximum(x - k_max, 0.0)
+    for knot, lam in zip(knots, lambdas):
+        inner = np.maximum(x - knot, 0.0)
+        columns.append((inner ** 3 - lam * below ** 3 - (1 - lam) * above ** 3) / span ** 2)
+        derivatives.append(3 * (inner ** 2 - lam * below ** 2 - (1 - lam) * above ** 2) / span ** 2)
+
+    X = np.column_stack(columns)
+    if not derivative:
+        return X
+    return X, np.column_stack(derivatives)
+
+
+# Prediction grids are reused across calls (milestones, the 0-240 month plot grid),
+# so their bases are memoised on (knots, boundary knots, grid)
+SPLINE_BASIS_CACHE_SIZE = int(os.environ.get('SPLINE_BASIS_CACHE_SIZE', '256'))
+_basis_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+_basis_cache_lock = threading.Lock()
+_basis_cache_stats = {"hits": 0, "misses": 0}
+
+
+def cached_spline_basis(log_t, knots, boundary_knots, derivative=False):
+    """spline_basis memoised on (knots, boundary knots, grid); the returned arrays are read-only"""
+    log_t = np.ascontiguousarray(np.atleast_1d(np.asarray(log_t, dtype=np.float64)))
+    knots = np.ascontiguousarray(np.asarray(knots, dtype=np.float64).ravel())
+    boundary_knots = np.ascontiguousarray(np.asarray(boundary_knots, dtype=np.float64).ravel())
+    key = (
+        knots.tobytes(),
+        boundary_knots.tobytes(),
+        len(log_t),
+        hashlib.blake2b(log_t.tobytes(), digest_size=16).digest()
+    )
+    with _basis_cache_lock:
+        entry = _basis_cache.get(key)
+        if entry is not None:
+            _basis_cache.move_to_end(key)
+            _basis_cache_stats["hits"] += 1
+    if entry is None:
+        entry = spline_basis(log_t, knots, boundary_knots, derivative=True)
+        for matrix in entry:
+            matrix.setflags(write=False)
+        with _basis_cache_lock:
+            _basis_cache_stats["misses"] += 1
+            _basis_cache[key] = entry
+            while len(_basis_cache) > SPLINE_BASIS_CACHE_SIZE:
+                _basis_cache.popitem(last=False)
+    return entry if derivative else entry[0]
+
+
+def basis_cache_stats():
+    with _basis_cache_lock:
+        return {"entries": len(_basis_cache), "max_entries": SPLINE_BASIS_CACHE_SIZE, **_basis_cache_stats}
+
+
+# d(eta)/d(log t) must be positive for a valid density; below this floor the event
+# term is held constant (the soft monotonicity constraint of the likelihood)
+MIN_ETA_PRIME = 1e-5
+
+
+def _scale_terms(scale, eta, events):
+    """Per-observation log-likelihood terms in eta with their first and second eta-derivatives.
+
+    The remaining event term, log(eta') - log t, is shared by all three scales.
+    """
+    if scale == 'hazard':
+        # log S = -exp(eta), log f = eta + log S + ...
+        cumulative = np.exp(eta)
+        return events * eta - cumulative, events - cumulative, -cumulative
+    if scale == 'odds':
+        # log S = -log(1 + e^eta), log f = log S + log(1 - S) + ...
+        failure = expit(eta)
+        ll = -np.logaddexp(0, eta) - events * np.logaddexp(0, -eta)
+        return ll, events * (1 - failure) - failure, -(1 + events) * failure * (1 - failure)
+    if scale == 'normal':
+        # log S = log Phi(-eta), log f = log phi(eta) + ...
+        log_S = norm.logcdf(-eta)
+        mills = np.exp(norm.logpdf(eta) - log_S)
+        ll = events * norm.logpdf(eta) + (1 - events) * log_S
+        return ll, -events * eta - (1 - events) * mills, -events - (1 - events) * mills * (mills - eta)
+    raise ValueError(f"Unknown spline scale: {scale}")
+
+
+def _knot_locations(log_t, event_observed, n_knots):
+    """Boundary knots at the extreme event times and interior knots at their centiles"""
+    uncensored_log_t = log_t[event_observed == 1]
+    if len(uncensored_log_t) == 0:
+        uncensored_log_t = log_t
+    boundary_knots = np.array([uncensored_log_t.min(), uncensored_log_t.max()])
+    if n_knots > 0:
+        qs = np.linspace(0, 100, n_knots + 2)[1:-1]
+        return boundary_knots, np.percentile(uncensored_log_t, qs)
+    return boundary_knots, np.array([])
+
+
+def _exponential_start(X, log_t, event_observed):
+    # Exponential model: eta = log(rate) + log t
+    init_params = np.zeros(X.shape[1])
+    init_params[0] = np.log(max(np.sum(event_observed), 1.0) / np.sum(np.exp(log_t)))
+    init_params[1] = 1.0
+    return init_params
+
+
+def _eta_to_log_cumulative_hazard(scale, eta):
+    if scale == 'hazard':
+        return eta
+    if scale == 'odds':
+        return np.log(np.logaddexp(0, eta))
+    return np.log(-norm.logcdf(-eta))
+
+
+def _log_cumulative_hazard_to_eta(scale, log_cumulative):
+    if scale == 'hazard':
+        return log_cumulative
+    cumulative = np.exp(log_cumulative)
+    if scale == 'odds':
+        # log(e^H - 1), written to stay finite for small and large H
+        return cumulative + np.log(-np.expm1(-cumulative))
+    return norm.isf(np.clip(np.exp(-cumulative), 1e-300, 1 - 1e-16))
+
 
 class RoystonParmarFitter:
     def __init__(self, scale='hazard', knots=1):
@@ -14,152 +159,182 @@ class RoystonParmarFitter:
         self.BIC_ = None
         self.log_likelihood_ = None
         self.boundary_knots_ = None
+        self.variance_matrix_ = None
+        self.n_iterations_ = None
+        self.converged_ = None
+        self.fit_seconds_ = None
 
-    def _basis(self, log_t, knots, boundary_knots):
-        """Generate natural cubic spline basis"""
-        # Use patsy to generate natural cubic splines
-        # df = knots + 1 (intercept) + 1 (linear) - 1 (constraint) ? 
-        # Royston-Parmar uses restricted cubic splines.
-        # Patsy's cr() is natural cubic spline.
-        # We need to pass knot locations explicitly.
-        
-        # Construct formula for patsy
-        # cr(x, knots=inner_knots, lower_bound=min, upper_bound=max)
-        return patsy.dmatrix(
-            "cr(x, knots=inner_knots, lower_bound=lower, upper_bound=upper) - 1",
-            {"x": log_t, "inner_knots": knots, "lower": boundary_knots[0], "upper": boundary_knots[1]},
-            return_type='dataframe'
-        )
+    def _log_likelihood(self, params, X, events, hessian=False, weights=None):
+        """Log-likelihood and its analytic gradient (and Hessian) in the spline coefficients"""
+        eta = X @ params
+        eta_prime = self.X_deriv @ params  # d(eta)/d(log t)
+        valid = eta_prime > MIN_ETA_PRIME
+        eta_prime = np.where(valid, eta_prime, MIN_ETA_PRIME)
+        weights = 1.0 if weights is None else weights
 
-    def _neg_log_likelihood(self, params, X, events):
-        # Calculate eta = X * beta
-        eta = np.dot(X, params)
-        
-        # We need d(eta)/d(log t) to calculate the density f(t)
-        # Since X is pre-calculated basis at log_t, we can't easily differentiate X wrt log_t here without the basis function.
-        # BUT, we can pre-calculate X_deriv (derivative of basis wrt log_t) in fit()!
-        # Let's assume self.X_deriv is available (we will add it to fit method)
-        
-        eta_prime = np.dot(self.X_deriv, params) # d(eta)/d(log t)
-        
-        # Avoid numerical issues
-        eta = np.clip(eta, -20, 20)
-        eta_prime = np.maximum(eta_prime, 1e-5) # Monotonicity constraint (soft)
-        
-        if self.scale == 'hazard':
-            # eta = log(H(t)) => H(t) = exp(eta)
-            # S(t) = exp(-H(t)) = exp(-exp(eta))
-            # f(t) = h(t)S(t) = dH/dt * S(t)
-            # H(t) = exp(eta)
-            # dH/dt = exp(eta) * d(eta)/dt = exp(eta) * eta_prime * (1/t)
-            # But we work in log-likelihood.
-            # LL = event * log(f) + (1-event) * log(S)
-            # log(S) = -exp(eta)
-            # log(f) = log(dH/dt) + log(S) = eta + log(eta_prime) - log_t + log(S)
-            
-            log_S = -np.exp(eta)
-            log_f = eta + np.log(eta_prime) - self.log_t + log_S
-            
-        elif self.scale == 'odds':
-            # eta = log((1-S)/S) => S = 1 / (1 + exp(eta))
-            # log(S) = -log(1 + exp(eta))
-            # f(t) = -dS/dt = - dS/deta * deta/dt
-            # dS/deta = -exp(eta) / (1+exp(eta))^2 = -S * (1-S)
-            # deta/dt = eta_prime / t
-            # f(t) = S * (1-S) * eta_prime / t
-            # log(f) = log(S) + log(1-S) + log(eta_prime) - log_t
-            
-            # Numerical stability for log(1+exp(eta)) -> np.logaddexp(0, eta)
-            log_S = -np.logaddexp(0, eta)
-            log_1_minus_S = -np.logaddexp(0, -eta) # log(exp(eta)/(1+exp(eta))) = eta - log(1+exp(eta))
-            
-            log_f = log_S + log_1_minus_S + np.log(eta_prime) - self.log_t
-            
-        elif self.scale == 'normal':
-            # eta = Phi^-1(1-S) => 1-S = Phi(eta) => S = 1 - Phi(eta) = Phi(-eta)
-            # log(S) = log(Phi(-eta))
-            # f(t) = -dS/dt = phi(eta) * deta/dt  (phi is PDF, Phi is CDF)
-            # f(t) = phi(eta) * eta_prime / t
-            # log(f) = log(phi(eta)) + log(eta_prime) - log_t
-            
-            log_S = norm.logcdf(-eta)
-            log_f = norm.logpdf(eta) + np.log(eta_prime) - self.log_t
-            
-        ll = events * log_f + (1 - events) * log_S
-        return -np.sum(ll)
+        with np.errstate(over='ignore'):
+            ll, d_eta, d2_eta = _scale_terms(self.scale, eta, events)
+        ll = np.sum(weights * (ll + events * (np.log(eta_prime) - self.log_t)))
+        d_prime = np.where(valid, events / eta_prime, 0.0)
+        gradient = X.T @ (weights * d_eta) + self.X_deriv.T @ (weights * d_prime)
+        if not hessian:
+            return ll, gradient
+        d2_prime = np.where(valid, events / eta_prime ** 2, 0.0)
+        hess = (X * (weights * d2_eta)[:, np.newaxis]).T @ X \
+            - (self.X_deriv * (weights * d2_prime)[:, np.newaxis]).T @ self.X_deriv
+        return ll, gradient, hess
+
+    def _neg_log_likelihood(self, params, X, events, weights=None):
+        ll, gradient = self._log_likelihood(params, X, events, weights=weights)
+        if not np.isfinite(ll):
+            return np.inf, np.zeros_like(params)
+        return -ll, -gradient
+
+    def _neg_hessian(self, params, X, events, weights=None):
+        return -self._log_likelihood(params, X, events, hessian=True, weights=weights)[2]
 
-    def fit(self, durations, event_observed):
-        durations = np.array(durations)
-        event_observed = np.array(event_observed)
+    def fit(self, durations, event_observed, init_params=None):
+        durations = np.array(durations, dtype=np.float64)
+        event_observed = np.array(event_observed, dtype=np.float64)
         
         # Handle zeros
         durations[durations <= 0] = 1e-5
         self.log_t = np.log(durations)
         
         # Calculate knots
-        uncensored_log_t = self.log_t[event_observed == 1]
-        if len(uncensored_log_t) == 0:
-            uncensored_log_t = self.log_t
+        self.boundary_knots_, self.knots_ = _knot_locations(self.log_t, event_observed, self.knots)
             
-        self.boundary_knots_ = np.array([uncensored_log_t.min(), uncensored_log_t.max()])
-        
-        if self.knots > 0:
-            qs = np.linspace(0, 100, self.knots + 2)[1:-1]
-            self.knots_ = np.percentile(uncensored_log_t, qs)
-        else:
-            self.knots_ = np.array([])
-            
-        # Generate basis matrix X
-        X = self._basis(self.log_t, self.knots_, self.boundary_knots_)
-        X = np.column_stack([np.ones(len(X)), X])
-        
-        # Generate derivative matrix X_deriv using finite differences
-        epsilon = 1e-6
-        log_t_plus = self.log_t + epsilon
-        X_plus = self._basis(log_t_plus, self.knots_, self.boundary_knots_)
-        X_plus = np.column_stack([np.ones(len(X_plus)), X_plus])
-        self.X_deriv = (X_plus - X) / epsilon
-        
-        # Initial guess
-        init_params = np.zeros(X.shape[1])
-        if self.scale == 'hazard':
-            init_params[0] = np.log(np.sum(event_observed) / np.sum(durations)) # crude hazard
+        # Basis matrix X and its derivative in log time
+        X, self.X_deriv = spline_basis(self.log_t, self.knots_, self.boundary_knots_, derivative=True)
+        return self._optimise(X, event_observed, init_params)
+
+    def _optimise(self, X, event_observed, init_params=None, weights=None):
+        if init_params is None:
+            init_params = _exponential_start(X, self.log_t, event_observed)
         
-        # Optimization
+        # Optimization: trust-region Newton on the analytic gradient and Hessian
+        start = time.perf_counter()
         try:
             res = minimize(
                 self._neg_log_likelihood,
                 init_params,
-                args=(X, event_observed),
-                method='BFGS', # L-BFGS-B might be safer but BFGS is standard
-                options={'maxiter': 1000}
+                args=(X, event_observed, weights),
+                jac=True,
+                hess=self._neg_hessian,
+                method='trust-exact',
+                options={'maxiter': 200}
             )
             self.params_ = res.x
             self.log_likelihood_ = -res.fun
+            self.n_iterations_ = int(res.nit)
             self.AIC_ = 2 * len(self.params_) - 2 * self.log_likelihood_
-            self.BIC_ = len(self.params_) * np.log(len(durations)) - 2 * self.log_likelihood_
+            self.BIC_ = len(self.params_) * np.log(len(self.log_t)) - 2 * self.log_likelihood_
+            # Standard errors of a point the optimiser did not certify would be meaningless
+            self.converged_ = bool(res.success)
+            if self.converged_:
+                self.variance_matrix_ = _inverse_information(self._neg_hessian(self.params_, X, event_observed, weights))
+            else:
+                print(f"Spline optimization did not converge ({self.scale}, {self.knots} knots): {res.message}")
+                self.variance_matrix_ = None
         except Exception as e:
             print(f"Optimization failed: {e}")
+            self.converged_ = False
+            self.variance_matrix_ = None
             self.params_ = init_params # Fallback
             self.AIC_ = 9999
             self.BIC_ = 9999
+        self.fit_seconds_ = time.perf_counter() - start
         
         return self
 
+    @property
+    def standard_errors_(self):
+        if self.variance_matrix_ is None:
+            return None
+        return np.sqrt(np.clip(np.diag(self.variance_matrix_), 0.0, None))
+
     def predict_survival(self, times):
-        times = np.array(times)
-        times[times <= 0] = 1e-5
-        log_t = np.log(times)
-        
-        X = self._basis(log_t, self.knots_, self.boundary_knots_)
-        X = np.column_stack([np.ones(len(X)), X])
-        
-        eta = np.dot(X, self.params_)
-        
+        return survival_predictor.survival(
+            'royston-parmar', survival_predictor.fitter_parameters(self), times
+        )
+
+    def survival_confidence_interval(self, times, alpha=0.05):
+        """Pointwise (lower, upper) survival bounds by the delta method on the eta scale.
+
+        S is monotone in eta on every scale, so the Wald interval of eta maps exactly onto S.
+        """
+        if self.variance_matrix_ is None:
+            raise ValueError("Model has no variance matrix; fit it first")
+        t = np.maximum(np.atleast_1d(np.asarray(times, dtype=np.float64)), 1e-5)
+        X = cached_spline_basis(np.log(t), self.knots_, self.boundary_knots_)
+        eta = X @ self.params_
+        se = np.sqrt(np.clip(np.einsum('ij,jk,ik->i', X, self.variance_matrix_, X), 0.0, None))
+        z = norm.ppf(1 - alpha / 2)
+        return self._survival_from_eta(eta + z * se), self._survival_from_eta(eta - z * se)
+
+    def _survival_from_eta(self, eta):
         if self.scale == 'hazard':
             return np.exp(-np.exp(eta))
-        elif self.scale == 'odds':
-            return 1.0 / (1.0 + np.exp(eta))
-        elif self.scale == 'normal':
-            return norm.cdf(-eta)
-        return np.zeros_like(times)
+        if self.scale == 'odds':
+            return expit(-eta)
+        return norm.cdf(-eta)
+
+
+def _inverse_information(information):
+    """Covariance from the observed information; pseudo-inverse if it is singular"""
+    try:
+        return np.linalg.inv(information)
+    except np.linalg.LinAlgError:
+        return np.linalg.pinv(information)
+
+
+def fit_spline_family(durations, event_observed, scales=('hazard', 'odds', 'normal'), knots=(1, 2, 3)):
+    """Fit every (scale, knots) Royston-Parmar model of one dataset with shared bases and warm starts.
+
+    Knot locations depend only on the data and the knot count, so each basis is built
+    once and shared by the three scales. Every model after the first starts from a
+    previously fitted curve, converted to its scale and projected onto its basis by least
+    squares, whenever that start is better than the exponential one.
+
+    Returns:
+        Dict mapping (scale, knots) to fitted RoystonParmarFitter, in fitting order
+    """
+    durations = np.array(durations, dtype=np.float64)
+    event_observed = np.array(event_observed, dtype=np.float64)
+    durations[durations <= 0] = 1e-5
+    log_t = np.log(durations)
+
+    bases = {}
+    for k in knots:
+        boundary_knots, knot_locations = _knot_locations(log_t, event_observed, k)
+        X, X_deriv = spline_basis(log_t, knot_locations, boundary_knots, derivative=True)
+        bases[k] = (boundary_knots, knot_locations, X, X_deriv)
+
+    fitters = {}
+    # log H at the data of converged fits: the same knot count on the previous
+    # scale is the closest start, otherwise the last model fitted
+    fitted_curves = {}
+    previous = None
+    for scale in scales:
+        for k in knots:
+            boundary_knots, knot_locations, X, X_deriv = bases[k]
+            fitter = RoystonParmarFitter(scale=scale, knots=k)
+            fitter.log_t = log_t
+            fitter.boundary_knots_, fitter.knots_, fitter.X_deriv = boundary_knots, knot_locations, X_deriv
+
+            init_params = _exponential_start(X, log_t, event_observed)
+            previous = fitted_curves.get(k, previous)
+            if previous is not None:
+                with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+                    target = _log_cumulative_hazard_to_eta(scale, previous)
+                if np.all(np.isfinite(target)):
+                    projected = np.linalg.lstsq(X, target, rcond=None)[0]
+                    if fitter._neg_log_likelihood(projected, X, event_observed)[0] < \
+                            fitter._neg_log_likelihood(init_params, X, event_observed)[0]:
+                        init_params = projected
+
+            fitter._optimise(X, event_observed, init_params)
+            fitters[(scale, k)] = fitter
+            if fitter.converged_:
+                previous = fitted_curves[k] = _eta_to_log_cumulative_hazard(scale, X @ fitter.params_)
+    return fitters
@@ -0,0 +1,96 @@
+"""Server-side store for uploaded IPD datasets
+
+Datasets are uploaded once and referenced by a content-addressed `dataset_id`,
+so fit endpoints do not have to re-validate and re-parse the same time/event
+arrays on every call. Arrays are kept as contiguous float64/int8 NumPy arrays
+and evicted after a sliding TTL.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+
+from model_registry import dataset_fingerprint
+
+DATASET_TTL_SECONDS = float(os.environ.get('DATASET_TTL_SECONDS', '3600'))
+DATASET_STORE_SIZE = int(os.environ.get('DATASET_STORE_SIZE', '64'))
+
+
+class DatasetStore:
+    """Content-addressed, TTL-evicted store of time/event arrays"""
+
+    def __init__(self, ttl_seconds: float = DATASET_TTL_SECONDS, max_entries: int = DATASET_STORE_SIZE):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, time_values, event_values, label: Optional[str] = None) -> Dict:
+        """Store a dataset and return its metadata; identical data maps to the same id"""
+        times = np.ascontiguousarray(np.asarray(time_values, dtype=np.float64))
+        events = np.ascontiguousarray(np.asarray(event_values, dtype=np.int8))
+        if times.shape != events.shape or times.ndim != 1:
+            raise ValueError("time and event must be 1-D arrays of equal length")
+        times.setflags(write=False)
+        events.setflags(write=False)
+
+        data = {"time": times, "event": events}
+        dataset_id = dataset_fingerprint(data)
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                entry = {"data": data, "label": label, "created_at": now}
+                self._entries[dataset_id] = entry
+            entry["expires_at"] = now + self.ttl_seconds
+            self._entries.move_to_end(dataset_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return self._describe(dataset_id, entry)
+
+    def get(self, dataset_id: str) -> Optional[Dict]:
+        """Return {'time', 'event'} arrays for an id, refreshing its TTL, or None if unknown/expired"""
+        now = time.time()
+        with self._lock:
+            self._purge_expired(now)
+            entry = self._entries.get(dataset_id)
+            if entry is None:
+                return None
+            entry["expires_at"] = now + self.ttl_seconds
+            self._entries.move_to_end(dataset_id)
+            return entry["data"]
+
+    def describe(self, dataset_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._purge_expired(time.time())
+            entry = self._entries.get(dataset_id)
+            return self._describe(dataset_id, entry) if entry else None
+
+    def delete(self, dataset_id: str) -> bool:
+        with self._lock:
+            return self._entries.pop(dataset_id, None) is not None
+
+    def _purge_expired(self, now: float) -> None:
+        expired = [key for key, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    @staticmethod
+    def _describe(dataset_id: str, entry: Dict) -> Dict:
+        data = entry["data"]
+        return {
+            "dataset_id": dataset_id,
+            "label": entry["label"],
+            "n": int(len(data["time"])),
+            "events": int(data["event"].sum()),
+            "max_time": float(data["time"].max()) if len(data["time"]) else None,
+            "expires_at": entry["expires_at"]
+        }
+
+
+# Shared store used by the API
+datasets = DatasetStore()
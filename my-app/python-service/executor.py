@@ -0,0 +1,164 @@
+"""Bounded execution layer for CPU-bound endpoint work
+
+Lifelines fits, matplotlib rendering, OpenCV extraction and blocking R service
+calls run on a pre-warmed worker pool instead of the asyncio event loop, so a
+slow request cannot stall /health or other requests on the same worker.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+# 'thread' keeps the fitted-model registry shared with the API process;
+# 'process' sidesteps the GIL for pure-Python hot loops.
+EXECUTOR_KIND = os.environ.get('EXECUTOR_KIND', 'thread')
+EXECUTOR_WORKERS = int(os.environ.get('EXECUTOR_WORKERS', os.cpu_count() or 1))
+# Requests allowed to wait for a worker before new ones are rejected with 429
+EXECUTOR_QUEUE_SIZE = int(os.environ.get('EXECUTOR_QUEUE_SIZE', '32'))
+
+
+class ExecutorSaturated(Exception):
+    """Raised when every worker is busy and the wait queue is full"""
+
+
+def warm_up_worker() -> None:
+    """Import the heavy scientific stack and run a dummy fit so the first real request is fast"""
+    import numpy as np
+    import scipy.optimize  # noqa: F401
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot  # noqa: F401
+    from lifelines import WeibullFitter
+
+    try:
+        rng = np.random.default_rng(0)
+        WeibullFitter().fit(rng.exponential(10.0, 50) + 0.1, np.ones(50))
+    except Exception as e:
+        print(f"[Executor] Warm-up fit failed: {e}")
+
+
+def _invoke(fn: Callable, args: tuple, kwargs: Dict) -> Dict:
+    """Run fn in the worker and report when it actually started"""
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    payload = {"result": result, "started_at": started_at}
+    if multiprocessing.parent_process() is not None and isinstance(result, dict) and result.get('model_handle'):
+        # Fitted models registered in a worker process are shipped back to the API process
+        from model_registry import registry
+        payload["record"] = registry.get(result['model_handle'])
+    return payload
+
+
+class CPUExecutor:
+    """Worker pool with bounded admission and queue/wait-time metrics"""
+
+    def __init__(
+        self,
+        kind: str = EXECUTOR_KIND,
+        workers: int = EXECUTOR_WORKERS,
+        max_queue: int = EXECUTOR_QUEUE_SIZE
+    ):
+        self.kind = kind
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._pool = None
+        # Serialises pool creation: the startup warm-up and early requests may race to start()
+        self._start_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self._wait_times = deque(maxlen=1000)
+        self._run_times = deque(maxlen=1000)
+
+    def start(self) -> None:
+        """Create the pool and pre-spawn every worker with the scientific stack loaded"""
+        with self._start_lock:
+            if self._pool is not None:
+                return
+            if self.kind == 'process':
+                pool = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_up_worker)
+                futures = [pool.submit(time.sleep, 0) for _ in range(self.workers)]
+            else:
+                warm_up_worker()
+                pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='cpu-worker')
+                # Each sleep keeps its thread busy briefly so the pool spawns all of them
+                futures = [pool.submit(time.sleep, 0.01) for _ in range(self.workers)]
+            for future in futures:
+                future.result()
+            self._pool = pool
+
+    def shutdown(self) -> None:
+        with self._start_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """Run fn on the pool, raising ExecutorSaturated when the queue is full"""
+        if self._pool is None:
+            # start() blocks on the warm-up, so it must not run on the event loop
+            await asyncio.to_thread(self.start)
+
+        with self._lock:
+            if self._in_flight >= self.workers + self.max_queue:
+                self.rejected += 1
+                raise ExecutorSaturated(
+                    f"Server busy: {self._in_flight} requests in flight "
+                    f"({self.workers} workers, queue limit {self.max_queue})"
+                )
+            self._in_flight += 1
+            self.submitted += 1
+
+        submitted_at = time.time()
+        loop = asyncio.get_running_loop()
+        try:
+            payload = await loop.run_in_executor(self._pool, _invoke, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self.failed += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        finished_at = time.time()
+        with self._lock:
+            self.completed += 1
+            self._wait_times.append(payload['started_at'] - submitted_at)
+            self._run_times.append(finished_at - payload['started_at'])
+
+        if payload.get('record') is not None:
+            from model_registry import registry
+            registry.put_record(payload['record'])
+        return payload['result']
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._wait_times)
+            runs = list(self._run_times)
+            return {
+                "kind": self.kind,
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "in_flight": self._in_flight,
+                "queue_depth": max(0, self._in_flight - self.workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_ms_mean": 1000 * sum(waits) / len(waits) if waits else 0.0,
+                "wait_ms_p95": 1000 * waits[int(0.95 * (len(waits) - 1))] if waits else 0.0,
+                "wait_ms_max": 1000 * waits[-1] if waits else 0.0,
+                "run_ms_mean": 1000 * sum(runs) / len(runs) if runs else 0.0
+            }
+
+
+# Shared executor used by the API handlers
+executor = CPUExecutor()
@@ -1,8 +1,8 @@
 """IPD reconstruction plotting using R service"""
-import requests
-import os
 from typing import Dict, List, Optional
 
+from r_client import r_client
+
 
 def plot_ipd_reconstruction_r(
     original_times: List[float],
@@ -25,17 +25,10 @@ def plot_ipd_reconstruction_r(
     Returns:
         Dict with 'plot_base64' and 'comparison' data, or None if failed
     """
-    r_service_url = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
-    
     try:
-        # Quick health check
-        try:
-            health_check = requests.get(f"{r_service_url}/", timeout=2)
-            if not health_check.ok:
-                print(f"[IPDPlotting] R service not available at {r_service_url}")
-                return None
-        except requests.exceptions.RequestException:
-            print(f"[IPDPlotting] R service not available at {r_service_url}")
+        # Quick health check (cached, and immediate while the R circuit breaker is open)
+        if not r_client.available():
+            print(f"[IPDPlotting] R service not available at {r_client.base_url}")
             return None
         
         # Prepare payload
@@ -49,19 +42,10 @@ def plot_ipd_reconstruction_r(
         }
         
         # Call R service
-        response = requests.post(
-            f"{r_service_url}/plot-ipd-reconstruction",
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"[IPDPlotting] R service returned status {response.status_code}")
-            print(f"   Response: {response.text[:500]}")
+        result = r_client.post("/plot-ipd-reconstruction", payload, timeout=30)
+        if result is None:
             return None
         
-        result = response.json()
-        
         # Handle Plumber's list serialization
         success = result.get('success')
         if isinstance(success, list):
@@ -83,9 +67,6 @@ def plot_ipd_reconstruction_r(
             'comparison': comparison
         }
         
-    except requests.exceptions.RequestException as e:
-        print(f"[IPDPlotting] Request error: {e}")
-        return None
     except Exception as e:
         print(f"[IPDPlotting] Unexpected error: {e}")
         return None
@@ -110,17 +91,10 @@ def plot_km_from_ipd_r(
     Returns:
         Dict with 'plot_base64' and 'p_value', or None if failed
     """
-    r_service_url = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
-    
     try:
-        # Quick health check
-        try:
-            health_check = requests.get(f"{r_service_url}/", timeout=2)
-            if not health_check.ok:
-                print(f"[IPDPlotting] R service not available at {r_service_url}")
-                return None
-        except requests.exceptions.RequestException:
-            print(f"[IPDPlotting] R service not available at {r_service_url}")
+        # Quick health check (cached, and immediate while the R circuit breaker is open)
+        if not r_client.available():
+            print(f"[IPDPlotting] R service not available at {r_client.base_url}")
             return None
         
         # Prepare payload
@@ -133,19 +107,10 @@ def plot_km_from_ipd_r(
         }
         
         # Call R service
-        response = requests.post(
-            f"{r_service_url}/plot-km-from-ipd",
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"[IPDPlotting] R service returned status {response.status_code}")
-            print(f"   Response: {response.text[:500]}")
+        result = r_client.post("/plot-km-from-ipd", payload, timeout=30)
+        if result is None:
             return None
         
-        result = response.json()
-        
         # Handle Plumber's list serialization
         success = result.get('success')
         if isinstance(success, list):
@@ -169,9 +134,6 @@ def plot_km_from_ipd_r(
             'p_value': p_value
         }
         
-    except requests.exceptions.RequestException as e:
-        print(f"[IPDPlotting] Request error: {e}")
-        return None
     except Exception as e:
         print(f"[IPDPlotting] Unexpected error: {e}")
         return None
@@ -194,17 +156,10 @@ def plot_km_dynamic_r(
     Returns:
         Dict with 'plot_base64', 'p_value', and 'arms', or None if failed
     """
-    r_service_url = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
-    
     try:
-        # Quick health check
-        try:
-            health_check = requests.get(f"{r_service_url}/", timeout=2)
-            if not health_check.ok:
-                print(f"[IPDPlotting] R service not available at {r_service_url}")
-                return None
-        except requests.exceptions.RequestException:
-            print(f"[IPDPlotting] R service not available at {r_service_url}")
+        # Quick health check (cached, and immediate while the R circuit breaker is open)
+        if not r_client.available():
+            print(f"[IPDPlotting] R service not available at {r_client.base_url}")
             return None
         
         # Prepare payload
@@ -214,19 +169,10 @@ def plot_km_dynamic_r(
         }
         
         # Call R service
-        response = requests.post(
-            f"{r_service_url}/plot-km-dynamic",
-            json=payload,
-            timeout=30
-        )
-        
-        if response.status_code != 200:
-            print(f"[IPDPlotting] R service returned status {response.status_code}")
-            print(f"   Response: {response.text[:500]}")
+        result = r_client.post("/plot-km-dynamic", payload, timeout=30)
+        if result is None:
             return None
         
-        result = response.json()
-        
         # Handle Plumber's list serialization
         success = result.get('success')
         if isinstance(success, list):
@@ -251,9 +197,6 @@ def plot_km_dynamic_r(
             'arms': result.get('arms', [])
         }
         
-    except requests.exceptions.RequestException as e:
-        print(f"[IPDPlotting] Request error: {e}")
-        return None
     except Exception as e:
         print(f"[IPDPlotting] Unexpected error: {e}")
         return None
@@ -836,9 +836,7 @@ class KMCurveExtractor:
         
         Returns list of saved plot file paths.
         """
-        import matplotlib
-        matplotlib.use('Agg')  # Non-interactive backend for server
-        import matplotlib.pyplot as plt
+        from plotting import new_figure
         
         print("📊 Creating result plots...")
         saved_files = []
@@ -860,7 +858,8 @@ class KMCurveExtractor:
         }
         
         # 1. Processing pipeline visualization (6-panel)
-        fig, axes = plt.subplots(2, 3, figsize=(18, 12))
+        fig = new_figure((18, 12))
+        axes = fig.subplots(2, 3)
         
         # Original image
         if self.original_image is not None:
@@ -935,16 +934,14 @@ class KMCurveExtractor:
         axes[1,2].set_xlim(self.x_min, self.x_max)
         axes[1,2].set_ylim(self.y_min, self.y_max)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         if save_plots:
             pipeline_file = os.path.join(output_dir, 'km_extraction_pipeline.png')
-            plt.savefig(pipeline_file, dpi=200, bbox_inches='tight')
+            fig.savefig(pipeline_file, dpi=200, bbox_inches='tight')
             saved_files.append(pipeline_file)
             print(f"   💾 Saved: {pipeline_file}")
         
-        plt.close()
-        
         # 2. Validation plot (side by side comparison)
         validation_file = self.create_validation_plot(output_dir, save_plots)
         if validation_file:
@@ -959,9 +956,7 @@ class KMCurveExtractor:
     
     def create_validation_plot(self, output_dir: str = None, save_plot: bool = True) -> str:
         """Create a dedicated validation plot comparing original image with digitized curves"""
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
+        from plotting import new_figure
         
         if not self.monotonic_curves or self.original_image is None:
             print("   ⚠️  Cannot create validation plot - missing data")
@@ -979,16 +974,16 @@ class KMCurveExtractor:
             'medical_blue': '#0080FF', 'clinical_gray': '#808080'
         }
         
-        fig = plt.figure(figsize=(20, 10))
+        fig = new_figure((20, 10))
         
         # Left: Original image (larger, 2/3 width)
-        ax1 = plt.subplot(1, 3, (1, 2))
+        ax1 = fig.add_subplot(1, 3, (1, 2))
         ax1.imshow(cv2.cvtColor(self.original_image, cv2.COLOR_BGR2RGB))
         ax1.set_title("Original KM Plot", fontsize=16, fontweight='bold', pad=20)
         ax1.axis('off')
         
         # Right: Digitized curves only (cleaner)
-        ax2 = plt.subplot(1, 3, 3)
+        ax2 = fig.add_subplot(1, 3, 3)
         
         curve_count = 0
         for curve_name, points in self.monotonic_curves.items():
@@ -1034,22 +1029,19 @@ class KMCurveExtractor:
         ax2.text(0.02, 0.98, textstr, transform=ax2.transAxes, fontsize=10,
                 verticalalignment='top', bbox=props)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         validation_file = None
         if save_plot:
             validation_file = os.path.join(output_dir, 'km_validation_comparison.png')
-            plt.savefig(validation_file, dpi=200, bbox_inches='tight')
+            fig.savefig(validation_file, dpi=200, bbox_inches='tight')
             print(f"   💾 Saved: {validation_file}")
         
-        plt.close()
         return validation_file
     
     def _create_precise_overlay_plot(self, output_dir: str = None, save_plot: bool = True) -> str:
         """Create a precise overlay plot using the cropped image area"""
-        import matplotlib
-        matplotlib.use('Agg')
-        import matplotlib.pyplot as plt
+        from plotting import new_figure
         
         if self.cropped_image is None or not self.monotonic_curves:
             return None
@@ -1063,7 +1055,8 @@ class KMCurveExtractor:
             'purple': '#9900CC', 'black': '#000000'
         }
         
-        fig, ax = plt.subplots(1, 1, figsize=(12, 8))
+        fig = new_figure((12, 8))
+        ax = fig.subplots(1, 1)
         
         # Use the cropped image with proper scaling
         ax.imshow(cv2.cvtColor(self.cropped_image, cv2.COLOR_BGR2RGB), 
@@ -1102,15 +1095,14 @@ class KMCurveExtractor:
         ax.set_xlim(self.x_min, self.x_max)
         ax.set_ylim(self.y_min, self.y_max)
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         overlay_file = None
         if save_plot:
             overlay_file = os.path.join(output_dir, 'km_precision_overlay.png')
-            plt.savefig(overlay_file, dpi=200, bbox_inches='tight')
+            fig.savefig(overlay_file, dpi=200, bbox_inches='tight')
             print(f"   💾 Saved: {overlay_file}")
         
-        plt.close()
         return overlay_file
     
     def calculate_validation_metrics(self) -> Dict[str, Dict]:
@@ -1440,18 +1432,11 @@ class IPDBuilder:
         arm_name: str
     ) -> Optional[Dict[str, Any]]:
         """Try to use R service (IPDfromKM) for IPD reconstruction."""
-        import requests
-        import os
-        
-        r_service_url = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
+        from r_client import r_client
         
         try:
-            # Quick health check
-            try:
-                health_check = requests.get(f"{r_service_url}/", timeout=2)
-                if not health_check.ok:
-                    return None
-            except requests.exceptions.RequestException:
+            # Quick health check (cached, and immediate while the R circuit breaker is open)
+            if not r_client.available():
                 return None
             
             # Prepare data
@@ -1477,9 +1462,9 @@ class IPDBuilder:
                 total_patients = 100  # Default estimate
             
             # Call R service
-            response = requests.post(
-                f"{r_service_url}/reconstruct-ipd",
-                json={
+            result = r_client.post(
+                "/reconstruct-ipd",
+                {
                     'km_times': km_times,
                     'km_survival': km_survival,
                     'atrisk_times': atrisk_times if atrisk_times else None,
@@ -1489,8 +1474,7 @@ class IPDBuilder:
                 timeout=10
             )
             
-            if response.status_code == 200:
-                result = response.json()
+            if result is not None:
                 # Handle Plumber's list serialization (single values become lists)
                 success = result.get('success')
                 if isinstance(success, list):
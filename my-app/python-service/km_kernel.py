@@ -0,0 +1,144 @@
+"""NumPy Kaplan-Meier / Nelson-Aalen kernel shared by every endpoint
+
+One sort (`np.unique` with counts) gives the event table, and survival,
+Greenwood variance, log(-log) confidence bands, the Nelson-Aalen cumulative
+hazard and its variance all follow from cumulative sums and products. Results
+match lifelines' KaplanMeierFitter / NelsonAalenFitter (timeline starting at 0,
+exponential Greenwood bands, smoothed Nelson-Aalen for ties) and are memoised
+per dataset fingerprint, so the KM of an arm is computed once however many
+endpoints, plots and tests ask for it.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import numpy as np
+from scipy.stats import norm
+
+from model_registry import dataset_fingerprint
+
+KM_CACHE_SIZE = int(os.environ.get('KM_CACHE_SIZE', '128'))
+
+_cache: "OrderedDict[tuple, Dict[str, np.ndarray]]" = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_hits = 0
+_cache_misses = 0
+
+
+def event_table(time_values, event_values) -> Dict[str, np.ndarray]:
+    """Distinct times (with 0 prepended) and the deaths, removals and number at risk at each"""
+    time_values = np.asarray(time_values, dtype=np.float64)
+    event_values = np.asarray(event_values, dtype=np.float64)
+    times, inverse, removed = np.unique(time_values, return_inverse=True, return_counts=True)
+    deaths = np.bincount(inverse.ravel(), weights=event_values, minlength=len(times))
+    if len(times) == 0 or times[0] > 0:
+        times = np.concatenate([[0.0], times])
+        deaths = np.concatenate([[0.0], deaths])
+        removed = np.concatenate([[0], removed])
+    at_risk = len(time_values) - np.concatenate([[0], np.cumsum(removed)[:-1]])
+    return {"times": times, "deaths": deaths, "removed": removed, "at_risk": at_risk.astype(np.float64)}
+
+
+def _estimate(time_values, event_values, alpha: float) -> Dict[str, np.ndarray]:
+    table = event_table(time_values, event_values)
+    deaths, at_risk = table['deaths'], table['at_risk']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        survival = np.cumprod(1.0 - deaths / at_risk)
+        greenwood = np.cumsum(np.where(at_risk > deaths, deaths / (at_risk * (at_risk - deaths)), 0.0))
+
+        # Exponential Greenwood (log(-log)) bands; undefined where S = 1, where they are 1
+        z = norm.ppf(1 - alpha / 2)
+        log_s = np.log(survival)
+        spread = z * np.sqrt(greenwood) / log_s
+        lower = np.exp(-np.exp(np.log(-log_s) - spread))
+        upper = np.exp(-np.exp(np.log(-log_s) + spread))
+
+    # Smoothed Nelson-Aalen: sums of 1/k (and 1/k^2 for the variance) over k = n - d + 1 .. n,
+    # read off prefix sums of the harmonic series
+    k = np.arange(1, int(at_risk[0]) + 1, dtype=np.float64)
+    harmonic = np.concatenate([[0.0], np.cumsum(1.0 / k)])
+    harmonic_sq = np.concatenate([[0.0], np.cumsum(1.0 / k ** 2)])
+    n, survivors = at_risk.astype(np.int64), (at_risk - deaths).astype(np.int64)
+    cumulative_hazard = np.cumsum(harmonic[n] - harmonic[survivors])
+    hazard_variance = np.cumsum(harmonic_sq[n] - harmonic_sq[survivors])
+
+    result = {
+        **table,
+        "survival": survival,
+        "greenwood": greenwood,
+        "lower": np.nan_to_num(lower, nan=1.0),
+        "upper": np.nan_to_num(upper, nan=1.0),
+        "cumulative_hazard": cumulative_hazard,
+        "cumulative_hazard_variance": hazard_variance,
+        "alpha": alpha
+    }
+    for value in result.values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+    return result
+
+
+def kaplan_meier(data: Dict, alpha: float = 0.05, fingerprint: Optional[str] = None) -> Dict[str, np.ndarray]:
+    """
+    Kaplan-Meier and Nelson-Aalen estimates of a {'time', 'event'} dataset, memoised.
+
+    Args:
+        data: Dictionary with 'time' and 'event' arrays
+        alpha: 1 - confidence level of the survival bands
+        fingerprint: Dataset fingerprint if already known (e.g. a dataset_id)
+
+    Returns:
+        Read-only arrays over the timeline: times, deaths, removed, at_risk, survival,
+        greenwood, lower, upper, cumulative_hazard and cumulative_hazard_variance
+    """
+    global _cache_hits, _cache_misses
+    key = (fingerprint or dataset_fingerprint(data), alpha)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            _cache_hits += 1
+            return cached
+        _cache_misses += 1
+
+    result = _estimate(data['time'], data['event'], alpha)
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > KM_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
+
+
+def km_cache_stats() -> Dict:
+    with _cache_lock:
+        return {"entries": len(_cache), "max_entries": KM_CACHE_SIZE, "hits": _cache_hits, "misses": _cache_misses}
+
+
+def step_lookup(km: Dict[str, np.ndarray], times, column: str = 'survival') -> np.ndarray:
+    """Right-continuous step-function value of a KM column at arbitrary times"""
+    index = np.searchsorted(km['times'], np.asarray(times, dtype=np.float64), side='right') - 1
+    values = km[column][np.clip(index, 0, None)]
+    # Before the first time point the curve has not started
+    return np.where(index >= 0, values, 1.0 if column in ('survival', 'lower', 'upper') else 0.0)
+
+
+def quantile_time(km: Dict[str, np.ndarray], q: float = 0.5, column: str = 'survival') -> Optional[float]:
+    """First time the column drops to q or below; None if it never does"""
+    below = np.flatnonzero(km[column] <= q)
+    return float(km['times'][below[0]]) if len(below) else None
+
+
+def median_survival(km: Dict[str, np.ndarray]) -> Dict[str, Optional[float]]:
+    """Median survival with the confidence interval read off the survival bands"""
+    return {
+        "median": quantile_time(km, 0.5),
+        "ci_lower": quantile_time(km, 0.5, 'lower'),
+        "ci_upper": quantile_time(km, 0.5, 'upper')
+    }
+
+
+def event_steps(km: Dict[str, np.ndarray]):
+    """Event times and the survival just after each (the drops of the KM curve)"""
+    has_event = km['deaths'] > 0
+    return km['times'][has_event], km['survival'][has_event]
@@ -2,14 +2,21 @@
 FastAPI service for survival analysis
 Provides endpoints for fitting survival models, generating plots, and statistical analysis
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
+from fastapi.responses import Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Annotated, List, Optional, Dict, Any, Union
+import asyncio
+import time
 import uvicorn
 
 app = FastAPI(title="Survival Analysis Service")
 
+# Arrow IPC request bodies are turned into stored datasets before routing
+from arrow_io import ArrowBodyMiddleware, ARROW_STREAM_MEDIA_TYPE, wants_arrow, stream_parquet_ipd, stream_arrays
+app.add_middleware(ArrowBodyMiddleware)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -22,11 +29,39 @@ app.add_middleware(
 # Import analysis modules
 from survival_models import fit_km_curves, fit_one_piece_model, fit_spline_model
 from piecewise_models import fit_piecewise_model
+from bootstrap import bootstrap_tasks, fit_point_estimate, shutdown_bootstrap_pool, stream_replicates
 from ph_testing import test_proportional_hazards
-from plotting import generate_dual_plots
+from plotting import generate_dual_plots, generate_plot_data, new_figure, plot_km, shutdown_render_pool
+from km_kernel import kaplan_meier, km_cache_stats, median_survival
+from plot_cache import PLOT_TYPES, get_plot, plot_key, plot_urls, remember_dataset
 from survival_statistics import calculate_statistics
+from model_grid import collect_grid_results, plan_model_grid, run_grid_job
+from executor import executor, ExecutorSaturated
+from dataset_store import datasets
+
+async def run_cpu_bound(fn, *args, **kwargs):
+    """Run blocking work on the shared worker pool, mapping saturation to 429"""
+    try:
+        return await executor.run(fn, *args, **kwargs)
+    except ExecutorSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+@app.on_event("startup")
+async def start_executor():
+    # Pre-warm the pool without holding up startup
+    asyncio.get_running_loop().run_in_executor(None, executor.start)
+
+@app.on_event("shutdown")
+async def stop_executor():
+    executor.shutdown()
+    shutdown_render_pool()
+    shutdown_bootstrap_pool()
 
 # Request/Response models
+
+# Percentiles of a band; out-of-range values are rejected with 422 rather than failing in numpy
+Percentile = Annotated[float, Field(ge=0, le=100)]
+
 class ParquetDataRequest(BaseModel):
     chemo_path: str
     pembro_path: str
@@ -36,36 +71,167 @@ class ParquetData(BaseModel):
     event: List[int]
     arm: List[str]
 
+class DatasetUploadRequest(BaseModel):
+    time: List[float]
+    event: List[int]
+    arm: Optional[List[str]] = None
+    label: Optional[str] = None
+
 class DataPair(BaseModel):
-    chemo: ParquetData
-    pembro: ParquetData
+    # Inline data or handles from POST /datasets
+    chemo: Optional[ParquetData] = None
+    pembro: Optional[ParquetData] = None
+    chemo_dataset_id: Optional[str] = None
+    pembro_dataset_id: Optional[str] = None
+
+class TimeVaryingHRRequest(DataPair):
+    breakpoints: Optional[List[float]] = None  # detected (one breakpoint) when missing
+    time_function: str = "log"  # g(t) of the treatment x g(t) term: log or identity
 
 class ModelFitRequest(BaseModel):
-    data: ParquetData
+    data: Optional[ParquetData] = None
+    dataset_id: Optional[str] = None  # Used in place of inline data
     arm: str
     distribution: Optional[str] = None
     scale: Optional[str] = None
     knots: Optional[int] = None
     cutpoint: Optional[float] = None
+    cutpoints: Optional[List[float]] = None  # Several cutpoints for a multi-segment piecewise model
+    weeks_start: Optional[int] = 12
+    weeks_end: Optional[int] = 52
+    cutpoint_candidates: Optional[Union[str, List[float]]] = None  # 'event-times' or weeks; default every 2 weeks
+
+class ModelGridRequest(BaseModel):
+    datasets: Optional[Dict[str, ParquetData]] = None  # arm -> data, sent once for the whole grid
+    dataset_ids: Optional[Dict[str, str]] = None  # arm -> dataset_id, in place of inline data
+    approaches: Optional[List[str]] = None
+    distributions: Optional[List[str]] = None
+    scales: Optional[List[str]] = None
+    knots: Optional[List[int]] = None
+    cutpoints: Optional[Dict[str, Union[float, List[float]]]] = None  # Detected per arm when missing
+    cutpoint_method: Optional[str] = "chow"  # or "changepoint" for multi-segment detection
     weeks_start: Optional[int] = 12
     weeks_end: Optional[int] = 52
+    cutpoint_candidates: Optional[Union[str, List[float]]] = None
+    max_workers: Optional[int] = None
+
+class BootstrapRequest(BaseModel):
+    datasets: Optional[Dict[str, ParquetData]] = None  # arm -> data
+    dataset_ids: Optional[Dict[str, str]] = None  # arm -> dataset_id, in place of inline data
+    approaches: Optional[List[str]] = None  # 'one-piece' (default) and/or 'spline'
+    distributions: Optional[List[str]] = None
+    scales: Optional[List[str]] = None
+    knots: Optional[List[int]] = None
+    n_replicates: int = 1000
+    seed: int = 0
+    times: Optional[List[float]] = None  # defaults to the shared 0-240 month grid
+    percentiles: Optional[List[Percentile]] = None  # defaults to 2.5, 50, 97.5
+    max_workers: Optional[int] = None
 
 class PlotRequest(BaseModel):
     model_id: str
     model_result: Dict[str, Any]
     km_data: Dict[str, Any]
     original_data: Optional[Dict[str, Any]] = None  # Original time/event data for refitting
+    original_dataset_id: Optional[str] = None
     seer_data: Optional[Dict[str, Any]] = None
+    model_handle: Optional[str] = None  # Registered fit to reuse instead of refitting
+
+class PredictRequest(BaseModel):
+    model_handle: str
+    times: List[float]
+    quantity: str = "survival"  # survival, hazard, cumulative_hazard or density
+
+class PredictBatchRequest(BaseModel):
+    model_handles: List[str]
+    times: Optional[List[float]] = None  # defaults to the shared 0-240 month grid
+    quantity: str = "survival"
+
+class PSARequest(BaseModel):
+    model_handles: List[str]
+    n_draws: int = 1000
+    times: Optional[List[float]] = None  # defaults to cycle boundaries up to horizon
+    horizon: float = 240.0
+    cycle_length: float = 1.0
+    seed: int = 0
+    quantity: str = "survival"
+    percentiles: Optional[List[Percentile]] = None  # defaults to 2.5, 50, 97.5
+    include_draws: bool = False  # return the full draws x times matrices
+
+class RMSTRequest(BaseModel):
+    model_handles: List[str]
+    horizons: Optional[List[float]] = None  # defaults to 60, 120 and 240
+    discount_rate: float = 0.035  # annual, for discounted life years
+    time_units_per_year: float = 12.0  # 12 for months, 52.18 for weeks
+    # Observed IPD for the KM RMST, matched to models by content; stored datasets are found automatically
+    datasets: Optional[Dict[str, ParquetData]] = None
+    dataset_ids: Optional[List[str]] = None
+
+class PSMArm(BaseModel):
+    os_model_handle: str
+    pfs_model_handle: str
+    costs: Dict[str, float] = {}  # per cycle: progression_free, progressed; one-off: death
+    utilities: Optional[Dict[str, float]] = None  # overrides the shared utilities for this arm
+
+class PartitionedSurvivalRequest(BaseModel):
+    arms: Dict[str, PSMArm]
+    utilities: Dict[str, float]  # annual: progression_free, progressed
+    horizon: float = 240.0
+    cycle_length: float = 1.0
+    discount_rate_costs: float = 0.035
+    discount_rate_outcomes: float = 0.035
+    half_cycle_correction: bool = True
+    time_units_per_year: float = 12.0
+    comparator: Optional[str] = None  # defaults to the first arm
+    n_draws: int = 0  # PSA draws of the OS/PFS parameters; 0 for deterministic only
+    seed: int = 0
+    percentiles: Optional[List[Percentile]] = None
+
+def resolve_data(inline: Optional[ParquetData], dataset_id: Optional[str], name: str = "data") -> Dict:
+    """Return time/event data from a dataset handle or inline payload"""
+    if dataset_id:
+        stored = datasets.get(dataset_id)
+        if stored is None:
+            raise HTTPException(
+                status_code=404,
+                detail=f"Unknown or expired dataset_id for {name}: {dataset_id}. Re-upload via POST /datasets"
+            )
+        return stored
+    if inline is None:
+        raise HTTPException(status_code=422, detail=f"Either {name} or a dataset_id must be provided")
+    return inline.dict()
+
+def resolve_pair(data: DataPair) -> tuple:
+    return (
+        resolve_data(data.chemo, data.chemo_dataset_id, "chemo"),
+        resolve_data(data.pembro, data.pembro_dataset_id, "pembro")
+    )
+
+def _check_plot_format(format: str) -> None:
+    if format not in ("png", "data"):
+        raise HTTPException(status_code=422, detail="format must be 'png' or 'data'")
+
+async def _with_plot_urls(results: List[Dict], data: Dict) -> None:
+    """Point fit results of one dataset at their lazily rendered plots and keep the data for rendering them"""
+    registered = [result for result in results if result and result.get('model_handle')]
+    if not registered:
+        return
+    # One hash and write per dataset, off the event loop
+    await asyncio.to_thread(remember_dataset, data)
+    for result in registered:
+        result["plot_urls"] = plot_urls(result['model_handle'])
 
 @app.get("/")
 async def root():
     return {"message": "Survival Analysis Service", "status": "running"}
 
 @app.get("/demo-data/{endpoint_type}")
-async def get_demo_data(endpoint_type: str = "OS"):
+async def get_demo_data(http_request: Request, endpoint_type: str = "OS"):
     """
     Load pre-packaged demo IPD data for survival analysis.
     This provides working data for demos without requiring KM Digitizer flow.
+    With `Accept: application/vnd.apache.arrow.stream` the parquet files are
+    streamed as Arrow IPC record batches (arm column 'chemo'/'pembro').
     
     Args:
         endpoint_type: "OS" or "PFS"
@@ -86,6 +252,15 @@ async def get_demo_data(endpoint_type: str = "OS"):
                 detail=f"Demo data not found for endpoint type: {endpoint_type}. Available: OS, PFS"
             )
         
+        if wants_arrow(http_request.headers.get('accept')):
+            return StreamingResponse(
+                stream_parquet_ipd(
+                    [(str(chemo_path), "chemo"), (str(pembro_path), "pembro")],
+                    metadata={"endpoint_type": endpoint_type, "source": "demo_data"}
+                ),
+                media_type=ARROW_STREAM_MEDIA_TYPE
+            )
+        
         from data_loader import load_parquet_files
         chemo_data, pembro_data = load_parquet_files(str(chemo_path), str(pembro_path))
         
@@ -133,9 +308,14 @@ async def list_demo_data():
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/load-data")
-async def load_data(request: ParquetDataRequest):
-    """Load parquet data files"""
+async def load_data(request: ParquetDataRequest, http_request: Request):
+    """Load parquet data files, as JSON or (on Accept) an Arrow IPC stream"""
     try:
+        if wants_arrow(http_request.headers.get('accept')):
+            return StreamingResponse(
+                stream_parquet_ipd([(request.chemo_path, "chemo"), (request.pembro_path, "pembro")]),
+                media_type=ARROW_STREAM_MEDIA_TYPE
+            )
         from data_loader import load_parquet_files
         chemo_data, pembro_data = load_parquet_files(request.chemo_path, request.pembro_path)
         return {
@@ -145,21 +325,94 @@ async def load_data(request: ParquetDataRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/datasets")
+async def upload_dataset(request: DatasetUploadRequest):
+    """
+    Upload time/event arrays once and get back a content-addressed `dataset_id`.
+    Fit, PH-test and plot endpoints accept the id in place of inline data.
+    Arrow IPC bodies are stored by ArrowBodyMiddleware before reaching here.
+    """
+    try:
+        return datasets.put(request.time, request.event, label=request.label)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.get("/datasets/{dataset_id}")
+async def get_dataset(http_request: Request, dataset_id: str, include_data: bool = False):
+    """Describe a stored dataset, optionally returning its arrays (as Arrow IPC on Accept)"""
+    info = datasets.describe(dataset_id)
+    if info is None:
+        raise HTTPException(status_code=404, detail=f"Unknown or expired dataset_id: {dataset_id}")
+    if wants_arrow(http_request.headers.get('accept')):
+        stored = datasets.get(dataset_id)
+        return Response(
+            stream_arrays(stored, metadata={"dataset_id": dataset_id, "label": info["label"] or ""}),
+            media_type=ARROW_STREAM_MEDIA_TYPE
+        )
+    if include_data:
+        stored = datasets.get(dataset_id)
+        info["time"] = stored["time"].tolist()
+        info["event"] = stored["event"].tolist()
+    return info
+
+@app.delete("/datasets/{dataset_id}")
+async def delete_dataset(dataset_id: str):
+    if not datasets.delete(dataset_id):
+        raise HTTPException(status_code=404, detail=f"Unknown or expired dataset_id: {dataset_id}")
+    return {"deleted": dataset_id}
+
 @app.post("/fit-km")
 async def fit_km(data: DataPair):
     """Fit Kaplan-Meier curves"""
     try:
-        result = fit_km_curves(data.chemo.dict(), data.pembro.dict())
+        result = await run_cpu_bound(fit_km_curves, *resolve_pair(data))
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/test-ph")
-async def test_ph(data: DataPair):
-    """Test proportional hazards assumption"""
+async def test_ph(data: DataPair, format: str = "png"):
+    """Test proportional hazards assumption
+    
+    `?format=data` returns the diagnostic series (`diagnostic_data`) instead of PNGs.
+    """
+    _check_plot_format(format)
     try:
-        result = test_proportional_hazards(data.chemo.dict(), data.pembro.dict())
+        result = await run_cpu_bound(test_proportional_hazards, *resolve_pair(data), plot_format=format)
         return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/detect-crossings")
+async def detect_curve_crossings(data: DataPair):
+    """Every crossing of the chemo and pembro KM curves, found exactly on their merged event times"""
+    from curve_crossing import detect_data_crossings
+    try:
+        return await run_cpu_bound(detect_data_crossings, *resolve_pair(data))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/time-varying-hr")
+async def time_varying_hazard_ratio(request: TimeVaryingHRRequest):
+    """Period-specific pembro vs chemo HRs and a time-varying treatment x g(t) term (Cox, counting process)"""
+    from two_arm_context import pair_time_varying_hr
+    try:
+        return await run_cpu_bound(
+            pair_time_varying_hr,
+            *resolve_pair(request),
+            breakpoints=request.breakpoints,
+            time_function=request.time_function
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -167,12 +420,12 @@ async def test_ph(data: DataPair):
 async def fit_one_piece(request: ModelFitRequest):
     """Fit one-piece parametric model"""
     try:
-        result = fit_one_piece_model(
-            request.data.dict(),
-            request.arm,
-            request.distribution
-        )
+        data = resolve_data(request.data, request.dataset_id)
+        result = await run_cpu_bound(fit_one_piece_model, data, request.arm, request.distribution)
+        await _with_plot_urls([result], data)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -192,29 +445,82 @@ async def detect_cutpoint(request: ModelFitRequest):
     - n_events_post: events after cutpoint
     - n_at_risk_pre: patients at risk before cutpoint
     - n_at_risk_post: patients at risk after cutpoint
+    - profile: LRT statistic at every evaluated cutpoint
+    
+    Set `cutpoint_candidates` to "event-times" to scan every distinct event time.
     """
     try:
         from piecewise_models import detect_cutpoint_chow_test
-        result = detect_cutpoint_chow_test(
-            request.data.dict(),
+        result = await run_cpu_bound(
+            detect_cutpoint_chow_test,
+            resolve_data(request.data, request.dataset_id),
             weeks_start=request.weeks_start or 12,
-            weeks_end=request.weeks_end or 52
+            weeks_end=request.weeks_end or 52,
+            candidates=request.cutpoint_candidates
         )
         return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+class ChangepointRequest(BaseModel):
+    data: Optional[ParquetData] = None
+    dataset_id: Optional[str] = None
+    max_segments: int = 4
+    n_segments: Optional[int] = None  # Fix the number of segments instead of choosing by criterion
+    min_events: int = 5
+    weeks_start: Optional[float] = None
+    weeks_end: Optional[float] = None
+    criterion: str = "bic"
+
+@app.post("/detect-cutpoints")
+async def detect_cutpoints(request: ChangepointRequest):
+    """
+    Detect one or more hazard change points with a piecewise-exponential
+    dynamic programme. The number of segments is chosen by BIC (or AIC)
+    subject to `min_events` per segment; pass the returned `cutpoints` to
+    /fit-piecewise for a multi-segment piecewise model.
+    """
+    try:
+        from changepoint import detect_changepoints
+        return await run_cpu_bound(
+            detect_changepoints,
+            resolve_data(request.data, request.dataset_id),
+            max_segments=request.max_segments,
+            n_segments=request.n_segments,
+            min_events=request.min_events,
+            weeks_start=request.weeks_start,
+            weeks_end=request.weeks_end,
+            criterion=request.criterion
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/fit-piecewise")
 async def fit_piecewise(request: ModelFitRequest):
-    """Fit piecewise parametric model"""
+    """Fit piecewise parametric model at `cutpoint`, or at several `cutpoints`"""
+    if request.cutpoints is None and request.cutpoint is None:
+        raise HTTPException(status_code=422, detail="cutpoint or cutpoints is required")
+    if request.cutpoints is not None and not request.cutpoints:
+        raise HTTPException(status_code=422, detail="cutpoints must not be empty")
     try:
-        result = fit_piecewise_model(
-            request.data.dict(),
+        data = resolve_data(request.data, request.dataset_id)
+        result = await run_cpu_bound(
+            fit_piecewise_model,
+            data,
             request.arm,
             request.distribution,
-            request.cutpoint
+            request.cutpoints if request.cutpoints is not None else request.cutpoint
         )
+        await _with_plot_urls([result], data)
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -222,31 +528,372 @@ async def fit_piecewise(request: ModelFitRequest):
 async def fit_spline(request: ModelFitRequest):
     """Fit Royston-Parmar spline model"""
     try:
-        result = fit_spline_model(
-            request.data.dict(),
-            request.arm,
-            request.scale,
-            request.knots
+        data = resolve_data(request.data, request.dataset_id)
+        result = await run_cpu_bound(fit_spline_model, data, request.arm, request.scale, request.knots)
+        await _with_plot_urls([result], data)
+        return result
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _resolve_grid_datasets(request: Union[ModelGridRequest, BootstrapRequest]) -> Dict[str, Dict]:
+    resolved = {arm: data.dict() for arm, data in (request.datasets or {}).items()}
+    for arm, dataset_id in (request.dataset_ids or {}).items():
+        resolved[arm] = resolve_data(None, dataset_id, arm)
+    if not resolved:
+        raise HTTPException(status_code=422, detail="Either datasets or dataset_ids must be provided")
+    return resolved
+
+@app.post("/fit-grid")
+async def fit_grid(request: ModelGridRequest):
+    """
+    Fit the full model grid (arms x approaches x distributions / scales x knots)
+    in one call, spread across the shared worker pool.
+    
+    Each entry in `results` carries the model result (or error) and its
+    elapsed fitting time, so partial failures do not fail the whole grid.
+    `max_workers` caps how many of the grid's jobs run at once.
+    """
+    try:
+        grid_datasets = _resolve_grid_datasets(request)
+        started = time.perf_counter()
+        plan = await run_cpu_bound(
+            plan_model_grid,
+            grid_datasets,
+            approaches=request.approaches,
+            distributions=request.distributions,
+            scales=request.scales,
+            knots=request.knots,
+            cutpoints=request.cutpoints,
+            weeks_start=request.weeks_start or 12,
+            weeks_end=request.weeks_end or 52,
+            cutpoint_candidates=request.cutpoint_candidates,
+            cutpoint_method=request.cutpoint_method or "chow"
         )
+        # Jobs go to the shared executor rather than a nested process pool; a
+        # semaphore keeps this request to at most one job per worker.
+        workers = max(1, min(request.max_workers or executor.workers, executor.workers, len(plan['jobs']) or 1))
+        slots = asyncio.Semaphore(workers)
+        ship_records = executor.kind == 'process'
+
+        async def run_job(job):
+            async with slots:
+                return await run_cpu_bound(run_grid_job, job, grid_datasets[job[0]['arm']], ship_records)
+
+        job_entries = await asyncio.gather(*(run_job(job) for job in plan['jobs']))
+        result = collect_grid_results(plan, job_entries, workers, time.perf_counter() - started)
+        await asyncio.gather(*(
+            _with_plot_urls([entry['result'] for entry in result['results'] if entry['task']['arm'] == arm], data)
+            for arm, data in grid_datasets.items()
+        ))
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/bootstrap")
+async def bootstrap(request: BootstrapRequest):
+    """
+    Nonparametric bootstrap of the requested models, streamed as NDJSON.
+    
+    Lines are a header (time grid, percentiles), one message per model with
+    percentile bands of S(t), milestone survival and restricted mean survival
+    as soon as its replicates are in, and a closing summary.
+    """
+    import json
+    
+    if request.n_replicates < 1:
+        raise HTTPException(status_code=422, detail="n_replicates must be at least 1")
+    # Resolve datasets up-front so unknown ids fail the request rather than the stream
+    data = _resolve_grid_datasets(request)
+    started = time.perf_counter()
+    tasks = bootstrap_tasks(data, request.approaches, request.distributions, request.scales, request.knots)
+    # Point fits go through the shared executor like /fit-grid's jobs, so a busy
+    # server answers 429 before streaming; the replicates then run on the
+    # bootstrap pool, which caps replicates in flight across all requests.
+    workers = max(1, min(request.max_workers or executor.workers, executor.workers, len(tasks) or 1))
+    slots = asyncio.Semaphore(workers)
+
+    async def fit_point(task):
+        async with slots:
+            return await run_cpu_bound(fit_point_estimate, data[task['arm']], task)
+
+    point_fits = await asyncio.gather(*(fit_point(task) for task in tasks))
+    messages = stream_replicates(
+        data,
+        tasks,
+        point_fits,
+        n_replicates=request.n_replicates,
+        seed=request.seed,
+        times=request.times,
+        percentiles=request.percentiles,
+        max_workers=request.max_workers,
+        started=started
+    )
+    return StreamingResponse(
+        (json.dumps(message) + "\n" for message in messages),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/generate-plots")
-async def generate_plots(request: PlotRequest):
-    """Generate dual plots (short-term and long-term)"""
+async def generate_plots(request: PlotRequest, format: str = "png"):
+    """Generate dual plots (short-term and long-term)
+    
+    `?format=data` returns the plotted series for client-side rendering instead of PNGs.
+    """
+    _check_plot_format(format)
     try:
-        result = generate_dual_plots(
+        if format == "data":
+            return await run_cpu_bound(
+                generate_plot_data,
+                request.model_result,
+                request.km_data,
+                resolve_data(None, request.original_dataset_id, "original_data")
+                if request.original_dataset_id else request.original_data,
+                request.seer_data,
+                request.model_handle
+            )
+        result = await run_cpu_bound(
+            generate_dual_plots,
             request.model_id,
             request.model_result,
             request.km_data,
-            request.original_data,  # Pass original data for refitting
-            request.seer_data
+            # Only used when the model handle is unknown
+            resolve_data(None, request.original_dataset_id, "original_data")
+            if request.original_dataset_id else request.original_data,
+            request.seer_data,
+            request.model_handle
         )
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/plots/{model_handle}")
+async def get_model_plot(model_handle: str, request: Request, plot_type: str = "short_term"):
+    """
+    PNG plot of a registered model, rendered on first request and served from
+    the on-disk plot cache afterwards. The ETag is the plot's content address,
+    so `If-None-Match` revalidation answers 304 without touching matplotlib.
+    """
+    from model_registry import registry
+    if plot_type not in PLOT_TYPES:
+        raise HTTPException(status_code=422, detail=f"plot_type must be one of {', '.join(PLOT_TYPES)}")
+    # Resolve the handle first: an unknown one is a 404 even with a matching If-None-Match
+    record = registry.get(model_handle)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model handle: {model_handle}")
+    etag = f'"{plot_key(model_handle, plot_type)}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    try:
+        png = await run_cpu_bound(get_plot, model_handle, plot_type, record)
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if png is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model handle: {model_handle}")
+    return Response(content=png, media_type="image/png", headers=headers)
+
+@app.post("/predict")
+async def predict(request: PredictRequest):
+    """Evaluate survival, hazard, cumulative hazard or density of a registered fitted model"""
+    from model_registry import registry
+    from survival_predictor import predict_record, QUANTITIES
+    import numpy as np
+    
+    record = registry.get(request.model_handle)
+    if record is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model handle: {request.model_handle}")
+    if request.quantity not in QUANTITIES:
+        raise HTTPException(status_code=422, detail=f"quantity must be one of {', '.join(QUANTITIES)}")
+    try:
+        times = np.array(request.times, dtype=float)
+        values = await run_cpu_bound(predict_record, record, times, request.quantity)
+        return {
+            "model_handle": request.model_handle,
+            "times": times.tolist(),
+            request.quantity: [None if np.isnan(v) else float(v) for v in values]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/predict-batch")
+async def predict_batch(request: PredictBatchRequest):
+    """Evaluate many registered models on one time grid (spline models share one matrix multiply)"""
+    from model_registry import registry
+    from survival_predictor import predict_records, QUANTITIES, PREDICTION_GRID
+    import numpy as np
+    
+    records = [registry.get(handle) for handle in request.model_handles]
+    missing = [handle for handle, record in zip(request.model_handles, records) if record is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown model handles: {', '.join(missing)}")
+    if request.quantity not in QUANTITIES:
+        raise HTTPException(status_code=422, detail=f"quantity must be one of {', '.join(QUANTITIES)}")
+    try:
+        times = PREDICTION_GRID if request.times is None else np.array(request.times, dtype=float)
+        values = await run_cpu_bound(predict_records, records, times, request.quantity)
+        return {
+            "times": times.tolist(),
+            "quantity": request.quantity,
+            "models": {
+                handle: [None if np.isnan(v) else float(v) for v in curve]
+                for handle, curve in zip(request.model_handles, values)
+            }
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/psa")
+async def psa(request: PSARequest):
+    """
+    Probabilistic sensitivity analysis: curves of registered models under
+    multivariate normal draws of their parameters, on a cycle grid.
+    
+    Returns the mean and percentile curves per model, plus the draws x times
+    matrices (float32) when include_draws is set.
+    """
+    from model_registry import registry
+    from survival_predictor import QUANTITIES
+    import numpy as np
+    import psa as psa_sampler
+    
+    records = [registry.get(handle) for handle in request.model_handles]
+    missing = [handle for handle, record in zip(request.model_handles, records) if record is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown model handles: {', '.join(missing)}")
+    if request.quantity not in QUANTITIES:
+        raise HTTPException(status_code=422, detail=f"quantity must be one of {', '.join(QUANTITIES)}")
+    if request.n_draws < 1:
+        raise HTTPException(status_code=422, detail="n_draws must be at least 1")
+    if request.times is None and request.cycle_length <= 0:
+        raise HTTPException(status_code=422, detail="cycle_length must be positive")
+    times = (
+        np.array(request.times, dtype=float) if request.times is not None
+        else psa_sampler.cycle_times(request.horizon, request.cycle_length)
+    )
+    
+    try:
+        return await run_cpu_bound(
+            psa_sampler.run_psa,
+            records,
+            request.n_draws,
+            times,
+            seed=request.seed,
+            quantity=request.quantity,
+            percentiles=request.percentiles,
+            include_draws=request.include_draws
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/rmst")
+async def rmst(request: RMSTRequest):
+    """
+    Restricted mean survival time of many registered models at several horizons,
+    against the observed Kaplan-Meier RMST, with (discounted) life years.
+    
+    All models share one integration grid and are integrated in a single pass.
+    """
+    from model_registry import registry, dataset_fingerprint
+    from rmst import rmst_table
+    
+    records = [registry.get(handle) for handle in request.model_handles]
+    missing = [handle for handle, record in zip(request.model_handles, records) if record is None]
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Unknown model handles: {', '.join(missing)}")
+    
+    observed = {}
+    for record in records:
+        stored = datasets.get(record['dataset_fingerprint'])
+        if stored is not None:
+            observed[record['dataset_fingerprint']] = stored
+    for data in (request.datasets or {}).values():
+        data = data.dict()
+        observed[dataset_fingerprint(data)] = data
+    for dataset_id in request.dataset_ids or []:
+        observed[dataset_id] = resolve_data(None, dataset_id, dataset_id)
+    
+    try:
+        return await run_cpu_bound(
+            rmst_table,
+            records,
+            request.horizons,
+            request.discount_rate,
+            request.time_units_per_year,
+            observed
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/partitioned-survival")
+async def partitioned_survival(request: PartitionedSurvivalRequest):
+    """
+    Partitioned survival cohort model from fitted OS and PFS models per arm:
+    state traces, (discounted) life years, QALYs and costs, incremental results
+    and ICERs, plus PSA summaries over n_draws parameter draws.
+    """
+    from model_registry import registry
+    from partitioned_survival import partitioned_survival_analysis
+    
+    arms = {}
+    for name, arm in request.arms.items():
+        records = {key: registry.get(getattr(arm, f"{key}_model_handle")) for key in ('os', 'pfs')}
+        missing = [getattr(arm, f"{key}_model_handle") for key, record in records.items() if record is None]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Unknown model handles for {name}: {', '.join(missing)}")
+        arms[name] = {**records, "costs": arm.costs, "utilities": arm.utilities}
+    if request.cycle_length <= 0 or request.horizon <= 0:
+        raise HTTPException(status_code=422, detail="horizon and cycle_length must be positive")
+    
+    try:
+        return await run_cpu_bound(
+            partitioned_survival_analysis,
+            arms,
+            horizon=request.horizon,
+            cycle_length=request.cycle_length,
+            utilities=request.utilities,
+            discount_rate_costs=request.discount_rate_costs,
+            discount_rate_outcomes=request.discount_rate_outcomes,
+            half_cycle_correction=request.half_cycle_correction,
+            time_units_per_year=request.time_units_per_year,
+            comparator=request.comparator,
+            n_draws=max(0, request.n_draws),
+            seed=request.seed,
+            percentiles=request.percentiles
+        )
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/models/registry")
+async def model_registry_stats():
+    """Fitted-model registry occupancy and hit rate"""
+    from model_registry import registry
+    from custom_spline_models import basis_cache_stats
+    return {**registry.stats(), "spline_basis_cache": basis_cache_stats(), "km_cache": km_cache_stats()}
+
 @app.post("/validate-seer")
 async def validate_seer(request: Dict[str, Any]):
     """Validate model against SEER benchmark data"""
@@ -355,7 +1002,8 @@ async def extract_km_curve(request: KMExtractionRequest):
         if risk_table_base64:
             print(f"[KM Extraction] Risk table base64 length: {len(risk_table_base64)}")
         
-        result = extract_km_from_base64(
+        result = await run_cpu_bound(
+            extract_km_from_base64,
             image_base64=image_base64,
             risk_table_image_base64=risk_table_base64,
             granularity=request.granularity,
@@ -406,6 +1054,8 @@ async def extract_km_curve(request: KMExtractionRequest):
             success=False,
             error=f"Missing dependencies: {str(e)}. Run: pip install opencv-python anthropic openai pytesseract scipy"
         )
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         return KMExtractionResponse(
@@ -438,7 +1088,8 @@ async def generate_ipd(request: IPDGenerationRequest):
         from km_extractor import generate_ipd_from_km
         
         # Call the comprehensive IPD generator
-        result = generate_ipd_from_km(
+        result = await run_cpu_bound(
+            generate_ipd_from_km,
             km_data=request.km_data,
             atrisk_data=request.atrisk_data,
             endpoint_type=request.endpoint_type,
@@ -456,7 +1107,7 @@ async def generate_ipd(request: IPDGenerationRequest):
         file_path = str(Path(output_dir) / file_name)
         
         ipd_df = pd.DataFrame(result["ipd"])
-        ipd_df.to_parquet(file_path, index=False)
+        await run_cpu_bound(ipd_df.to_parquet, file_path, index=False)
         
         summary = result.get("summary", {})
         
@@ -483,6 +1134,14 @@ class IPDValidationRequest(BaseModel):
     arms: List[Dict[str, Any]]  # [{arm: str, data: [{patient_id, time, event, arm}]}]
 
 
+def _cox_summary(df):
+    """Fit a Cox PH model on time/event/treatment and return its summary table"""
+    from lifelines import CoxPHFitter
+    cph = CoxPHFitter()
+    cph.fit(df, duration_col="time", event_col="event")
+    return cph.summary
+
+
 @app.post("/validate-ipd")
 async def validate_ipd(request: IPDValidationRequest):
     """
@@ -499,7 +1158,6 @@ async def validate_ipd(request: IPDValidationRequest):
     try:
         import pandas as pd
         import numpy as np
-        from lifelines import CoxPHFitter
         
         if len(request.arms) < 2:
             return {
@@ -554,12 +1212,8 @@ async def validate_ipd(request: IPDValidationRequest):
                 "error": "Insufficient data for Cox model (need at least 10 patients)"
             }
         
-        # Fit Cox Proportional Hazards model
-        cph = CoxPHFitter()
-        cph.fit(df, duration_col="time", event_col="event")
-        
-        # Extract HR, CI, and p-value for treatment effect
-        summary = cph.summary
+        # Fit Cox Proportional Hazards model on the worker pool
+        summary = await run_cpu_bound(_cox_summary, df)
         
         if "treatment" not in summary.index:
             return {
@@ -583,6 +1237,8 @@ async def validate_ipd(request: IPDValidationRequest):
             "comparisonArm": arm_names[1] if len(arm_names) > 1 else None
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         import traceback
         return {
@@ -598,7 +1254,8 @@ async def plot_ipd_reconstruction(request: Dict[str, Any]):
     try:
         from ipd_plotting import plot_ipd_reconstruction_r
         
-        result = plot_ipd_reconstruction_r(
+        result = await run_cpu_bound(
+            plot_ipd_reconstruction_r,
             original_times=request.get('original_times', []),
             original_survival=request.get('original_survival', []),
             ipd_time=request.get('ipd_time', []),
@@ -611,6 +1268,8 @@ async def plot_ipd_reconstruction(request: Dict[str, Any]):
             raise HTTPException(status_code=500, detail="Failed to generate IPD plot via R service")
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -620,7 +1279,8 @@ async def plot_km_from_ipd(request: Dict[str, Any]):
     try:
         from ipd_plotting import plot_km_from_ipd_r
         
-        result = plot_km_from_ipd_r(
+        result = await run_cpu_bound(
+            plot_km_from_ipd_r,
             chemo_time=request.get('chemo_time', []),
             chemo_event=request.get('chemo_event', []),
             pembro_time=request.get('pembro_time', []),
@@ -632,6 +1292,8 @@ async def plot_km_from_ipd(request: Dict[str, Any]):
             raise HTTPException(status_code=500, detail="Failed to generate KM plot via R service")
         
         return result
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -640,10 +1302,28 @@ async def health_check():
     """Health check endpoint for deployment platforms"""
     return {"status": "healthy", "service": "survival-analysis-python"}
 
+@app.get("/metrics/executor")
+async def executor_metrics():
+    """Worker pool occupancy, queue depth and wait-time metrics"""
+    return executor.metrics()
+
+@app.get("/metrics/r-service")
+async def r_service_metrics():
+    """R service circuit-breaker state, cached health and per-endpoint latency"""
+    from r_client import r_client
+    return r_client.metrics()
+
 @app.get("/ipd-preview")
 async def ipd_preview(endpoint: str = "OS"):
     """
     Get a preview of available IPD data for a given endpoint type.
+    KM fitting and plotting run on the worker pool.
+    """
+    return await run_cpu_bound(_ipd_preview, endpoint)
+
+def _ipd_preview(endpoint: str = "OS"):
+    """
+    Get a preview of available IPD data for a given endpoint type.
     
     Returns:
     - KM plot with both arms overlaid
@@ -655,10 +1335,6 @@ async def ipd_preview(endpoint: str = "OS"):
         from pathlib import Path
         import pandas as pd
         import numpy as np
-        import matplotlib.pyplot as plt
-        import matplotlib
-        matplotlib.use('Agg')
-        from lifelines import KaplanMeierFitter
         import base64
         from io import BytesIO
         
@@ -724,34 +1400,9 @@ async def ipd_preview(endpoint: str = "OS"):
             n = len(df)
             events = int(df['event'].sum())
             
-            # Fit KM for median survival
-            kmf = KaplanMeierFitter()
-            kmf.fit(df['time'], df['event'])
-            
-            median_survival = kmf.median_survival_time_
-            median_val = float(median_survival) if not np.isinf(median_survival) else None
-            
-            # Get CI for median - handle different lifelines versions
-            ci_lower = None
-            ci_upper = None
-            try:
-                if hasattr(kmf, 'confidence_interval_median_survival_time_'):
-                    ci = kmf.confidence_interval_median_survival_time_
-                    ci_lower = float(ci.iloc[0, 0]) if not np.isnan(ci.iloc[0, 0]) else None
-                    ci_upper = float(ci.iloc[0, 1]) if not np.isnan(ci.iloc[0, 1]) else None
-                else:
-                    # Fallback for older lifelines versions
-                    ci_df = kmf.confidence_interval_survival_function_
-                    lower_ci_col = ci_df.columns[0]
-                    upper_ci_col = ci_df.columns[1]
-                    mask_lower = ci_df[upper_ci_col] <= 0.5
-                    if mask_lower.any():
-                        ci_lower = float(ci_df[mask_lower].index[0])
-                    mask_upper = ci_df[lower_ci_col] <= 0.5
-                    if mask_upper.any():
-                        ci_upper = float(ci_df[mask_upper].index[0])
-            except Exception:
-                pass
+            # Median and its CI from the shared KM kernel
+            median = median_survival(kaplan_meier(df))
+            median_val, ci_lower, ci_upper = median['median'], median['ci_lower'], median['ci_upper']
             
             follow_up = f"{df['time'].min():.1f} - {df['time'].max():.1f} mo"
             
@@ -768,7 +1419,9 @@ async def ipd_preview(endpoint: str = "OS"):
         chemo_stats = calc_stats(chemo_df)
         
         # 5. Generate KM plot
-        fig, ax = plt.subplots(figsize=(10, 7))
+        # Built outside pyplot: this handler runs on the executor threads
+        fig = new_figure((10, 7))
+        ax = fig.subplots()
         
         # Plot settings
         ax.set_xlim(0, max(
@@ -783,15 +1436,11 @@ async def ipd_preview(endpoint: str = "OS"):
         
         # Plot Pembrolizumab
         if pembro_df is not None and len(pembro_df) > 0:
-            kmf_pembro = KaplanMeierFitter()
-            kmf_pembro.fit(pembro_df['time'], pembro_df['event'], label='Pembrolizumab')
-            kmf_pembro.plot_survival_function(ax=ax, ci_show=True, color='#FF7F0E', linewidth=2)
+            plot_km(ax, kaplan_meier(pembro_df), 'Pembrolizumab', '#FF7F0E')
         
         # Plot Chemotherapy
         if chemo_df is not None and len(chemo_df) > 0:
-            kmf_chemo = KaplanMeierFitter()
-            kmf_chemo.fit(chemo_df['time'], chemo_df['event'], label='Chemotherapy')
-            kmf_chemo.plot_survival_function(ax=ax, ci_show=True, color='#1F77B4', linewidth=2)
+            plot_km(ax, kaplan_meier(chemo_df), 'Chemotherapy', '#1F77B4')
         
         ax.legend(loc='lower left', fontsize=11)
         
@@ -799,14 +1448,13 @@ async def ipd_preview(endpoint: str = "OS"):
         ax.text(0.98, 0.02, f"Source: {source.title()} Data", 
                 transform=ax.transAxes, fontsize=9, alpha=0.5, ha='right')
         
-        plt.tight_layout()
+        fig.tight_layout()
         
         # Convert to base64
         buffer = BytesIO()
         fig.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
         buffer.seek(0)
         plot_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-        plt.close(fig)
         
         return {
             "source": source,
@@ -835,7 +1483,69 @@ async def ipd_preview(endpoint: str = "OS"):
         }
 
 @app.get("/ipd-data")
-async def ipd_data(endpoint: str = "OS", projectId: str = None):
+async def ipd_data(http_request: Request, endpoint: str = "OS", projectId: str = None):
+    """
+    Get full IPD data for a given endpoint type, including records, statistics, and KM plot.
+    Parquet loading, KM fitting and plotting run on the worker pool.
+
+    With `Accept: application/vnd.apache.arrow.stream` only the records are returned,
+    streamed from the parquet files as Arrow IPC; arm metadata travels in the schema
+    metadata, and statistics/plot stay on the JSON response.
+    """
+    if wants_arrow(http_request.headers.get('accept')):
+        import json
+        files = _find_ipd_files(endpoint)
+        if not files:
+            raise HTTPException(status_code=404, detail=f"No IPD data found for endpoint: {endpoint}")
+        arms_meta = [
+            {"name": arm_name, "color": IPD_ARM_COLORS[idx % len(IPD_ARM_COLORS)]}
+            for idx, (_, arm_name) in enumerate(files)
+        ]
+        return StreamingResponse(
+            stream_parquet_ipd(files, metadata={"endpoint": endpoint, "source": "demo", "arms": json.dumps(arms_meta)}),
+            media_type=ARROW_STREAM_MEDIA_TYPE
+        )
+    return await run_cpu_bound(_ipd_data, endpoint, projectId)
+
+# Color palette for arms (will cycle if more than 10 arms)
+IPD_ARM_COLORS = ['#FF7F0E', '#1F77B4', '#2CA02C', '#D62728', '#9467BD',
+                  '#8C564B', '#E377C2', '#7F7F7F', '#BCBD22', '#17BECF']
+
+def _find_ipd_files(endpoint: str) -> List[tuple]:
+    """Discover (parquet path, arm name) pairs for an endpoint in the demo data directory"""
+    import os
+    import glob
+    import re
+    from pathlib import Path
+
+    demo_dir = Path(__file__).parent / "demo_data"
+
+    # TODO: If projectId is provided, fetch from Supabase
+    # For now, dynamically discover demo data files
+    
+    # Find all parquet files matching the endpoint pattern
+    pattern = str(demo_dir / f"ipd_EndpointType.{endpoint}_*.parquet")
+    matching_files = glob.glob(pattern)
+    
+    # Also try alternative pattern (arm name might be in different format)
+    if not matching_files:
+        pattern = str(demo_dir / f"*{endpoint}*.parquet")
+        matching_files = glob.glob(pattern)
+
+    files = []
+    for file_path in matching_files:
+        file_name = os.path.basename(file_path)
+        # Extract arm name from filename (e.g., "ipd_EndpointType.OS_Chemotherapy.parquet" -> "Chemotherapy")
+        match = re.search(rf'ipd_EndpointType\.{endpoint}_(.+)\.parquet', file_name)
+        if match:
+            arm_name = match.group(1)
+        else:
+            # Fallback: use filename without extension
+            arm_name = file_name.replace('.parquet', '').split('_')[-1]
+        files.append((file_path, arm_name))
+    return files
+
+def _ipd_data(endpoint: str = "OS", projectId: str = None):
     """
     Get full IPD data for a given endpoint type, including records, statistics, and KM plot.
     Dynamically handles any arm names and endpoints.
@@ -847,50 +1557,19 @@ async def ipd_data(endpoint: str = "OS", projectId: str = None):
     - km_plot_base64: KM plot from R service (or fallback to Python)
     """
     try:
-        import os
-        import glob
-        import re
-        from pathlib import Path
         import pandas as pd
         import numpy as np
-        from lifelines import KaplanMeierFitter
-        
-        # Data directory from environment or fallback
-        demo_dir = Path(__file__).parent / "demo_data"
         
         # Track data source
         source = "demo"
         
-        # Color palette for arms (will cycle if more than 10 arms)
-        ARM_COLORS = ['#FF7F0E', '#1F77B4', '#2CA02C', '#D62728', '#9467BD', 
-                      '#8C564B', '#E377C2', '#7F7F7F', '#BCBD22', '#17BECF']
-        
-        # TODO: If projectId is provided, fetch from Supabase
-        # For now, dynamically discover demo data files
-        
-        # Find all parquet files matching the endpoint pattern
-        pattern = str(demo_dir / f"ipd_EndpointType.{endpoint}_*.parquet")
-        matching_files = glob.glob(pattern)
-        
-        # Also try alternative pattern (arm name might be in different format)
-        if not matching_files:
-            pattern = str(demo_dir / f"*{endpoint}*.parquet")
-            matching_files = glob.glob(pattern)
+        ARM_COLORS = IPD_ARM_COLORS
         
         # Extract arm names and load data
         arm_data = {}  # arm_name -> DataFrame
         arm_names = []
         
-        for file_path in matching_files:
-            file_name = os.path.basename(file_path)
-            # Extract arm name from filename (e.g., "ipd_EndpointType.OS_Chemotherapy.parquet" -> "Chemotherapy")
-            match = re.search(rf'ipd_EndpointType\.{endpoint}_(.+)\.parquet', file_name)
-            if match:
-                arm_name = match.group(1)
-            else:
-                # Fallback: use filename without extension
-                arm_name = file_name.replace('.parquet', '').split('_')[-1]
-            
+        for file_path, arm_name in _find_ipd_files(endpoint):
             try:
                 df = pd.read_parquet(file_path)
                 if len(df) > 0:
@@ -919,16 +1598,19 @@ async def ipd_data(endpoint: str = "OS", projectId: str = None):
                 "color": ARM_COLORS[idx % len(ARM_COLORS)]
             })
         
-        # Combine and format records
+        # Combine and format records column-wise rather than row by row
         records = []
         for arm_name, df in arm_data.items():
-            for idx, row in df.iterrows():
-                records.append({
-                    "patient_id": int(row.get('patient_id', idx + 1)),
-                    "time": float(row['time']),
-                    "event": int(row['event']),
-                    "arm": arm_name
-                })
+            if 'patient_id' in df.columns:
+                patient_ids = df['patient_id'].astype(np.int64)
+            else:
+                patient_ids = pd.Series(df.index, dtype=np.int64) + 1
+            records.extend(pd.DataFrame({
+                "patient_id": patient_ids.to_numpy(),
+                "time": df['time'].astype(np.float64).to_numpy(),
+                "event": df['event'].astype(np.int64).to_numpy(),
+                "arm": arm_name
+            }).to_dict(orient='records'))
         
         # Calculate statistics for each arm
         def calc_stats(df):
@@ -938,33 +1620,8 @@ async def ipd_data(endpoint: str = "OS", projectId: str = None):
             n = len(df)
             events = int(df['event'].sum())
             
-            kmf = KaplanMeierFitter()
-            kmf.fit(df['time'], df['event'])
-            
-            median_survival = kmf.median_survival_time_
-            median_val = float(median_survival) if not np.isinf(median_survival) else None
-            
-            # Get CI for median - handle different lifelines versions
-            ci_lower = None
-            ci_upper = None
-            try:
-                if hasattr(kmf, 'confidence_interval_median_survival_time_'):
-                    ci = kmf.confidence_interval_median_survival_time_
-                    ci_lower = float(ci.iloc[0, 0]) if not np.isnan(ci.iloc[0, 0]) else None
-                    ci_upper = float(ci.iloc[0, 1]) if not np.isnan(ci.iloc[0, 1]) else None
-                else:
-                    # Fallback for older lifelines
-                    ci_df = kmf.confidence_interval_survival_function_
-                    lower_ci_col = ci_df.columns[0]
-                    upper_ci_col = ci_df.columns[1]
-                    mask_lower = ci_df[upper_ci_col] <= 0.5
-                    if mask_lower.any():
-                        ci_lower = float(ci_df[mask_lower].index[0])
-                    mask_upper = ci_df[lower_ci_col] <= 0.5
-                    if mask_upper.any():
-                        ci_upper = float(ci_df[mask_upper].index[0])
-            except Exception as ci_err:
-                print(f"[calc_stats] Could not compute median CI: {ci_err}")
+            median = median_survival(kaplan_meier(df))
+            median_val, ci_lower, ci_upper = median['median'], median['ci_lower'], median['ci_upper']
             
             follow_up = f"{df['time'].min():.1f} - {df['time'].max():.1f} mo"
             
@@ -1007,13 +1664,12 @@ async def ipd_data(endpoint: str = "OS", projectId: str = None):
         
         # Fallback to Python matplotlib if R failed or for non-standard arms
         if km_plot_base64 is None:
-            import matplotlib.pyplot as plt
-            import matplotlib
-            matplotlib.use('Agg')
             import base64
             from io import BytesIO
             
-            fig, ax = plt.subplots(figsize=(10, 7))
+            # Built outside pyplot: this handler runs on the executor threads
+            fig = new_figure((10, 7))
+            ax = fig.subplots()
             
             max_time = max(df['time'].max() for df in arm_data.values())
             ax.set_xlim(0, max_time * 1.1)
@@ -1026,22 +1682,18 @@ async def ipd_data(endpoint: str = "OS", projectId: str = None):
             # Plot each arm with its assigned color
             for idx, (arm_name, df) in enumerate(arm_data.items()):
                 if len(df) > 0:
-                    kmf = KaplanMeierFitter()
-                    kmf.fit(df['time'], df['event'], label=arm_name)
-                    color = ARM_COLORS[idx % len(ARM_COLORS)]
-                    kmf.plot_survival_function(ax=ax, ci_show=True, color=color, linewidth=2)
+                    plot_km(ax, kaplan_meier(df), arm_name, ARM_COLORS[idx % len(ARM_COLORS)])
             
             ax.legend(loc='lower left', fontsize=11)
             ax.text(0.98, 0.02, f"Source: {source.title()} Data", 
                     transform=ax.transAxes, fontsize=9, alpha=0.5, ha='right')
             
-            plt.tight_layout()
+            fig.tight_layout()
             
             buffer = BytesIO()
             fig.savefig(buffer, format='png', dpi=120, bbox_inches='tight')
             buffer.seek(0)
             km_plot_base64 = base64.b64encode(buffer.read()).decode('utf-8')
-            plt.close(fig)
         
         return {
             "endpoint": endpoint,
@@ -0,0 +1,300 @@
+"""Batch fitting of the full arm x approach x distribution model grid"""
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Union
+
+from survival_models import fit_one_piece_model, fit_spline_model, fit_spline_grid
+from piecewise_models import fit_piecewise_model, detect_cutpoint_chow_test
+from changepoint import detect_changepoints
+from model_registry import registry
+
+# Number of worker processes used for a grid; 0 or 1 fits in-process
+MODEL_GRID_WORKERS = int(os.environ.get('MODEL_GRID_WORKERS', os.cpu_count() or 1))
+
+DEFAULT_DISTRIBUTIONS = ['exponential', 'weibull', 'log-normal', 'log-logistic', 'gompertz', 'generalized-gamma']
+DEFAULT_SCALES = ['hazard', 'odds', 'normal']
+DEFAULT_KNOTS = [1, 2, 3]
+DEFAULT_APPROACHES = ['one-piece', 'piecewise', 'spline']
+
+# Datasets are handed to each worker once via the pool initializer
+# rather than being pickled again with every task.
+_worker_datasets: Dict[str, Dict] = {}
+
+
+def _init_worker(datasets: Dict[str, Dict]) -> None:
+    global _worker_datasets
+    _worker_datasets = datasets
+
+
+def build_grid_tasks(
+    arms: List[str],
+    approaches: List[str],
+    distributions: List[str],
+    scales: List[str],
+    knots: List[int],
+    cutpoints: Dict[str, Union[float, List[float]]]
+) -> List[Dict]:
+    """Expand the grid spec into one task per model, in the agent's fitting order"""
+    tasks = []
+    for approach in approaches:
+        for arm in arms:
+            if approach == 'one-piece':
+                for distribution in distributions:
+                    tasks.append({"approach": approach, "arm": arm, "distribution": distribution})
+            elif approach == 'piecewise':
+                for distribution in distributions:
+                    tasks.append({
+                        "approach": approach,
+                        "arm": arm,
+                        "distribution": distribution,
+                        "cutpoint": cutpoints.get(arm)
+                    })
+            elif approach == 'spline':
+                for scale in scales:
+                    for k in knots:
+                        tasks.append({"approach": approach, "arm": arm, "scale": scale, "knots": k})
+            else:
+                raise ValueError(f"Unknown approach: {approach}")
+    return tasks
+
+
+def _run_grid_task(task: Dict, data: Optional[Dict] = None, ship_records: Optional[bool] = None) -> Dict:
+    """Fit a single grid model, capturing timing and any error instead of raising"""
+    in_worker = data is None
+    if in_worker:
+        data = _worker_datasets[task['arm']]
+    ship_records = in_worker if ship_records is None else ship_records
+
+    start = time.perf_counter()
+    result = None
+    error = None
+    try:
+        approach = task['approach']
+        if approach == 'one-piece':
+            result = fit_one_piece_model(data, task['arm'], task['distribution'])
+        elif approach == 'piecewise':
+            if task.get('cutpoint') is None:
+                raise ValueError(f"No cutpoint available for arm {task['arm']}")
+            result = fit_piecewise_model(data, task['arm'], task['distribution'], task['cutpoint'])
+        elif approach == 'spline':
+            result = fit_spline_model(data, task['arm'], task['scale'], task['knots'])
+            if result.get('error'):
+                error = result['error']
+        else:
+            raise ValueError(f"Unknown approach: {approach}")
+    except Exception as e:
+        error = str(e)
+        print(f"[ModelGrid] {task} failed: {e}\n{traceback.format_exc()}")
+
+    entry = {
+        "task": task,
+        "result": result,
+        "error": error,
+        "elapsed_seconds": time.perf_counter() - start
+    }
+    if ship_records and result and result.get('model_handle'):
+        # Ship the fitted model back so the parent registry can serve it
+        entry["_record"] = registry.get(result['model_handle'])
+    return entry
+
+
+def group_grid_jobs(tasks: List[Dict]) -> List[List[Dict]]:
+    """One job per model, except that all spline models of an arm form a single warm-started job"""
+    jobs = []
+    spline_jobs: Dict[str, List[Dict]] = {}
+    for task in tasks:
+        if task['approach'] != 'spline':
+            jobs.append([task])
+        elif task['arm'] in spline_jobs:
+            spline_jobs[task['arm']].append(task)
+        else:
+            spline_jobs[task['arm']] = [task]
+            jobs.append(spline_jobs[task['arm']])
+    return jobs
+
+
+def _run_grid_job(job: List[Dict], data: Optional[Dict] = None, ship_records: Optional[bool] = None) -> List[Dict]:
+    """Run one job; a spline job fits its whole scale x knots family in one pass"""
+    if job[0]['approach'] != 'spline' or len(job) == 1:
+        return [_run_grid_task(task, data, ship_records) for task in job]
+
+    in_worker = data is None
+    arm = job[0]['arm']
+    if in_worker:
+        data = _worker_datasets[arm]
+    ship_records = in_worker if ship_records is None else ship_records
+
+    start = time.perf_counter()
+    scales = list(dict.fromkeys(task['scale'] for task in job))
+    knots = list(dict.fromkeys(task['knots'] for task in job))
+    try:
+        results = {
+            (result['scale'], result['knots']): result
+            for result in fit_spline_grid(data, arm, scales, knots)
+        }
+    except Exception as e:
+        print(f"[ModelGrid] Spline family for {arm} failed: {e}\n{traceback.format_exc()}")
+        elapsed = (time.perf_counter() - start) / len(job)
+        return [{"task": task, "result": None, "error": str(e), "elapsed_seconds": elapsed} for task in job]
+
+    entries = []
+    for task in job:
+        result = results[(task['scale'], task['knots'])]
+        entry = {
+            "task": task,
+            "result": result,
+            "error": result.get('error'),
+            "elapsed_seconds": result.get('fit_seconds') or 0.0
+        }
+        if ship_records and result.get('model_handle'):
+            entry["_record"] = registry.get(result['model_handle'])
+        entries.append(entry)
+    return entries
+
+
+def run_grid_job(job: List[Dict], data: Dict, ship_records: bool = False) -> List[Dict]:
+    """
+    Run one job of a planned grid on its arm's data.
+
+    For callers that schedule the jobs on a pool of their own (the API's shared
+    executor). Set ship_records when that pool is a process pool, so fitted
+    models come back as '_record' for collect_grid_results to register.
+    """
+    return _run_grid_job(job, data, ship_records)
+
+
+def plan_model_grid(
+    datasets: Dict[str, Dict],
+    approaches: Optional[List[str]] = None,
+    distributions: Optional[List[str]] = None,
+    scales: Optional[List[str]] = None,
+    knots: Optional[List[int]] = None,
+    cutpoints: Optional[Dict[str, Union[float, List[float]]]] = None,
+    weeks_start: int = 12,
+    weeks_end: int = 52,
+    cutpoint_candidates=None,
+    cutpoint_method: str = 'chow'
+) -> Dict:
+    """
+    Detect missing piecewise cutpoints and split the grid into jobs.
+
+    Takes fit_model_grid's arguments (without max_workers).
+
+    Returns:
+        Dict with 'jobs' (see group_grid_jobs), 'cutpoints' per arm and the
+        detection output in 'cutpoint_results'
+    """
+    approaches = approaches or DEFAULT_APPROACHES
+    distributions = distributions or DEFAULT_DISTRIBUTIONS
+    scales = scales or DEFAULT_SCALES
+    knots = knots or DEFAULT_KNOTS
+    cutpoints = dict(cutpoints or {})
+    arms = list(datasets.keys())
+
+    # Cutpoint detection is cheap relative to the fits, so it runs up-front
+    cutpoint_results = {}
+    if 'piecewise' in approaches:
+        for arm in arms:
+            if cutpoints.get(arm) is None:
+                if cutpoint_method == 'changepoint':
+                    # A failed detection falls back to Chow like one that finds no change
+                    try:
+                        changepoints = detect_changepoints(datasets[arm])
+                    except Exception as e:
+                        print(f"[ModelGrid] Changepoint detection failed for {arm}, using Chow: {e}")
+                        changepoints = {"cutpoints": []}
+                    if changepoints['cutpoints']:
+                        cutpoint_results[arm] = changepoints
+                        cutpoints[arm] = changepoints['cutpoints']
+                        continue
+                try:
+                    cutpoint_results[arm] = detect_cutpoint_chow_test(
+                        datasets[arm], weeks_start=weeks_start, weeks_end=weeks_end,
+                        candidates=cutpoint_candidates
+                    )
+                    cutpoints[arm] = cutpoint_results[arm]['cutpoint']
+                except Exception as e:
+                    print(f"[ModelGrid] Cutpoint detection failed for {arm}: {e}")
+
+    tasks = build_grid_tasks(arms, approaches, distributions, scales, knots, cutpoints)
+    return {"jobs": group_grid_jobs(tasks), "cutpoints": cutpoints, "cutpoint_results": cutpoint_results}
+
+
+def collect_grid_results(plan: Dict, job_entries: List[List[Dict]], workers: int, elapsed_seconds: float) -> Dict:
+    """fit_model_grid's response from the entries of every job, registering shipped-back models"""
+    entries = [entry for entries_of_job in job_entries for entry in entries_of_job]
+    for entry in entries:
+        record = entry.pop("_record", None)
+        if record is not None:
+            registry.put_record(record)
+    return {
+        "results": entries,
+        "cutpoints": plan['cutpoints'],
+        "cutpoint_results": plan['cutpoint_results'],
+        "n_models": len(entries),
+        "n_failed": sum(1 for entry in entries if entry['error'] is not None),
+        "workers": workers,
+        "elapsed_seconds": elapsed_seconds
+    }
+
+
+def fit_model_grid(
+    datasets: Dict[str, Dict],
+    approaches: Optional[List[str]] = None,
+    distributions: Optional[List[str]] = None,
+    scales: Optional[List[str]] = None,
+    knots: Optional[List[int]] = None,
+    cutpoints: Optional[Dict[str, Union[float, List[float]]]] = None,
+    weeks_start: int = 12,
+    weeks_end: int = 52,
+    cutpoint_candidates=None,
+    cutpoint_method: str = 'chow',
+    max_workers: Optional[int] = None
+) -> Dict:
+    """Fit every requested model for every arm, fanned out across a process pool.
+
+    Args:
+        datasets: Mapping of arm name to {'time': [...], 'event': [...]}
+        approaches: Subset of 'one-piece', 'piecewise', 'spline'
+        distributions: Distributions for one-piece and piecewise models
+        scales: Royston-Parmar scales for spline models
+        knots: Internal knot counts for spline models
+        cutpoints: Per-arm piecewise cutpoint(s); arms without one are detected
+            with the Chow test over [weeks_start, weeks_end]
+        cutpoint_candidates: Chow scan grid (see detect_cutpoint_chow_test)
+        cutpoint_method: 'chow' for one cutpoint, or 'changepoint' for the BIC-chosen
+            multi-segment split (falling back to Chow when no change is found)
+        max_workers: Pool size override (defaults to MODEL_GRID_WORKERS)
+
+    Spline models of an arm are fitted together with shared bases and warm
+    starts; their entries report each model's own optimisation time and
+    Newton iteration count (`result['iterations']`).
+
+    Returns:
+        Dictionary with one entry per model (result, error and timing, in grid
+        order), the cutpoints used, and overall timing.
+    """
+    start = time.perf_counter()
+    plan = plan_model_grid(
+        datasets, approaches, distributions, scales, knots, cutpoints,
+        weeks_start=weeks_start, weeks_end=weeks_end,
+        cutpoint_candidates=cutpoint_candidates, cutpoint_method=cutpoint_method
+    )
+    jobs = plan['jobs']
+
+    workers = MODEL_GRID_WORKERS if max_workers is None else max_workers
+    workers = max(0, min(workers, len(jobs)))
+
+    if workers <= 1:
+        job_entries = [_run_grid_job(job, datasets[job[0]['arm']]) for job in jobs]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(datasets,)
+        ) as pool:
+            job_entries = list(pool.map(_run_grid_job, jobs))
+
+    return collect_grid_results(plan, job_entries, workers, time.perf_counter() - start)
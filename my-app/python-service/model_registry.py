@@ -0,0 +1,159 @@
+"""In-process registry of fitted survival models
+
+Fitted models are keyed by a fingerprint of the data they were fitted on plus
+the model spec (approach, distribution, scale, knots, cutpoint), so plotting and
+prediction can reuse a fit instead of refitting from the original data.
+"""
+import hashlib
+import json
+import os
+import pickle
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+MODEL_REGISTRY_SIZE = int(os.environ.get('MODEL_REGISTRY_SIZE', '256'))
+# Optional on-disk tier; records are written through so they survive eviction and restarts
+MODEL_REGISTRY_DIRECTORY = os.environ.get('MODEL_REGISTRY_DIRECTORY')
+
+SPEC_FIELDS = ('approach', 'distribution', 'scale', 'knots', 'cutpoint')
+
+# Handles are the first 32 hex digits of a sha256 (make_model_handle)
+HANDLE_LENGTH = 32
+_HANDLE_PATTERN = re.compile(rf'[0-9a-f]{{{HANDLE_LENGTH}}}')
+
+
+def is_model_handle(handle: Any) -> bool:
+    """Whether handle has the registry's own format; anything else is never a known model"""
+    return isinstance(handle, str) and _HANDLE_PATTERN.fullmatch(handle) is not None
+
+
+def dataset_fingerprint(data: Dict) -> str:
+    """Content hash of a dataset's time and event columns"""
+    time_values = np.ascontiguousarray(np.asarray(data['time'], dtype=np.float64))
+    event_values = np.ascontiguousarray(np.asarray(data['event'], dtype=np.int8))
+    digest = hashlib.sha256()
+    digest.update(time_values.tobytes())
+    digest.update(event_values.tobytes())
+    return digest.hexdigest()
+
+
+def make_model_handle(fingerprint: str, spec: Dict) -> str:
+    """Deterministic handle for a (dataset, model spec) pair"""
+    key = {field: spec.get(field) for field in SPEC_FIELDS}
+    payload = fingerprint + json.dumps(key, sort_keys=True, default=float)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:HANDLE_LENGTH]
+
+
+class ModelRegistry:
+    """Bounded LRU store of fitted models with an optional write-through disk tier"""
+
+    def __init__(self, max_entries: int = MODEL_REGISTRY_SIZE, directory: Optional[str] = MODEL_REGISTRY_DIRECTORY):
+        self.max_entries = max_entries
+        self.directory = directory
+        self._records: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.directory:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def register(self, data: Dict, spec: Dict, fitter: Any, extra: Optional[Dict] = None) -> str:
+        """Store a fitted model and return its handle"""
+        fingerprint = dataset_fingerprint(data)
+        handle = make_model_handle(fingerprint, spec)
+        record = {
+            "handle": handle,
+            "dataset_fingerprint": fingerprint,
+            "spec": {field: spec.get(field) for field in SPEC_FIELDS},
+            "fitter": fitter,
+            "extra": extra or {},
+            "created_at": time.time()
+        }
+        self.put_record(record)
+        return handle
+
+    def put_record(self, record: Dict) -> None:
+        """Insert a record produced elsewhere (e.g. by a grid worker process)"""
+        with self._lock:
+            self._records[record['handle']] = record
+            self._records.move_to_end(record['handle'])
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+        if self.directory:
+            try:
+                with open(self._path(record['handle']), 'wb') as f:
+                    pickle.dump(record, f)
+            except Exception as e:
+                print(f"[ModelRegistry] Could not persist {record['handle']}: {e}")
+
+    def get(self, handle: Optional[str]) -> Optional[Dict]:
+        """Look up a record by handle, falling back to the disk tier"""
+        if not handle:
+            return None
+        if not is_model_handle(handle):
+            # Client-supplied; never let it near the disk tier's paths
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            record = self._records.get(handle)
+            if record is not None:
+                self._records.move_to_end(handle)
+                self.hits += 1
+                return record
+
+        record = self._load_from_disk(handle)
+        with self._lock:
+            if record is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._records[handle] = record
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+        return record
+
+    def get_fitter(self, handle: Optional[str]) -> Any:
+        record = self.get(handle)
+        return record['fitter'] if record else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "entries": len(self._records),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_tier": self.directory
+            }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._records.clear()
+
+    def _path(self, handle: str) -> str:
+        if not is_model_handle(handle):
+            raise ValueError(f"Invalid model handle: {handle!r}")
+        return os.path.join(self.directory, f"{handle}.pkl")
+
+    def _load_from_disk(self, handle: str) -> Optional[Dict]:
+        if not self.directory:
+            return None
+        path = self._path(handle)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            print(f"[ModelRegistry] Could not load {handle} from disk: {e}")
+            return None
+
+
+# Shared registry used by the fitters, plotting and the API
+registry = ModelRegistry()
@@ -0,0 +1,219 @@
+"""Partitioned survival cohort model on fitted OS and PFS curves
+
+Each arm's state membership comes straight from its OS and PFS curves on the
+cycle grid: progression-free = PFS, progressed = OS - PFS, dead = 1 - OS,
+with PFS capped at OS where the two fitted curves cross. Costs and QALYs are
+accumulated per cycle with optional half-cycle correction and discounting.
+
+Every step works on (..., cycles) arrays, so the deterministic model is a
+single row and a probabilistic run pushes all PSA draws (psa.sample_curves)
+through the same NumPy expressions at once.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+import psa
+import survival_predictor
+
+STATES = ('progression_free', 'progressed', 'dead')
+
+
+def state_membership(os_curve: np.ndarray, pfs_curve: np.ndarray) -> Dict[str, np.ndarray]:
+    """Proportion of the cohort in each state at each cycle boundary (OS >= PFS enforced)"""
+    os_curve = np.clip(os_curve, 0.0, 1.0)
+    pfs_curve = np.minimum(np.clip(pfs_curve, 0.0, 1.0), os_curve)
+    return {
+        "progression_free": pfs_curve,
+        "progressed": os_curve - pfs_curve,
+        "dead": 1.0 - os_curve
+    }
+
+
+def cycle_occupancy(membership: np.ndarray, half_cycle_correction: bool = True) -> np.ndarray:
+    """Per-cycle occupancy from boundary membership: the boundary mean (half-cycle) or the cycle start"""
+    if half_cycle_correction:
+        return (membership[..., 1:] + membership[..., :-1]) / 2
+    return membership[..., :-1]
+
+
+def run_partitioned_survival(
+    os_curve: np.ndarray,
+    pfs_curve: np.ndarray,
+    times: np.ndarray,
+    costs: Dict[str, float],
+    utilities: Dict[str, float],
+    discount_rate_costs: float = 0.035,
+    discount_rate_outcomes: float = 0.035,
+    half_cycle_correction: bool = True,
+    time_units_per_year: float = 12.0
+) -> Dict[str, np.ndarray]:
+    """
+    Life years, QALYs and costs of one arm for one or many curve draws.
+
+    Args:
+        os_curve, pfs_curve: S(t) at the cycle boundaries `times`, shape (cycles + 1,)
+            or (draws, cycles + 1)
+        times: Cycle boundaries in the model time unit, starting at 0
+        costs: Cost per cycle in 'progression_free' and 'progressed', plus an optional
+            one-off 'death' cost applied to each cycle's new deaths
+        utilities: Annual utility of 'progression_free' and 'progressed'
+        discount_rate_costs, discount_rate_outcomes: Annual discount rates
+        half_cycle_correction: Average membership at both ends of each cycle
+        time_units_per_year: 12 for months, 52.18 for weeks
+
+    Returns:
+        Dict of totals (shape () or (draws,)): life_years, qalys, costs and their
+        discounted versions, plus the boundary membership trace of each state
+    """
+    times = np.asarray(times, dtype=np.float64)
+    membership = state_membership(np.asarray(os_curve, dtype=np.float64), np.asarray(pfs_curve, dtype=np.float64))
+    cycle_years = np.diff(times) / time_units_per_year
+    # Discounting at the middle (corrected) or the start of each cycle
+    cycle_time = (times[1:] + times[:-1]) / 2 if half_cycle_correction else times[:-1]
+    years = cycle_time / time_units_per_year
+    discount_costs = (1.0 + discount_rate_costs) ** -years
+    discount_outcomes = (1.0 + discount_rate_outcomes) ** -years
+
+    occupancy = {state: cycle_occupancy(membership[state], half_cycle_correction) for state in STATES[:2]}
+    alive = occupancy['progression_free'] + occupancy['progressed']
+    life_years = alive * cycle_years
+    qalys = sum(occupancy[state] * utilities.get(state, 0.0) for state in STATES[:2]) * cycle_years
+    cycle_costs = sum(occupancy[state] * costs.get(state, 0.0) for state in STATES[:2])
+    if costs.get('death'):
+        cycle_costs = cycle_costs + np.diff(membership['dead'], axis=-1) * costs['death']
+
+    return {
+        "life_years": life_years.sum(axis=-1),
+        "qalys": qalys.sum(axis=-1),
+        "costs": cycle_costs.sum(axis=-1),
+        "discounted_life_years": (life_years * discount_outcomes).sum(axis=-1),
+        "discounted_qalys": (qalys * discount_outcomes).sum(axis=-1),
+        "discounted_costs": (cycle_costs * discount_costs).sum(axis=-1),
+        "membership": membership
+    }
+
+
+_TOTALS = ('life_years', 'qalys', 'costs', 'discounted_life_years', 'discounted_qalys', 'discounted_costs')
+
+
+def _summary(values: np.ndarray, percentiles: List[float]) -> Dict:
+    """Mean and percentiles over the draws that produced finite totals"""
+    values = values[np.isfinite(values)]
+    if not len(values):
+        return {"mean": None, **{str(p): None for p in percentiles}}
+    return {"mean": float(np.mean(values)), **{str(p): float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}}
+
+
+def _finite_list(values: np.ndarray) -> List[Optional[float]]:
+    return [float(v) if np.isfinite(v) else None for v in values]
+
+
+def partitioned_survival_analysis(
+    arms: Dict[str, Dict],
+    horizon: float = 240.0,
+    cycle_length: float = 1.0,
+    utilities: Optional[Dict[str, float]] = None,
+    discount_rate_costs: float = 0.035,
+    discount_rate_outcomes: float = 0.035,
+    half_cycle_correction: bool = True,
+    time_units_per_year: float = 12.0,
+    comparator: Optional[str] = None,
+    n_draws: int = 0,
+    seed: int = 0,
+    percentiles: Optional[List[float]] = None
+) -> Dict:
+    """
+    Deterministic (and optionally probabilistic) partitioned survival model for several arms.
+
+    Args:
+        arms: Arm name -> {'os': registry record, 'pfs': registry record, 'costs': {...},
+            optional 'utilities': {...} overriding the shared utilities}
+        horizon, cycle_length: Cycle grid in the model time unit
+        comparator: Arm the others are compared against (default: the first arm)
+        n_draws: PSA draws of the OS and PFS parameters (0 for deterministic only);
+            OS and PFS are sampled independently
+        seed, percentiles: PSA seed and the percentiles reported for each total
+
+    Returns:
+        Dict with the cycle times, per-arm totals and state traces, incremental
+        results and ICERs against the comparator, and PSA summaries when n_draws > 0
+    """
+    if not arms:
+        raise ValueError("At least one arm is required")
+    comparator = comparator or next(iter(arms))
+    if comparator not in arms:
+        raise ValueError(f"Unknown comparator arm: {comparator}")
+    times = psa.cycle_times(horizon, cycle_length)
+    percentiles = percentiles or psa.DEFAULT_PERCENTILES
+    settings = dict(
+        discount_rate_costs=discount_rate_costs,
+        discount_rate_outcomes=discount_rate_outcomes,
+        half_cycle_correction=half_cycle_correction,
+        time_units_per_year=time_units_per_year
+    )
+
+    deterministic, probabilistic = {}, {}
+    for i, (name, arm) in enumerate(arms.items()):
+        arm_utilities = {**(utilities or {}), **(arm.get('utilities') or {})}
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            curves = [survival_predictor.predict_record(arm[key], times) for key in ('os', 'pfs')]
+        deterministic[name] = run_partitioned_survival(*curves, times, arm.get('costs') or {}, arm_utilities, **settings)
+        if n_draws > 0:
+            draws = [
+                psa.sample_curves(arm[key], n_draws, times, seed=psa.model_seed(seed, 2 * i + j))
+                for j, key in enumerate(('os', 'pfs'))
+            ]
+            probabilistic[name] = run_partitioned_survival(*draws, times, arm.get('costs') or {}, arm_utilities, **settings)
+
+    result = {
+        "times": times.tolist(),
+        "comparator": comparator,
+        "arms": {
+            name: {
+                **{key: float(totals[key]) for key in _TOTALS},
+                "trace": {state: totals['membership'][state].tolist() for state in STATES}
+            }
+            for name, totals in deterministic.items()
+        },
+        "incremental": {
+            name: _incremental(deterministic[name], deterministic[comparator])
+            for name in arms if name != comparator
+        }
+    }
+
+    if n_draws > 0:
+        result["psa"] = {
+            "n_draws": n_draws,
+            "seed": seed,
+            "arms": {
+                name: {key: _summary(totals[key], percentiles) for key in _TOTALS}
+                for name, totals in probabilistic.items()
+            },
+            "incremental": {}
+        }
+        for name in arms:
+            if name == comparator:
+                continue
+            delta_costs = probabilistic[name]['discounted_costs'] - probabilistic[comparator]['discounted_costs']
+            delta_qalys = probabilistic[name]['discounted_qalys'] - probabilistic[comparator]['discounted_qalys']
+            valid = np.isfinite(delta_costs) & np.isfinite(delta_qalys)
+            result["psa"]["incremental"][name] = {
+                "discounted_costs": _summary(delta_costs, percentiles),
+                "discounted_qalys": _summary(delta_qalys, percentiles),
+                # Ratio of mean differences, the standard probabilistic ICER
+                "icer": _ratio(np.mean(delta_costs[valid]), np.mean(delta_qalys[valid])) if valid.any() else None,
+                # Cost-effectiveness plane
+                "draws": {"discounted_costs": _finite_list(delta_costs), "discounted_qalys": _finite_list(delta_qalys)}
+            }
+    return result
+
+
+def _ratio(numerator: float, denominator: float) -> Optional[float]:
+    return float(numerator / denominator) if denominator != 0 and np.isfinite(denominator) else None
+
+
+def _incremental(arm: Dict, comparator: Dict) -> Dict:
+    delta = {key: float(arm[key] - comparator[key]) for key in _TOTALS}
+    delta["icer"] = _ratio(delta['discounted_costs'], delta['discounted_qalys'])
+    return delta
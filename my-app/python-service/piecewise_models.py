@@ -2,32 +2,62 @@
 import pandas as pd
 import numpy as np
 from scipy import stats
-from survival_models import fit_one_piece_model
-from typing import Dict, Optional
+from survival_models import fit_parametric, MILESTONE_TIMES
+from model_registry import registry
+from km_kernel import kaplan_meier
+from changepoint import cumulative_events_exposure, exponential_log_likelihood, piecewise_exponential_rates
+import survival_predictor
+from typing import Dict, List, Optional, Union
 
-# Safe imports for fitters
-try:
-    from lifelines import ExponentialFitter, WeibullFitter, LogNormalFitter, LogLogisticFitter
-except ImportError:
-    # Essential fitters missing, let it fail at module level or handle downstream
-    ExponentialFitter = None
+def chow_lrt_profile(time_weeks: np.ndarray, event: np.ndarray, candidates: np.ndarray, min_events: int = 5) -> Dict:
+    """Chow likelihood-ratio statistic at every candidate cutpoint in one vectorised pass.
 
-try:
-    from lifelines import GeneralizedGammaFitter
-except ImportError:
-    GeneralizedGammaFitter = None
+    The exponential MLE is events / exposure, so after one sort the early segment
+    (follow-up censored at the cutpoint) and the late segment (survivors, time shifted
+    to the cutpoint) only need prefix sums of events and follow-up time.
+    """
+    candidates = np.asarray(candidates, dtype=np.float64)
+    events_pre, exposure_pre, n_pre, total_events, total_exposure = cumulative_events_exposure(
+        time_weeks, event, candidates
+    )
+    n_post = len(time_weeks) - n_pre
+    events_post = total_events - events_pre
+    exposure_post = total_exposure - exposure_pre
+
+    ll_null = float(exponential_log_likelihood(total_events, total_exposure))
+    ll_alt = exponential_log_likelihood(events_pre, exposure_pre) + exponential_log_likelihood(events_post, exposure_post)
+    valid = (events_pre >= min_events) & (events_post >= min_events)
+
+    return {
+        "candidates": candidates,
+        "lrt": 2 * (ll_alt - ll_null),
+        "ll_alternative": ll_alt,
+        "ll_null": ll_null,
+        "valid": valid,
+        "n_events_pre": events_pre.astype(int),
+        "n_events_post": events_post.astype(int),
+        "n_at_risk_pre": n_pre,
+        "n_at_risk_post": n_post
+    }
 
-try:
-    from custom_gompertz import GompertzFitter
-except ImportError:
-    GompertzFitter = None
 
-def detect_cutpoint_chow_test(data: Dict, weeks_start: int = 12, weeks_end: int = 52) -> Dict:
+def detect_cutpoint_chow_test(
+    data: Dict,
+    weeks_start: int = 12,
+    weeks_end: int = 52,
+    candidates: Optional[Union[str, List[float]]] = None
+) -> Dict:
     """
     Detect optimal cutpoint using a rigorous Likelihood Ratio Test (Chow Test for Survival).
     Scans potential cutpoints and finds the one that maximizes the improvement in model fit
     (Likelihood Ratio) when allowing hazard rates to differ before and after the cutpoint.
     
+    Args:
+        data: Dictionary with 'time' and 'event' arrays
+        weeks_start, weeks_end: Search window in weeks
+        candidates: None scans every 2 weeks in the window; 'event-times' scans every
+            distinct event time in the window; a list gives explicit cutpoints in weeks
+    
     Returns:
         Dict containing:
         - cutpoint: float (in original time units, typically months)
@@ -40,132 +70,105 @@ def detect_cutpoint_chow_test(data: Dict, weeks_start: int = 12, weeks_end: int
         - n_events_post: int (events after cutpoint)
         - n_at_risk_pre: int (patients at risk before cutpoint)
         - n_at_risk_post: int (patients at risk after cutpoint)
+        - profile: LRT statistic at every evaluated cutpoint with enough events
     """
-    df = pd.DataFrame(data)
+    time_values = np.asarray(data['time'], dtype=np.float64)
+    event_values = np.asarray(data['event'], dtype=np.float64)
     
     # Convert time to weeks if needed
-    max_time = df['time'].max()
+    max_time = time_values.max()
     is_months = max_time < 100
-    if is_months:  # Assume months, convert to weeks
-        df['time_weeks'] = df['time'] * 4.33
+    time_weeks = time_values * 4.33 if is_months else time_values.copy()
+    
+    # Small epsilon keeps zero durations out of the likelihood
+    time_weeks = time_weeks + 1e-5
+    
+    if candidates is None:
+        # Step by 2 weeks to be efficient but granular enough
+        grid = np.arange(weeks_start, min(weeks_end, int(time_weeks.max())), 2, dtype=np.float64)
+    elif isinstance(candidates, str):
+        if candidates != 'event-times':
+            raise ValueError(f"Unknown cutpoint candidates: {candidates}")
+        event_times = np.unique(time_weeks[event_values == 1])
+        grid = event_times[(event_times >= weeks_start) & (event_times <= weeks_end)]
     else:
-        df['time_weeks'] = df['time']
-        
-    # Add small epsilon to avoid zero duration errors in ExponentialFitter
-    df['time_weeks'] = df['time_weeks'] + 1e-5
-    
-    # Import fitter for scanning
-    from lifelines import ExponentialFitter
-    
-    best_cutpoint = weeks_start
-    max_lrt = -1.0
-    best_ll_alt = None
-    best_n_events_pre = 0
-    best_n_events_post = 0
-    best_n_at_risk_pre = 0
-    best_n_at_risk_post = 0
-    
-    # Fit null model (constant hazard over full duration)
-    null_fitter = ExponentialFitter().fit(df['time_weeks'], df['event'])
-    ll_null = null_fitter.log_likelihood_
-    
-    # Scan through potential cutpoints
-    # We step by 2 weeks to be efficient but granular enough
-    search_range = range(weeks_start, min(weeks_end, int(df['time_weeks'].max())), 2)
-    
-    for cutpoint in search_range:
-        # Split data
-        pre_mask = df['time_weeks'] <= cutpoint
-        pre_data = df[pre_mask]
-        post_data = df[~pre_mask].copy()
-        
-        # Count events and at-risk in each segment
-        n_events_pre = int(pre_data['event'].sum())
-        n_events_post = int(post_data['event'].sum())
-        n_at_risk_pre = len(pre_data)
-        n_at_risk_post = len(post_data)
-        
-        # Ensure sufficient events in both segments for stable fitting
-        if n_events_pre < 5 or n_events_post < 5:
-            continue
-            
-        try:
-            # Fit early segment
-            # 1. Early Fit:
-            # Patients who die before cutpoint: observed death.
-            # Patients who survive past cutpoint: censored at cutpoint.
-            early_time = df['time_weeks'].clip(upper=cutpoint)
-            early_event = df['event'].copy()
-            early_event[df['time_weeks'] > cutpoint] = 0 # Censored at cutpoint
-            
-            early_fitter = ExponentialFitter().fit(early_time, early_event)
-            ll_early = early_fitter.log_likelihood_
-            
-            # 2. Late Fit:
-            # Only patients who survived to cutpoint are included (conditional probability).
-            # Time is shifted: t_new = t_old - cutpoint
-            post_data['time_shifted'] = post_data['time_weeks'] - cutpoint
-            
-            late_fitter = ExponentialFitter().fit(post_data['time_shifted'], post_data['event'])
-            ll_late = late_fitter.log_likelihood_
-            
-            # Calculate Likelihood Ratio Statistic
-            # LRT = 2 * (LL_alternative - LL_null)
-            # LL_alternative = LL_early + LL_late
-            ll_alt = ll_early + ll_late
-            lrt = 2 * (ll_alt - ll_null)
-            
-            if lrt > max_lrt:
-                max_lrt = lrt
-                best_cutpoint = cutpoint
-                best_ll_alt = ll_alt
-                best_n_events_pre = n_events_pre
-                best_n_events_post = n_events_post
-                best_n_at_risk_pre = n_at_risk_pre
-                best_n_at_risk_post = n_at_risk_post
-                
-        except Exception:
-            continue
+        grid = np.asarray(candidates, dtype=np.float64)
+    
+    scan = chow_lrt_profile(time_weeks, event_values, grid)
+    ll_null = scan['ll_null']
+    valid = np.flatnonzero(scan['valid'])
+    
+    if len(valid):
+        best = valid[np.argmax(scan['lrt'][valid])]
+        best_cutpoint = float(grid[best])
+        max_lrt = float(scan['lrt'][best])
+        best_ll_alt = float(scan['ll_alternative'][best])
+        counts = {
+            key: int(scan[key][best])
+            for key in ('n_events_pre', 'n_events_post', 'n_at_risk_pre', 'n_at_risk_post')
+        }
+    else:
+        best_cutpoint = float(weeks_start)
+        max_lrt = -1.0
+        best_ll_alt = ll_null
+        counts = {'n_events_pre': 0, 'n_events_post': 0, 'n_at_risk_pre': 0, 'n_at_risk_post': 0}
     
     # Calculate p-value from LRT statistic (chi-squared with 1 degree of freedom)
     # The piecewise model has 2 parameters (lambda_early, lambda_late) vs 1 for null (lambda)
     lrt_pvalue = 1 - stats.chi2.cdf(max_lrt, df=1) if max_lrt > 0 else 1.0
     
-    # Convert cutpoint back to original time units
-    cutpoint_months = best_cutpoint / 4.33 if is_months else best_cutpoint
+    # Convert cutpoints back to original time units
+    to_original = (lambda weeks: weeks / 4.33) if is_months else (lambda weeks: weeks)
     
     return {
-        "cutpoint": float(cutpoint_months),
-        "cutpoint_weeks": float(best_cutpoint),
-        "lrt_statistic": float(max_lrt),
+        "cutpoint": float(to_original(best_cutpoint)),
+        "cutpoint_weeks": best_cutpoint,
+        "lrt_statistic": max_lrt,
         "lrt_pvalue": float(lrt_pvalue),
         "ll_null": float(ll_null),
-        "ll_alternative": float(best_ll_alt) if best_ll_alt is not None else float(ll_null),
-        "n_events_pre": best_n_events_pre,
-        "n_events_post": best_n_events_post,
-        "n_at_risk_pre": best_n_at_risk_pre,
-        "n_at_risk_post": best_n_at_risk_post
+        "ll_alternative": best_ll_alt,
+        **counts,
+        "profile": {
+            "cutpoint_weeks": grid[valid].tolist(),
+            "cutpoint": to_original(grid[valid]).tolist(),
+            "lrt_statistic": scan['lrt'][valid].tolist()
+        }
     }
 
-def fit_piecewise_model(data: Dict, arm: str, distribution: str, cutpoint: float) -> Dict:
-    """Fit piecewise parametric model"""
+def fit_piecewise_model(data: Dict, arm: str, distribution: str, cutpoint: Union[float, List[float]]) -> Dict:
+    """Fit piecewise model: Kaplan-Meier up to the cutpoint, parametric after it
+    
+    With several cutpoints the KM runs to the first one, each interval between
+    cutpoints gets a constant (piecewise-exponential) hazard, and the parametric
+    distribution is fitted after the last one.
+    """
     df = pd.DataFrame(data)
+    cutpoints = sorted(float(c) for c in np.atleast_1d(cutpoint))
+    first_cutpoint, last_cutpoint = cutpoints[0], cutpoints[-1]
     
-    # Split data at cutpoint
-    pre_data = df[df['time'] <= cutpoint].copy()
-    post_data = df[df['time'] > cutpoint].copy()
+    # Split data at the last cutpoint
+    post_data = df[df['time'] > last_cutpoint].copy()
     
-    # Use KM for pre-cutpoint period
-    from lifelines import KaplanMeierFitter
-    kmf = KaplanMeierFitter()
-    kmf.fit(pre_data['time'], pre_data['event'])
+    # KM of the whole cohort describes survival up to the (first) cutpoint
+    km = kaplan_meier(data)
+    before_cutpoint = km['times'] <= first_cutpoint
+    km_times, km_survival = km['times'][before_cutpoint], km['survival'][before_cutpoint]
+    prob_at_cutpoint = float(km_survival[-1]) if len(km_survival) else 1.0
+    
+    # Constant hazards between consecutive cutpoints
+    segment_rates = []
+    if len(cutpoints) > 1:
+        segments = piecewise_exponential_rates(df['time'].values, df['event'].values, cutpoints)
+        segment_rates = segments['rates'][1:-1].tolist()
+        prob_at_cutpoint *= float(np.exp(-np.dot(segment_rates, np.diff(cutpoints))))
     
     # Fit parametric model for post-cutpoint period
     # Adjust time to start from cutpoint
     post_data_adjusted = post_data.copy()
-    post_data_adjusted['time'] = post_data_adjusted['time'] - cutpoint
+    post_data_adjusted['time'] = post_data_adjusted['time'] - last_cutpoint
     
-    model_result = fit_one_piece_model(
+    # Only the piecewise model is registered; the post-cutpoint fit on its own is not a model
+    model_result, fitter = fit_parametric(
         {
             "time": post_data_adjusted['time'].tolist(),
             "event": post_data_adjusted['event'].tolist()
@@ -174,122 +177,23 @@ def fit_piecewise_model(data: Dict, arm: str, distribution: str, cutpoint: float
         distribution
     )
     
-    # Calculate predictions
-    # S(t) = S_km(cutpoint) * S_parametric(t - cutpoint)
-    # S_parametric(0) = 1
-    
-    # Get KM survival at cutpoint
-    # Use the KM fitter from pre-period
-    try:
-        prob_at_cutpoint = float(kmf.predict(cutpoint))
-    except:
-        prob_at_cutpoint = float(kmf.survival_function_.iloc[-1].iloc[0]) if not kmf.survival_function_.empty else 0.0
-
-    predictions = {}
-    for t in [60, 120]:
-        if t <= cutpoint:
-            # Use KM prediction directly if t <= cutpoint (unlikely for extrapolation task but possible)
-            pred = float(kmf.predict(t))
-        else:
-            # Extrapolate
-            t_adj = t - cutpoint
-            # Get parametric survival
-            # We need the fitter object, but fit_one_piece_model returns a dict.
-            # Ideally we refit or extract params. 
-            # But fit_one_piece_model returns predictions for the adjusted time frame!
-            # Let's extract them from model_result if we can trust it matches our t_adj
-            # But model_result['predictions'] used t=60 and t=120 on the ADJUSTED timeline.
-            # That corresponds to t_total = 60 + cutpoint. Not what we want.
-            
-            # We need S_parametric(t - cutpoint).
-            # S_parametric(t) = exp(-(t/scale)^shape) etc.
-            # This is hard to do generically without the fitter object.
-            # Better approach: Pass specific times to fit_one_piece_model? 
-            # No, fit_one_piece_model interface is fixed.
-            
-            # Use the 'predictions' from model_result?
-            # model_result['predictions']['60'] is S_param(60). This is S(cutpoint + 60) for the whole model.
-            # So predictions['60'] corresponds to t_total = cutpoint + 60.
-            
-            # This is tricky.
-            # Re-instantiate the fitter?
-            pass
-
-    # REVISED STRATEGY: 
-    # Since we can't easily access the fitter object from fit_one_piece_model result,
-    # and we don't want to duplicate distributions logic.
-    # We will assume that for extrapolation, t > cutpoint.
-    # We can reconstruct the parametric curve if we know the distribution and parameters.
-    # OR simpler: The fit_one_piece_model function just returned. It calculated predictions.
-    # But those predictions are for t=60 and t=120 relative to the START of the parametric segment!
-    # i.e., t_adj = 60 => t_real = cutpoint + 60.
-    
-    # We want prediction for t_real = 60.
-    # t_adj = 60 - cutpoint.
-    # If cutpoint < 60, we need S_param(60 - cutpoint).
-    # The default fit_one_piece_model predicts at 60 and 120.
-    # If cutpoint is e.g. 20 weeks (~4.6 months), then:
-    # We have S_param(60) -> survival 60 months AFTER cutpoint (t=64.6).
-    # We have S_param(120) -> survival 120 months AFTER cutpoint (t=124.6).
-    
-    # This is not exactly what we want.
-    # However, since we are editing the files, we can modify fit_one_piece_model to accept custom prediction times!
-    # But fit_one_piece_model signature is fixed in the endpoint.
-    
-    # Let's import the Fitter classes and recalculate.
-    # Fitters mapping
-    fitters = {
-        'exponential': ExponentialFitter,
-        'weibull': WeibullFitter,
-        'log-normal': LogNormalFitter,
-        'log-logistic': LogLogisticFitter
-    }
-    
-    if GeneralizedGammaFitter:
-        fitters['generalized-gamma'] = GeneralizedGammaFitter
-        
-    if GompertzFitter:
-        fitters['gompertz'] = GompertzFitter
-    
-    if distribution not in fitters:
-        raise ValueError(f"Distribution '{distribution}' is not supported or available in this environment.")
-        
-    Fitter = fitters[distribution]
-    fitter = Fitter()
-    
-    # Re-fit the parametric part locally to get the fitter object
-    # (Fast enough)
-    fitter.fit(post_data_adjusted['time'], post_data_adjusted['event'])
-    
-    predictions = {}
-    for t in [60, 120]:
-        if t <= cutpoint:
-             predictions[str(t)] = float(kmf.predict(t))
-        else:
-             t_adj = t - cutpoint
-             # Get survival probability using the appropriate method
-             if hasattr(fitter, 'predict_survival'):
-                 # Custom GompertzFitter
-                 s_param = float(fitter.predict_survival([t_adj])[0])
-             elif hasattr(fitter, 'survival_function_at_times'):
-                 # Standard lifelines fitters
-                 result = fitter.survival_function_at_times([t_adj])
-                 if hasattr(result, 'values'):
-                     s_param = float(result.values.flatten()[0])
-                 else:
-                     s_param = float(result.flatten()[0] if hasattr(result, 'flatten') else result[0])
-             else:
-                 # Fallback: interpolate from survival_function_
-                 sf = fitter.survival_function_
-                 if t_adj <= sf.index.max():
-                     s_param = float(np.interp(t_adj, sf.index, sf.iloc[:, 0]))
-                 else:
-                     s_param = float(sf.iloc[-1, 0])
-             predictions[str(t)] = prob_at_cutpoint * s_param
-
-    model_result["cutpoint"] = cutpoint
+    model_result["cutpoint"] = cutpoints[0] if len(cutpoints) == 1 else cutpoints
     model_result["approach"] = "piecewise"
-    model_result["predictions"] = predictions
+    if segment_rates:
+        model_result["segment_hazards"] = segment_rates
+    model_result["model_handle"] = registry.register(
+        data,
+        {"approach": "piecewise", "distribution": distribution, "cutpoint": model_result["cutpoint"]},
+        fitter,
+        extra={
+            "survival_at_cutpoint": prob_at_cutpoint,
+            "km_times": km_times.tolist(),
+            "km_survival": km_survival.tolist(),
+            "segment_rates": segment_rates
+        }
+    )
+    # S(t) = S_km(t) up to the cutpoint, S_km(cutpoint) * S_parametric(t - cutpoint) after
+    milestones = survival_predictor.predict_record(registry.get(model_result["model_handle"]), MILESTONE_TIMES)
+    model_result["predictions"] = {str(t): float(s) for t, s in zip(MILESTONE_TIMES, milestones)}
     
     return model_result
-
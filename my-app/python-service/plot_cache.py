@@ -0,0 +1,215 @@
+"""On-demand, content-addressed plots for registered models
+
+GET /plots/{model_handle} renders a model's short- or long-term plot on first
+request and serves it from disk afterwards. The cache key combines the model
+handle (itself a hash of the dataset fingerprint and model spec), the plot type
+and PLOT_STYLE_VERSION, so a key always names the same picture: it doubles as
+the ETag and never needs invalidating. Bump PLOT_STYLE_VERSION when a change
+to plotting.py alters the rendered output.
+
+Rendering needs the observed data for the KM curve. Fit endpoints save each
+dataset they fit as a small .npz keyed by its fingerprint (remember_dataset),
+so plots can be drawn long after the dataset store has evicted the upload.
+At most PLOT_DATASET_CACHE_SIZE of them are kept, least recently used evicted.
+
+Only renders built here from registry data are cached: a key names the
+registered model, so a caller-supplied rendering must never be stored under it.
+"""
+import hashlib
+import os
+import threading
+from typing import Dict, Optional
+
+import numpy as np
+
+from dataset_store import datasets
+from km_kernel import kaplan_meier
+from model_registry import dataset_fingerprint, registry
+
+PLOT_STYLE_VERSION = "3"
+PLOT_TYPES = ('short_term', 'long_term')
+PLOT_CACHE_DIRECTORY = os.environ.get(
+    'PLOT_CACHE_DIRECTORY', os.path.join(os.getenv('PLOTS_DIRECTORY', './data/plots'), 'cache')
+)
+
+PLOT_DATASET_CACHE_SIZE = int(os.environ.get('PLOT_DATASET_CACHE_SIZE', '256'))
+
+_render_locks: Dict[str, threading.Lock] = {}
+_render_locks_guard = threading.Lock()
+
+
+def plot_key(model_handle: str, plot_type: str) -> str:
+    """Content address of a rendered plot"""
+    payload = f"{model_handle}:{plot_type}:{PLOT_STYLE_VERSION}"
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+
+def plot_urls(model_handle: str) -> Dict[str, str]:
+    return {plot_type: f"/plots/{model_handle}?plot_type={plot_type}" for plot_type in PLOT_TYPES}
+
+
+def _png_path(key: str) -> str:
+    return os.path.join(PLOT_CACHE_DIRECTORY, f"{key}.png")
+
+
+def _dataset_path(fingerprint: str) -> str:
+    return os.path.join(PLOT_CACHE_DIRECTORY, 'datasets', f"{fingerprint}.npz")
+
+
+def _write_atomic(path: str, write) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _evict_datasets(directory: str) -> None:
+    """Drop the least recently used dataset files beyond PLOT_DATASET_CACHE_SIZE"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.name.endswith('.npz')]
+    except OSError:
+        return
+    if len(entries) <= PLOT_DATASET_CACHE_SIZE:
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    for entry in entries[:len(entries) - PLOT_DATASET_CACHE_SIZE]:
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass
+
+
+def remember_dataset(data: Dict, fingerprint: Optional[str] = None) -> str:
+    """Keep a fitted dataset on disk for later plot rendering; returns its fingerprint"""
+    fingerprint = fingerprint or dataset_fingerprint(data)
+    path = _dataset_path(fingerprint)
+    if os.path.exists(path):
+        _touch(path)
+        return fingerprint
+    try:
+        _write_atomic(path, lambda f: np.savez(
+            f,
+            time=np.asarray(data['time'], dtype=np.float64),
+            event=np.asarray(data['event'], dtype=np.int8)
+        ))
+    except OSError as e:
+        print(f"[PlotCache] Could not save dataset {fingerprint}: {e}")
+        return fingerprint
+    _evict_datasets(os.path.dirname(path))
+    return fingerprint
+
+
+def _touch(path: str) -> None:
+    # The modification time orders eviction, so reads and re-fits refresh it
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def observed_data(fingerprint: str) -> Optional[Dict]:
+    """A dataset by fingerprint from the dataset store or the plot cache"""
+    stored = datasets.get(fingerprint)
+    if stored is not None:
+        return stored
+    path = _dataset_path(fingerprint)
+    try:
+        with np.load(path) as archive:
+            data = {"time": archive['time'], "event": archive['event']}
+    except (OSError, ValueError):
+        # Missing, or evicted between the check and the read
+        return None
+    _touch(path)
+    return data
+
+
+def km_data(data: Dict) -> Dict:
+    """KM curve in the fit_km_curves shape used by the plot functions"""
+    km = kaplan_meier(data)
+    return {
+        "times": km['times'].tolist(),
+        "survival": km['survival'].tolist(),
+        "confidence_lower": km['lower'].tolist(),
+        "confidence_upper": km['upper'].tolist()
+    }
+
+
+def model_result(record: Dict) -> Dict:
+    """The fit-result fields the plot functions read, rebuilt from a registry record"""
+    fitter = record['fitter']
+    aic, bic = getattr(fitter, 'AIC_', None), getattr(fitter, 'BIC_', None)
+    return {
+        **record['spec'],
+        "model_handle": record['handle'],
+        "aic": float(aic) if aic is not None else None,
+        "bic": float(bic) if bic is not None else None
+    }
+
+
+def cached_png(model_handle: str, plot_type: str) -> Optional[bytes]:
+    path = _png_path(plot_key(model_handle, plot_type))
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def get_plot(model_handle: str, plot_type: str, record: Optional[Dict] = None) -> Optional[bytes]:
+    """
+    PNG of a registered model's plot, rendered on first request.
+
+    Args:
+        model_handle: Registry handle of the model
+        plot_type: 'short_term' or 'long_term'
+        record: The registry record when already looked up (e.g. in the API
+            process before handing the work to a process-pool worker)
+
+    Returns:
+        PNG bytes, or None when the model handle is unknown
+
+    Raises:
+        ValueError: Unknown plot type, or the model's observed data is no longer available
+    """
+    if plot_type not in PLOT_TYPES:
+        raise ValueError(f"plot_type must be one of {', '.join(PLOT_TYPES)}")
+    png = cached_png(model_handle, plot_type)
+    if png is not None:
+        return png
+
+    key = plot_key(model_handle, plot_type)
+    with _render_locks_guard:
+        lock = _render_locks.setdefault(key, threading.Lock())
+    try:
+        with lock:
+            # A concurrent request may have rendered it while we waited
+            png = cached_png(model_handle, plot_type)
+            if png is None:
+                record = record or registry.get(model_handle)
+                if record is None:
+                    return None
+                _render(record, plot_type, _png_path(key))
+                png = cached_png(model_handle, plot_type)
+    finally:
+        with _render_locks_guard:
+            _render_locks.pop(key, None)
+    return png
+
+
+def _render(record: Dict, plot_type: str, path: str) -> None:
+    from plotting import render_plots
+    from survival_predictor import PREDICTION_GRID, predict_record
+
+    data = observed_data(record['dataset_fingerprint'])
+    if data is None:
+        raise ValueError(f"Observed data of model {record['handle']} is no longer available; refit it to plot")
+
+    result = model_result(record)
+    km = km_data(data)
+    predictions = {"times": PREDICTION_GRID.tolist(), "survival": predict_record(record, PREDICTION_GRID).tolist()}
+    args = (record['handle'], result, km, predictions) if plot_type == 'short_term' \
+        else (record['handle'], result, km, None, predictions)
+    os.makedirs(PLOT_CACHE_DIRECTORY, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    render_plots([(plot_type, tmp_path, args)])
+    os.replace(tmp_path, path)
@@ -105,8 +105,8 @@ def plot_schoenfeld_residuals(residuals, times, p_value, smooth_times=None, smoo
     # Or keep minimal legend if needed
     # ax.legend(loc='best', fontsize=9, framealpha=0.9)
     
-    plt.tight_layout()
-    plt.savefig(output_file, dpi=300, bbox_inches='tight')
+    fig.tight_layout()
+    fig.savefig(output_file, dpi=300, bbox_inches='tight')
     print(f"\nPlot saved to: {output_file}")
     print(f"P-value: {p_value:.4f}")
     
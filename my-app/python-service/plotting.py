@@ -2,24 +2,147 @@
 import matplotlib
 matplotlib.use('Agg')  # Non-interactive backend
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import seaborn as sns
 import numpy as np
 import base64
 import io
+import multiprocessing
 import os
-from typing import Dict, Optional
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 
 # Set style
 sns.set_style("whitegrid")
 plt.rcParams['figure.figsize'] = (12, 8)
 
+# Processes rasterising figures; 0 renders in the calling process
+PLOT_WORKERS = int(os.environ.get('PLOT_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Rows per series in format=data responses
+PLOT_DATA_POINTS = int(os.environ.get('PLOT_DATA_POINTS', '200'))
+
+# Milestones annotated on the long-term plot (months)
+PLOT_MILESTONES = [12, 24, 60, 120, 240]
+
+_render_pool: Optional[ProcessPoolExecutor] = None
+_render_pool_lock = threading.Lock()
+
+
+def new_figure(figsize: Tuple[float, float]) -> Figure:
+    """
+    A figure outside pyplot's global state (no figure manager, no current figure).
+
+    Unlike plt.subplots it is safe to build from any thread, so renders on
+    the API's executor threads do not race one another through pyplot.
+    """
+    return Figure(figsize=figsize)
+
+
+def render_png(fig, file_path: Optional[str] = None, dpi: int = 150, **savefig_kwargs) -> bytes:
+    """Rasterise a figure once and close it; the same PNG bytes go to file_path when given"""
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png', dpi=dpi, **savefig_kwargs)
+    if fig.canvas.manager is not None:
+        # Only pyplot-managed figures need closing; new_figure ones are just dropped
+        plt.close(fig)
+    png = buf.getvalue()
+    if file_path:
+        with open(file_path, 'wb') as f:
+            f.write(png)
+    return png
+
+
+def encode_png(png: bytes) -> str:
+    return base64.b64encode(png).decode('utf-8')
+
+
+def _cutpoint_list(cutpoint) -> List[float]:
+    """A piecewise result's cutpoint (one value, or a list for multi-segment fits) as a list"""
+    if cutpoint is None:
+        return []
+    return [float(c) for c in np.atleast_1d(cutpoint)]
+
+
+def _draw_piecewise(ax, times, survival, cutpoints: List[float], color: str, linewidth: float) -> None:
+    """Modeled curve of a piecewise fit with a vertical line at each cutpoint"""
+    label = ', '.join(f"{c:g}" for c in cutpoints)
+    # Plot the full modeled curve (which includes KM before cutpoint + parametric after)
+    # This matches NICE TA style where "Modeled OS" follows KM before cutpoint
+    ax.plot(times, survival, 'r-', linewidth=2,
+            label=f'Modeled OS (KM→Parametric at {label}mo)', zorder=2)
+    # Add vertical lines at the cutpoints to show the transitions
+    for i, c in enumerate(cutpoints):
+        ax.axvline(x=c, color=color, linestyle=':', linewidth=linewidth,
+                   label=f'Cutpoint{"s" if len(cutpoints) > 1 else ""} ({label}mo)' if i == 0 else None,
+                   alpha=0.7, zorder=1)
+
+
+def _init_render_worker() -> None:
+    matplotlib.use('Agg')
+
+
+def _get_render_pool() -> ProcessPoolExecutor:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=PLOT_WORKERS, initializer=_init_render_worker)
+        return _render_pool
+
+
+def shutdown_render_pool() -> None:
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None:
+            _render_pool.shutdown(wait=False, cancel_futures=True)
+            _render_pool = None
+
+
+def _render_job(plot_type: str, file_path: str, args: tuple) -> Dict:
+    """Draw and rasterise one plot, timing the whole job"""
+    start = time.perf_counter()
+    base64_data = _RENDERERS[plot_type](*args, file_path)
+    return {
+        "plot_type": plot_type,
+        "file_path": file_path,
+        "base64_data": base64_data,
+        "render_seconds": time.perf_counter() - start
+    }
+
+
+def render_plots(jobs: List[Tuple[str, str, tuple]]) -> List[Dict]:
+    """
+    Render (plot_type, file_path, args) jobs, in parallel on the render pool.
+
+    Every render goes through the pool, single lazy /plots renders and the
+    PH diagnostics included, so jobs from concurrent requests render side by
+    side off the API's executor threads. Renders in-process when PLOT_WORKERS
+    is 0, inside a worker process (EXECUTOR_KIND=process) or if the pool
+    breaks; the renderers draw on new_figure, so even then they never touch
+    pyplot's global state.
+    """
+    if PLOT_WORKERS >= 1 and jobs and multiprocessing.parent_process() is None:
+        try:
+            pool = _get_render_pool()
+            futures = [pool.submit(_render_job, *job) for job in jobs]
+            return [future.result() for future in futures]
+        except (BrokenProcessPool, RuntimeError) as e:
+            # e.g. a broken pool after a worker was killed; start over next time
+            print(f"[Plotting] Render pool failed ({e}), rendering in-process")
+            shutdown_render_pool()
+    return [_render_job(*job) for job in jobs]
+
 def generate_dual_plots(
     model_id: str,
     model_result: Dict,
     km_data: Dict,
     original_data: Optional[Dict] = None,
-    seer_data: Optional[Dict] = None
+    seer_data: Optional[Dict] = None,
+    model_handle: Optional[str] = None
 ) -> Dict:
     """Generate short-term and long-term plots with actual fitted model predictions"""
     
@@ -28,523 +151,178 @@ def generate_dual_plots(
     os.makedirs(plots_dir, exist_ok=True)
     
     timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    model_handle = model_handle or model_result.get('model_handle')
+    paths = {
+        plot_type: os.path.join(plots_dir, f"{model_id}_{plot_type}_{timestamp}.png")
+        for plot_type in ('short_term', 'long_term')
+    }
     
-    # Generate actual model predictions by refitting the model
-    # This ensures the fitted curve uses real model predictions, not placeholders
-    model_predictions = _generate_actual_model_predictions(
-        model_result, 
-        km_data, 
-        original_data, 
-        max_time=240
-    )
-    
-    # Generate short-term plot (0-30 months)
-    short_term_path = os.path.join(plots_dir, f"{model_id}_short_term_{timestamp}.png")
-    short_term_base64 = _generate_short_term_plot(
-        model_id, model_result, km_data, model_predictions, short_term_path
-    )
+    # Plots of a registered model are content-addressed (see plot_cache): reuse a
+    # cached rendering instead of drawing it again. The long-term plot is only
+    # shared when no SEER overlay is requested. Renders of the caller's inputs
+    # are never stored under the model's key; only plot_cache fills it, from
+    # registry data.
+    from model_registry import registry
+    import plot_cache
+    cacheable = {
+        plot_type for plot_type in paths
+        if registry.get(model_handle) is not None and (plot_type == 'short_term' or not seer_data)
+    }
+    plots = {}
+    for plot_type in cacheable:
+        png = plot_cache.cached_png(model_handle, plot_type)
+        if png is not None:
+            with open(paths[plot_type], 'wb') as f:
+                f.write(png)
+            plots[plot_type] = {
+                "plot_type": plot_type,
+                "file_path": paths[plot_type],
+                "base64_data": encode_png(png),
+                "render_seconds": 0.0,
+                "cached": True
+            }
     
-    # Generate long-term plot (0-240 months) using the same predictions
-    long_term_path = os.path.join(plots_dir, f"{model_id}_long_term_{timestamp}.png")
-    long_term_base64 = _generate_long_term_plot(
-        model_id, model_result, km_data, seer_data, model_predictions, long_term_path
-    )
+    missing = [plot_type for plot_type in paths if plot_type not in plots]
+    if missing:
+        # Generate actual model predictions, reusing the registered fit when the
+        # handle is known and only refitting from original_data otherwise
+        model_predictions = _generate_actual_model_predictions(
+            model_result, 
+            km_data, 
+            original_data, 
+            max_time=240,
+            model_handle=model_handle
+        )
+        
+        # Short-term (0-30 months) and long-term (0-240 months) plots use the same
+        # predictions and are rasterised in parallel, each exactly once
+        args = {
+            "short_term": (model_id, model_result, km_data, model_predictions),
+            "long_term": (model_id, model_result, km_data, seer_data, model_predictions)
+        }
+        for plot in render_plots([(plot_type, paths[plot_type], args[plot_type]) for plot_type in missing]):
+            plots[plot['plot_type']] = {**plot, "cached": False}
     
     return {
-        "short_term": {
-            "plot_type": "short_term",
-            "file_path": short_term_path,
-            "base64_data": short_term_base64
+        "short_term": plots['short_term'],
+        "long_term": plots['long_term']
+    }
+
+def compact_series(max_points: Optional[int] = None, decimals: int = 5, **columns) -> Dict[str, List]:
+    """Equal-length columns thinned to at most max_points rows (first and last kept) and rounded"""
+    max_points = max_points or PLOT_DATA_POINTS
+    arrays = {name: np.asarray(values, dtype=np.float64) for name, values in columns.items()}
+    n = len(next(iter(arrays.values()))) if arrays else 0
+    index = np.arange(n) if n <= max_points else np.unique(np.linspace(0, n - 1, max_points).round().astype(int))
+    return {
+        name: [float(v) if np.isfinite(v) else None for v in np.round(values[index], decimals)]
+        for name, values in arrays.items()
+    }
+
+def generate_plot_data(
+    model_result: Dict,
+    km_data: Dict,
+    original_data: Optional[Dict] = None,
+    seer_data: Optional[Dict] = None,
+    model_handle: Optional[str] = None
+) -> Dict:
+    """
+    The series behind the short- and long-term plots, for client-side rendering.
+    
+    Returns:
+        Dict with the downsampled KM steps and CI band, the model curve to 240
+        months, SEER curve (if given), milestone survival, and the annotations
+        (approach, cutpoint, AIC/BIC, end of observed follow-up)
+    """
+    predictions = _generate_actual_model_predictions(
+        model_result,
+        km_data,
+        original_data,
+        max_time=240,
+        model_handle=model_handle or model_result.get('model_handle')
+    )
+    model_times = np.asarray(predictions['times'], dtype=np.float64)
+    model_survival = np.asarray(predictions['survival'], dtype=np.float64)
+    
+    km_times = km_data.get('times', [])
+    km_columns = {"times": km_times, "survival": km_data.get('survival', [])}
+    if len(km_data.get('confidence_lower', [])) == len(km_times) and len(km_data.get('confidence_upper', [])) == len(km_times):
+        km_columns.update(lower=km_data['confidence_lower'], upper=km_data['confidence_upper'])
+    
+    result = {
+        "km": compact_series(**km_columns),
+        "model": compact_series(times=model_times, survival=model_survival),
+        "milestones": {
+            str(t): float(np.interp(t, model_times, model_survival)) for t in PLOT_MILESTONES
         },
-        "long_term": {
-            "plot_type": "long_term",
-            "file_path": long_term_path,
-            "base64_data": long_term_base64
-        }
+        "max_observed_time": float(max(km_times)) if len(km_times) else None,
+        "approach": model_result.get('approach', 'one-piece'),
+        "cutpoint": model_result.get('cutpoint'),
+        "aic": model_result.get('aic'),
+        "bic": model_result.get('bic')
     }
+    if seer_data:
+        result["seer"] = compact_series(times=seer_data.get('times', []), survival=seer_data.get('survival', []))
+    return result
 
 def _generate_actual_model_predictions(
     model_result: Dict, 
     km_data: Dict, 
     original_data: Optional[Dict],
-    max_time: float = 240
+    max_time: float = 240,
+    model_handle: Optional[str] = None
 ) -> Dict:
-    """Generate actual model predictions by refitting the model
+    """Evaluate the fitted model on the plot grid with the closed-form predictor
     
-    Returns a dictionary with 'times' and 'survival' arrays using real fitted model predictions.
+    Uses the registered fit when the handle is known. Otherwise the model is refitted
+    from original_data through the regular fit functions, which register it.
+    Returns a dictionary with 'times' and 'survival' arrays.
     """
-    import pandas as pd
-    from lifelines import (
-        ExponentialFitter, WeibullFitter, LogNormalFitter, 
-        LogLogisticFitter, GeneralizedGammaFitter,
-        KaplanMeierFitter
-    )
-    from custom_spline_models import RoystonParmarFitter
-    # Try to import GompertzFitter if available
-    try:
-        from lifelines import GompertzFitter
-    except ImportError:
-        GompertzFitter = None
-    
-    # Generate time points for predictions
-    # Increase resolution to 1000 points for smoother curves and better step function representation
-    prediction_times = np.linspace(0, max_time, 1000)
-    
-    # Extract model info
-    approach = model_result.get('approach', 'one-piece')
-    distribution = model_result.get('distribution', 'exponential')
-    cutpoint = model_result.get('cutpoint')
-    scale = model_result.get('scale')
-    knots = model_result.get('knots')
-    
-    # If we have original data, refit the model to get actual predictions
-    if original_data and 'time' in original_data and 'event' in original_data:
-        df = pd.DataFrame({
-            'time': original_data['time'],
-            'event': original_data['event']
-        })
-        
-        # Handle zero/negative times - parametric models require t > 0
-        # This is critical for distributions like Log-Normal that fail on non-positive values
-        df.loc[df['time'] <= 0, 'time'] = 1e-5
-        
+    from model_registry import registry
+    from survival_predictor import predict_record, PREDICTION_GRID
+    
+    # 1000 points gives smooth curves and a faithful step function before piecewise cutpoints;
+    # the default horizon reuses the shared grid so cached spline bases are hit
+    prediction_times = PREDICTION_GRID if max_time == PREDICTION_GRID[-1] else np.linspace(0, max_time, 1000)
+    
+    record = registry.get(model_handle)
+    if record is None and original_data and 'time' in original_data and 'event' in original_data:
+        try:
+            record = registry.get(_refit_model(model_result, original_data).get('model_handle'))
+        except Exception as e:
+            print(f"Warning: Failed to refit model for predictions: {e}")
+    
+    if record is not None:
         try:
-            if approach == 'one-piece':
-                # Refit one-piece model
-                fitters = {
-                    'exponential': ExponentialFitter,
-                    'weibull': WeibullFitter,
-                    'log-normal': LogNormalFitter,
-                    'log-logistic': LogLogisticFitter,
-                    'generalized-gamma': GeneralizedGammaFitter
-                }
-                # Add Gompertz if available (otherwise will try R service)
-                if GompertzFitter is not None:
-                    fitters['gompertz'] = GompertzFitter
-                
-                if distribution in fitters:
-                    Fitter = fitters[distribution]
-                    fitter = Fitter()
-                    fitter.fit(df['time'], df['event'])
-                    
-                    # Use survival_function_at_times for proper parametric extrapolation
-                    # This gives us actual model predictions beyond observed data, not flat extrapolation
-                    try:
-                        model_survival = fitter.survival_function_at_times(prediction_times, label='prediction').values
-                    except (AttributeError, TypeError, ValueError):
-                        # Fallback: use survival_function_ and interpolate/extrapolate manually
-                        survival_function = fitter.survival_function_
-                        timeline = survival_function.index.values
-                        
-                        # For times within observed range, interpolate
-                        observed_mask = prediction_times <= timeline[-1]
-                        if np.any(observed_mask):
-                            model_survival = np.zeros_like(prediction_times)
-                            model_survival[observed_mask] = np.interp(
-                                prediction_times[observed_mask],
-                                timeline,
-                                survival_function.iloc[:, 0].values,
-                                left=1.0
-                            )
-                        else:
-                            model_survival = np.ones_like(prediction_times)
-                        
-                        # For times beyond observed range, use model's parametric form
-                        extrapolation_mask = prediction_times > timeline[-1]
-                        if np.any(extrapolation_mask):
-                            last_surv = survival_function.iloc[-1, 0]
-                            last_time = timeline[-1]
-                            
-                            # Use parametric formula based on distribution type
-                            if hasattr(fitter, 'lambda_') and hasattr(fitter, 'rho_'):
-                                # Weibull: S(t) = exp(-(lambda * t)^rho)
-                                lambda_param = fitter.lambda_
-                                rho_param = fitter.rho_
-                                extrap_times = prediction_times[extrapolation_mask]
-                                model_survival[extrapolation_mask] = np.exp(-(lambda_param * extrap_times) ** rho_param)
-                            elif hasattr(fitter, 'lambda_'):
-                                # Exponential: S(t) = exp(-lambda * t)
-                                lambda_param = fitter.lambda_
-                                extrap_times = prediction_times[extrapolation_mask]
-                                model_survival[extrapolation_mask] = np.exp(-lambda_param * extrap_times)
-                            else:
-                                # Generic exponential decay from last point
-                                # Estimate hazard rate from last portion of curve
-                                if len(timeline) > 1:
-                                    dt = timeline[-1] - timeline[-2]
-                                    ds = survival_function.iloc[-2, 0] - survival_function.iloc[-1, 0]
-                                    if dt > 0 and survival_function.iloc[-2, 0] > 0:
-                                        hazard_est = ds / (dt * survival_function.iloc[-2, 0])
-                                    else:
-                                        hazard_est = 0.01  # Default small hazard
-                                else:
-                                    hazard_est = 0.01
-                                
-                                extrap_times = prediction_times[extrapolation_mask] - last_time
-                                model_survival[extrapolation_mask] = last_surv * np.exp(-hazard_est * extrap_times)
-                elif distribution == 'gompertz':
-                    # Try R service for Gompertz if Python doesn't have it
-                    print("Gompertz not available in Python, trying R service...")
-                    model_survival = _try_r_service_for_predictions(
-                        'gompertz', original_data, model_result, prediction_times
-                    )
-                    if model_survival is None:
-                        # Fall back to Weibull approximation if R service unavailable
-                        print("R service unavailable for Gompertz, using Weibull approximation...")
-                        Fitter = WeibullFitter
-                        fitter = Fitter()
-                        fitter.fit(df['time'], df['event'])
-                        # Use survival_function_at_times for proper extrapolation
-                        try:
-                            model_survival = fitter.survival_function_at_times(prediction_times, label='prediction').values
-                        except (AttributeError, TypeError, ValueError):
-                            # Fallback to interpolation if method not available
-                            survival_function = fitter.survival_function_
-                            timeline = survival_function.index.values
-                            model_survival = np.interp(
-                                prediction_times,
-                                timeline,
-                                survival_function.iloc[:, 0].values,
-                                left=1.0,
-                                right=survival_function.iloc[:, 0].values[-1] if len(survival_function) > 0 else 0.0
-                            )
-                else:
-                    raise ValueError(f"Unknown distribution: {distribution}")
-                    
-            elif approach == 'piecewise':
-                # Piecewise model: use ORIGINAL KM for pre-cutpoint, parametric for post-cutpoint
-                if cutpoint is None:
-                    raise ValueError("Cutpoint required for piecewise model")
-                
-                # Get original KM data to use directly for pre-cutpoint
-                km_times = np.array(km_data.get('times', []))
-                km_survival = np.array(km_data.get('survival', []))
-                
-                # Post-cutpoint: fit parametric model
-                post_data = df[df['time'] > cutpoint].copy()
-                post_data_adjusted = post_data.copy()
-                post_data_adjusted['time'] = post_data_adjusted['time'] - cutpoint
-                
-                fitters = {
-                    'exponential': ExponentialFitter,
-                    'weibull': WeibullFitter,
-                    'log-normal': LogNormalFitter,
-                    'log-logistic': LogLogisticFitter,
-                    'generalized-gamma': GeneralizedGammaFitter
-                }
-                # Add Gompertz if available (will try R if not)
-                if GompertzFitter is not None:
-                    fitters['gompertz'] = GompertzFitter
-                
-                if distribution in fitters:
-                    Fitter = fitters[distribution]
-                    fitter_post = Fitter()
-                    fitter_post.fit(post_data_adjusted['time'], post_data_adjusted['event'])
-                    
-                    # Combine predictions
-                    model_survival = np.zeros_like(prediction_times)
-                    
-                    # Pre-cutpoint: use ORIGINAL KM data directly (not re-fitted)
-                    # This ensures the model line exactly matches the observed KM curve
-                    pre_mask = prediction_times <= cutpoint
-                    pre_times = prediction_times[pre_mask]
-                    if len(km_times) > 0 and len(km_survival) > 0:
-                        # Interpolate from original KM data to get exact match
-                        model_survival[pre_mask] = np.interp(
-                            pre_times, 
-                            km_times, 
-                            km_survival,
-                            left=1.0,  # Start at 1.0
-                            right=km_survival[km_times <= cutpoint][-1] if np.any(km_times <= cutpoint) else km_survival[-1]
-                        )
-                    
-                    # Post-cutpoint: use parametric model
-                    post_mask = prediction_times > cutpoint
-                    post_times = prediction_times[post_mask] - cutpoint
-                    
-                    # Get survival at cutpoint for continuity
-                    surv_at_cutpoint = model_survival[pre_mask][-1] if np.any(pre_mask) else 1.0
-                    
-                    # Use survival_function_at_times for proper parametric extrapolation
-                    try:
-                        post_surv = fitter_post.survival_function_at_times(post_times, label='prediction').values
-                        # Scale to ensure continuity at cutpoint
-                        if len(post_surv) > 0 and surv_at_cutpoint > 0:
-                            scale_factor = surv_at_cutpoint / post_surv[0] if post_surv[0] > 0 else 1.0
-                            post_surv = post_surv * scale_factor
-                        model_survival[post_mask] = post_surv
-                    except (AttributeError, TypeError, ValueError):
-                        # Fallback: use interpolation for observed, parametric for extrapolation
-                        post_survival_function = fitter_post.survival_function_
-                        post_timeline = post_survival_function.index.values
-                        
-                        # Split post-cutpoint predictions into observed and extrapolation
-                        post_observed_mask = post_times <= post_timeline[-1]
-                        post_extrap_mask = post_times > post_timeline[-1]
-                        
-                        post_surv = np.ones_like(post_times)
-                        
-                        # Interpolate within observed post-cutpoint range
-                        if np.any(post_observed_mask):
-                            post_surv[post_observed_mask] = np.interp(
-                                post_times[post_observed_mask],
-                                post_timeline,
-                                post_survival_function.iloc[:, 0].values,
-                                left=1.0
-                            )
-                        
-                        # Parametric extrapolation beyond observed post-cutpoint range
-                        if np.any(post_extrap_mask):
-                            extrap_times = post_times[post_extrap_mask]
-                            if hasattr(fitter_post, 'lambda_') and hasattr(fitter_post, 'rho_'):
-                                # Weibull
-                                post_surv[post_extrap_mask] = np.exp(-(fitter_post.lambda_ * extrap_times) ** fitter_post.rho_)
-                            elif hasattr(fitter_post, 'lambda_'):
-                                # Exponential
-                                post_surv[post_extrap_mask] = np.exp(-fitter_post.lambda_ * extrap_times)
-                            elif hasattr(fitter_post, 'mu_') and hasattr(fitter_post, 'sigma_'):
-                                # Log-Normal
-                                from scipy.stats import lognorm
-                                post_surv[post_extrap_mask] = 1 - lognorm.cdf(extrap_times, s=fitter_post.sigma_, scale=np.exp(fitter_post.mu_))
-                            elif hasattr(fitter_post, 'alpha_') and hasattr(fitter_post, 'beta_'):
-                                # Log-Logistic
-                                post_surv[post_extrap_mask] = 1 / (1 + (extrap_times / fitter_post.alpha_) ** fitter_post.beta_)
-                            else:
-                                # Generic exponential decay
-                                last_surv = post_survival_function.iloc[-1, 0]
-                                last_time = post_timeline[-1]
-                                if len(post_timeline) > 1 and last_surv > 0:
-                                    dt = post_timeline[-1] - post_timeline[-2]
-                                    ds = post_survival_function.iloc[-2, 0] - last_surv
-                                    hazard_est = ds / (dt * post_survival_function.iloc[-2, 0]) if dt > 0 else 0.01
-                                else:
-                                    hazard_est = 0.01
-                                post_surv[post_extrap_mask] = last_surv * np.exp(-hazard_est * (extrap_times - last_time))
-                        
-                        # Scale to ensure continuity at cutpoint
-                        if len(post_surv) > 0 and surv_at_cutpoint > 0:
-                            scale_factor = surv_at_cutpoint / post_surv[0] if post_surv[0] > 0 else 1.0
-                            post_surv = post_surv * scale_factor
-                        
-                        model_survival[post_mask] = post_surv
-                elif distribution == 'gompertz':
-                    # Try R service for Gompertz piecewise post-cutpoint
-                    print("Gompertz not available in Python for piecewise model, trying R service...")
-                    # For piecewise, we need to handle KM pre-cutpoint and R post-cutpoint
-                    model_survival = np.zeros_like(prediction_times)
-                    
-                    # Pre-cutpoint: use ORIGINAL KM data directly
-                    pre_mask = prediction_times <= cutpoint
-                    pre_times = prediction_times[pre_mask]
-                    if len(km_times) > 0 and len(km_survival) > 0:
-                        # Interpolate from original KM data to get exact match
-                        model_survival[pre_mask] = np.interp(
-                            pre_times, 
-                            km_times, 
-                            km_survival,
-                            left=1.0,
-                            right=km_survival[km_times <= cutpoint][-1] if np.any(km_times <= cutpoint) else km_survival[-1]
-                        )
-                    
-                    # Post-cutpoint: use R service for Gompertz
-                    post_mask = prediction_times > cutpoint
-                    post_times_adjusted = prediction_times[post_mask] - cutpoint
-                    surv_at_cutpoint = model_survival[pre_mask][-1] if np.any(pre_mask) else 1.0
-                    
-                    # Create adjusted data for R service
-                    r_data_adjusted = {
-                        'time': post_data_adjusted['time'].tolist(),
-                        'event': post_data_adjusted['event'].tolist()
-                    }
-                    r_model_result = {'distribution': 'gompertz', 'cutpoint': cutpoint}
-                    post_surv_r = _try_r_service_for_predictions(
-                        'gompertz', r_data_adjusted, r_model_result, post_times_adjusted
-                    )
-                    
-                    if post_surv_r is not None:
-                        # Scale to ensure continuity
-                        if len(post_surv_r) > 0 and surv_at_cutpoint > 0:
-                            scale_factor = surv_at_cutpoint / post_surv_r[0] if post_surv_r[0] > 0 else 1.0
-                            post_surv_r = post_surv_r * scale_factor
-                        model_survival[post_mask] = post_surv_r
-                    else:
-                        # Fall back to Weibull approximation if R service unavailable
-                        print("R service unavailable for Gompertz piecewise, using Weibull approximation...")
-                        Fitter = WeibullFitter
-                        fitter_post = Fitter()
-                        fitter_post.fit(post_data_adjusted['time'], post_data_adjusted['event'])
-                        # Use survival_function_at_times for proper extrapolation
-                        try:
-                            post_surv = fitter_post.survival_function_at_times(post_times, label='prediction').values
-                            # Scale to ensure continuity at cutpoint
-                            if len(post_surv) > 0 and surv_at_cutpoint > 0:
-                                scale_factor = surv_at_cutpoint / post_surv[0] if post_surv[0] > 0 else 1.0
-                                post_surv = post_surv * scale_factor
-                            model_survival[post_mask] = post_surv
-                        except (AttributeError, TypeError, ValueError):
-                            # Fallback to interpolation for observed, parametric for extrapolation
-                            post_survival_function = fitter_post.survival_function_
-                            post_timeline = post_survival_function.index.values
-                            
-                            post_observed_mask = post_times <= post_timeline[-1]
-                            post_extrap_mask = post_times > post_timeline[-1]
-                            
-                            post_surv = np.ones_like(post_times)
-                            
-                            if np.any(post_observed_mask):
-                                post_surv[post_observed_mask] = np.interp(
-                                    post_times[post_observed_mask],
-                                    post_timeline,
-                                    post_survival_function.iloc[:, 0].values,
-                                    left=1.0
-                                )
-                            
-                            if np.any(post_extrap_mask):
-                                extrap_times = post_times[post_extrap_mask]
-                                # Weibull parametric extrapolation
-                                post_surv[post_extrap_mask] = np.exp(-(fitter_post.lambda_ * extrap_times) ** fitter_post.rho_)
-                            
-                            # Scale to ensure continuity at cutpoint
-                            if len(post_surv) > 0 and surv_at_cutpoint > 0:
-                                scale_factor = surv_at_cutpoint / post_surv[0] if post_surv[0] > 0 else 1.0
-                                post_surv = post_surv * scale_factor
-                            model_survival[post_mask] = post_surv
-                else:
-                    raise ValueError(f"Unknown distribution: {distribution}")
-                    
-            elif approach == 'spline':
-                # Refit spline model using RoystonParmarFitter
-                if knots is None:
-                    knots = 2  # Default
-                
-                try:
-                    fitter = RoystonParmarFitter(scale=scale or 'hazard', knots=knots)
-                    fitter.fit(df['time'], df['event'])
-                    
-                    # Use predict_survival for RoystonParmarFitter
-                    model_survival = fitter.predict_survival(prediction_times)
-                    # Ensure it's a numpy array
-                    if hasattr(model_survival, 'values'):
-                        model_survival = model_survival.values
-                    model_survival = np.array(model_survival).flatten()
-                except Exception as spline_error:
-                    # Fallback: use KM interpolation with exponential extrapolation
-                    print(f"Spline fitting failed: {spline_error}, using KM fallback")
-                    kmf = KaplanMeierFitter()
-                    kmf.fit(df['time'], df['event'])
-                    survival_function = kmf.survival_function_
-                    timeline = survival_function.index.values
-                    
-                    # Split into observed and extrapolation regions
-                    observed_mask = prediction_times <= timeline[-1]
-                    extrap_mask = prediction_times > timeline[-1]
-                    
-                    model_survival = np.ones_like(prediction_times)
-                    
-                    # Interpolate within observed range
-                    if np.any(observed_mask):
-                        model_survival[observed_mask] = np.interp(
-                            prediction_times[observed_mask],
-                            timeline,
-                            survival_function.iloc[:, 0].values,
-                            left=1.0
-                        )
-                    
-                    # Exponential extrapolation beyond observed range
-                    if np.any(extrap_mask):
-                        last_surv = survival_function.iloc[-1, 0]
-                        last_time = timeline[-1]
-                        extrap_times = prediction_times[extrap_mask]
-                        if len(timeline) > 1 and last_surv > 0:
-                            dt = timeline[-1] - timeline[-2]
-                            ds = survival_function.iloc[-2, 0] - last_surv
-                            hazard_est = ds / (dt * survival_function.iloc[-2, 0]) if dt > 0 else 0.01
-                        else:
-                            hazard_est = 0.01
-                        model_survival[extrap_mask] = last_surv * np.exp(-hazard_est * (extrap_times - last_time))
-            else:
-                raise ValueError(f"Unknown approach: {approach}")
-                
             return {
                 'times': prediction_times.tolist(),
-                'survival': model_survival.tolist()
+                'survival': predict_record(record, prediction_times).tolist()
             }
-            
         except Exception as e:
-            print(f"Warning: Failed to refit model for predictions: {e}")
-            print(f"Falling back to simplified predictions")
-            # Fall back to simplified predictions
-            return _generate_simplified_predictions(model_result, km_data, max_time)
-    else:
-        # No original data available, use simplified predictions
-        return _generate_simplified_predictions(model_result, km_data, max_time)
-
-def _try_r_service_for_predictions(
-    model_type: str,
-    original_data: Dict,
-    model_result: Dict,
-    prediction_times: np.ndarray
-) -> Optional[np.ndarray]:
-    """Try to get predictions from R service as fallback
+            print(f"Warning: Model {record['handle']} could not predict: {e}")
     
-    Returns numpy array of survival predictions or None if R service unavailable
-    """
-    import requests
-    import os
+    print("Falling back to simplified predictions")
+    return _generate_simplified_predictions(model_result, km_data, max_time)
+
+def _refit_model(model_result: Dict, original_data: Dict) -> Dict:
+    """Refit the model described by model_result on original_data"""
+    from survival_models import fit_one_piece_model, fit_spline_model
+    from piecewise_models import fit_piecewise_model
     
-    r_service_url = os.getenv('R_SERVICE_URL', 'http://localhost:8001')
+    data = {'time': original_data['time'], 'event': original_data['event']}
+    arm = model_result.get('arm', 'arm')
+    approach = model_result.get('approach', 'one-piece')
+    distribution = model_result.get('distribution', 'exponential')
     
-    try:
-        # Quick health check first (with short timeout)
-        try:
-            health_check = requests.get(f"{r_service_url}/", timeout=2)
-            if not health_check.ok:
-                print(f"R service health check failed, skipping R service")
-                return None
-        except requests.exceptions.RequestException:
-            print(f"R service not available at {r_service_url}, skipping R service")
-            return None
-        
-        # Prepare data
-        time_data = original_data.get('time', [])
-        event_data = original_data.get('event', [])
-        
-        model_params = {
-            'scale': model_result.get('scale'),
-            'knots': model_result.get('knots'),
-            'cutpoint': model_result.get('cutpoint'),
-        }
-        
-        # Call R service with shorter timeout
-        response = requests.post(
-            f"{r_service_url}/refit-and-predict",
-            json={
-                'model_type': model_type,
-                'time': time_data,
-                'event': event_data,
-                'model_params': model_params,
-                'prediction_times': prediction_times.tolist(),
-            },
-            timeout=10  # Reduced from 30 to 10 seconds
-        )
-        
-        if response.status_code == 200:
-            result = response.json()
-            if 'error' not in result and 'survival' in result:
-                return np.array(result['survival'])
-            else:
-                print(f"R service returned error: {result.get('error', 'Unknown error')}")
-                return None
-        else:
-            print(f"R service returned status {response.status_code}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        print(f"R service request failed: {e}")
-        return None
-    except Exception as e:
-        print(f"Error calling R service: {e}")
-        return None
+    if approach == 'one-piece':
+        return fit_one_piece_model(data, arm, distribution)
+    if approach == 'piecewise':
+        if model_result.get('cutpoint') is None:
+            raise ValueError("Cutpoint required for piecewise model")
+        return fit_piecewise_model(data, arm, distribution, model_result['cutpoint'])
+    if approach == 'spline':
+        return fit_spline_model(data, arm, model_result.get('scale') or 'hazard', model_result.get('knots') or 2)
+    raise ValueError(f"Unknown approach: {approach}")
 
 def _generate_simplified_predictions(model_result: Dict, km_data: Dict, max_time: float = 240) -> Dict:
     """Fallback: Generate simplified predictions when original data is not available"""
@@ -581,7 +359,8 @@ def _generate_short_term_plot(
     file_path: str
 ) -> str:
     """Generate short-term fit plot (0-30 months)"""
-    fig, ax = plt.subplots(figsize=(10, 6))
+    fig = new_figure((10, 6))
+    ax = fig.subplots()
     
     # Plot KM curve
     times = km_data.get('times', [])
@@ -618,17 +397,10 @@ def _generate_short_term_plot(
     
     # For piecewise models, show modeled curve following KM before cutoff, then parametric after
     approach = model_result.get('approach', 'one-piece')
-    cutpoint = model_result.get('cutpoint')
+    cutpoints = [c for c in _cutpoint_list(model_result.get('cutpoint')) if c <= max_time]
     
-    if approach == 'piecewise' and cutpoint is not None and cutpoint <= max_time:
-        # Plot the full modeled curve (which includes KM before cutpoint + parametric after)
-        # This matches NICE TA style where "Modeled OS" follows KM before cutpoint
-        ax.plot(model_times_filtered, model_survival_filtered, 'r-', linewidth=2, 
-               label=f'Modeled OS (KM→Parametric at {cutpoint}mo)', zorder=2)
-        
-        # Add vertical line at cutpoint to show transition
-        ax.axvline(x=cutpoint, color='gray', linestyle=':', linewidth=1.5, 
-                  label=f'Cutpoint ({cutpoint}mo)', alpha=0.7, zorder=1)
+    if approach == 'piecewise' and cutpoints:
+        _draw_piecewise(ax, model_times_filtered, model_survival_filtered, cutpoints, 'gray', 1.5)
     else:
         # One-piece or spline: show full fitted curve
         ax.plot(model_times_filtered, model_survival_filtered, 'r--', linewidth=2, label='Fitted Model')
@@ -653,17 +425,8 @@ def _generate_short_term_plot(
     ax.set_xlim(0, max_time)
     ax.set_ylim(0, 1)
     
-    plt.tight_layout()
-    plt.savefig(file_path, dpi=150, bbox_inches='tight')
-    
-    # Convert to base64
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    base64_data = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-    
-    return base64_data
+    fig.tight_layout()
+    return encode_png(render_png(fig, file_path, dpi=150, bbox_inches='tight'))
 
 def _generate_long_term_plot(
     model_id: str,
@@ -674,7 +437,8 @@ def _generate_long_term_plot(
     file_path: str
 ) -> str:
     """Generate long-term extrapolation plot (0-240 months / 20 years)"""
-    fig, ax = plt.subplots(figsize=(12, 8))
+    fig = new_figure((12, 8))
+    ax = fig.subplots()
     
     # Plot observed KM for trial period
     times = km_data.get('times', [])
@@ -689,17 +453,10 @@ def _generate_long_term_plot(
     
     # For piecewise models, show modeled curve following KM before cutoff, then parametric after
     approach = model_result.get('approach', 'one-piece')
-    cutpoint = model_result.get('cutpoint')
+    cutpoints = _cutpoint_list(model_result.get('cutpoint'))
     
-    if approach == 'piecewise' and cutpoint is not None:
-        # Plot the full modeled curve (which includes KM before cutpoint + parametric after)
-        # This matches NICE TA style where "Modeled OS" follows KM before cutpoint
-        ax.plot(extrapolation_times, extrapolated_survival, 'r-', linewidth=2, 
-               label=f'Modeled OS (KM→Parametric at {cutpoint}mo)', zorder=2)
-        
-        # Add vertical line at cutpoint to show transition
-        ax.axvline(x=cutpoint, color='green', linestyle=':', linewidth=2, 
-                  label=f'Cutpoint ({cutpoint}mo)', alpha=0.7, zorder=1)
+    if approach == 'piecewise' and cutpoints:
+        _draw_piecewise(ax, extrapolation_times, extrapolated_survival, cutpoints, 'green', 2)
     else:
         # One-piece or spline: show full model prediction
         ax.plot(extrapolation_times, extrapolated_survival, 'r--', linewidth=2, label='Model Extrapolation')
@@ -717,7 +474,7 @@ def _generate_long_term_plot(
         ax.plot(seer_times, seer_survival, 'g-', linewidth=2, alpha=0.7, label='SEER Benchmark (Stage IV NSCLC)')
     
     # Add survival milestones
-    milestones = [12, 24, 60, 120, 240]  # 1-yr, 2-yr, 5-yr, 10-yr, 20-yr
+    milestones = PLOT_MILESTONES  # 1-yr, 2-yr, 5-yr, 10-yr, 20-yr
     for milestone in milestones:
         if milestone <= 240:
             # Find survival at milestone
@@ -737,15 +494,116 @@ def _generate_long_term_plot(
     ax.set_xlim(0, 240)
     ax.set_ylim(0, 1)
     
-    plt.tight_layout()
-    plt.savefig(file_path, dpi=150, bbox_inches='tight')
+    fig.tight_layout()
+    return encode_png(render_png(fig, file_path, dpi=150, bbox_inches='tight'))
+
+
+def plot_km(ax, km: Dict, label: str, color: str, ci_show: bool = True, linewidth: float = 2):
+    """Draw a km_kernel estimate as a step curve with its confidence band"""
+    ax.step(km['times'], km['survival'], where='post', color=color, linewidth=linewidth, label=label)
+    if ci_show:
+        ax.fill_between(km['times'], km['lower'], km['upper'], step='post', alpha=0.25, color=color, linewidth=0)
+
+
+def _generate_cumulative_hazard_plot(
+    chemo_times: np.ndarray,
+    chemo_hazard: np.ndarray,
+    pembro_times: np.ndarray,
+    pembro_hazard: np.ndarray,
+    file_path: Optional[str]
+) -> str:
+    """PH diagnostic: Nelson-Aalen cumulative hazard of both arms"""
+    fig = new_figure((10, 6))
+    ax = fig.subplots()
     
-    # Convert to base64
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', dpi=150, bbox_inches='tight')
-    buf.seek(0)
-    base64_data = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
+    ax.step(chemo_times, chemo_hazard, where='post', label='Chemotherapy', linewidth=2, color='blue')
+    ax.step(pembro_times, pembro_hazard, where='post', label='Pembrolizumab', linewidth=2, color='orange')
+    
+    ax.legend()
+    ax.set_xlabel('Time', fontsize=12)
+    ax.set_ylabel('Cumulative Hazard', fontsize=12)
+    ax.set_title('Cumulative Hazard Plot\n(Diverging lines expected)', fontsize=14)
+    ax.grid(True, alpha=0.3)
     
-    return base64_data
+    fig.tight_layout()
+    return encode_png(render_png(fig, file_path, dpi=150))
+
+def _generate_log_cumulative_hazard_plot(
+    chemo_times: np.ndarray,
+    chemo_hazard: np.ndarray,
+    pembro_times: np.ndarray,
+    pembro_hazard: np.ndarray,
+    file_path: Optional[str]
+) -> str:
+    """PH diagnostic: log H(t) against log time; parallel lines indicate proportional hazards"""
+    fig = new_figure((10, 6))
+    ax = fig.subplots()
+    
+    # Log of the Nelson-Aalen cumulative hazard; avoid log(0)
+    for times, hazard, label, color in ((chemo_times, chemo_hazard, 'Chemotherapy', 'blue'),
+                                        (pembro_times, pembro_hazard, 'Pembrolizumab', 'orange')):
+        positive = hazard > 0
+        ax.plot(times[positive], np.log(hazard[positive]), label=label, linewidth=2, color=color)
+    
+    # X on a log scale; Y is linear in the already log-transformed hazard
+    ax.set_xscale('log')
+    ax.set_xlabel('Time (log scale)', fontsize=12)
+    ax.set_ylabel('Log-Cumulative Hazard', fontsize=12)
+    ax.set_title('Log-Cumulative Hazard Plot\n(Parallel lines indicate proportional hazards)', fontsize=14)
+    ax.legend()
+    ax.grid(True, alpha=0.3, which='both')
+    
+    fig.tight_layout()
+    return encode_png(render_png(fig, file_path, dpi=150))
+
+def _generate_schoenfeld_plot(
+    times: np.ndarray,
+    residuals: np.ndarray,
+    smooth_times: np.ndarray,
+    smooth_values: np.ndarray,
+    ci_lower: np.ndarray,
+    ci_upper: np.ndarray,
+    file_path: Optional[str]
+) -> str:
+    """PH diagnostic: scaled Schoenfeld residuals with their smoother and band, in the reference style"""
+    fig = new_figure((12, 6))
+    ax = fig.subplots()
+    
+    # Scatter plot of individual residuals (open circles)
+    ax.scatter(times, residuals, alpha=0.4, s=15, color='black', marker='o', edgecolors='none', zorder=1)
+    
+    # Horizontal reference line at zero (dotted)
+    ax.axhline(y=0, color='black', linestyle=':', linewidth=1.5, alpha=0.7, zorder=2)
+    
+    # Pointwise confidence band of the smoother (dashed lines)
+    if len(smooth_times) > 0 and len(ci_lower) > 0 and len(ci_upper) > 0:
+        ax.plot(smooth_times, ci_lower, 'k--', linewidth=1, alpha=0.5, zorder=3)
+        ax.plot(smooth_times, ci_upper, 'k--', linewidth=1, alpha=0.5, zorder=3)
+    
+    # Smoothed trend line (solid black)
+    if len(smooth_times) > 0 and len(smooth_values) > 0:
+        ax.plot(smooth_times, smooth_values, 'k-', linewidth=2, zorder=4)
+    
+    # Log scale x-axis with specific tick marks matching reference
+    ax.set_xscale('log')
+    ax.set_xlim(left=0.3, right=float(np.max(times)) * 1.5)
+    ax.set_xticks([0.5, 1, 2, 5, 10, 20, 50])
+    ax.set_xticklabels(['0.5', '1.0', '2.0', '5.0', '10.0', '20.0', '50.0'])
+    
+    # Axis labels matching reference style; no title or legend
+    ax.set_ylabel('Beta(t) for TRT01PSOC', fontsize=12, fontweight='bold')
+    ax.set_xlabel('Time', fontsize=12, fontweight='bold')
+    ax.grid(True, alpha=0.3, which='both', linestyle='-', linewidth=0.5)
+    ax.grid(True, alpha=0.2, which='minor', linestyle=':', linewidth=0.5)
+    
+    fig.tight_layout()
+    return encode_png(render_png(fig, file_path, dpi=300, bbox_inches='tight'))
+
 
+_RENDERERS = {
+    "short_term": _generate_short_term_plot,
+    "long_term": _generate_long_term_plot,
+    "cumulative_hazard": _generate_cumulative_hazard_plot,
+    "log_cumulative_hazard": _generate_log_cumulative_hazard_plot,
+    "schoenfeld_residuals": _generate_schoenfeld_plot
+}
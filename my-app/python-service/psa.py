@@ -0,0 +1,210 @@
+"""Probabilistic sensitivity analysis draws of fitted survival curves
+
+Each registered model's parameters are drawn from the multivariate normal of
+its estimates (the fitter's `variance_matrix_`), and every chunk of draws is
+evaluated on the cycle grid in one broadcasted survival_predictor call. The
+result is a (draws, times) matrix per model for cost-effectiveness loops.
+
+Positive parameters are drawn on the log scale (delta-method covariance), so
+every draw is a valid curve. Piecewise models draw the post-cutpoint model
+only; the Kaplan-Meier part and segment hazards are kept at their estimates.
+"""
+import os
+import warnings
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+import survival_predictor
+
+DEFAULT_PERCENTILES = [2.5, 50.0, 97.5]
+
+# Draws evaluated per broadcasted pass; bounds memory at chunk x times values
+PSA_CHUNK_SIZE = int(os.environ.get('PSA_CHUNK_SIZE', '2000'))
+
+# Parameters that must stay positive, drawn as log-normal
+LOG_SCALE_PARAMETERS = {
+    'exponential': {'lambda_'},
+    'weibull': {'lambda_', 'rho_'},
+    'log-normal': {'sigma_'},
+    'log-logistic': {'alpha_', 'beta_'},
+    'gompertz': {'lambda_'},
+}
+
+
+def cycle_times(horizon: float, cycle_length: float = 1.0) -> np.ndarray:
+    """Cycle boundaries 0, cycle_length, ..., horizon (months by default)"""
+    if cycle_length <= 0:
+        raise ValueError("cycle_length must be positive")
+    return np.arange(0.0, horizon + cycle_length / 2, cycle_length)
+
+
+def parameter_distribution(record: Dict) -> Tuple[List[str], np.ndarray, np.ndarray, set]:
+    """Names, mean and covariance of a registered model's (working) parameters.
+
+    Returns:
+        (names, mean, covariance, log_scale) where log_scale holds the names whose
+        mean and covariance are on the log scale
+    """
+    fitter = record['fitter']
+    covariance = getattr(fitter, 'variance_matrix_', None)
+    if covariance is None or not np.all(np.isfinite(np.asarray(covariance, dtype=np.float64))):
+        raise ValueError(f"Model {record.get('handle')} has no finite variance matrix to sample from")
+
+    family = survival_predictor.record_family(record)
+    params = survival_predictor.fitter_parameters(fitter)
+    if family == 'royston-parmar':
+        names = [f"gamma{j}" for j in range(len(params['coeffs']))]
+        return names, np.asarray(params['coeffs'], dtype=np.float64), np.asarray(covariance, dtype=np.float64), set()
+
+    if isinstance(covariance, pd.DataFrame):
+        names = [name for name in covariance.index if name in params]
+        covariance = covariance.loc[names, names].to_numpy(dtype=np.float64)
+    else:
+        names = list(params)
+        covariance = np.asarray(covariance, dtype=np.float64)
+    mean = np.array([params[name] for name in names], dtype=np.float64)
+
+    log_scale = LOG_SCALE_PARAMETERS.get(family, set()) & set(names)
+    if log_scale:
+        # Delta method: d(log x) = dx / x
+        jacobian = np.array([1.0 / mean[j] if name in log_scale else 1.0 for j, name in enumerate(names)])
+        covariance = covariance * np.outer(jacobian, jacobian)
+        mean = np.array([np.log(mean[j]) if name in log_scale else mean[j] for j, name in enumerate(names)])
+    return names, mean, covariance, log_scale
+
+
+def _normal_factor(covariance: np.ndarray) -> np.ndarray:
+    """L with L @ L.T = covariance; near-singular matrices are clipped to their PSD part"""
+    try:
+        return np.linalg.cholesky(covariance)
+    except np.linalg.LinAlgError:
+        values, vectors = np.linalg.eigh((covariance + covariance.T) / 2)
+        return vectors * np.sqrt(np.clip(values, 0.0, None))
+
+
+def _predictor_parameters(record: Dict, names: List[str], draws: np.ndarray, log_scale: set) -> Dict:
+    """Parameter dict for survival_predictor with one row of draws per parameter set"""
+    family = survival_predictor.record_family(record)
+    if family == 'royston-parmar':
+        params = survival_predictor.fitter_parameters(record['fitter'])
+        return {**params, "coeffs": draws}
+    return {
+        name: np.exp(draws[:, j]) if name in log_scale else draws[:, j]
+        for j, name in enumerate(names)
+    }
+
+
+def iter_draws(
+    record: Dict,
+    n_draws: int,
+    times,
+    seed: int = 0,
+    quantity: str = 'survival',
+    chunk_size: Optional[int] = None,
+    dtype=np.float64
+) -> Iterator[np.ndarray]:
+    """Yield (chunk, n_times) blocks of sampled curves until n_draws are produced.
+
+    The draws depend on the seed and the chunk size only, so streamed and
+    collected results agree.
+    """
+    names, mean, covariance, log_scale = parameter_distribution(record)
+    factor = _normal_factor(covariance)
+    rng = np.random.default_rng(seed)
+    times = np.asarray(times, dtype=np.float64)
+    chunk_size = chunk_size or PSA_CHUNK_SIZE
+
+    for offset in range(0, n_draws, chunk_size):
+        size = min(chunk_size, n_draws - offset)
+        draws = mean + rng.standard_normal((size, len(mean))) @ factor.T
+        params = _predictor_parameters(record, names, draws, log_scale)
+        with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+            values = survival_predictor.predict_record(record, times, quantity, params=params)
+        yield np.broadcast_to(values, (size, len(times))).astype(dtype, copy=False)
+
+
+def sample_curves(
+    record: Dict,
+    n_draws: int,
+    times,
+    seed: int = 0,
+    quantity: str = 'survival',
+    chunk_size: Optional[int] = None,
+    dtype=np.float64
+) -> np.ndarray:
+    """(n_draws, n_times) matrix of sampled curves of one registered model"""
+    out = np.empty((n_draws, len(np.atleast_1d(times))), dtype=dtype)
+    offset = 0
+    for block in iter_draws(record, n_draws, times, seed, quantity, chunk_size, dtype):
+        out[offset:offset + len(block)] = block
+        offset += len(block)
+    return out
+
+
+def sample_models(
+    records: List[Dict],
+    n_draws: int,
+    times,
+    seed: int = 0,
+    quantity: str = 'survival',
+    chunk_size: Optional[int] = None,
+    dtype=np.float64
+) -> Dict[str, np.ndarray]:
+    """sample_curves for a set of models, keyed by handle.
+
+    Each model gets its own stream seeded by (seed, position), so adding a model
+    does not change the draws of the others listed before it.
+    """
+    return {
+        record['handle']: sample_curves(record, n_draws, times, model_seed(seed, i), quantity, chunk_size, dtype)
+        for i, record in enumerate(records)
+    }
+
+
+def model_seed(seed: int, position: int) -> int:
+    """Independent per-model seed derived from the request seed"""
+    return int(np.random.SeedSequence([seed, position]).generate_state(1)[0])
+
+
+def summarise_draws(values: np.ndarray, percentiles: List[float]) -> Dict:
+    """Mean and percentile curves over the draws (NaN draws excluded)"""
+    with warnings.catch_warnings(), np.errstate(invalid='ignore'):
+        warnings.simplefilter('ignore', RuntimeWarning)  # all-NaN columns
+        mean = np.nanmean(values, axis=0, dtype=np.float64)
+        bands = np.nanpercentile(values, percentiles, axis=0)
+
+    def to_list(curve):
+        return [float(v) if np.isfinite(v) else None for v in curve]
+
+    return {"mean": to_list(mean), **{str(p): to_list(band) for p, band in zip(percentiles, bands)}}
+
+
+def run_psa(
+    records: List[Dict],
+    n_draws: int,
+    times,
+    seed: int = 0,
+    quantity: str = 'survival',
+    percentiles: Optional[List[float]] = None,
+    include_draws: bool = False
+) -> Dict:
+    """JSON-ready PSA of several models: summary curves and optionally the float32 draws.
+
+    Models that cannot be sampled get an 'error' entry instead of failing the call.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    percentiles = percentiles or DEFAULT_PERCENTILES
+    models = {}
+    for i, record in enumerate(records):
+        try:
+            values = sample_curves(record, n_draws, times, model_seed(seed, i), quantity, dtype=np.float32)
+        except ValueError as e:
+            # e.g. a degenerate fit without a usable covariance; the other models still run
+            models[record['handle']] = {"error": str(e)}
+            continue
+        models[record['handle']] = summarise_draws(values, percentiles)
+        if include_draws:
+            models[record['handle']]["draws"] = np.where(np.isfinite(values), values, None).tolist()
+    return {"times": times.tolist(), "n_draws": n_draws, "quantity": quantity, "models": models}
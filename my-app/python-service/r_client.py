@@ -0,0 +1,185 @@
+"""Shared client for the R (plumber) service
+
+Every R call goes through one requests.Session with a keep-alive connection
+pool, so calls reuse TCP connections instead of opening one each. The health
+check (GET /) is cached for R_HEALTH_TTL_SECONDS, and a circuit breaker opens
+after R_BREAKER_FAILURES consecutive failures (connection errors, timeouts,
+5xx). While it is open, calls fail fast without touching the network; after
+R_BREAKER_COOLDOWN_SECONDS a single trial call decides whether it closes
+again. When R is down, callers fall back to Python at once instead of waiting
+out a 2-30 s timeout per model.
+
+State is per process: with EXECUTOR_KIND=process each worker keeps its own.
+"""
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+R_SERVICE_URL = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
+R_POOL_SIZE = int(os.environ.get('R_POOL_SIZE', '8'))
+R_HEALTH_TTL_SECONDS = float(os.environ.get('R_HEALTH_TTL_SECONDS', '30'))
+R_HEALTH_TIMEOUT_SECONDS = 2.0
+R_BREAKER_FAILURES = int(os.environ.get('R_BREAKER_FAILURES', '3'))
+R_BREAKER_COOLDOWN_SECONDS = float(os.environ.get('R_BREAKER_COOLDOWN_SECONDS', '30'))
+
+
+class RClient:
+    """Pooled R service session with cached health, circuit breaker and per-endpoint latency"""
+
+    def __init__(
+        self,
+        base_url: str = R_SERVICE_URL,
+        pool_size: int = R_POOL_SIZE,
+        health_ttl: float = R_HEALTH_TTL_SECONDS,
+        failure_threshold: int = R_BREAKER_FAILURES,
+        cooldown: float = R_BREAKER_COOLDOWN_SECONDS
+    ):
+        self.base_url = base_url.rstrip('/')
+        self.health_ttl = health_ttl
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown = cooldown
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size), max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._lock = threading.Lock()
+        self._healthy: Optional[bool] = None
+        self._health_checked_at = 0.0
+        self._consecutive_failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self.short_circuited = 0
+        self._endpoints: Dict[str, Dict[str, Any]] = {}
+
+    # Circuit breaker
+
+    def _state(self, now: float) -> str:
+        if self._opened_at is None:
+            return 'closed'
+        return 'open' if now - self._opened_at < self.cooldown else 'half_open'
+
+    def _admit(self) -> bool:
+        """Whether a call may go out now; in half-open state only one trial call does"""
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def _record_success(self) -> None:
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+            self._healthy, self._health_checked_at = True, time.monotonic()
+
+    def _record_failure(self) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self._consecutive_failures += 1
+            self._trial_in_flight = False
+            self._healthy, self._health_checked_at = False, now
+            if self._opened_at is not None or self._consecutive_failures >= self.failure_threshold:
+                # A failed trial call re-opens the breaker for another cooldown
+                self._opened_at = now
+
+    # Calls
+
+    def available(self) -> bool:
+        """Cached health check; False straight away while the breaker is open"""
+        with self._lock:
+            now = time.monotonic()
+            state = self._state(now)
+            if state == 'open':
+                self.short_circuited += 1
+                return False
+            # A half-open breaker always probes, whatever the cached answer
+            if state == 'closed' and self._healthy is not None and now - self._health_checked_at < self.health_ttl:
+                return self._healthy
+        return self.get('/', timeout=R_HEALTH_TIMEOUT_SECONDS) is not None
+
+    def get(self, path: str, timeout: float = R_HEALTH_TIMEOUT_SECONDS) -> Optional[Any]:
+        return self._request('GET', path, None, timeout)
+
+    def post(self, path: str, payload: Dict, timeout: float = 30) -> Optional[Any]:
+        """
+        POST JSON to an R endpoint.
+
+        Returns:
+            The decoded JSON body of a 200 response, or None when the breaker is
+            open, the service is unreachable or slow, or it answers an error status
+        """
+        return self._request('POST', path, payload, timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict], timeout: float) -> Optional[Any]:
+        if not self._admit():
+            return None
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", json=payload, timeout=timeout)
+        except requests.exceptions.RequestException as e:
+            self._record(path, time.perf_counter() - started, ok=False)
+            self._record_failure()
+            print(f"[RClient] {method} {path} failed: {e}")
+            return None
+        self._record(path, time.perf_counter() - started, ok=response.status_code == 200)
+
+        if response.status_code >= 500:
+            self._record_failure()
+        else:
+            # Any answer below 500 means R is up, even when it rejects this request
+            self._record_success()
+        if response.status_code != 200:
+            print(f"[RClient] {method} {path} returned status {response.status_code}: {response.text[:500]}")
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            print(f"[RClient] {method} {path} returned a non-JSON body")
+            return None
+
+    # Metrics
+
+    def _record(self, path: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            endpoint = self._endpoints.setdefault(
+                path, {"calls": 0, "errors": 0, "latencies": deque(maxlen=1000)}
+            )
+            endpoint['calls'] += 1
+            endpoint['errors'] += 0 if ok else 1
+            endpoint['latencies'].append(seconds)
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            endpoints = {}
+            for path, endpoint in self._endpoints.items():
+                latencies = sorted(endpoint['latencies'])
+                endpoints[path] = {
+                    "calls": endpoint['calls'],
+                    "errors": endpoint['errors'],
+                    "latency_ms_mean": 1000 * sum(latencies) / len(latencies) if latencies else 0.0,
+                    "latency_ms_p50": 1000 * latencies[int(0.5 * (len(latencies) - 1))] if latencies else 0.0,
+                    "latency_ms_p95": 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else 0.0,
+                    "latency_ms_max": 1000 * latencies[-1] if latencies else 0.0
+                }
+            return {
+                "base_url": self.base_url,
+                "breaker_state": self._state(time.monotonic()),
+                "consecutive_failures": self._consecutive_failures,
+                "healthy": self._healthy,
+                "short_circuited": self.short_circuited,
+                "endpoints": endpoints
+            }
+
+
+# Shared client used by every R call site
+r_client = RClient()
@@ -0,0 +1,255 @@
+"""Scaled Schoenfeld residuals and the Grambsch-Therneau test, in NumPy
+
+The PH diagnostics used to ask the R service for cox.zph output and fall back
+to lifelines' compute_residuals (a per-row Python loop) plus a statsmodels
+lowess. Everything here works on sorted arrays instead:
+
+- Schoenfeld residuals with Efron ties come from reverse cumulative sums of
+  the risk scores (the risk sets) and per-event-time sums over the tied deaths,
+  so a cohort costs a sort and a few passes over it.
+- The Grambsch-Therneau test is lifelines' (and the pre-2019 cox.zph)
+  approximation: (sum g~ r*)^2 / (d * var(beta) * sum g~^2), where g~ is the
+  centred transformed event time.
+- The smoother is a local quadratic fit with tricube weights on the nearest
+  `span` share of points (loess(y ~ x, span = 0.4) in R), evaluated on a grid
+  in batches of 3x3 systems, with pointwise bands from its linear weights. The
+  nearest points of a grid point are a contiguous run of the sorted times, so
+  only those windows are formed, a block of grid points at a time.
+
+The result has the shape of the R service's /schoenfeld-residuals response.
+"""
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+from scipy import stats
+
+from km_kernel import kaplan_meier, step_lookup
+
+TIME_TRANSFORMS = ('km', 'rank', 'identity')
+
+# Smoother settings of the R service (loess span, prediction grid, 95% band)
+SMOOTH_SPAN = 0.4
+SMOOTH_POINTS = 200
+BAND_Z = 1.96
+# Window entries (grid points x q nearest) evaluated at once by loess_band
+_LOESS_BLOCK_ELEMENTS = 1 << 20
+
+
+def _as_matrix(covariates) -> np.ndarray:
+    X = np.asarray(covariates, dtype=np.float64)
+    return X[:, None] if X.ndim == 1 else X
+
+
+def scaled_schoenfeld_residuals(
+    time: Sequence[float],
+    event: Sequence[int],
+    covariates,
+    params: Sequence[float],
+    variance_matrix
+) -> Dict[str, np.ndarray]:
+    """
+    Schoenfeld residuals of a fitted Cox model (Efron ties), unscaled and scaled.
+
+    Scaled residuals follow R's residuals(fit, "scaledsch"): d * r @ V + beta,
+    so their smooth estimates beta(t).
+
+    Args:
+        time, event: Follow-up time and event indicator of each subject
+        covariates: (n,) or (n, p) covariate values the model was fitted on
+        params: Fitted coefficients (p,)
+        variance_matrix: Their (p, p) variance matrix
+
+    Returns:
+        Dict with 'times' (event times, ascending), 'residuals' and
+        'scaled_residuals' ((n_events, p), same order)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    event = np.asarray(event).astype(bool)
+    X = _as_matrix(covariates)
+    beta = np.asarray(params, dtype=np.float64).reshape(-1)
+    variance = np.asarray(variance_matrix, dtype=np.float64).reshape(beta.size, beta.size)
+
+    order = np.argsort(time, kind='stable')
+    time, event = time[order], event[order]
+    # Residuals do not depend on the covariate origin; centring keeps exp() in range
+    X = X[order] - X.mean(axis=0)
+    phi = np.exp(X @ beta)
+
+    # Risk set sums at each time: everyone still followed at or after it
+    risk_phi = np.cumsum(phi[::-1])[::-1]
+    risk_phi_x = np.cumsum((phi[:, None] * X)[::-1], axis=0)[::-1]
+
+    event_times, event_X, event_phi = time[event], X[event], phi[event]
+    unique_times, starts, counts = np.unique(event_times, return_index=True, return_counts=True)
+    at_risk = np.searchsorted(time, unique_times, side='left')
+    tie_phi = np.add.reduceat(event_phi, starts)
+    tie_phi_x = np.add.reduceat(event_phi[:, None] * event_X, starts, axis=0)
+
+    # Efron: the l-th of m tied deaths sees the risk set less l/m of the tied deaths
+    group = np.repeat(np.arange(unique_times.size), counts)
+    fraction = (np.arange(event_times.size) - starts[group]) / counts[group]
+    numerator = risk_phi_x[at_risk][group] - fraction[:, None] * tie_phi_x[group]
+    denominator = risk_phi[at_risk][group] - fraction * tie_phi[group]
+    terms = numerator / (denominator * counts[group])[:, None]
+    weighted_mean = np.add.reduceat(terms, starts, axis=0)
+
+    residuals = event_X - weighted_mean[group]
+    scaled = event_times.size * residuals @ variance + beta
+    return {"times": event_times, "residuals": residuals, "scaled_residuals": scaled}
+
+
+def transform_times(time, event, event_times, transform: str = 'rank') -> np.ndarray:
+    """
+    g(t) of the event times for the Grambsch-Therneau test.
+
+    'km' is 1 - S(t) of the pooled Kaplan-Meier curve, 'rank' the rank among
+    the event times (ties averaged, as R's rank) and 'identity' the time itself.
+    """
+    event_times = np.asarray(event_times, dtype=np.float64)
+    if transform == 'km':
+        km = kaplan_meier({"time": np.asarray(time, dtype=np.float64), "event": np.asarray(event)})
+        return 1.0 - step_lookup(km, event_times)
+    if transform == 'rank':
+        return stats.rankdata(event_times)
+    if transform == 'identity':
+        return event_times
+    raise ValueError(f"transform must be one of {', '.join(TIME_TRANSFORMS)}")
+
+
+def grambsch_therneau_test(
+    scaled_residuals,
+    transformed_times,
+    variance_matrix
+) -> Dict[str, np.ndarray]:
+    """
+    Per-covariate Grambsch-Therneau test of proportional hazards (1 df each).
+
+    Args:
+        scaled_residuals: (n_events, p) scaled Schoenfeld residuals
+        transformed_times: g(t) of the matching event times (transform_times)
+        variance_matrix: (p, p) variance matrix of the coefficients
+
+    Returns:
+        Dict with 'statistic' and 'p_value' arrays (p,)
+    """
+    residuals = _as_matrix(scaled_residuals)
+    g = np.asarray(transformed_times, dtype=np.float64)
+    g = g - g.mean()
+    variance = np.diag(np.asarray(variance_matrix, dtype=np.float64).reshape(residuals.shape[1], -1))
+    # Adding beta to every residual does not change the statistic as g is centred
+    statistic = (g @ residuals) ** 2 / (residuals.shape[0] * variance * (g @ g))
+    return {"statistic": statistic, "p_value": stats.chi2.sf(statistic, 1)}
+
+
+def loess_band(
+    x,
+    y,
+    span: float = SMOOTH_SPAN,
+    grid_size: int = SMOOTH_POINTS,
+    z: float = BAND_Z
+) -> Dict[str, np.ndarray]:
+    """
+    Local quadratic smoother with a pointwise confidence band on an even grid.
+
+    Each grid point fits a weighted quadratic to its nearest span * n points
+    (tricube weights), as R's loess. The fit is linear in y, fitted = L y, so
+    the band is fitted +/- z * s * ||l(x0)||, with s^2 = RSS / tr((I - L)'(I - L))
+    and the data-point terms interpolated from the grid as loess does.
+
+    Returns:
+        Dict with 'smooth_times', 'smooth_values', 'ci_lower', 'ci_upper'.
+        With three points or fewer the data are returned unsmoothed.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = x.size
+    if n <= 3:
+        return {"smooth_times": x, "smooth_values": y, "ci_lower": y, "ci_upper": y}
+
+    order = np.argsort(x, kind='stable')
+    x, y = x[order], y[order]
+    grid = np.linspace(x[0], x[-1], grid_size)
+    q = min(n, max(int(np.floor(span * n)), 3))
+    # The q nearest points of x0 are a run of the sorted x starting at the first s
+    # with x[s] + x[s + q] >= 2 * x0 (sliding further right would only move away)
+    starts = np.minimum(np.searchsorted(x[:n - q] + x[q:], 2 * grid, side='left'), n - q)
+    bandwidth = np.maximum(grid - x[starts], x[starts + q - 1] - grid)
+    bandwidth = np.maximum(bandwidth, np.finfo(np.float64).eps * max(1.0, np.abs(x).max()))
+
+    # Leverages and ||l(x_i)||^2 at the data are interpolated from the two neighbouring grid points
+    right = np.clip(np.searchsorted(grid, x, side='right'), 1, grid_size - 1)
+    left = right - 1
+    share = np.clip((x - grid[left]) / (grid[right] - grid[left]), 0.0, 1.0)
+
+    fitted_grid = np.empty(grid_size)
+    norm_sq = np.empty(grid_size)
+    leverage = np.zeros(n)
+    window = np.arange(q)
+    # Grid points go in blocks of about _LOESS_BLOCK_ELEMENTS window entries to bound memory
+    block_rows = max(1, _LOESS_BLOCK_ELEMENTS // q)
+    for first in range(0, grid_size, block_rows):
+        block = slice(first, min(first + block_rows, grid_size))
+        index = starts[block, None] + window
+        # Weighted moments of u = (x - x0) / h give each grid point's 3x3 normal equations
+        u = (x[index] - grid[block, None]) / bandwidth[block, None]
+        weights = np.clip(1.0 - np.abs(u) ** 3, 0.0, None) ** 3
+        moments = np.empty((u.shape[0], 5))
+        weighted_power = weights.copy()
+        for k in range(5):
+            moments[:, k] = weighted_power.sum(axis=1)
+            weighted_power *= u
+        del weighted_power
+        normal = moments[:, np.array([[0, 1, 2], [1, 2, 3], [2, 3, 4]])]
+        # First row of the inverse: the intercept of the local fit as a linear map of y
+        intercept = np.linalg.pinv(normal)[:, 0, :]
+        kernel = (intercept[:, 0, None] + intercept[:, 1, None] * u + intercept[:, 2, None] * u ** 2) * weights
+        del u, weights
+
+        fitted_grid[block] = np.einsum('gi,gi->g', kernel, y[index])
+        norm_sq[block] = np.einsum('gi,gi->g', kernel, kernel)
+        for neighbour, factor in ((left, 1.0 - share), (right, share)):
+            # neighbour is sorted with x, so the points next to this block are one run
+            points = np.arange(*np.searchsorted(neighbour, [block.start, block.stop]))
+            column = points - starts[neighbour[points]]
+            inside = (column >= 0) & (column < q)
+            points, column = points[inside], column[inside]
+            leverage[points] += factor[points] * kernel[neighbour[points] - block.start, column]
+
+    fitted = np.interp(x, grid, fitted_grid)
+    one_delta = n - 2 * leverage.sum() + np.interp(x, grid, norm_sq).sum()
+    sigma = np.sqrt(np.sum((y - fitted) ** 2) / max(one_delta, 1.0))
+
+    half_width = z * sigma * np.sqrt(norm_sq)
+    return {
+        "smooth_times": grid,
+        "smooth_values": fitted_grid,
+        "ci_lower": fitted_grid - half_width,
+        "ci_upper": fitted_grid + half_width
+    }
+
+
+def schoenfeld_diagnostics(
+    time: Sequence[float],
+    event: Sequence[int],
+    covariate: Sequence[float],
+    params: Sequence[float],
+    variance_matrix,
+    transforms: Optional[Sequence[str]] = TIME_TRANSFORMS
+) -> Dict:
+    """
+    Scaled Schoenfeld residuals of a single-covariate Cox model with their
+    smoother and Grambsch-Therneau tests, in the shape of R's /schoenfeld-residuals.
+
+    Returns:
+        Dict with 'residuals', 'times', 'smooth_times', 'smooth_values',
+        'ci_lower', 'ci_upper' (arrays) and 'tests': {transform: {'chisq',
+        'p_value', 'df'}} for each requested time transform
+    """
+    result = scaled_schoenfeld_residuals(time, event, covariate, params, variance_matrix)
+    residuals, times = result['scaled_residuals'][:, 0], result['times']
+    tests = {}
+    for transform in transforms or ():
+        test = grambsch_therneau_test(result['scaled_residuals'], transform_times(time, event, times, transform),
+                                      variance_matrix)
+        tests[transform] = {"chisq": float(test['statistic'][0]), "p_value": float(test['p_value'][0]), "df": 1}
+    return {"residuals": residuals, "times": times, **loess_band(times, residuals), "tests": tests}
@@ -1,10 +1,7 @@
 """Survival model fitting functions"""
 import pandas as pd
 import numpy as np
-import os
-import requests
 from lifelines import (
-    KaplanMeierFitter, 
     WeibullFitter, 
     ExponentialFitter, 
     LogNormalFitter, 
@@ -12,25 +9,24 @@ from lifelines import (
     GeneralizedGammaFitter,
     SplineFitter
 )
-from custom_spline_models import RoystonParmarFitter
+from custom_spline_models import RoystonParmarFitter, fit_spline_family
 from custom_gompertz import GompertzFitter
-from typing import Dict, List, Optional
+from model_registry import registry
+from km_kernel import kaplan_meier
+import survival_predictor
+from r_client import r_client
+from typing import Dict, List, Optional, Tuple
 import json
 
-# R service URL for fallback
-R_SERVICE_URL = os.environ.get('R_SERVICE_URL', 'http://localhost:8001')
+# Milestone times (months) reported in every fit response
+MILESTONE_TIMES = [60, 120]
 
 
 def _try_r_service_parametric(time: list, event: list, distribution: str, arm: str) -> Optional[Dict]:
     """Try to fit parametric model using R service as fallback"""
     try:
-        response = requests.post(
-            f"{R_SERVICE_URL}/fit-parametric",
-            json={"time": time, "event": event, "distribution": distribution},
-            timeout=30
-        )
-        if response.status_code == 200:
-            r_result = response.json()
+        r_result = r_client.post("/fit-parametric", {"time": time, "event": event, "distribution": distribution}, timeout=30)
+        if r_result is not None:
             if 'error' not in r_result:
                 print(f"Successfully used R service for {distribution} model")
                 return {
@@ -55,13 +51,8 @@ def _try_r_service_parametric(time: list, event: list, distribution: str, arm: s
 def _try_r_service_spline(time: list, event: list, scale: str, knots: int, arm: str) -> Optional[Dict]:
     """Try to fit spline model using R service as fallback"""
     try:
-        response = requests.post(
-            f"{R_SERVICE_URL}/fit-rp-spline",
-            json={"time": time, "event": event, "scale": scale, "knots": knots},
-            timeout=30
-        )
-        if response.status_code == 200:
-            r_result = response.json()
+        r_result = r_client.post("/fit-rp-spline", {"time": time, "event": event, "scale": scale, "knots": knots}, timeout=30)
+        if r_result is not None:
             if 'error' not in r_result:
                 print(f"Successfully used R service for spline model ({scale}, {knots} knots)")
                 return {
@@ -106,156 +97,131 @@ def fit_spline_model(data: Dict, arm: str, scale: str, knots: int) -> Dict:
     try:
         fitter = RoystonParmarFitter(scale=scale, knots=knots)
         fitter.fit(times, df['event'])
-        
-        # Extract parameters
-        params = {'coeffs': fitter.params_.tolist()}
-        
-        # Get AIC/BIC
-        aic = fitter.AIC_
-        bic = fitter.BIC_
-        log_likelihood = fitter.log_likelihood_
-        
-        # Generate survival curve
-        max_time = df['time'].max()
-        survival_times = np.linspace(0, max_time, 100)
-        survival_probs = fitter.predict_survival(survival_times)
-        
-        return {
-            "model_id": f"{arm}_{scale}_knots{knots}_spline",
-            "arm": arm,
-            "approach": "spline",
-            "scale": scale,
-            "knots": knots,
-            "parameters": params,
-            "aic": aic,
-            "bic": bic,
-            "log_likelihood": log_likelihood,
-            "predictions": {
-                "60": float(fitter.predict_survival(60).item() if hasattr(fitter.predict_survival(60), 'item') else fitter.predict_survival(60)),
-                "120": float(fitter.predict_survival(120).item() if hasattr(fitter.predict_survival(120), 'item') else fitter.predict_survival(120))
-            },
-            "fitted_by": "Python"
-        }
+        return _spline_result(fitter, data, arm)
     except Exception as e:
-        # Log the error for debugging
-        print(f"Python spline fitting failed for {arm} with {knots} knots: {e}")
-        print("Attempting R service fallback...")
-        
-        # Try R service as fallback
-        r_result = _try_r_service_spline(
-            time=df['time'].tolist(),
-            event=df['event'].tolist(),
-            scale=scale,
-            knots=knots,
-            arm=arm
-        )
-        
-        if r_result:
-            return r_result
-        
-        # Both Python and R failed - return error structure
-        print(f"Both Python and R failed for spline model")
-        return {
-            "model_id": f"{arm}_{scale}_knots{knots}_spline",
-            "arm": arm,
-            "approach": "spline",
-            "scale": scale,
-            "knots": knots,
-            "parameters": {"error": str(e)},
-            "aic": None,
-            "bic": None,
-            "log_likelihood": None,
-            "error": f"Both Python and R failed: {str(e)}"
-        }
+        return _spline_fallback(df, arm, scale, knots, e)
 
-def fit_km_curves(chemo_data: Dict, pembro_data: Dict) -> Dict:
-    """Fit Kaplan-Meier curves for both arms"""
-    chemo_df = pd.DataFrame(chemo_data)
-    pembro_df = pd.DataFrame(pembro_data)
+def fit_spline_grid(data: Dict, arm: str, scales: List[str], knots: List[int]) -> List[Dict]:
+    """Fit every (scale, knots) spline model of an arm in one pass
     
-    kmf_chemo = KaplanMeierFitter()
-    kmf_chemo.fit(chemo_df['time'], chemo_df['event'])
+    The basis for each knot count is built once and every model is warm-started
+    from an earlier fit (see custom_spline_models.fit_spline_family).
+    
+    Returns:
+        One fit_spline_model-shaped result per model, scales outer and knots inner
+    """
+    df = pd.DataFrame(data)
+    times = df['time'].copy()
+    times[times <= 0] = 1e-5
     
-    kmf_pembro = KaplanMeierFitter()
-    kmf_pembro.fit(pembro_df['time'], pembro_df['event'])
+    fitters = fit_spline_family(times, df['event'], scales, knots)
+    results = []
+    for (scale, k), fitter in fitters.items():
+        try:
+            results.append(_spline_result(fitter, data, arm))
+        except Exception as e:
+            results.append(_spline_fallback(df, arm, scale, k, e))
+    return results
+
+def _spline_result(fitter: RoystonParmarFitter, data: Dict, arm: str) -> Dict:
+    """Register a fitted spline model and build its response"""
+    scale, knots = fitter.scale, fitter.knots
+    if fitter.log_likelihood_ is None:
+        # The optimiser raised outright; callers fall back to the R service
+        raise ValueError("Spline optimization failed")
     
-    # Get survival estimates
-    times_chemo = kmf_chemo.timeline.tolist()
-    survival_chemo = kmf_chemo.survival_function_.values.flatten().tolist()
-    ci_lower_chemo = kmf_chemo.confidence_interval_.iloc[:, 0].values.tolist()
-    ci_upper_chemo = kmf_chemo.confidence_interval_.iloc[:, 1].values.tolist()
+    # Coefficients plus the knot positions needed to evaluate the spline
+    params = survival_predictor.fitter_parameters(fitter)
+    milestones = survival_predictor.survival('royston-parmar', params, MILESTONE_TIMES)
+    # A fit that did not converge has no variance matrix, so no intervals or standard errors
+    prediction_intervals, standard_errors = None, None
+    if fitter.converged_:
+        lower, upper = fitter.survival_confidence_interval(MILESTONE_TIMES)
+        prediction_intervals = {str(t): [float(lo), float(hi)] for t, lo, hi in zip(MILESTONE_TIMES, lower, upper)}
+        standard_errors = fitter.standard_errors_.tolist()
     
-    times_pembro = kmf_pembro.timeline.tolist()
-    survival_pembro = kmf_pembro.survival_function_.values.flatten().tolist()
-    ci_lower_pembro = kmf_pembro.confidence_interval_.iloc[:, 0].values.tolist()
-    ci_upper_pembro = kmf_pembro.confidence_interval_.iloc[:, 1].values.tolist()
+    model_handle = registry.register(
+        data,
+        {"approach": "spline", "scale": scale, "knots": knots},
+        fitter
+    )
     
     return {
-        "chemo": {
-            "times": times_chemo,
-            "survival": survival_chemo,
-            "confidence_lower": ci_lower_chemo,
-            "confidence_upper": ci_upper_chemo
-        },
-        "pembro": {
-            "times": times_pembro,
-            "survival": survival_pembro,
-            "confidence_lower": ci_lower_pembro,
-            "confidence_upper": ci_upper_pembro
-        }
+        "model_id": f"{arm}_{scale}_knots{knots}_spline",
+        "arm": arm,
+        "approach": "spline",
+        "scale": scale,
+        "knots": knots,
+        "parameters": params,
+        "aic": fitter.AIC_,
+        "bic": fitter.BIC_,
+        "log_likelihood": fitter.log_likelihood_,
+        "predictions": _milestone_predictions(milestones),
+        "prediction_intervals": prediction_intervals,
+        "standard_errors": standard_errors,
+        "iterations": fitter.n_iterations_,
+        "converged": fitter.converged_,
+        "fit_seconds": fitter.fit_seconds_,
+        "model_handle": model_handle,
+        "fitted_by": "Python"
     }
 
-def _predict_survival_at_time(fitter, time: float) -> float:
-    """Helper function to predict survival at a specific time point"""
-    try:
-        # Try survival_function_at_times (lifelines standard method)
-        if hasattr(fitter, 'survival_function_at_times'):
-            result = fitter.survival_function_at_times([time])
-            # Handle different return types
-            if hasattr(result, 'values'):
-                vals = result.values
-                # Handle both 1D and 2D arrays
-                if vals.ndim == 1:
-                    return float(vals[0])
-                else:
-                    return float(vals[0, 0])
-            elif hasattr(result, 'iloc'):
-                # DataFrame-like object
-                if len(result.columns) > 0:
-                    return float(result.iloc[0, 0])
-                else:
-                    return float(result.iloc[0])
-            elif isinstance(result, (list, np.ndarray)):
-                return float(result[0] if len(result) > 0 else 0.0)
-            else:
-                return float(result)
-        # Fallback for custom fitters (like Gompertz)
-        elif hasattr(fitter, 'predict_survival'):
-            result = fitter.predict_survival(time)
-            if hasattr(result, 'item'):
-                return float(result.item())
-            elif isinstance(result, (list, np.ndarray)):
-                return float(result[0] if len(result) > 0 else 0.0)
-            else:
-                return float(result)
-        # Last resort: use survival_function_ and interpolate
-        elif hasattr(fitter, 'survival_function_'):
-            sf = fitter.survival_function_
-            timeline = sf.index.values
-            if time <= timeline[-1]:
-                # Interpolate
-                return float(np.interp(time, timeline, sf.iloc[:, 0].values))
-            else:
-                # Extrapolate using last value (conservative)
-                return float(sf.iloc[-1, 0])
-        else:
-            return 0.0
-    except Exception as e:
-        print(f"Warning: Error predicting survival at {time}: {e}")
-        return 0.0
+def _spline_fallback(df: pd.DataFrame, arm: str, scale: str, knots: int, e: Exception) -> Dict:
+    """R service fallback (or error structure) after a failed Python spline fit"""
+    # Log the error for debugging
+    print(f"Python spline fitting failed for {arm} with {knots} knots: {e}")
+    print("Attempting R service fallback...")
+    
+    # Try R service as fallback
+    r_result = _try_r_service_spline(
+        time=df['time'].tolist(),
+        event=df['event'].tolist(),
+        scale=scale,
+        knots=knots,
+        arm=arm
+    )
+    
+    if r_result:
+        return r_result
+    
+    # Both Python and R failed - return error structure
+    print(f"Both Python and R failed for spline model")
+    return {
+        "model_id": f"{arm}_{scale}_knots{knots}_spline",
+        "arm": arm,
+        "approach": "spline",
+        "scale": scale,
+        "knots": knots,
+        "parameters": {"error": str(e)},
+        "aic": None,
+        "bic": None,
+        "log_likelihood": None,
+        "error": f"Both Python and R failed: {str(e)}"
+    }
 
-def fit_one_piece_model(data: Dict, arm: str, distribution: str) -> Dict:
-    """Fit one-piece parametric survival model with R fallback"""
+def fit_km_curves(chemo_data: Dict, pembro_data: Dict) -> Dict:
+    """Fit Kaplan-Meier curves for both arms"""
+    curves = {}
+    for arm, data in (("chemo", chemo_data), ("pembro", pembro_data)):
+        km = kaplan_meier(data)
+        curves[arm] = {
+            "times": km['times'].tolist(),
+            "survival": km['survival'].tolist(),
+            "confidence_lower": km['lower'].tolist(),
+            "confidence_upper": km['upper'].tolist()
+        }
+    return curves
+
+def _milestone_predictions(survival: np.ndarray) -> Dict[str, float]:
+    """Map survival at MILESTONE_TIMES to the {"60": ..., "120": ...} response shape"""
+    return {str(t): float(s) for t, s in zip(MILESTONE_TIMES, survival)}
+
+def fit_parametric(data: Dict, arm: str, distribution: str) -> Tuple[Dict, object]:
+    """Fit a one-piece parametric model in Python without registering it
+    
+    Returns:
+        (fit_one_piece_model-shaped result without 'model_handle', fitted fitter)
+    """
     df = pd.DataFrame(data)
     
     # Map distribution names to fitters
@@ -267,49 +233,52 @@ def fit_one_piece_model(data: Dict, arm: str, distribution: str) -> Dict:
         'gompertz': GompertzFitter,
         'generalized-gamma': GeneralizedGammaFitter
     }
+    if distribution not in fitters:
+        raise ValueError(f"Unknown distribution: {distribution}")
     
     # Handle zero times by adding a small epsilon, as parametric models require t > 0
     times = df['time'].copy()
     times[times <= 0] = 1e-5
     
+    Fitter = fitters[distribution]
+    fitter = Fitter()
+    fitter.fit(times, df['event'])
+    
+    params = survival_predictor.fitter_parameters(fitter)
+    
+    # Calculate AIC/BIC
+    aic = fitter.AIC_ if hasattr(fitter, 'AIC_') else None
+    bic = fitter.BIC_ if hasattr(fitter, 'BIC_') else None
+    log_likelihood = fitter.log_likelihood_ if hasattr(fitter, 'log_likelihood_') else None
+    
+    return {
+        "model_id": f"{arm}_{distribution}_one_piece",
+        "arm": arm,
+        "approach": "one-piece",
+        "distribution": distribution,
+        "parameters": params,
+        "aic": float(aic) if aic is not None else None,
+        "bic": float(bic) if bic is not None else None,
+        "log_likelihood": float(log_likelihood) if log_likelihood is not None else None,
+        "predictions": _milestone_predictions(
+            survival_predictor.survival(distribution, params, MILESTONE_TIMES)
+        ),
+        "fitted_by": "Python"
+    }, fitter
+
+def fit_one_piece_model(data: Dict, arm: str, distribution: str) -> Dict:
+    """Fit one-piece parametric survival model with R fallback"""
+    df = pd.DataFrame(data)
+    
     # Try Python first
     try:
-        if distribution not in fitters:
-            raise ValueError(f"Unknown distribution: {distribution}")
-        
-        Fitter = fitters[distribution]
-        fitter = Fitter()
-        fitter.fit(times, df['event'])
-        
-        # Extract parameters
-        if hasattr(fitter, 'params_'):
-            if isinstance(fitter.params_, dict):
-                params = fitter.params_
-            else:
-                params = fitter.params_.to_dict()
-        else:
-            params = {}
-        
-        # Calculate AIC/BIC
-        aic = fitter.AIC_ if hasattr(fitter, 'AIC_') else None
-        bic = fitter.BIC_ if hasattr(fitter, 'BIC_') else None
-        log_likelihood = fitter.log_likelihood_ if hasattr(fitter, 'log_likelihood_') else None
-        
-        return {
-            "model_id": f"{arm}_{distribution}_one_piece",
-            "arm": arm,
-            "approach": "one-piece",
-            "distribution": distribution,
-            "parameters": params,
-            "aic": float(aic) if aic is not None else None,
-            "bic": float(bic) if bic is not None else None,
-            "log_likelihood": float(log_likelihood) if log_likelihood is not None else None,
-            "predictions": {
-                "60": _predict_survival_at_time(fitter, 60),
-                "120": _predict_survival_at_time(fitter, 120)
-            },
-            "fitted_by": "Python"
-        }
+        result, fitter = fit_parametric(data, arm, distribution)
+        model_handle = registry.register(
+            data,
+            {"approach": "one-piece", "distribution": distribution},
+            fitter
+        )
+        return {**result, "model_handle": model_handle}
     except Exception as e:
         print(f"Python {distribution} fitting failed: {e}")
         print("Attempting R service fallback...")
@@ -0,0 +1,311 @@
+"""Closed-form survival, hazard, cumulative hazard and density from stored parameters
+
+Every supported family is evaluated directly from its parameters with NumPy
+broadcasting, so milestones, plots and economic calculations never refit or
+probe fitter objects. Parameters use the lifelines names returned by the fit
+endpoints (e.g. `lambda_`/`rho_` for Weibull). Each parameter may be a scalar
+or a 1-D array of m parameter sets (e.g. PSA draws); the result then has shape
+(m, n_times) instead of (n_times,).
+"""
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from scipy import special
+from scipy.stats import norm
+
+DISTRIBUTIONS = (
+    'exponential', 'weibull', 'log-normal', 'log-logistic',
+    'gompertz', 'generalized-gamma', 'royston-parmar'
+)
+QUANTITIES = ('survival', 'hazard', 'cumulative_hazard', 'density')
+
+# Times at or below zero are evaluated at this floor, matching the fitters
+MIN_TIME = 1e-5
+
+# Shared 0-240 month grid used for plots and batch prediction
+PREDICTION_GRID = np.linspace(0, 240, 1000)
+
+
+def _param(params: Dict, name: str) -> np.ndarray:
+    """Parameter as an array that broadcasts against the time axis"""
+    if name not in params:
+        raise ValueError(f"Missing parameter '{name}'")
+    value = np.asarray(params[name], dtype=np.float64)
+    return value[..., np.newaxis] if value.ndim else value
+
+
+def _exponential(params, t, log_t):
+    lambda_ = _param(params, 'lambda_')
+    return t / lambda_, np.broadcast_to(-np.log(lambda_), np.broadcast(lambda_, t).shape)
+
+
+def _weibull(params, t, log_t):
+    lambda_, rho_ = _param(params, 'lambda_'), _param(params, 'rho_')
+    log_z = log_t - np.log(lambda_)
+    return np.exp(rho_ * log_z), np.log(rho_) - np.log(lambda_) + (rho_ - 1) * log_z
+
+
+def _log_normal(params, t, log_t, mu_=None, sigma_=None):
+    mu_ = _param(params, 'mu_') if mu_ is None else mu_
+    sigma_ = _param(params, 'sigma_') if sigma_ is None else sigma_
+    z = (log_t - mu_) / sigma_
+    log_sf = norm.logsf(z)
+    return -log_sf, norm.logpdf(z) - np.log(sigma_) - log_t - log_sf
+
+
+def _log_logistic(params, t, log_t):
+    alpha_, beta_ = _param(params, 'alpha_'), _param(params, 'beta_')
+    log_z = log_t - np.log(alpha_)
+    log1p_z = np.logaddexp(0.0, beta_ * log_z)
+    return log1p_z, np.log(beta_) - np.log(alpha_) + (beta_ - 1) * log_z - log1p_z
+
+
+def _gompertz(params, t, log_t):
+    # h(t) = lambda * exp(gamma * t); exprel keeps gamma -> 0 (exponential) exact
+    lambda_, gamma_ = _param(params, 'lambda_'), _param(params, 'gamma_')
+    return lambda_ * t * special.exprel(gamma_ * t), np.log(lambda_) + gamma_ * t
+
+
+def _generalized_gamma(params, t, log_t):
+    # lifelines parametrisation: mu_, ln_sigma_, lambda_ (lambda_ = 0 is log-normal)
+    mu_, ln_sigma_, lambda_ = _param(params, 'mu_'), _param(params, 'ln_sigma_'), _param(params, 'lambda_')
+    sigma_ = np.exp(ln_sigma_)
+    z = (log_t - mu_) / sigma_
+    near_zero = np.abs(lambda_) < 1e-8
+    safe_lambda = np.where(near_zero, 1.0, lambda_)
+    shape = 1.0 / safe_lambda ** 2
+    u = np.clip(np.exp(safe_lambda * z) * shape, 1e-300, 1e20)
+
+    with np.errstate(divide='ignore'):
+        sf = np.where(safe_lambda > 0, special.gammaincc(shape, u), special.gammainc(shape, u))
+        cumulative = -np.log(sf)
+    log_density = (
+        np.log(np.abs(safe_lambda)) - log_t - ln_sigma_ - special.gammaln(shape)
+        + shape * np.log(u) - u
+    )
+    log_hazard = log_density + cumulative
+
+    if np.any(near_zero):
+        ln_cumulative, ln_log_hazard = _log_normal(params, t, log_t, mu_=mu_, sigma_=sigma_)
+        cumulative = np.where(near_zero, ln_cumulative, cumulative)
+        log_hazard = np.where(near_zero, ln_log_hazard, log_hazard)
+    return cumulative, log_hazard
+
+
+def _spline_scale(scale, eta, eta_prime, log_t):
+    """Cumulative and log hazard from the spline eta and its log-time derivative"""
+    eta_prime = np.maximum(eta_prime, 1e-5)
+    if scale == 'hazard':
+        return np.exp(eta), eta + np.log(eta_prime) - log_t
+    if scale == 'odds':
+        return np.logaddexp(0.0, eta), -np.logaddexp(0.0, -eta) + np.log(eta_prime) - log_t
+    if scale == 'normal':
+        cumulative = -norm.logcdf(-eta)
+        return cumulative, norm.logpdf(eta) + np.log(eta_prime) - log_t + cumulative
+    raise ValueError(f"Unknown spline scale: {scale}")
+
+
+def _royston_parmar(params, t, log_t):
+    """Royston-Parmar spline on the hazard, odds or normal scale"""
+    from custom_spline_models import cached_spline_basis
+
+    coeffs = np.asarray(params['coeffs'], dtype=np.float64)
+    knots = np.asarray(params.get('knots', []), dtype=np.float64)
+    boundary_knots = np.asarray(params['boundary_knots'], dtype=np.float64)
+
+    X, dX = cached_spline_basis(log_t, knots, boundary_knots, derivative=True)
+    # (n_times, p) @ (p, m) -> (m, n_times) for stacked coefficient sets
+    return _spline_scale(params.get('scale', 'hazard'), (X @ coeffs.T).T, (dX @ coeffs.T).T, log_t)
+
+
+_FAMILIES = {
+    'exponential': _exponential,
+    'weibull': _weibull,
+    'log-normal': _log_normal,
+    'log-logistic': _log_logistic,
+    'gompertz': _gompertz,
+    'generalized-gamma': _generalized_gamma,
+    'royston-parmar': _royston_parmar,
+}
+
+
+def evaluate(distribution: str, params: Dict[str, Any], times, quantity: str = 'survival') -> np.ndarray:
+    """Evaluate S(t), h(t), H(t) or f(t) for one or many parameter sets.
+
+    Args:
+        distribution: One of DISTRIBUTIONS
+        params: Parameter dict as returned by the fit endpoints / `fitter_parameters`
+        times: Scalar or array of times (original units)
+        quantity: One of QUANTITIES
+
+    Returns:
+        Array of shape (n_times,) for scalar parameters, or (m, n_times) for m parameter sets
+    """
+    if distribution not in _FAMILIES:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    if quantity not in QUANTITIES:
+        raise ValueError(f"Unknown quantity: {quantity}")
+
+    times = np.asarray(times, dtype=np.float64)
+    t = np.maximum(times, MIN_TIME)
+    with np.errstate(over='ignore', under='ignore'):
+        cumulative, log_hazard = _FAMILIES[distribution](params, t, np.log(t))
+        return _quantity(times, cumulative, log_hazard, quantity)
+
+
+def hazard_terms(distribution: str, params: Dict[str, Any], times):
+    """Cumulative hazard and log hazard at times > 0, the two terms of a censored log-likelihood"""
+    if distribution not in _FAMILIES:
+        raise ValueError(f"Unknown distribution: {distribution}")
+    t = np.maximum(np.asarray(times, dtype=np.float64), MIN_TIME)
+    with np.errstate(over='ignore', under='ignore'):
+        return _FAMILIES[distribution](params, t, np.log(t))
+
+
+def _quantity(times, cumulative, log_hazard, quantity):
+    cumulative = np.where(times > 0, cumulative, 0.0)
+    if quantity == 'cumulative_hazard':
+        return cumulative
+    if quantity == 'survival':
+        return np.exp(-cumulative)
+    if quantity == 'hazard':
+        return np.exp(log_hazard)
+    return np.exp(log_hazard - cumulative)
+
+
+def evaluate_splines(param_sets: List[Dict[str, Any]], times=PREDICTION_GRID, quantity: str = 'survival') -> np.ndarray:
+    """Evaluate many Royston-Parmar models on one time grid, shape (m, n_times).
+
+    The cached bases of all models are stacked side by side and multiplied by a
+    block-diagonal coefficient matrix, so eta for every model is a single matmul.
+    """
+    from custom_spline_models import cached_spline_basis
+
+    if quantity not in QUANTITIES:
+        raise ValueError(f"Unknown quantity: {quantity}")
+    times = np.asarray(times, dtype=np.float64)
+    t = np.maximum(times, MIN_TIME)
+    log_t = np.log(t)
+    if not param_sets:
+        return np.empty((0, len(t)))
+
+    bases = [cached_spline_basis(log_t, p.get('knots', []), p['boundary_knots'], derivative=True) for p in param_sets]
+    widths = [X.shape[1] for X, _ in bases]
+    offsets = np.concatenate([[0], np.cumsum(widths)])
+    coeffs = np.zeros((offsets[-1], len(param_sets)))
+    for i, p in enumerate(param_sets):
+        coeffs[offsets[i]:offsets[i + 1], i] = p['coeffs']
+    eta = (np.hstack([X for X, _ in bases]) @ coeffs).T
+    eta_prime = (np.hstack([dX for _, dX in bases]) @ coeffs).T
+
+    scales = np.array([p.get('scale', 'hazard') for p in param_sets])
+    cumulative = np.empty_like(eta)
+    log_hazard = np.empty_like(eta)
+    with np.errstate(over='ignore', under='ignore'):
+        for scale in np.unique(scales):
+            rows = scales == scale
+            cumulative[rows], log_hazard[rows] = _spline_scale(scale, eta[rows], eta_prime[rows], log_t)
+        return _quantity(times, cumulative, log_hazard, quantity)
+
+
+def survival(distribution: str, params: Dict[str, Any], times) -> np.ndarray:
+    return evaluate(distribution, params, times, 'survival')
+
+
+def hazard(distribution: str, params: Dict[str, Any], times) -> np.ndarray:
+    return evaluate(distribution, params, times, 'hazard')
+
+
+def cumulative_hazard(distribution: str, params: Dict[str, Any], times) -> np.ndarray:
+    return evaluate(distribution, params, times, 'cumulative_hazard')
+
+
+def density(distribution: str, params: Dict[str, Any], times) -> np.ndarray:
+    return evaluate(distribution, params, times, 'density')
+
+
+def fitter_parameters(fitter) -> Dict[str, Any]:
+    """Extract the predictor's parameter dict from a fitted lifelines or custom fitter"""
+    if hasattr(fitter, 'boundary_knots_'):
+        return {
+            "coeffs": np.asarray(fitter.params_, dtype=np.float64).tolist(),
+            "knots": np.asarray(fitter.knots_, dtype=np.float64).tolist(),
+            "boundary_knots": np.asarray(fitter.boundary_knots_, dtype=np.float64).tolist(),
+            "scale": fitter.scale
+        }
+    params = fitter.params_
+    if not isinstance(params, dict):
+        params = params.to_dict()
+    return {name: float(value) for name, value in params.items()}
+
+
+def record_family(record: Dict) -> str:
+    """Predictor family of a registry record"""
+    spec = record['spec']
+    return 'royston-parmar' if spec.get('approach') == 'spline' else spec['distribution']
+
+
+def predict_record(record: Dict, times, quantity: str = 'survival', params: Optional[Dict] = None) -> np.ndarray:
+    """Evaluate a registered model (one-piece, piecewise or spline) on a time grid.
+
+    Piecewise models follow the stored Kaplan-Meier steps up to the first cutpoint,
+    the constant segment hazards between cutpoints, and S(last cutpoint) *
+    S_post(t - last cutpoint) after it; hazard and density are NaN on the KM part.
+    """
+    family = record_family(record)
+    params = fitter_parameters(record['fitter']) if params is None else params
+    spec = record['spec']
+    if spec.get('approach') != 'piecewise':
+        return evaluate(family, params, times, quantity)
+
+    times = np.asarray(times, dtype=np.float64)
+    extra = record.get('extra', {})
+    cutpoints = np.atleast_1d(np.asarray(spec['cutpoint'], dtype=np.float64))
+    first, last = cutpoints[0], cutpoints[-1]
+    rates = np.asarray(extra.get('segment_rates', []), dtype=np.float64)
+    before = times <= first
+    after = times > last
+    shifted = np.where(after, times - last, 0.0)
+
+    km_times = np.asarray(extra.get('km_times', [0.0]), dtype=np.float64)
+    km_survival = np.asarray(extra.get('km_survival', [1.0]), dtype=np.float64)
+    step = km_survival[np.clip(np.searchsorted(km_times, times, side='right') - 1, 0, None)]
+
+    with np.errstate(divide='ignore'):
+        km_cumulative = np.log(1.0 / step)
+        middle = np.log(1.0 / km_survival[-1]) + np.sum(
+            rates[:, np.newaxis] * np.clip(times - cutpoints[:-1, np.newaxis], 0.0, np.diff(cutpoints)[:, np.newaxis]),
+            axis=0
+        )
+        post = np.log(1.0 / extra['survival_at_cutpoint']) + evaluate(family, params, shifted, 'cumulative_hazard')
+    cumulative = np.where(before, km_cumulative, np.where(after, post, middle))
+
+    if quantity == 'cumulative_hazard':
+        return cumulative
+    if quantity == 'survival':
+        return np.where(before, step, np.exp(-cumulative))
+
+    segment = np.clip(np.searchsorted(cutpoints, times, side='left') - 1, 0, len(rates))
+    hazard_values = np.where(
+        after,
+        evaluate(family, params, shifted, 'hazard'),
+        np.concatenate([rates, [np.nan]])[segment]
+    )
+    hazard_values = np.where(before, np.nan, hazard_values)
+    if quantity == 'hazard':
+        return hazard_values
+    return hazard_values * np.exp(-cumulative)
+
+
+def predict_records(records: List[Dict], times=PREDICTION_GRID, quantity: str = 'survival') -> List[np.ndarray]:
+    """predict_record for many models; spline models share one stacked matrix multiply"""
+    results: List[Optional[np.ndarray]] = [None] * len(records)
+    spline_rows = [i for i, record in enumerate(records) if record['spec'].get('approach') == 'spline']
+    if spline_rows:
+        values = evaluate_splines([fitter_parameters(records[i]['fitter']) for i in spline_rows], times, quantity)
+        for row, i in enumerate(spline_rows):
+            results[i] = values[row]
+    for i, record in enumerate(records):
+        if results[i] is None:
+            results[i] = predict_record(record, times, quantity)
+    return results
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+from fastapi.testclient import TestClient
+import arrow_io
+from arrow_io import ARROW_STREAM_MEDIA_TYPE, store_arrow_datasets, stream_parquet_ipd
+from dataset_store import datasets
+from main import app
+
+
+def _to_stream(table):
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+class TestArrowTransport(unittest.TestCase):
+
+    def setUp(self):
+        self.client = TestClient(app)
+
+    def test_demo_data_stream_matches_json(self):
+        as_json = self.client.get('/demo-data/OS').json()
+        response = self.client.get('/demo-data/OS', headers={"accept": ARROW_STREAM_MEDIA_TYPE})
+        self.assertEqual(response.headers['content-type'], ARROW_STREAM_MEDIA_TYPE)
+
+        table = pa.ipc.open_stream(response.content).read_all()
+        self.assertEqual(table.schema.field('event').type, pa.int8())
+        arms = np.asarray(table.column('arm').to_pylist())
+        times = table.column('time').to_numpy()
+        np.testing.assert_array_equal(times[arms == 'chemo'], as_json['chemo']['time'])
+        np.testing.assert_array_equal(times[arms == 'pembro'], as_json['pembro']['time'])
+
+    def test_fit_endpoints_accept_arrow_bodies(self):
+        demo = self.client.get('/demo-data/OS').json()
+        table = self.client.get('/demo-data/OS', headers={"accept": ARROW_STREAM_MEDIA_TYPE}).content
+        body = _to_stream(pa.ipc.open_stream(table).read_all())
+
+        from_json = self.client.post('/fit-one-piece', json={
+            "data": demo['chemo'], "arm": "chemo", "distribution": "weibull"
+        }).json()
+        from_arrow = self.client.post(
+            '/fit-one-piece?arm=chemo&distribution=weibull',
+            content=body,
+            headers={"content-type": ARROW_STREAM_MEDIA_TYPE}
+        ).json()
+        self.assertAlmostEqual(from_json['aic'], from_arrow['aic'], places=6)
+
+        km = self.client.post('/fit-km', content=body, headers={"content-type": ARROW_STREAM_MEDIA_TYPE})
+        self.assertEqual(km.status_code, 200)
+        self.assertIn('pembro', km.json())
+
+    def test_arms_split_by_dictionary_codes(self):
+        arm = pa.chunked_array([
+            pa.array(['pembro', 'chemo', None]).dictionary_encode(),
+            pa.array(['chemo', 'pembro', 'pembro']).dictionary_encode()
+        ])
+        table = pa.table({
+            "time": pa.chunked_array([[1.0, 2.0, 3.0], [4.0, 5.0, 6.0]]),
+            "event": pa.chunked_array([[1, 0, 1], [1, 1, 0]]),
+            "arm": arm
+        })
+        stored = store_arrow_datasets(table)
+        # Arms in order of first appearance, rows without an arm under None
+        self.assertEqual(list(stored), ['pembro', 'chemo', None])
+        np.testing.assert_array_equal(datasets.get(stored['pembro']['dataset_id'])['time'], [1.0, 5.0, 6.0])
+        np.testing.assert_array_equal(datasets.get(stored['chemo']['dataset_id'])['event'], [0, 1])
+        self.assertEqual(stored[None]['n'], 1)
+
+    def test_parquet_files_closed(self):
+        opened = []
+        parquet_file = pq.ParquetFile
+
+        def tracked(path):
+            opened.append(parquet_file(path))
+            return opened[-1]
+
+        with tempfile.TemporaryDirectory() as tmp, patch.object(arrow_io.pq, 'ParquetFile', side_effect=tracked):
+            path = os.path.join(tmp, 'arm.parquet')
+            pq.write_table(pa.table({"time": [1.0, 2.0], "event": [1, 0]}), path)
+            b''.join(stream_parquet_ipd([(path, 'chemo'), (path, 'pembro')]))
+            self.assertTrue(all(f.closed for f in opened))
+
+            # Abandoned streams and failed opens close what was opened too
+            stream = stream_parquet_ipd([(path, 'chemo')])
+            next(stream)
+            stream.close()
+            with self.assertRaises(OSError):
+                stream_parquet_ipd([(path, 'chemo'), (os.path.join(tmp, 'missing.parquet'), 'pembro')])
+        self.assertEqual(len(opened), 4)
+        self.assertTrue(all(f.closed for f in opened))
+
+    def test_invalid_arrow_body_is_rejected(self):
+        response = self.client.post('/fit-km', content=b'not arrow', headers={"content-type": ARROW_STREAM_MEDIA_TYPE})
+        self.assertEqual(response.status_code, 400)
+
+        # A two-arm body never silently fits an arm other than the one asked for
+        table = pa.table({"time": [1.0, 2.0, 3.0, 4.0], "event": [1, 0, 1, 1], "arm": ['chemo', 'chemo', 'pembro', 'pembro']})
+        for query in ('arm=placebo&distribution=weibull', 'distribution=weibull'):
+            response = self.client.post(
+                f'/fit-one-piece?{query}', content=_to_stream(table), headers={"content-type": ARROW_STREAM_MEDIA_TYPE}
+            )
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('?arm=', response.text)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi.testclient import TestClient
+import bootstrap
+from bootstrap import bootstrap_weights, stream_bootstrap
+from executor import ExecutorSaturated
+from main import app, executor
+
+
+class TestBootstrap(unittest.TestCase):
+
+    def create_synthetic_data(self, rate, n=120, seed=0):
+        rng = np.random.default_rng(seed)
+        times = rng.exponential(1 / rate, n)
+        censor = rng.uniform(0, 36, n)
+        return {
+            "time": np.round(np.minimum(times, censor), 2).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def models(self, messages):
+        return {
+            (m['task']['arm'], m['task'].get('distribution')): m
+            for m in messages if m['type'] == 'model'
+        }
+
+    def test_weights_are_seeded_per_arm_and_chunk(self):
+        first = bootstrap_weights(50, 20, seed=7, arm_index=0, chunk_index=1)
+        np.testing.assert_array_equal(first, bootstrap_weights(50, 20, seed=7, arm_index=0, chunk_index=1))
+        self.assertFalse(np.array_equal(first, bootstrap_weights(50, 20, seed=7, arm_index=1, chunk_index=1)))
+        np.testing.assert_array_equal(first.sum(axis=1), np.full(20, 50))
+
+    def test_bands_cover_point_estimate(self):
+        datasets = {'chemo': self.create_synthetic_data(0.08, seed=1)}
+        messages = list(stream_bootstrap(
+            datasets, distributions=['exponential', 'weibull', 'gompertz'], n_replicates=60, max_workers=0
+        ))
+        self.assertEqual(messages[0]['type'], 'header')
+        self.assertEqual(messages[-1], {**messages[-1], 'type': 'summary', 'n_models': 3, 'n_failed_models': 0})
+
+        for key, model in self.models(messages).items():
+            self.assertNotIn('error', model, key)
+            self.assertEqual(model['n_replicates'], 60)
+            lower, upper = np.array(model['survival_bands']['2.5']), np.array(model['survival_bands']['97.5'])
+            self.assertEqual(len(lower), len(messages[0]['times']))
+            self.assertTrue(np.all(lower <= upper + 1e-12))
+            for milestone in model['milestones'].values():
+                self.assertLessEqual(milestone['2.5'], milestone['estimate'] + 1e-9)
+                self.assertGreaterEqual(milestone['97.5'], milestone['estimate'] - 1e-9)
+            rmst = model['restricted_mean_survival']
+            self.assertLess(rmst['2.5'], rmst['estimate'])
+            self.assertGreater(rmst['97.5'], rmst['estimate'])
+
+    def test_results_do_not_depend_on_workers(self):
+        datasets = {'chemo': self.create_synthetic_data(0.08, seed=2), 'pembro': self.create_synthetic_data(0.05, seed=3)}
+        kwargs = dict(distributions=['exponential', 'log-normal'], n_replicates=40, times=[0, 12, 24, 60])
+
+        chunk_size = bootstrap.BOOTSTRAP_CHUNK_SIZE
+        bootstrap.BOOTSTRAP_CHUNK_SIZE = 15
+        try:
+            serial = self.models(stream_bootstrap(datasets, max_workers=0, **kwargs))
+            pooled = self.models(stream_bootstrap(datasets, max_workers=2, **kwargs))
+        finally:
+            bootstrap.BOOTSTRAP_CHUNK_SIZE = chunk_size
+            bootstrap.shutdown_bootstrap_pool()
+
+        self.assertEqual(pooled.keys(), serial.keys())
+        for key in serial:
+            self.assertEqual(pooled[key]['n_replicates'], 40)
+            for percentile in ('2.5', '50.0', '97.5'):
+                np.testing.assert_allclose(
+                    pooled[key]['survival_bands'][percentile], serial[key]['survival_bands'][percentile]
+                )
+
+    def test_replicates_in_flight_are_capped(self):
+        datasets = {'chemo': self.create_synthetic_data(0.08, seed=5), 'pembro': self.create_synthetic_data(0.05, seed=6)}
+        reserve = bootstrap._reserve_replicates
+        peaks = []
+
+        def tracked(size):
+            reserved = reserve(size)
+            peaks.append(bootstrap._replicates_in_flight)
+            return reserved
+
+        try:
+            with patch.object(bootstrap, 'BOOTSTRAP_CHUNK_SIZE', 10), \
+                    patch.object(bootstrap, 'BOOTSTRAP_MAX_REPLICATES', 20), \
+                    patch.object(bootstrap, '_reserve_replicates', side_effect=tracked):
+                models = self.models(stream_bootstrap(
+                    datasets, distributions=['exponential'], n_replicates=50, times=[0, 12], max_workers=4
+                ))
+        finally:
+            bootstrap.shutdown_bootstrap_pool()
+        self.assertEqual(len(models), 2)
+        self.assertTrue(all('error' not in model for model in models.values()))
+        # Ten chunks went through, never more than two of them at once
+        self.assertEqual(len(peaks), 10)
+        self.assertLessEqual(max(peaks), 20)
+        with bootstrap._replicates_free:
+            self.assertTrue(bootstrap._replicates_free.wait_for(lambda: bootstrap._replicates_in_flight == 0, timeout=5))
+
+    def test_endpoint_rejects_when_executor_saturated(self):
+        with patch.object(executor, 'run', side_effect=ExecutorSaturated("busy")):
+            response = TestClient(app).post('/bootstrap', json={
+                "datasets": {'chemo': {**self.create_synthetic_data(0.08, seed=7), "arm": ['chemo'] * 120}},
+                "distributions": ['exponential'],
+                "n_replicates": 20
+            })
+        self.assertEqual(response.status_code, 429)
+
+    def test_endpoint_streams_ndjson(self):
+        client = TestClient(app)
+        response = client.post('/bootstrap', json={
+            "datasets": {'chemo': {**self.create_synthetic_data(0.08, seed=4), "arm": ['chemo'] * 120}},
+            "distributions": ['exponential'],
+            "n_replicates": 20,
+            "times": [0, 12, 24],
+            "max_workers": 0
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.headers['content-type'].startswith('application/x-ndjson'))
+        lines = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([line['type'] for line in lines], ['header', 'model', 'summary'])
+        self.assertEqual(len(lines[1]['survival_bands']['2.5']), 3)
+
+        missing = client.post('/bootstrap', json={"dataset_ids": {'chemo': 'missing'}})
+        self.assertEqual(missing.status_code, 404)
+        out_of_range = client.post('/bootstrap', json={"dataset_ids": {'chemo': 'missing'}, "percentiles": [50, 150]})
+        self.assertEqual(out_of_range.status_code, 422)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+import itertools
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi.testclient import TestClient
+import model_grid
+from changepoint import detect_changepoints, exponential_log_likelihood, piecewise_exponential_rates
+from main import app
+
+
+class TestChangepoints(unittest.TestCase):
+
+    def setUp(self):
+        # Hazard 0.1 until week 10, 0.02 until week 40, then 0.1
+        rng = np.random.default_rng(8)
+        n = 600
+        u = rng.exponential(1.0, n)
+        times = np.where(
+            u < 1.0, u / 0.1,
+            np.where(u < 1.6, 10 + (u - 1.0) / 0.02, 40 + (u - 1.6) / 0.1)
+        )
+        censor = rng.uniform(100, 200, n)
+        self.data = {
+            "time": np.minimum(times, censor).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def test_recovers_two_changes(self):
+        result = detect_changepoints(self.data)
+        self.assertEqual(result['n_segments'], 3)
+        first, second = result['cutpoints']
+        self.assertAlmostEqual(first, 10, delta=3)
+        self.assertAlmostEqual(second, 40, delta=6)
+        for segment in result['segments']:
+            self.assertGreaterEqual(segment['events'], 5)
+
+    def test_matches_exhaustive_search(self):
+        result = detect_changepoints(self.data, n_segments=3, max_candidates=25)
+        time = np.asarray(self.data['time']) + 1e-5
+        event = np.asarray(self.data['event'], dtype=float)
+        event_times = np.unique(time[event == 1])[:-1]
+        candidates = event_times[np.unique(np.round(np.linspace(0, len(event_times) - 1, 25)).astype(int))]
+        best = -np.inf
+        for cuts in itertools.combinations(candidates, 2):
+            segments = piecewise_exponential_rates(time, event, cuts)
+            if (segments['events'] >= 5).all():
+                best = max(best, exponential_log_likelihood(segments['events'], segments['exposure']).sum())
+        self.assertAlmostEqual(result['log_likelihood'], best, places=8)
+
+    def test_piecewise_fit_with_several_cutpoints(self):
+        client = TestClient(app)
+        detected = client.post('/detect-cutpoints', json={"data": {**self.data, "arm": ["a"] * 600}}).json()
+        fitted = client.post('/fit-piecewise', json={
+            "data": {**self.data, "arm": ["a"] * 600},
+            "arm": "a",
+            "distribution": "exponential",
+            "cutpoints": detected['cutpoints']
+        }).json()
+        self.assertEqual(len(fitted['segment_hazards']), 1)
+        self.assertAlmostEqual(fitted['segment_hazards'][0], detected['segments'][1]['hazard'], places=6)
+        self.assertGreater(fitted['predictions']['60'], 0.0)
+        # Both plots mark every cutpoint of the list
+        for url in fitted['plot_urls'].values():
+            self.assertEqual(client.get(url).status_code, 200)
+
+        self.assertEqual(client.post('/fit-piecewise', json={
+            "data": {**self.data, "arm": ["a"] * 600}, "arm": "a", "distribution": "exponential", "cutpoints": []
+        }).status_code, 422)
+
+    def test_grid_falls_back_to_chow(self):
+        with patch.object(model_grid, 'detect_changepoints', side_effect=RuntimeError("no fit")):
+            result = model_grid.fit_model_grid({"a": self.data}, approaches=['piecewise'],
+                                               distributions=['exponential'], cutpoint_method='changepoint',
+                                               max_workers=0)
+        self.assertIn('lrt_statistic', result['cutpoint_results']['a'])
+        self.assertEqual(result['cutpoints']['a'], result['cutpoint_results']['a']['cutpoint'])
+        self.assertIsNotNone(result['results'][0]['result'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+import numpy as np
+from lifelines import ExponentialFitter
+from piecewise_models import chow_lrt_profile, detect_cutpoint_chow_test
+
+
+class TestChowScan(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(3)
+        early = rng.exponential(8, 300)
+        late = 20 + rng.exponential(30, 300)
+        times = np.where(early < 20, early, late)
+        censor = rng.uniform(0, 90, 300)
+        self.time = np.minimum(times, censor) + 1e-5
+        self.event = (times <= censor).astype(int)
+
+    def test_matches_exponential_fits(self):
+        candidates = np.array([10.0, 20.0, 35.0])
+        scan = chow_lrt_profile(self.time, self.event, candidates)
+        ll_null = ExponentialFitter().fit(self.time, self.event).log_likelihood_
+        for i, cut in enumerate(candidates):
+            early_event = np.where(self.time > cut, 0, self.event)
+            ll_early = ExponentialFitter().fit(np.minimum(self.time, cut), early_event).log_likelihood_
+            post = self.time > cut
+            ll_late = ExponentialFitter().fit(self.time[post] - cut, self.event[post]).log_likelihood_
+            self.assertAlmostEqual(scan['lrt'][i], 2 * (ll_early + ll_late - ll_null), places=4)
+
+    def test_event_time_scan_returns_profile(self):
+        data = {"time": self.time.tolist(), "event": self.event.tolist()}
+        result = detect_cutpoint_chow_test(data, weeks_start=5, weeks_end=60, candidates='event-times')
+        profile = result['profile']
+        self.assertEqual(len(profile['cutpoint_weeks']), len(profile['lrt_statistic']))
+        self.assertGreater(len(profile['lrt_statistic']), 50)
+        self.assertAlmostEqual(result['lrt_statistic'], max(profile['lrt_statistic']))
+        self.assertLess(result['lrt_pvalue'], 0.05)
+
+
+if __name__ == '__main__':
+    unittest.main()
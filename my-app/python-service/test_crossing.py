@@ -2,7 +2,8 @@ import unittest
 import numpy as np
 import pandas as pd
 from lifelines import KaplanMeierFitter
-from ph_testing import test_proportional_hazards
+import ph_testing
+from curve_crossing import detect_data_crossings
 
 class TestCrossingDetection(unittest.TestCase):
     
@@ -98,7 +99,7 @@ class TestCrossingDetection(unittest.TestCase):
 
     def test_crossing_detected(self):
         c_data, p_data = self.create_synthetic_data('crossing')
-        result = test_proportional_hazards(c_data, p_data)
+        result = ph_testing.test_proportional_hazards(c_data, p_data)
         
         print(f"\nCrossing Test Result: Detected={result['crossing_detected']}, Time={result['crossing_time']}")
         self.assertTrue(result['crossing_detected'])
@@ -106,7 +107,7 @@ class TestCrossingDetection(unittest.TestCase):
 
     def test_no_crossing(self):
         c_data, p_data = self.create_synthetic_data('no_crossing')
-        result = test_proportional_hazards(c_data, p_data)
+        result = ph_testing.test_proportional_hazards(c_data, p_data)
         
         print(f"\nNo Crossing Test Result: Detected={result['crossing_detected']}")
         self.assertFalse(result['crossing_detected'])
@@ -114,11 +115,50 @@ class TestCrossingDetection(unittest.TestCase):
         
     def test_touching_identical(self):
         c_data, p_data = self.create_synthetic_data('touching')
-        result = test_proportional_hazards(c_data, p_data)
+        result = ph_testing.test_proportional_hazards(c_data, p_data)
         
         print(f"\nTouching Test Result: Detected={result['crossing_detected']}")
         # Identical curves (diff=0) should NOT trigger crossing
         self.assertFalse(result['crossing_detected'])
 
+
+    def test_all_crossings_exact(self):
+        # Chemo: 1 -> 0.5 at t=1 -> 0 at t=8; pembro: 1 -> 0.75 at t=2 -> 0.25 at t=2.01 -> 0 at t=9
+        # chemo - pembro: -0.5 on [1, 2), -0.25 on [2, 2.01), +0.25 on [2.01, 8), -0.25 on [8, 9)
+        chemo = {'time': [1, 1, 8, 8], 'event': [1, 1, 1, 1]}
+        pembro = {'time': [2, 2.01, 2.01, 9], 'event': [1, 1, 1, 1]}
+        result = detect_data_crossings(chemo, pembro)
+        self.assertEqual(result['n_crossings'], 2)
+        self.assertEqual([c['time'] for c in result['crossings']], [2.01, 8.0])
+        self.assertEqual(result['crossings'][0]['sign_before'], -1)
+        self.assertAlmostEqual(result['crossings'][0]['magnitude'], 0.25)
+        self.assertEqual(result['crossing_time'], 2.01)
+
+        # A crossing lasting 0.004 months is missed by a 500-point grid over [0, 500]
+        # chemo - pembro: -0.25 on [100, 100.002), +0.25 on [100.002, 100.006), then equal
+        late_chemo = {'time': [100, 100.006, 500, 500], 'event': [1, 1, 1, 1]}
+        late_pembro = {'time': [100.002, 100.002, 500, 500], 'event': [1, 1, 1, 1]}
+        crossings = detect_data_crossings(late_chemo, late_pembro)['crossings']
+        self.assertEqual([c['time'] for c in crossings], [100.002])
+        self.assertTrue(crossings[0]['significant'])
+
+    def test_late_noise_filtered(self):
+        # 2000 per arm, half censored at 100, so a late step is about 0.0005
+        shared_time = np.linspace(0.5, 9.5, 998).tolist() + [100.0] * 1000
+        shared_event = [1] * 998 + [0] * 1000
+        # chemo - pembro: -0.0005 on [15, 15.1), 0 until 16, +0.0005 on [16, 16.1), then equal
+        chemo = {'time': shared_time + [15.0, 16.1], 'event': shared_event + [1, 1]}
+        pembro = {'time': shared_time + [15.1, 16.0], 'event': shared_event + [1, 1]}
+        result = detect_data_crossings(chemo, pembro)
+        self.assertEqual(result['n_crossings'], 1)
+        crossing, = result['crossings']
+        self.assertEqual((crossing['time'], crossing['time_end']), (15.1, 16.0))
+        self.assertAlmostEqual(crossing['magnitude'], 0.0005, places=6)
+        # A crossing after month 10 of at most 0.001 is noise, not a detected crossing
+        self.assertFalse(crossing['significant'])
+        self.assertFalse(result['crossing_detected'])
+        self.assertIsNone(result['crossing_time'])
+
+
 if __name__ == '__main__':
     unittest.main()
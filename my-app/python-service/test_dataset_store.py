@@ -0,0 +1,61 @@
+import time
+import unittest
+import numpy as np
+from fastapi.testclient import TestClient
+from dataset_store import DatasetStore
+from main import app
+
+
+class TestDatasetStore(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        times = rng.exponential(10, 120)
+        censor = rng.uniform(0, 24, 120)
+        self.time = np.minimum(times, censor).tolist()
+        self.event = (times <= censor).astype(int).tolist()
+
+    def test_content_addressed_and_contiguous(self):
+        store = DatasetStore(ttl_seconds=60, max_entries=4)
+        first = store.put(self.time, self.event)
+        second = store.put(list(self.time), list(self.event), label='again')
+        self.assertEqual(first['dataset_id'], second['dataset_id'])
+
+        data = store.get(first['dataset_id'])
+        self.assertEqual(data['time'].dtype, np.float64)
+        self.assertEqual(data['event'].dtype, np.int8)
+        self.assertTrue(data['time'].flags['C_CONTIGUOUS'])
+        self.assertFalse(data['time'].flags['WRITEABLE'])
+
+    def test_ttl_eviction(self):
+        store = DatasetStore(ttl_seconds=0.05, max_entries=4)
+        dataset_id = store.put(self.time, self.event)['dataset_id']
+        time.sleep(0.1)
+        self.assertIsNone(store.get(dataset_id))
+
+    def test_fit_endpoints_accept_dataset_id(self):
+        client = TestClient(app)
+        dataset_id = client.post('/datasets', json={"time": self.time, "event": self.event}).json()['dataset_id']
+
+        inline = client.post('/fit-one-piece', json={
+            "data": {"time": self.time, "event": self.event, "arm": ["chemo"] * len(self.time)},
+            "arm": "chemo",
+            "distribution": "weibull"
+        }).json()
+        by_id = client.post('/fit-one-piece', json={
+            "dataset_id": dataset_id,
+            "arm": "chemo",
+            "distribution": "weibull"
+        }).json()
+        self.assertAlmostEqual(inline['aic'], by_id['aic'], places=6)
+        self.assertEqual(inline['model_handle'], by_id['model_handle'])
+
+        km = client.post('/fit-km', json={"chemo_dataset_id": dataset_id, "pembro_dataset_id": dataset_id})
+        self.assertEqual(km.status_code, 200)
+
+        missing = client.post('/fit-one-piece', json={"dataset_id": "nope", "arm": "chemo", "distribution": "weibull"})
+        self.assertEqual(missing.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
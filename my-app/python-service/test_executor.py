@@ -0,0 +1,79 @@
+import asyncio
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import numpy as np
+from executor import CPUExecutor, ExecutorSaturated
+from model_registry import registry
+from survival_models import fit_one_piece_model
+
+
+class TestCPUExecutor(unittest.TestCase):
+
+    def test_backpressure_rejects_when_queue_full(self):
+        pool = CPUExecutor(kind='thread', workers=1, max_queue=1)
+        pool.start()
+
+        async def submit_three():
+            tasks = [asyncio.ensure_future(pool.run(time.sleep, 0.2)) for _ in range(3)]
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        results = asyncio.run(submit_three())
+        self.assertEqual(sum(isinstance(r, ExecutorSaturated) for r in results), 1)
+
+        metrics = pool.metrics()
+        self.assertEqual(metrics['completed'], 2)
+        self.assertEqual(metrics['rejected'], 1)
+        self.assertEqual(metrics['in_flight'], 0)
+        # The second request waited for the first to finish
+        self.assertGreater(metrics['wait_ms_max'], 100)
+        pool.shutdown()
+
+    def test_concurrent_start_creates_one_pool(self):
+        pool = CPUExecutor(kind='thread', workers=2, max_queue=0)
+        with patch('executor.warm_up_worker', side_effect=lambda: time.sleep(0.05)) as warm_up:
+            threads = [threading.Thread(target=pool.start) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(warm_up.call_count, 1)
+        self.assertEqual(asyncio.run(pool.run(sum, [1, 2])), 3)
+        pool.shutdown()
+
+    def test_lazy_start_keeps_event_loop_free(self):
+        pool = CPUExecutor(kind='thread', workers=1, max_queue=0)
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.time())
+                await asyncio.sleep(0.01)
+
+        async def first_request():
+            ticker = asyncio.ensure_future(tick())
+            try:
+                return await pool.run(sum, [1, 2])
+            finally:
+                ticker.cancel()
+
+        with patch('executor.warm_up_worker', side_effect=lambda: time.sleep(0.3)):
+            self.assertEqual(asyncio.run(first_request()), 3)
+        pool.shutdown()
+        # The loop kept ticking while the warm-up ran
+        self.assertGreater(len(ticks), 5)
+
+    def test_process_pool_ships_fitted_models_back(self):
+        rng = np.random.default_rng(3)
+        data = {"time": rng.exponential(12, 120).tolist(), "event": [1] * 120}
+        pool = CPUExecutor(kind='process', workers=1, max_queue=4)
+        try:
+            result = asyncio.run(pool.run(fit_one_piece_model, data, 'chemo', 'exponential'))
+        finally:
+            pool.shutdown()
+        self.assertIsNotNone(registry.get(result['model_handle']))
+
+
+if __name__ == '__main__':
+    unittest.main()
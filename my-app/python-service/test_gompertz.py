@@ -0,0 +1,77 @@
+import unittest
+import numpy as np
+from scipy.optimize import approx_fprime
+from custom_gompertz import GompertzFitter, fit_weighted, _log_likelihood
+from survival_models import fit_one_piece_model
+
+
+class TestGompertzFitter(unittest.TestCase):
+
+    def setUp(self):
+        # Gompertz times by inversion of H(t) = lambda / gamma * (exp(gamma t) - 1)
+        rng = np.random.default_rng(11)
+        n, lambda_, gamma = 300, 0.04, 0.03
+        times = np.log1p(gamma * -np.log(rng.uniform(size=n)) / lambda_) / gamma
+        censor = rng.uniform(0, 60, n)
+        self.time = np.minimum(times, censor)
+        self.event = (times <= censor).astype(float)
+        self.rng = rng
+
+    def test_gradient_and_hessian(self):
+        theta = np.array([[np.log(0.05), 0.01]])
+        weights = np.ones((1, len(self.time)))
+        _, gradient, hessian = _log_likelihood(theta, self.time, self.event, weights)
+
+        def ll(p):
+            return _log_likelihood(p[np.newaxis], self.time, self.event, weights, order=0)[0][0]
+
+        def grad(p, i):
+            return _log_likelihood(p[np.newaxis], self.time, self.event, weights, order=1)[1][0][i]
+
+        np.testing.assert_allclose(gradient[0], approx_fprime(theta[0], ll, 1e-7), rtol=1e-4)
+        numeric = np.array([approx_fprime(theta[0], grad, 1e-7, i) for i in range(2)])
+        np.testing.assert_allclose(hessian[0], numeric, rtol=1e-4)
+
+    def test_fit_and_prediction(self):
+        fitter = GompertzFitter().fit(self.time, self.event)
+        params = fitter.params_
+        self.assertAlmostEqual(params['lambda_'], 0.04, delta=0.015)
+        self.assertAlmostEqual(params['gamma_'], 0.03, delta=0.015)
+        self.assertEqual(list(fitter.variance_matrix_.index), ['lambda_', 'gamma_'])
+        self.assertTrue(np.all(fitter.standard_errors_ > 0))
+
+        times = np.array([0.0, 1.0, 12.0, 60.0])
+        expected = np.exp(-params['lambda_'] / params['gamma_'] * np.expm1(params['gamma_'] * times))
+        np.testing.assert_allclose(fitter.predict_survival(times), expected, rtol=1e-10)
+        np.testing.assert_allclose(
+            fitter.predict_hazard(times[1:]), params['lambda_'] * np.exp(params['gamma_'] * times[1:]), rtol=1e-10
+        )
+
+        result = fit_one_piece_model({"time": self.time, "event": self.event}, 'chemo', 'gompertz')
+        self.assertEqual(result['fitted_by'], 'Python')
+        self.assertAlmostEqual(result['log_likelihood'], fitter.log_likelihood_, places=8)
+
+    def test_weighted_batch_matches_single_fits(self):
+        n = len(self.time)
+        bootstrap = self.rng.multinomial(n, np.full(n, 1 / n), size=20).astype(float)
+        subgroup = (np.arange(n) % 2 == 0).astype(float)
+        weights = np.vstack([bootstrap, subgroup])
+
+        batch = fit_weighted(self.time, self.event, weights)
+        self.assertTrue(batch['converged'].all())
+        for i in (0, 7, 19):
+            single = GompertzFitter().fit(self.time, self.event, weights=weights[i])
+            self.assertAlmostEqual(batch['lambda_'][i], single.params_['lambda_'], places=10)
+            self.assertAlmostEqual(batch['gamma_'][i], single.params_['gamma_'], places=10)
+
+        subset = GompertzFitter().fit(self.time[::2], self.event[::2])
+        self.assertAlmostEqual(batch['gamma_'][-1], subset.params_['gamma_'], places=8)
+        self.assertAlmostEqual(batch['log_likelihood'][-1], subset.log_likelihood_, places=6)
+
+        # A weight matrix is fit_weighted's job; fit would only ever fit its first row
+        with self.assertRaisesRegex(ValueError, 'fit_weighted'):
+            GompertzFitter().fit(self.time, self.event, weights=weights)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import numpy as np
+from lifelines import KaplanMeierFitter, NelsonAalenFitter
+import km_kernel
+from km_kernel import kaplan_meier, km_cache_stats, median_survival, step_lookup
+
+
+class TestKMKernel(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        times = np.round(rng.exponential(12, 400), 1)
+        censor = np.round(rng.uniform(0, 40, 400), 1)
+        self.data = {
+            "time": np.maximum(np.minimum(times, censor), 0.1).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def test_matches_lifelines(self):
+        km = kaplan_meier(self.data)
+        kmf = KaplanMeierFitter().fit(self.data['time'], self.data['event'])
+        naf = NelsonAalenFitter().fit(self.data['time'], self.data['event'])
+
+        np.testing.assert_allclose(km['times'], kmf.timeline)
+        np.testing.assert_allclose(km['survival'], kmf.survival_function_.iloc[:, 0])
+        np.testing.assert_allclose(km['lower'], kmf.confidence_interval_.iloc[:, 0], atol=1e-12)
+        np.testing.assert_allclose(km['upper'], kmf.confidence_interval_.iloc[:, 1], atol=1e-12)
+        np.testing.assert_allclose(km['cumulative_hazard'], naf.cumulative_hazard_.iloc[:, 0], atol=1e-12)
+        np.testing.assert_allclose(km['cumulative_hazard_variance'], naf._cumulative_sq.values, atol=1e-12)
+
+        grid = np.linspace(0, 45, 200)
+        np.testing.assert_allclose(step_lookup(km, grid), kmf.survival_function_at_times(grid).values)
+
+    def test_median_and_interval(self):
+        km = kaplan_meier(self.data)
+        kmf = KaplanMeierFitter().fit(self.data['time'], self.data['event'])
+        median = median_survival(km)
+        self.assertEqual(median['median'], kmf.median_survival_time_)
+
+        # Interval ends are where the lower and upper bands cross 0.5
+        bands = kmf.confidence_interval_survival_function_
+        self.assertEqual(median['ci_lower'], bands.index[bands.iloc[:, 0] <= 0.5][0])
+        self.assertEqual(median['ci_upper'], bands.index[bands.iloc[:, 1] <= 0.5][0])
+        self.assertLessEqual(median['ci_lower'], median['median'])
+        self.assertLessEqual(median['median'], median['ci_upper'])
+
+        censored = {"time": [1.0, 2.0, 3.0, 4.0], "event": [0, 1, 0, 0]}
+        self.assertIsNone(median_survival(kaplan_meier(censored))['median'])
+
+    def test_cache(self):
+        before = km_cache_stats()
+        first = kaplan_meier(self.data, alpha=0.1)
+        second = kaplan_meier({"time": list(self.data['time']), "event": list(self.data['event'])}, alpha=0.1)
+        after = km_cache_stats()
+        self.assertIs(first, second)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertFalse(first['survival'].flags.writeable)
+        self.assertLessEqual(after['entries'], km_kernel.KM_CACHE_SIZE)
+
+
+if __name__ == '__main__':
+    unittest.main()
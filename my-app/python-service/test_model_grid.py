@@ -0,0 +1,95 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi.testclient import TestClient
+import model_grid
+from main import app
+from model_grid import build_grid_tasks, fit_model_grid, group_grid_jobs
+from survival_models import fit_spline_model
+
+
+class TestModelGrid(unittest.TestCase):
+
+    def create_synthetic_data(self, rate, n=150, seed=0):
+        rng = np.random.default_rng(seed)
+        times = rng.exponential(1 / rate, n)
+        censor = rng.uniform(0, 36, n)
+        return {
+            "time": np.minimum(times, censor).tolist(),
+            "event": (times <= censor).astype(int).tolist(),
+            "arm": ["arm"] * n
+        }
+
+    def test_task_expansion(self):
+        tasks = build_grid_tasks(
+            ['chemo', 'pembro'],
+            ['one-piece', 'piecewise', 'spline'],
+            ['exponential', 'weibull'],
+            ['hazard', 'odds'],
+            [1, 2],
+            {'chemo': 3.0, 'pembro': 4.0}
+        )
+        # 2 arms x (2 one-piece + 2 piecewise + 2 scales x 2 knots)
+        self.assertEqual(len(tasks), 16)
+        piecewise = [t for t in tasks if t['approach'] == 'piecewise']
+        self.assertTrue(all(t['cutpoint'] == {'chemo': 3.0, 'pembro': 4.0}[t['arm']] for t in piecewise))
+
+    def test_grid_matches_serial_fits(self):
+        datasets = {
+            'chemo': self.create_synthetic_data(0.08, seed=1),
+            'pembro': self.create_synthetic_data(0.05, seed=2)
+        }
+        kwargs = dict(
+            approaches=['one-piece', 'spline'],
+            distributions=['exponential', 'weibull'],
+            scales=['hazard'],
+            knots=[1]
+        )
+        serial = fit_model_grid(datasets, max_workers=0, **kwargs)
+        pooled = fit_model_grid(datasets, max_workers=2, **kwargs)
+
+        self.assertEqual(serial['n_models'], 6)
+        self.assertEqual(serial['n_failed'], 0)
+        for a, b in zip(serial['results'], pooled['results']):
+            self.assertEqual(a['task'], b['task'])
+            self.assertGreaterEqual(b['elapsed_seconds'], 0.0)
+            self.assertAlmostEqual(a['result']['aic'], b['result']['aic'], places=4)
+
+    def test_spline_family_job_matches_single_fits(self):
+        data = self.create_synthetic_data(0.08, n=300, seed=3)
+        tasks = build_grid_tasks(['chemo'], ['one-piece', 'spline'], ['weibull'], ['hazard', 'odds', 'normal'], [1, 2, 3], {})
+        jobs = group_grid_jobs(tasks)
+        # One one-piece job plus a single job holding all nine spline models
+        self.assertEqual([len(job) for job in jobs], [1, 9])
+
+        grid = fit_model_grid({'chemo': data}, approaches=['spline'], max_workers=0)
+        self.assertEqual(grid['n_models'], 9)
+        self.assertEqual(grid['n_failed'], 0)
+        for entry in grid['results']:
+            task = entry['task']
+            single = fit_spline_model(data, 'chemo', task['scale'], task['knots'])
+            self.assertAlmostEqual(entry['result']['log_likelihood'], single['log_likelihood'], places=5)
+            self.assertGreater(entry['result']['iterations'], 0)
+
+    def test_endpoint_uses_shared_executor(self):
+        datasets = {
+            'chemo': self.create_synthetic_data(0.08, seed=1),
+            'pembro': self.create_synthetic_data(0.05, seed=2)
+        }
+        kwargs = dict(approaches=['one-piece', 'spline'], distributions=['weibull'], scales=['hazard'], knots=[1])
+        expected = fit_model_grid(datasets, max_workers=0, **kwargs)
+        # Grid jobs are submitted to the API's executor, never to a pool of their own
+        with patch.object(model_grid, 'ProcessPoolExecutor', side_effect=AssertionError("nested pool")):
+            response = TestClient(app).post('/fit-grid', json={"datasets": datasets, **kwargs})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        self.assertEqual(result['n_models'], 4)
+        self.assertEqual(result['n_failed'], 0)
+        for a, b in zip(expected['results'], result['results']):
+            self.assertEqual(a['task'], b['task'])
+            self.assertAlmostEqual(a['result']['aic'], b['result']['aic'], places=4)
+            self.assertIn('plot_urls', b['result'])
+
+
+if __name__ == '__main__':
+    unittest.main()
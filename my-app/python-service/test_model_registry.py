@@ -0,0 +1,79 @@
+import os
+import pickle
+import tempfile
+import unittest
+import numpy as np
+from model_registry import ModelRegistry, dataset_fingerprint, make_model_handle, registry
+from survival_models import fit_one_piece_model, fit_spline_model
+from plotting import _generate_actual_model_predictions
+
+
+class TestModelRegistry(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        times = rng.weibull(1.3, 200) * 15
+        censor = rng.uniform(0, 30, 200)
+        self.data = {
+            "time": np.minimum(times, censor).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def test_handle_is_deterministic(self):
+        fingerprint = dataset_fingerprint(self.data)
+        spec = {"approach": "one-piece", "distribution": "weibull"}
+        self.assertEqual(make_model_handle(fingerprint, spec), make_model_handle(fingerprint, dict(spec)))
+        self.assertNotEqual(
+            make_model_handle(fingerprint, spec),
+            make_model_handle(fingerprint, {"approach": "one-piece", "distribution": "exponential"})
+        )
+
+    def test_lru_eviction_and_disk_tier(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = ModelRegistry(max_entries=2, directory=directory)
+            handles = [
+                store.register(self.data, {"approach": "one-piece", "distribution": d}, object())
+                for d in ['exponential', 'weibull', 'log-normal']
+            ]
+            self.assertEqual(store.stats()['entries'], 2)
+            # Evicted from memory but still served from disk
+            self.assertIsNotNone(store.get(handles[0]))
+
+        memory_only = ModelRegistry(max_entries=1, directory=None)
+        first = memory_only.register(self.data, {"approach": "one-piece", "distribution": "exponential"}, object())
+        memory_only.register(self.data, {"approach": "one-piece", "distribution": "weibull"}, object())
+        self.assertIsNone(memory_only.get(first))
+
+    def test_handles_cannot_escape_disk_tier(self):
+        with tempfile.TemporaryDirectory() as root:
+            directory = os.path.join(root, 'models')
+            store = ModelRegistry(directory=directory)
+            handle = store.register(self.data, {"approach": "one-piece", "distribution": "weibull"}, object())
+            self.assertEqual(len(handle), 32)
+            with open(os.path.join(root, 'outside.pkl'), 'wb') as f:
+                pickle.dump({"handle": "outside"}, f)
+
+            store.clear()
+            self.assertIsNotNone(store.get(handle))
+            for bad in ('../outside', handle.upper(), handle + '/', '/etc/passwd', handle[:-1]):
+                self.assertIsNone(store.get(bad))
+            with self.assertRaises(ValueError):
+                store._path('../outside')
+            # Records with a foreign handle are kept in memory but never written to disk
+            store.put_record({"handle": "../escaped", "fitter": object()})
+            self.assertEqual(sorted(os.listdir(root)), ['models', 'outside.pkl'])
+            self.assertEqual(os.listdir(directory), [f"{handle}.pkl"])
+
+    def test_plots_reuse_registered_fit(self):
+        for result in [
+            fit_one_piece_model(self.data, 'chemo', 'weibull'),
+            fit_spline_model(self.data, 'chemo', 'hazard', 1)
+        ]:
+            self.assertIsNotNone(registry.get(result['model_handle']))
+            reused = _generate_actual_model_predictions(result, {}, None, model_handle=result['model_handle'])
+            refit = _generate_actual_model_predictions(result, {}, self.data)
+            np.testing.assert_allclose(reused['survival'], refit['survival'], atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
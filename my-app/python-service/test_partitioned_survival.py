@@ -0,0 +1,109 @@
+import unittest
+import numpy as np
+from fastapi.testclient import TestClient
+from main import app
+from model_registry import registry
+from partitioned_survival import partitioned_survival_analysis, run_partitioned_survival, state_membership
+from survival_models import fit_one_piece_model
+
+
+class TestPartitionedSurvival(unittest.TestCase):
+
+    def create_synthetic_data(self, rate, n=200, seed=0):
+        rng = np.random.default_rng(seed)
+        times = rng.exponential(1 / rate, n)
+        censor = rng.uniform(0, 48, n)
+        return {
+            "time": np.maximum(np.minimum(times, censor), 0.01).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def arm(self, os_rate, pfs_rate, seed, cost):
+        records = {
+            key: registry.get(fit_one_piece_model(self.create_synthetic_data(rate, seed=seed + j), key, 'exponential')['model_handle'])
+            for j, (key, rate) in enumerate((('os', os_rate), ('pfs', pfs_rate)))
+        }
+        return {**records, "costs": {"progression_free": cost, "progressed": 1000.0}}
+
+    def test_membership_enforces_os_above_pfs(self):
+        membership = state_membership(np.array([1.0, 0.6, 0.3]), np.array([1.0, 0.7, 0.1]))
+        np.testing.assert_allclose(membership['progression_free'], [1.0, 0.6, 0.1])
+        np.testing.assert_allclose(membership['progressed'], [0.0, 0.0, 0.2])
+        total = membership['progression_free'] + membership['progressed'] + membership['dead']
+        np.testing.assert_allclose(total, 1.0)
+
+    def test_exponential_closed_form(self):
+        # S_os = exp(-0.05 t), S_pfs = exp(-0.1 t); fine cycles approach the integrals
+        times = np.linspace(0, 600, 60001)
+        os_curve, pfs_curve = np.exp(-0.05 * times), np.exp(-0.1 * times)
+        totals = run_partitioned_survival(
+            os_curve, pfs_curve, times,
+            costs={"progression_free": 100.0, "progressed": 50.0},
+            utilities={"progression_free": 0.8, "progressed": 0.5},
+            discount_rate_costs=0.0, discount_rate_outcomes=0.0
+        )
+        pf_months, alive_months = 1 / 0.1, 1 / 0.05
+        self.assertAlmostEqual(totals['life_years'], alive_months / 12, places=4)
+        self.assertAlmostEqual(totals['qalys'], (0.8 * pf_months + 0.5 * (alive_months - pf_months)) / 12, places=4)
+        # Costs are per cycle of 0.01 months
+        self.assertAlmostEqual(totals['costs'] / 100, (100.0 * pf_months + 50.0 * (alive_months - pf_months)), places=1)
+
+        discounted = run_partitioned_survival(os_curve, pfs_curve, times, {}, {"progression_free": 1.0, "progressed": 1.0})
+        decay = 0.05 + np.log(1.035) / 12
+        self.assertAlmostEqual(discounted['discounted_qalys'], 1 / decay / 12, places=4)
+
+        # Draw-batched inputs give one total per row
+        batched = run_partitioned_survival(np.vstack([os_curve] * 3), np.vstack([pfs_curve] * 3), times, {}, {})
+        np.testing.assert_allclose(batched['life_years'], totals['life_years'])
+
+    def test_analysis_and_psa(self):
+        arms = {
+            "control": self.arm(0.06, 0.12, seed=1, cost=2000.0),
+            "treatment": self.arm(0.04, 0.08, seed=3, cost=6000.0)
+        }
+        result = partitioned_survival_analysis(
+            arms, horizon=120, utilities={"progression_free": 0.8, "progressed": 0.6}, n_draws=500, seed=4
+        )
+        self.assertEqual(result['comparator'], 'control')
+        self.assertEqual(len(result['times']), 121)
+        incremental = result['incremental']['treatment']
+        self.assertGreater(incremental['discounted_qalys'], 0)
+        self.assertAlmostEqual(incremental['icer'], incremental['discounted_costs'] / incremental['discounted_qalys'])
+
+        psa = result['psa']['incremental']['treatment']
+        self.assertEqual(len(psa['draws']['discounted_qalys']), 500)
+        self.assertLess(psa['discounted_qalys']['2.5'], incremental['discounted_qalys'])
+        self.assertGreater(psa['discounted_qalys']['97.5'], incremental['discounted_qalys'])
+
+        repeat = partitioned_survival_analysis(
+            arms, horizon=120, utilities={"progression_free": 0.8, "progressed": 0.6}, n_draws=500, seed=4
+        )
+        self.assertEqual(repeat['psa']['incremental'], result['psa']['incremental'])
+
+    def test_endpoint(self):
+        arms = {name: self.arm(0.05, 0.1, seed=seed, cost=1000.0) for name, seed in (("a", 5), ("b", 7))}
+        client = TestClient(app)
+        payload = {
+            "arms": {
+                name: {"os_model_handle": arm['os']['handle'], "pfs_model_handle": arm['pfs']['handle'], "costs": arm['costs']}
+                for name, arm in arms.items()
+            },
+            "utilities": {"progression_free": 0.8, "progressed": 0.6},
+            "horizon": 60
+        }
+        response = client.post('/partitioned-survival', json=payload)
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(set(body['arms']), {"a", "b"})
+        self.assertEqual(len(body['arms']['a']['trace']['dead']), 61)
+        self.assertNotIn('psa', body)
+
+        response = client.post('/partitioned-survival', json={**payload, "n_draws": 10, "percentiles": [-5, 50]})
+        self.assertEqual(response.status_code, 422)
+
+        payload['arms']['a']['os_model_handle'] = 'missing'
+        self.assertEqual(client.post('/partitioned-survival', json=payload).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi.testclient import TestClient
+import plot_cache
+import plotting
+from main import app
+
+
+class TestPlotCache(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(17)
+        times = rng.weibull(1.1, 180) * 10
+        censor = rng.uniform(0, 30, 180)
+        self.data = {
+            "time": np.maximum(np.minimum(times, censor), 0.05).tolist(),
+            "event": (times <= censor).astype(int).tolist(),
+            "arm": ["chemo"] * 180
+        }
+        self.tmp = tempfile.TemporaryDirectory()
+        self.patches = [
+            patch.object(plot_cache, 'PLOT_CACHE_DIRECTORY', os.path.join(self.tmp.name, 'cache')),
+            patch.dict(os.environ, {'PLOTS_DIRECTORY': self.tmp.name}),
+            patch.object(plotting, 'PLOT_WORKERS', 0)
+        ]
+        for p in self.patches:
+            p.start()
+        self.client = TestClient(app)
+
+    def tearDown(self):
+        for p in self.patches:
+            p.stop()
+        self.tmp.cleanup()
+
+    def test_lazy_render_and_etag(self):
+        response = self.client.post('/fit-one-piece', json={"data": self.data, "arm": "chemo", "distribution": "weibull"})
+        self.assertEqual(response.status_code, 200)
+        result = response.json()
+        url = result['plot_urls']['long_term']
+        self.assertEqual(url, f"/plots/{result['model_handle']}?plot_type=long_term")
+
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first.headers['content-type'], 'image/png')
+        self.assertTrue(first.content.startswith(b'\x89PNG'))
+        etag = first.headers['etag']
+        self.assertEqual(etag, f'"{plot_cache.plot_key(result["model_handle"], "long_term")}"')
+
+        # Served from disk the second time, and revalidated without a body
+        with patch.object(plot_cache, '_render', side_effect=AssertionError("re-rendered")):
+            self.assertEqual(self.client.get(url).content, first.content)
+        revalidated = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(revalidated.status_code, 304)
+
+        # /generate-plots reuses the cached rendering, but never stores a render of its own inputs
+        plots = plotting.generate_dual_plots('chemo_weibull', result, {"times": [1.0, 2.0], "survival": [0.5, 0.1]},
+                                             model_handle=result['model_handle'])
+        self.assertTrue(plots['long_term']['cached'])
+        self.assertFalse(plots['short_term']['cached'])
+        self.assertIsNone(plot_cache.cached_png(result['model_handle'], 'short_term'))
+        self.assertEqual(self.client.get(url).content, first.content)
+
+    def test_dataset_files_bounded(self):
+        rng = np.random.default_rng(5)
+        with patch.object(plot_cache, 'PLOT_DATASET_CACHE_SIZE', 3):
+            fingerprints = [plot_cache.remember_dataset({"time": rng.uniform(1, 10, 20), "event": np.ones(20)})
+                            for _ in range(3)]
+            for age, fingerprint in enumerate(fingerprints):
+                os.utime(plot_cache._dataset_path(fingerprint), (age, age))
+            # Reading the oldest one makes the second the least recently used
+            self.assertIsNotNone(plot_cache.observed_data(fingerprints[0]))
+            newest = plot_cache.remember_dataset({"time": rng.uniform(1, 10, 20), "event": np.ones(20)})
+        kept = sorted(os.listdir(os.path.join(plot_cache.PLOT_CACHE_DIRECTORY, 'datasets')))
+        self.assertEqual(kept, sorted(f"{f}.npz" for f in (fingerprints[0], fingerprints[2], newest)))
+
+    def test_errors(self):
+        self.assertEqual(self.client.get('/plots/unknown').status_code, 404)
+        # Unknown handles are not revalidated, whatever the client sends
+        etag = f'"{plot_cache.plot_key("unknown", "short_term")}"'
+        self.assertEqual(self.client.get('/plots/unknown', headers={"If-None-Match": etag}).status_code, 404)
+        self.assertEqual(self.client.get('/plots/unknown?plot_type=wide').status_code, 422)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import base64
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import numpy as np
+from fastapi.testclient import TestClient
+import plot_cache
+import plotting
+from main import app
+from survival_models import fit_km_curves, fit_one_piece_model
+
+
+class TestPlotRendering(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(9)
+        times = rng.weibull(1.2, 150) * 12
+        censor = rng.uniform(0, 30, 150)
+        self.data = {
+            "time": np.maximum(np.minimum(times, censor), 0.05).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+        self.km_data = fit_km_curves(self.data, self.data)['chemo']
+        self.model = fit_one_piece_model(self.data, 'chemo', 'weibull')
+
+    def render(self, workers):
+        with tempfile.TemporaryDirectory() as plots_dir, \
+                patch.dict(os.environ, {'PLOTS_DIRECTORY': plots_dir}), \
+                patch.object(plot_cache, 'PLOT_CACHE_DIRECTORY', os.path.join(plots_dir, 'cache')), \
+                patch.object(plotting, 'PLOT_WORKERS', workers):
+            result = plotting.generate_dual_plots('chemo_weibull', self.model, self.km_data)
+            for plot_type in ('short_term', 'long_term'):
+                plot = result[plot_type]
+                self.assertEqual(plot['plot_type'], plot_type)
+                self.assertGreater(plot['render_seconds'], 0)
+                # The file and the base64 payload are the same rasterisation
+                with open(plot['file_path'], 'rb') as f:
+                    png = f.read()
+                self.assertTrue(png.startswith(b'\x89PNG'))
+                self.assertEqual(base64.b64decode(plot['base64_data']), png)
+        return result
+
+    def test_in_process(self):
+        self.render(0)
+
+    def test_render_pool(self):
+        try:
+            self.render(2)
+            # A single render goes through the pool too, even with one worker
+            with tempfile.TemporaryDirectory() as plots_dir, patch.object(plotting, 'PLOT_WORKERS', 1), \
+                    patch.object(plotting, '_get_render_pool', wraps=plotting._get_render_pool) as get_pool:
+                predictions = {"times": [0.0, 12.0, 24.0], "survival": [1.0, 0.6, 0.3]}
+                path = os.path.join(plots_dir, 'short_term.png')
+                plotting.render_plots([('short_term', path, ('m', self.model, self.km_data, predictions))])
+                self.assertEqual(get_pool.call_count, 1)
+                self.assertTrue(os.path.exists(path))
+        finally:
+            plotting.shutdown_render_pool()
+
+    def test_data_format(self):
+        client = TestClient(app)
+        response = client.post('/generate-plots?format=data', json={
+            "model_id": "chemo_weibull", "model_result": self.model, "km_data": self.km_data,
+            "model_handle": self.model['model_handle']
+        })
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(set(body['km']), {'times', 'survival', 'lower', 'upper'})
+        self.assertLessEqual(len(body['model']['times']), plotting.PLOT_DATA_POINTS)
+        self.assertEqual(body['model']['times'][-1], 240.0)
+        self.assertAlmostEqual(body['milestones']['60'], self.model['predictions']['60'], places=3)
+
+        response = client.post('/test-ph?format=data', json={"chemo": self.arm_data(), "pembro": self.arm_data()})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['diagnostic_plots'], {})
+        diagnostics = body['diagnostic_data']
+        self.assertEqual(set(diagnostics['log_cumulative_hazard']), {'chemo', 'pembro'})
+        residuals = diagnostics['schoenfeld_residuals']['residuals']
+        self.assertEqual(len(residuals['times']), len(residuals['residuals']))
+        self.assertLess(len(response.content), 100_000)
+
+        self.assertEqual(client.post('/test-ph?format=svg', json={"chemo": self.arm_data(), "pembro": self.arm_data()}).status_code, 422)
+
+    def test_ph_diagnostics_on_render_pool(self):
+        rng = np.random.default_rng(12)
+        pembro = {
+            "time": (rng.weibull(1.5, 150) * 16 + 0.05).tolist(),
+            "event": rng.integers(0, 2, 150).tolist(),
+            "arm": ["pembro"] * 150
+        }
+        try:
+            with patch.object(plotting, 'PLOT_WORKERS', 1), \
+                    patch.object(plotting, '_get_render_pool', wraps=plotting._get_render_pool) as get_pool:
+                response = TestClient(app).post('/test-ph', json={"chemo": self.arm_data(), "pembro": pembro})
+        finally:
+            plotting.shutdown_render_pool()
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        # All three figures come off the pool in one batch
+        self.assertEqual(get_pool.call_count, 1)
+        self.assertEqual(list(body['diagnostic_plots']), ['cumulative_hazard', 'log_cumulative_hazard', 'schoenfeld_residuals'])
+        for plot_type, data in body['diagnostic_plots'].items():
+            self.assertTrue(base64.b64decode(data).startswith(b'\x89PNG'))
+            self.assertGreater(body['plot_render_seconds'][plot_type], 0)
+
+    def arm_data(self):
+        return {**self.data, "arm": ["chemo"] * len(self.data['time'])}
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import numpy as np
+from fastapi.testclient import TestClient
+import psa
+import survival_predictor
+from main import app
+from model_registry import registry
+from survival_models import fit_one_piece_model, fit_spline_model
+
+
+class TestPSA(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        times = rng.weibull(1.2, 250) * 14
+        censor = rng.uniform(0, 36, 250)
+        self.data = {
+            "time": np.maximum(np.minimum(times, censor), 1e-3).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+        self.times = psa.cycle_times(60, 1.0)
+
+    def record(self, result):
+        return registry.get(result['model_handle'])
+
+    def test_cycle_times(self):
+        np.testing.assert_allclose(psa.cycle_times(3, 0.5), [0, 0.5, 1, 1.5, 2, 2.5, 3])
+
+    def test_draws_follow_parameter_covariance(self):
+        record = self.record(fit_one_piece_model(self.data, 'arm', 'weibull'))
+        names, mean, covariance, log_scale = psa.parameter_distribution(record)
+        self.assertEqual(log_scale, {'lambda_', 'rho_'})
+
+        # Draws through the normal factor reproduce the working-scale covariance
+        rng = np.random.default_rng(0)
+        draws = mean + rng.standard_normal((20000, len(mean))) @ psa._normal_factor(covariance).T
+        np.testing.assert_allclose(np.cov(draws.T), covariance, atol=0.05 * np.max(np.diag(covariance)))
+
+        curves = psa.sample_curves(record, 2000, self.times, seed=1)
+        self.assertEqual(curves.shape, (2000, len(self.times)))
+        self.assertTrue(np.all((curves >= 0) & (curves <= 1)))
+        point = survival_predictor.predict_record(record, self.times)
+        np.testing.assert_allclose(np.median(curves, axis=0), point, atol=0.01)
+
+    def test_chunking_and_dtype(self):
+        record = self.record(fit_one_piece_model(self.data, 'arm', 'log-logistic'))
+        whole = psa.sample_curves(record, 500, self.times, seed=3, chunk_size=500)
+        chunks = list(psa.iter_draws(record, 500, self.times, seed=3, chunk_size=500, dtype=np.float32))
+        self.assertEqual(len(chunks), 1)
+        self.assertEqual(chunks[0].dtype, np.float32)
+        np.testing.assert_allclose(chunks[0], whole, rtol=1e-6)
+        self.assertEqual(len(list(psa.iter_draws(record, 500, self.times, chunk_size=120))), 5)
+
+    def test_custom_fitters(self):
+        for result in (
+            fit_one_piece_model(self.data, 'arm', 'gompertz'),
+            fit_spline_model(self.data, 'arm', 'odds', 2)
+        ):
+            curves = psa.sample_curves(self.record(result), 1000, self.times, seed=2)
+            self.assertTrue(np.all(np.isfinite(curves)))
+            spread = np.percentile(curves, 97.5, axis=0) - np.percentile(curves, 2.5, axis=0)
+            self.assertTrue(np.all(spread[1:] > 0))
+
+    def test_endpoint(self):
+        handles = [
+            fit_one_piece_model(self.data, 'arm', distribution)['model_handle']
+            for distribution in ('exponential', 'log-normal')
+        ]
+        client = TestClient(app)
+        response = client.post('/psa', json={
+            "model_handles": handles, "n_draws": 200, "horizon": 24, "include_draws": True
+        })
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(len(body['times']), 25)
+        for handle in handles:
+            model = body['models'][handle]
+            self.assertEqual(np.array(model['draws']).shape, (200, 25))
+            self.assertTrue(all(lo <= hi for lo, hi in zip(model['2.5'], model['97.5'])))
+
+        self.assertEqual(client.post('/psa', json={"model_handles": ["missing"]}).status_code, 404)
+        for percentiles in ([2.5, 101], [-1, 50]):
+            response = client.post('/psa', json={"model_handles": handles, "percentiles": percentiles})
+            self.assertEqual(response.status_code, 422)
+
+
+if __name__ == '__main__':
+    unittest.main()
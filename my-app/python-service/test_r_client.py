@@ -0,0 +1,91 @@
+import http.server
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import requests
+from r_client import RClient
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    connections = set()
+
+    def do_GET(self):
+        self.reply(b'{"status": "running"}')
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        if self.path == '/broken':
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.reply(b'{"aic": [1.5]}')
+
+    def reply(self, body):
+        _Handler.connections.add(self.client_address)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestRClient(unittest.TestCase):
+
+    def setUp(self):
+        _Handler.connections = set()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), _Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = RClient(f"http://127.0.0.1:{self.server.server_port}", health_ttl=60,
+                              failure_threshold=2, cooldown=0.2)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.client.session.close()
+
+    def test_pooled_calls_and_metrics(self):
+        self.assertTrue(self.client.available())
+        for _ in range(5):
+            self.assertEqual(self.client.post('/fit-parametric', {"time": [1.0]}), {"aic": [1.5]})
+        # The health check is cached and every call reuses one keep-alive connection
+        self.assertTrue(self.client.available())
+        self.assertEqual(len(_Handler.connections), 1)
+
+        metrics = self.client.metrics()
+        self.assertEqual(metrics['breaker_state'], 'closed')
+        self.assertEqual(metrics['endpoints']['/']['calls'], 1)
+        self.assertEqual(metrics['endpoints']['/fit-parametric']['calls'], 5)
+        self.assertGreater(metrics['endpoints']['/fit-parametric']['latency_ms_max'], 0)
+
+    def test_circuit_breaker(self):
+        self.assertIsNone(self.client.post('/broken', {}))
+        self.assertIsNone(self.client.post('/broken', {}))
+        self.assertEqual(self.client.metrics()['breaker_state'], 'open')
+
+        # Open: calls fail fast without reaching the service
+        with patch.object(self.client.session, 'request', side_effect=AssertionError("called R")):
+            started = time.perf_counter()
+            self.assertIsNone(self.client.post('/fit-parametric', {}))
+            self.assertFalse(self.client.available())
+            self.assertLess(time.perf_counter() - started, 0.05)
+        self.assertEqual(self.client.metrics()['short_circuited'], 2)
+
+        # Half-open after the cooldown: a failed trial re-opens, a good one closes
+        time.sleep(0.25)
+        with patch.object(self.client.session, 'request', side_effect=requests.exceptions.ConnectTimeout()):
+            self.assertIsNone(self.client.post('/fit-parametric', {}))
+        self.assertEqual(self.client.metrics()['breaker_state'], 'open')
+        time.sleep(0.25)
+        self.assertTrue(self.client.available())
+        self.assertEqual(self.client.metrics()['breaker_state'], 'closed')
+        self.assertEqual(self.client.post('/fit-parametric', {}), {"aic": [1.5]})
+
+
+if __name__ == '__main__':
+    unittest.main()
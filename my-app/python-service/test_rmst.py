@@ -0,0 +1,75 @@
+import unittest
+import numpy as np
+from fastapi.testclient import TestClient
+from lifelines import KaplanMeierFitter
+from lifelines.utils import restricted_mean_survival_time
+from main import app
+from model_registry import registry
+from km_kernel import event_steps, kaplan_meier
+from rmst import observed_rmst, rmst_table
+from survival_models import fit_one_piece_model, fit_spline_model
+
+
+class TestRMST(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(21)
+        times = np.round(rng.exponential(14, 200), 1)
+        censor = np.round(rng.uniform(0, 48, 200), 1)
+        self.data = {
+            "time": np.maximum(np.minimum(times, censor), 0.1).tolist(),
+            "event": (times <= censor).astype(int).tolist()
+        }
+
+    def test_kaplan_meier_matches_lifelines(self):
+        kmf = KaplanMeierFitter().fit(self.data['time'], self.data['event'])
+        step_times, survival = event_steps(kaplan_meier(self.data))
+        np.testing.assert_allclose(survival, kmf.survival_function_at_times(step_times).values)
+        for horizon in (12.0, 30.0):
+            expected = restricted_mean_survival_time(kmf, t=horizon)
+            self.assertAlmostEqual(observed_rmst(self.data, [horizon])[0], expected, places=8)
+        self.assertIsNone(observed_rmst(self.data, [500.0])[0])
+
+    def test_model_rmst_and_discounting(self):
+        result = fit_one_piece_model(self.data, 'arm', 'exponential')
+        record = registry.get(result['model_handle'])
+        scale = result['parameters']['lambda_']
+        horizons = [24.0, 240.0]
+        table = rmst_table([record], horizons, discount_rate=0.035, observed={record['dataset_fingerprint']: self.data})
+        model = table['models'][0]
+
+        # Closed forms for S(t) = exp(-t / scale), discounting at (1 + r) ** (-t / 12)
+        decay = 1 / scale + np.log(1.035) / 12
+        for j, h in enumerate(horizons):
+            self.assertAlmostEqual(model['rmst'][j], scale * (1 - np.exp(-h / scale)), places=3)
+            self.assertAlmostEqual(model['discounted_life_years'][j], (1 - np.exp(-decay * h)) / decay / 12, places=4)
+        self.assertAlmostEqual(model['life_years'][1], model['rmst'][1] / 12)
+        self.assertAlmostEqual(model['difference'][0], model['rmst'][0] - model['km_rmst'][0])
+        self.assertIsNone(model['km_rmst'][1])
+
+    def test_endpoint(self):
+        handles = [
+            fit_one_piece_model(self.data, 'arm', 'weibull')['model_handle'],
+            fit_spline_model(self.data, 'arm', 'hazard', 1)['model_handle']
+        ]
+        client = TestClient(app)
+        response = client.post('/rmst', json={
+            "model_handles": handles,
+            "horizons": [24, 240],
+            "datasets": {"arm": {**self.data, "arm": ["arm"] * 200}}
+        })
+        self.assertEqual(response.status_code, 200)
+        models = response.json()['models']
+        self.assertEqual([m['model_handle'] for m in models], handles)
+        for model in models:
+            self.assertIsNotNone(model['km_rmst'][0])
+            # Both models fit well inside follow-up
+            self.assertLess(abs(model['difference'][0]), 1.0)
+            self.assertLess(model['discounted_life_years'][1], model['life_years'][1])
+
+        self.assertEqual(client.post('/rmst', json={"model_handles": handles, "horizons": [-1]}).status_code, 422)
+        self.assertEqual(client.post('/rmst', json={"model_handles": ["missing"]}).status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
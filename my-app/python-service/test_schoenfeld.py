@@ -0,0 +1,103 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter
+from lifelines.statistics import proportional_hazard_test
+import schoenfeld
+from schoenfeld import (TIME_TRANSFORMS, grambsch_therneau_test, loess_band, schoenfeld_diagnostics,
+                        scaled_schoenfeld_residuals, transform_times)
+
+
+class TestSchoenfeld(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(11)
+        treatment = np.repeat([0, 1], 200)
+        times = rng.weibull(np.where(treatment, 1.4, 0.9)) * 10
+        censor = rng.uniform(0, 30, 400)
+        self.df = pd.DataFrame({
+            "time": np.minimum(times, censor),
+            "event": (times <= censor).astype(int),
+            "treatment": treatment
+        })
+        self.cox = CoxPHFitter().fit(self.df, duration_col='time', event_col='event')
+
+    def residuals(self, df, cox):
+        return scaled_schoenfeld_residuals(df['time'], df['event'], df['treatment'],
+                                           cox.params_.values, cox.variance_matrix_.values)
+
+    def test_matches_lifelines(self):
+        result = self.residuals(self.df, self.cox)
+        expected = self.cox.compute_residuals(self.df, kind='scaled_schoenfeld')
+        order = np.argsort(self.df.loc[expected.index, 'time'].to_numpy())
+        # lifelines leaves out beta, R's scaled residuals (and ours) include it
+        np.testing.assert_allclose(result['scaled_residuals'][:, 0],
+                                   expected['treatment'].to_numpy()[order] + self.cox.params_['treatment'],
+                                   atol=1e-10)
+        np.testing.assert_allclose(result['times'], np.sort(self.df['time'][self.df['event'] == 1]))
+
+        for transform in TIME_TRANSFORMS:
+            g = transform_times(self.df['time'], self.df['event'], result['times'], transform)
+            test = grambsch_therneau_test(result['scaled_residuals'], g, self.cox.variance_matrix_.values)
+            lifelines_test = proportional_hazard_test(self.cox, self.df, time_transform=transform)
+            self.assertAlmostEqual(test['p_value'][0], lifelines_test.summary['p'].iloc[0], places=10)
+
+    def test_efron_ties(self):
+        df = self.df.assign(time=np.ceil(self.df['time']))
+        cox = CoxPHFitter().fit(df, duration_col='time', event_col='event')
+        result = self.residuals(df, cox)
+        expected = cox.compute_residuals(df, kind='scaled_schoenfeld')
+        # Tied deaths share an expected value, so compare per time as sorted pairs
+        ours = np.lexsort((result['scaled_residuals'][:, 0], result['times']))
+        theirs_times = df.loc[expected.index, 'time'].to_numpy()
+        theirs_values = expected['treatment'].to_numpy() + cox.params_['treatment']
+        theirs = np.lexsort((theirs_values, theirs_times))
+        np.testing.assert_allclose(result['scaled_residuals'][ours, 0], theirs_values[theirs], atol=1e-10)
+
+        # Rank ties are averaged, as R's rank()
+        ranks = transform_times(df['time'], df['event'], [1.0, 2.0, 2.0, 3.0], 'rank')
+        np.testing.assert_array_equal(ranks, [1.0, 2.5, 2.5, 4.0])
+        with self.assertRaises(ValueError):
+            transform_times(df['time'], df['event'], [1.0], 'log')
+
+    def test_smoother(self):
+        x = np.linspace(0, 10, 300)
+        quadratic = 1 + 0.5 * x - 0.03 * x ** 2
+        exact = loess_band(x, quadratic)
+        self.assertEqual(len(exact['smooth_times']), 200)
+        # A local quadratic reproduces a quadratic, with a (near) zero-width band
+        np.testing.assert_allclose(exact['smooth_values'],
+                                   1 + 0.5 * exact['smooth_times'] - 0.03 * exact['smooth_times'] ** 2, atol=1e-10)
+        self.assertLess(np.max(exact['ci_upper'] - exact['ci_lower']), 1e-3)
+
+        noisy = loess_band(x, quadratic + np.random.default_rng(3).normal(0, 0.3, 300))
+        self.assertTrue(np.all(noisy['ci_lower'] < noisy['smooth_values']))
+        self.assertTrue(np.all(noisy['smooth_values'] < noisy['ci_upper']))
+        self.assertLess(np.max(np.abs(noisy['smooth_values'] - (1 + 0.5 * noisy['smooth_times']
+                                                                 - 0.03 * noisy['smooth_times'] ** 2))), 0.3)
+
+        # Blocks of grid points and unsorted, tied input give the same band
+        tied_x = np.round(x)
+        tied_y = quadratic + np.random.default_rng(5).normal(0, 0.3, 300)
+        whole = loess_band(tied_x, tied_y)
+        shuffled = np.random.default_rng(4).permutation(300)
+        with patch.object(schoenfeld, '_LOESS_BLOCK_ELEMENTS', 500):
+            blocked = loess_band(tied_x[shuffled], tied_y[shuffled])
+        for key in whole:
+            np.testing.assert_allclose(blocked[key], whole[key], atol=1e-10)
+
+        few = loess_band([1.0, 2.0, 3.0], [0.1, 0.2, 0.3])
+        np.testing.assert_array_equal(few['smooth_values'], [0.1, 0.2, 0.3])
+
+    def test_diagnostics_shape(self):
+        result = schoenfeld_diagnostics(self.df['time'], self.df['event'], self.df['treatment'],
+                                        self.cox.params_.values, self.cox.variance_matrix_.values)
+        self.assertEqual(len(result['residuals']), self.df['event'].sum())
+        self.assertEqual(len(result['ci_lower']), len(result['smooth_times']))
+        self.assertEqual(set(result['tests']), set(TIME_TRANSFORMS))
+        self.assertEqual(result['tests']['km']['df'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
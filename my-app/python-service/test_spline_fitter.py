@@ -0,0 +1,115 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from scipy.optimize import approx_fprime, minimize
+import custom_spline_models
+import survival_predictor
+from custom_spline_models import RoystonParmarFitter, basis_cache_stats, fit_spline_family, spline_basis
+from model_registry import registry
+from survival_models import fit_spline_model
+
+
+class TestSplineFitter(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(9)
+        times = rng.weibull(0.8, 250) * 20
+        censor = rng.uniform(5, 60, 250)
+        self.time = np.minimum(times, censor)
+        self.event = (times <= censor).astype(float)
+
+    def test_basis_derivative_and_linear_tails(self):
+        knots, boundary = np.array([0.5, 1.5, 2.5]), np.array([-1.0, 3.5])
+        x = np.linspace(-3.0, 6.0, 50)
+        X, dX = spline_basis(x, knots, boundary, derivative=True)
+        step = 1e-6
+        numeric = (spline_basis(x + step, knots, boundary) - spline_basis(x - step, knots, boundary)) / (2 * step)
+        np.testing.assert_allclose(dX, numeric, atol=1e-6)
+        # Restricted cubic splines are linear beyond both boundary knots
+        for tail in (x < boundary[0], x > boundary[1]):
+            self.assertTrue(np.allclose(np.diff(dX[tail], axis=0), 0.0, atol=1e-10))
+
+    def test_analytic_gradient_and_hessian(self):
+        for scale in ('hazard', 'odds', 'normal'):
+            fitter = RoystonParmarFitter(scale=scale, knots=2).fit(self.time, self.event)
+            X = spline_basis(fitter.log_t, fitter.knots_, fitter.boundary_knots_)
+            params = fitter.params_ + 0.02
+            _, gradient, hessian = fitter._log_likelihood(params, X, self.event, hessian=True)
+
+            def ll(p):
+                return fitter._log_likelihood(p, X, self.event)[0]
+
+            def grad(p, i):
+                return fitter._log_likelihood(p, X, self.event)[1][i]
+
+            np.testing.assert_allclose(gradient, approx_fprime(params, ll, 1e-6), rtol=1e-4, atol=1e-3, err_msg=scale)
+            numeric = np.array([approx_fprime(params, grad, 1e-6, i) for i in range(len(params))])
+            np.testing.assert_allclose(hessian, numeric, rtol=1e-4, atol=1e-3, err_msg=scale)
+
+    def test_fit_converges_with_standard_errors(self):
+        for scale in ('hazard', 'odds', 'normal'):
+            fitter = RoystonParmarFitter(scale=scale, knots=2).fit(self.time, self.event)
+            X = spline_basis(fitter.log_t, fitter.knots_, fitter.boundary_knots_)
+            _, gradient = fitter._log_likelihood(fitter.params_, X, self.event)
+            self.assertLess(np.max(np.abs(gradient)), 1e-4)
+            self.assertEqual(fitter.variance_matrix_.shape, (4, 4))
+            self.assertTrue(np.all(fitter.standard_errors_ > 0))
+
+            grid = np.linspace(0.5, 60, 100)
+            survival = fitter.predict_survival(grid)
+            self.assertTrue(np.all(np.diff(survival) <= 1e-12))
+            lower, upper = fitter.survival_confidence_interval(grid)
+            self.assertTrue(np.all((lower <= survival) & (survival <= upper)))
+
+    def test_fit_spline_model_intervals(self):
+        result = fit_spline_model({"time": self.time, "event": self.event}, 'pembro', 'odds', 1)
+        self.assertEqual(len(result['standard_errors']), 3)
+        for t, (lower, upper) in result['prediction_intervals'].items():
+            self.assertLessEqual(lower, result['predictions'][t])
+            self.assertLessEqual(result['predictions'][t], upper)
+
+    def test_unconverged_fit_is_reported(self):
+        calls = []
+
+        def first_call_stops_early(*args, **kwargs):
+            calls.append(len(calls))
+            if len(calls) == 1:
+                kwargs = {**kwargs, 'options': {'maxiter': 1}}
+            return minimize(*args, **kwargs)
+
+        with patch.object(custom_spline_models, 'minimize', side_effect=first_call_stops_early):
+            result = fit_spline_model({"time": self.time, "event": self.event}, 'pembro', 'odds', 2)
+        self.assertFalse(result['converged'])
+        self.assertIsNone(result['prediction_intervals'])
+        self.assertIsNone(result['standard_errors'])
+        self.assertIsNone(registry.get(result['model_handle'])['fitter'].variance_matrix_)
+        self.assertTrue(fit_spline_model({"time": self.time, "event": self.event}, 'pembro', 'odds', 2)['converged'])
+
+        # Only converged fits seed the warm starts of later models
+        calls.clear()
+        with patch.object(custom_spline_models, 'minimize', side_effect=first_call_stops_early), \
+                patch.object(custom_spline_models, '_eta_to_log_cumulative_hazard',
+                             wraps=custom_spline_models._eta_to_log_cumulative_hazard) as curves:
+            fitters = fit_spline_family(self.time, self.event, scales=('hazard', 'odds'), knots=(1,))
+        self.assertEqual([fitter.converged_ for fitter in fitters.values()], [False, True])
+        self.assertEqual(curves.call_count, 1)
+
+    def test_batch_prediction_matches_single_models(self):
+        handles = [
+            fit_spline_model({"time": self.time, "event": self.event}, 'pembro', scale, knots)['model_handle']
+            for scale, knots in [('hazard', 1), ('odds', 2), ('normal', 3)]
+        ]
+        records = [registry.get(handle) for handle in handles]
+        for quantity in ('survival', 'hazard'):
+            batch = survival_predictor.predict_records(records, quantity=quantity)
+            for record, values in zip(records, batch):
+                expected = survival_predictor.predict_record(record, survival_predictor.PREDICTION_GRID, quantity)
+                np.testing.assert_allclose(values, expected, rtol=1e-12)
+
+        hits = basis_cache_stats()['hits']
+        survival_predictor.predict_record(records[0], survival_predictor.PREDICTION_GRID)
+        self.assertEqual(basis_cache_stats()['hits'], hits + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from lifelines import (
+    ExponentialFitter, WeibullFitter, LogNormalFitter, LogLogisticFitter, GeneralizedGammaFitter
+)
+import survival_predictor
+from model_registry import registry
+from piecewise_models import fit_piecewise_model
+
+
+class TestSurvivalPredictor(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(5)
+        times = rng.weibull(1.3, 200) * 15
+        censor = rng.uniform(0, 30, 200)
+        self.time = np.maximum(np.minimum(times, censor), 1e-3)
+        self.event = (times <= censor).astype(int)
+        self.grid = np.array([0.5, 3.0, 12.0, 60.0, 120.0])
+
+    def test_matches_lifelines(self):
+        for distribution, Fitter in [
+            ('exponential', ExponentialFitter),
+            ('weibull', WeibullFitter),
+            ('log-normal', LogNormalFitter),
+            ('log-logistic', LogLogisticFitter),
+            ('generalized-gamma', GeneralizedGammaFitter)
+        ]:
+            fitter = Fitter().fit(self.time, self.event)
+            params = survival_predictor.fitter_parameters(fitter)
+            # lifelines saturates the generalized-gamma tail once S(t) underflows, so compare up to 60
+            grid = self.grid[self.grid <= 60]
+            for quantity, expected in [
+                ('survival', fitter.survival_function_at_times(grid).values),
+                ('hazard', fitter.hazard_at_times(grid).values),
+                ('cumulative_hazard', fitter.cumulative_hazard_at_times(grid).values),
+                ('density', fitter.density_at_times(grid).values)
+            ]:
+                actual = survival_predictor.evaluate(distribution, params, grid, quantity)
+                np.testing.assert_allclose(actual, expected, rtol=1e-8, atol=1e-12, err_msg=f"{distribution} {quantity}")
+
+    def test_broadcasts_over_parameter_sets(self):
+        params = {'lambda_': np.array([10.0, 20.0, 40.0]), 'rho_': np.array([0.8, 1.0, 1.5])}
+        matrix = survival_predictor.survival('weibull', params, self.grid)
+        self.assertEqual(matrix.shape, (3, len(self.grid)))
+        single = survival_predictor.survival('weibull', {'lambda_': 20.0, 'rho_': 1.0}, self.grid)
+        np.testing.assert_allclose(matrix[1], single)
+        self.assertEqual(survival_predictor.survival('weibull', {'lambda_': 20.0, 'rho_': 1.0}, [0.0])[0], 1.0)
+
+    def test_gompertz_density_is_derivative_of_survival(self):
+        params = {'lambda_': 0.05, 'gamma_': -0.02}
+        h = 1e-6
+        numeric = (survival_predictor.survival('gompertz', params, 12 - h) - survival_predictor.survival('gompertz', params, 12 + h)) / (2 * h)
+        np.testing.assert_allclose(survival_predictor.density('gompertz', params, 12), numeric, rtol=1e-6)
+        # gamma -> 0 reduces to the exponential
+        np.testing.assert_allclose(
+            survival_predictor.survival('gompertz', {'lambda_': 0.05, 'gamma_': 0.0}, self.grid),
+            np.exp(-0.05 * self.grid)
+        )
+
+    def test_piecewise_is_continuous_at_cutpoint(self):
+        data = {"time": self.time.tolist(), "event": self.event.tolist()}
+        with patch.object(registry, 'register', wraps=registry.register) as register:
+            result = fit_piecewise_model(data, 'chemo', 'weibull', 6.0)
+        # The post-cutpoint fit is not registered as a model of its own
+        self.assertEqual([c.args[1]['approach'] for c in register.call_args_list], ['piecewise'])
+        record = registry.get(result['model_handle'])
+        before, after = survival_predictor.predict_record(record, [6.0, 6.0 + 1e-9])
+        self.assertAlmostEqual(before, after, places=6)
+        self.assertGreater(result['predictions']['60'], 0.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
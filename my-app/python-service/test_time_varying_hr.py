@@ -0,0 +1,124 @@
+import unittest
+import warnings
+import numpy as np
+import pandas as pd
+from fastapi.testclient import TestClient
+from lifelines import CoxPHFitter, CoxTimeVaryingFitter
+from main import app
+from time_varying_hr import _fit, event_time_table, split_episodes, time_varying_hr
+
+
+class TestTimeVaryingHR(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(4)
+        self.treatment = np.repeat([0, 1], 150)
+        times = rng.weibull(np.where(self.treatment, 1.5, 0.9)) * 10
+        censor = rng.uniform(0, 30, 300)
+        # Rounded so that deaths tie and Efron's method is exercised
+        self.time = np.round(np.minimum(times, censor), 1) + 0.1
+        self.event = (times <= censor).astype(int)
+
+    def lifelines_fit(self, breakpoints, covariates):
+        episodes = split_episodes(self.time, self.event, breakpoints)
+        df = pd.DataFrame({
+            "id": episodes['subject'], "start": episodes['start'], "stop": episodes['stop'],
+            "event": episodes['event'].astype(int),
+            **covariates(self.treatment[episodes['subject']], episodes)
+        })
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            return CoxTimeVaryingFitter().fit(df, id_col='id', start_col='start', stop_col='stop', event_col='event')
+
+    def test_split_episodes(self):
+        episodes = split_episodes([5.0, 12.0, 3.0], [1, 0, 1], [3.0, 6.0, 10.0], entry=[0.0, 4.0, 0.0])
+        np.testing.assert_array_equal(episodes['subject'], [0, 0, 1, 1, 1, 2])
+        np.testing.assert_array_equal(episodes['start'], [0.0, 3.0, 4.0, 6.0, 10.0, 0.0])
+        np.testing.assert_array_equal(episodes['stop'], [3.0, 5.0, 6.0, 10.0, 12.0, 3.0])
+        np.testing.assert_array_equal(episodes['event'], [False, True, False, False, False, True])
+        np.testing.assert_array_equal(episodes['period'], [0, 1, 1, 2, 3, 0])
+
+        # Splitting leaves the risk sets unchanged
+        split = split_episodes(self.time, self.event, np.arange(1.0, 20.0))
+        whole = event_time_table(np.zeros(300), self.time, self.event, self.treatment)
+        parts = event_time_table(split['start'], split['stop'], split['event'], self.treatment[split['subject']])
+        for key in whole:
+            np.testing.assert_array_equal(whole[key], parts[key])
+
+    def test_matches_lifelines(self):
+        result = time_varying_hr(self.time, self.event, self.treatment, breakpoints=[6.0])
+        expected = self.lifelines_fit([6.0], lambda x, e: {"early": x * (e['period'] == 0), "late": x * (e['period'] == 1)})
+        np.testing.assert_allclose([p['log_hr'] for p in result['periods']], expected.params_.values, atol=1e-6)
+        np.testing.assert_allclose([p['se'] for p in result['periods']], expected.standard_errors_.values, atol=1e-6)
+        self.assertEqual(result['periods'][1]['start'], 6.0)
+        self.assertIsNone(result['periods'][1]['end'])
+        self.assertIsNotNone(result['period_lr_test']['p_value'])
+
+        # The g(t) term equals a counting-process fit split at every event time
+        event_times = np.unique(self.time[self.event == 1])
+        expected = self.lifelines_fit(event_times, lambda x, e: {"x": x, "xg": x * np.log(e['stop'] + 1e-5)})
+        interaction = result['time_interaction']
+        np.testing.assert_allclose([interaction['beta']['log_hr'], interaction['gamma']['log_hr']],
+                                   expected.params_.values, atol=1e-6)
+        np.testing.assert_allclose(interaction['gamma']['se'], expected.standard_errors_['xg'], atol=1e-6)
+
+        cox = CoxPHFitter().fit(pd.DataFrame({"t": self.time, "e": self.event, "x": self.treatment}), 't', 'e')
+        self.assertAlmostEqual(result['constant_hazard_ratio']['log_hr'], cox.params_['x'], places=6)
+
+    def test_detected_breakpoint(self):
+        result = time_varying_hr(self.time, self.event, self.treatment)
+        self.assertTrue(result['breakpoints_detected'])
+        self.assertEqual(len(result['periods']), 2)
+        self.assertIsNone(result['period_lr_test']['p_value'])
+
+        # Same choice as an exhaustive fit over every admissible breakpoint
+        table = event_time_table(np.zeros(300), self.time, self.event, self.treatment)
+        events = np.cumsum(table['deaths_control'] + table['deaths_treated'])
+        candidates = table['times'][(events >= 5) & (events[-1] - events >= 5)]
+        early = (table['times'][None, :] <= candidates[:, None]).astype(float)
+        _, ll, _, _, _ = _fit(table, np.stack([early, 1 - early], axis=2), len(candidates))
+        self.assertEqual(result['breakpoints'], [candidates[np.argmax(ll)]])
+
+        with self.assertRaises(ValueError):
+            time_varying_hr(self.time, self.event, self.treatment, breakpoints=[0.15])
+        with self.assertRaises(ValueError):
+            time_varying_hr(self.time, self.event, self.treatment, time_function='square')
+
+    def test_endpoint(self):
+        client = TestClient(app)
+        arms = {
+            name: {"time": self.time[self.treatment == k].tolist(), "event": self.event[self.treatment == k].tolist(),
+                   "arm": [name] * 150}
+            for name, k in (("chemo", 0), ("pembro", 1))
+        }
+        response = client.post('/time-varying-hr', json={**arms, "breakpoints": [6.0], "time_function": "identity"})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual(body['breakpoints'], [6.0])
+        self.assertEqual(body['time_interaction']['time_function'], 'identity')
+        self.assertEqual(client.post('/time-varying-hr', json={**arms, "time_function": "square"}).status_code, 422)
+
+    def test_separation_is_unestimable(self):
+        # Every late chemo death precedes the late pembro ones: the late log HR drifts to ~21
+        client = TestClient(app)
+        arms = {
+            "chemo": {"time": [1, 1, 1, 10, 10], "event": [1] * 5, "arm": ["chemo"] * 5},
+            "pembro": {"time": [2, 2, 5, 5, 5], "event": [1] * 5, "arm": ["pembro"] * 5}
+        }
+        response = client.post('/test-ph?format=data', json=arms)
+        self.assertEqual(response.status_code, 200)
+        late = response.json()['time_varying_hr']['periods'][-1]
+        self.assertFalse(late['estimable'])
+        self.assertIsNone(late['hazard_ratio'])
+        self.assertIsNone(late['ci_upper'])
+
+        response = client.post('/time-varying-hr', json={**arms, "breakpoints": [3.0]})
+        self.assertEqual(response.status_code, 200)
+        first, second = response.json()['periods']
+        self.assertTrue(first['estimable'])
+        self.assertGreater(first['hazard_ratio'], 0)
+        self.assertFalse(second['estimable'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from unittest.mock import patch
+import numpy as np
+from lifelines import CoxPHFitter
+import ph_testing
+import two_arm_context
+from two_arm_context import two_arm_context as context_of
+
+
+class TestTwoArmContext(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(23)
+
+        def arm(name, scale, seed_shift):
+            times = rng.weibull(0.9 + seed_shift, 160) * scale
+            censor = rng.uniform(0, 40, 160)
+            return {
+                "time": np.maximum(np.minimum(times, censor), 0.05).tolist(),
+                "event": (times <= censor).astype(int).tolist(),
+                "arm": [name] * 160
+            }
+
+        self.chemo = arm("chemo", 10, 0.0)
+        self.pembro = arm("pembro", 14, 0.3)
+
+    def test_memoised_per_pair(self):
+        context = context_of(self.chemo, self.pembro)
+        # Same data under a new object (e.g. a re-sent request) maps to the same context
+        again = context_of({k: list(v) for k, v in self.chemo.items()}, dict(self.pembro))
+        self.assertIs(context, again)
+        self.assertIs(context.cox, again.cox)
+        self.assertIsNot(context_of(self.pembro, self.chemo), context)
+        self.assertLessEqual(len(two_arm_context._contexts), two_arm_context.TWO_ARM_CONTEXT_SIZE)
+
+        self.assertEqual(len(context.cph_df), 320)
+        self.assertEqual(set(context.cox.summary.index), {'treatment'})
+        self.assertIn('gamma', context.time_varying_hr['time_interaction'])
+
+    def test_repeated_test_ph_reuses_fits(self):
+        two_arm_context._contexts.clear()
+        with patch.object(two_arm_context, 'CoxPHFitter', wraps=CoxPHFitter) as cox, \
+                patch.object(two_arm_context, 'time_varying_hr', wraps=two_arm_context.time_varying_hr) as tv_hr, \
+                patch.object(two_arm_context, 'schoenfeld_diagnostics',
+                             wraps=two_arm_context.schoenfeld_diagnostics) as diagnostics:
+            first = ph_testing.test_proportional_hazards(self.chemo, self.pembro, plot_format='data')
+            context = context_of(self.chemo, self.pembro)
+            fits = (context.cox, context.time_varying_hr, context.schoenfeld_residuals, context.km_chemo)
+            second = ph_testing.test_proportional_hazards(self.chemo, self.pembro, plot_format='data')
+
+        # The second call reuses every fit of the first instead of refitting
+        self.assertEqual((cox.call_count, tv_hr.call_count, diagnostics.call_count), (1, 1, 1))
+        self.assertIs(context_of(self.chemo, self.pembro), context)
+        for before, after in zip(fits, (context.cox, context.time_varying_hr,
+                                        context.schoenfeld_residuals, context.km_chemo)):
+            self.assertIs(before, after)
+
+        for key in ('chow_test_pvalue', 'schoenfeld_pvalue', 'logrank_pvalue', 'ph_violated', 'crossings'):
+            self.assertEqual(first[key], second[key])
+        self.assertEqual(first['diagnostic_data'], second['diagnostic_data'])
+
+if __name__ == '__main__':
+    unittest.main()
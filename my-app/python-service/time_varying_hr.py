@@ -0,0 +1,360 @@
+"""Time-varying treatment hazard ratios on a counting-process representation
+
+Two Cox models with a time-varying treatment effect, both exact in the
+partial likelihood:
+
+- a piecewise-constant HR: follow-up is split into episodes at breakpoints
+  (given, or the single breakpoint that maximises the partial likelihood) and
+  each period has its own treatment coefficient;
+- a treatment x g(t) term, log HR(t) = beta + gamma * g(t), with g(t)
+  evaluated at every event time rather than once per subject.
+
+Episodes are parallel NumPy arrays (split_episodes), not one DataFrame row
+per subject-period. Because treatment is binary, the partial likelihood only
+depends on the deaths and the numbers at risk in each arm at each event time,
+so both models (and the constant-HR reference) are fitted from one event-time
+table (event_time_table) built with sorted searches over the episodes,
+however many there are; g(t) never needs a split at every event time. Fits use
+batch_newton.maximise; a detected breakpoint comes from a prefix-sum score
+scan over all event times, with the leading candidates refitted as one batch.
+Ties use Efron's method, as lifelines' Cox fitters.
+"""
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+from scipy import stats
+
+from batch_newton import maximise
+
+# g(t) of the treatment x g(t) term; the epsilon keeps zero event times finite, as in the Chow test
+TIME_FUNCTIONS = {
+    'log': lambda t: np.log(t + 1e-5),
+    'identity': lambda t: t
+}
+
+# Breakpoint detection: events needed in each period, best score-scan candidates fitted exactly
+MIN_EVENTS = 5
+REFINE_CANDIDATES = 10
+CONFIDENCE_Z = stats.norm.ppf(0.975)
+
+
+def split_episodes(time, event, breakpoints: Sequence[float] = (), entry=None) -> Dict[str, np.ndarray]:
+    """
+    Counting-process episodes (start, stop] of each subject, split at the breakpoints.
+
+    Args:
+        time, event: Follow-up time and event indicator of each subject
+        breakpoints: Times at which follow-up is split (sorted and de-duplicated here)
+        entry: Optional delayed-entry time of each subject (default 0)
+
+    Returns:
+        Dict of parallel arrays: 'subject', 'start', 'stop', 'event' (only on a
+        subject's last episode) and 'period' (index of the breakpoint interval)
+    """
+    time = np.asarray(time, dtype=np.float64)
+    event = np.asarray(event).astype(bool)
+    entry = np.zeros_like(time) if entry is None else np.asarray(entry, dtype=np.float64)
+    breakpoints = np.unique(np.asarray(breakpoints, dtype=np.float64))
+
+    # Breakpoints strictly inside (entry, time) each open a new episode
+    first = np.searchsorted(breakpoints, entry, side='right')
+    last = np.searchsorted(breakpoints, time, side='left')
+    n_episodes = 1 + np.maximum(last - first, 0)
+
+    subject = np.repeat(np.arange(time.size), n_episodes)
+    offsets = np.cumsum(n_episodes) - n_episodes
+    position = np.arange(subject.size) - offsets[subject]
+    period = first[subject] + position
+    is_first = position == 0
+    is_last = position == n_episodes[subject] - 1
+    padded = np.append(breakpoints, np.inf)
+
+    return {
+        "subject": subject,
+        "start": np.where(is_first, entry[subject], padded[np.maximum(period - 1, 0)]),
+        "stop": np.where(is_last, time[subject], padded[np.minimum(period, breakpoints.size)]),
+        "event": event[subject] & is_last,
+        "period": period
+    }
+
+
+def _at_risk(start: np.ndarray, stop: np.ndarray, times: np.ndarray) -> np.ndarray:
+    """Number of episodes with start < t <= stop at each t"""
+    return np.searchsorted(np.sort(start), times, side='left') - np.searchsorted(np.sort(stop), times, side='left')
+
+
+def event_time_table(start, stop, event, treatment) -> Dict[str, np.ndarray]:
+    """
+    Deaths and numbers at risk per arm at each distinct event time.
+
+    Args:
+        start, stop, event: Episode arrays (split_episodes)
+        treatment: 0/1 treatment of each episode (may change between a subject's episodes)
+
+    Returns:
+        Dict with 'times', 'deaths_control', 'deaths_treated', 'at_risk_control', 'at_risk_treated'
+    """
+    start = np.asarray(start, dtype=np.float64)
+    stop = np.asarray(stop, dtype=np.float64)
+    event = np.asarray(event).astype(bool)
+    treated = np.asarray(treatment).astype(bool)
+
+    times, index = np.unique(stop[event], return_inverse=True)
+    deaths_treated = np.bincount(index, weights=treated[event], minlength=times.size)
+    deaths = np.bincount(index, minlength=times.size)
+    return {
+        "times": times,
+        "deaths_control": deaths - deaths_treated,
+        "deaths_treated": deaths_treated,
+        "at_risk_control": _at_risk(start[~treated], stop[~treated], times).astype(np.float64),
+        "at_risk_treated": _at_risk(start[treated], stop[treated], times).astype(np.float64)
+    }
+
+
+def _efron_terms(table: Dict[str, np.ndarray]):
+    """
+    Per-event-time partial log-likelihood and its first two derivatives in eta.
+
+    Returns terms(eta, order) for eta (B, J), the log HR at each event time.
+    """
+    deaths = (table['deaths_control'] + table['deaths_treated']).astype(int)
+    starts = np.cumsum(deaths) - deaths
+    # The l-th of d tied deaths sees the risk set less l/d of the dying (Efron)
+    group = np.repeat(np.arange(deaths.size), deaths)
+    fraction = (np.arange(group.size) - starts[group]) / deaths[group]
+    n0, n1 = table['at_risk_control'][group], table['at_risk_treated'][group]
+    d0, d1 = table['deaths_control'][group], table['deaths_treated'][group]
+
+    def terms(eta, order):
+        risk = np.exp(eta)[:, group]
+        denominator = n0 + n1 * risk - fraction * (d0 + d1 * risk)
+        ll = table['deaths_treated'] * eta - np.add.reduceat(np.log(denominator), starts, axis=1)
+        if order == 0:
+            return (ll,)
+        # Expected share of treated deaths for each of the tied deaths
+        share = (n1 - fraction * d1) * risk / denominator
+        gradient = table['deaths_treated'] - np.add.reduceat(share, starts, axis=1)
+        if order == 1:
+            return ll, gradient
+        return ll, gradient, -np.add.reduceat(share * (1 - share), starts, axis=1)
+
+    return terms
+
+
+def _efron_log_likelihood(table: Dict[str, np.ndarray], design: np.ndarray):
+    """
+    Batch partial log-likelihood with log HR(t_j) = design[b, j] @ theta[b].
+
+    design is (B, J, p) (or (1, J, p) shared by every row); returns a
+    batch_newton LogLikelihood.
+    """
+    terms = _efron_terms(table)
+
+    def log_likelihood(theta, rows, order):
+        features = design[rows] if design.shape[0] > 1 else design
+        result = terms(np.einsum('bjp,bp->bj', features, theta), order)
+        ll = result[0].sum(axis=1)
+        if order == 0:
+            return (ll,)
+        gradient = np.einsum('bj,bjp->bp', result[1], features)
+        if order == 1:
+            return ll, gradient
+        return ll, gradient, np.einsum('bj,bjp,bjq->bpq', result[2], features, features)
+
+    return log_likelihood
+
+
+def _fit(table: Dict[str, np.ndarray], design: np.ndarray, n_rows: int = 1):
+    log_likelihood = _efron_log_likelihood(table, design)
+    start = np.zeros((n_rows, design.shape[2]))
+    tolerance = 1e-9 * max(1.0, float(np.sum(table['deaths_treated'])))
+    return maximise(log_likelihood, start, tolerance, max_step=2.0)
+
+
+def _wald(estimate: float, variance: float, converged: bool = True) -> Dict:
+    """
+    Log HR, HR, confidence interval and Wald p of one estimate.
+
+    Under (quasi-)separation the likelihood has no finite maximum: the fit
+    drifts to a large log HR with a huge SE, and exp() of the interval
+    overflows. Such estimates (or ones from a fit that did not converge) come
+    back with `estimable` False and no HR, interval or p-value.
+    """
+    se = float(np.sqrt(variance)) if np.isfinite(variance) and variance >= 0 else np.nan
+    with np.errstate(over='ignore', invalid='ignore'):
+        bounds = np.exp([estimate, estimate - CONFIDENCE_Z * se, estimate + CONFIDENCE_Z * se])
+    if not (converged and np.isfinite(estimate) and se > 0 and np.all(np.isfinite(bounds))):
+        return {
+            "log_hr": float(estimate) if np.isfinite(estimate) else None,
+            "se": se if np.isfinite(se) else None,
+            "hazard_ratio": None,
+            "ci_lower": None,
+            "ci_upper": None,
+            "p_value": None,
+            "estimable": False
+        }
+    return {
+        "log_hr": float(estimate),
+        "se": se,
+        "hazard_ratio": float(bounds[0]),
+        "ci_lower": float(bounds[1]),
+        "ci_upper": float(bounds[2]),
+        "p_value": float(2 * stats.norm.sf(abs(estimate / se))),
+        "estimable": True
+    }
+
+
+def _period_design(times: np.ndarray, breakpoints: np.ndarray) -> np.ndarray:
+    periods = np.searchsorted(breakpoints, times, side='left')
+    return np.eye(breakpoints.size + 1)[periods][np.newaxis]
+
+
+def _detect_breakpoint(table: Dict[str, np.ndarray], log_hr: float, min_events: int, refine: int) -> Optional[float]:
+    """
+    Single breakpoint maximising the two-period partial likelihood.
+
+    Every event time is scored in one pass with prefix sums of the score and
+    information at the constant-HR estimate (the score statistic for a change
+    of HR there); the best `refine` candidates are then fitted exactly.
+    """
+    times = table['times']
+    cum_control = np.cumsum(table['deaths_control'])
+    cum_treated = np.cumsum(table['deaths_treated'])
+    total = cum_control + cum_treated
+    # A breakpoint at times[j] ends the first period with that event time
+    allowed = (
+        (total >= min_events) & (total[-1] - total >= min_events)
+        & (cum_control > 0) & (cum_treated > 0)
+        & (cum_control[-1] - cum_control > 0) & (cum_treated[-1] - cum_treated > 0)
+    )
+    if not allowed.any():
+        return None
+
+    _, score, information = _efron_terms(table)(np.full((1, times.size), log_hr), 2)
+    cum_score, cum_information = np.cumsum(score[0]), -np.cumsum(information[0])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        statistic = cum_score ** 2 / cum_information \
+            + (cum_score[-1] - cum_score) ** 2 / (cum_information[-1] - cum_information)
+    statistic = np.where(allowed & np.isfinite(statistic), statistic, -np.inf)
+    candidates = times[np.argsort(statistic)[::-1][:min(refine, int(allowed.sum()))]]
+
+    early = (times[np.newaxis, :] <= candidates[:, np.newaxis]).astype(np.float64)
+    _, ll, _, _, converged = _fit(table, np.stack([early, 1.0 - early], axis=2), len(candidates))
+    ll = np.where(converged, ll, -np.inf)
+    return float(candidates[np.argmax(ll)]) if np.isfinite(ll).any() else None
+
+
+def time_varying_hr(
+    time,
+    event,
+    treatment,
+    breakpoints: Optional[Sequence[float]] = None,
+    time_function: str = 'log',
+    entry=None,
+    min_events: int = MIN_EVENTS,
+    refine: int = REFINE_CANDIDATES
+) -> Dict:
+    """
+    Period-specific hazard ratios and a treatment x g(t) term in one pass.
+
+    Args:
+        time, event: Follow-up time and event indicator of each subject
+        treatment: 0/1 treatment indicator of each subject
+        breakpoints: Period boundaries; None detects the single best breakpoint
+            (each period needs min_events events and a death in both arms)
+        time_function: g(t) of the interaction term, 'log' or 'identity'
+        entry: Optional delayed-entry times
+        min_events, refine: Breakpoint detection settings (see _detect_breakpoint)
+
+    Returns:
+        Dict with 'breakpoints', 'breakpoints_detected', 'periods' (HR, CI and
+        Wald p per period; all None with estimable False when not estimable), 'period_lr_test' (against a constant HR; p only for
+        given breakpoints, as a searched maximum is not chi-squared),
+        'time_interaction' (beta, gamma and the HR at the event-time quartiles),
+        'constant_hazard_ratio' and episode/event counts
+
+    Raises:
+        ValueError: Unknown time function, or a period without a death in either arm
+    """
+    if time_function not in TIME_FUNCTIONS:
+        raise ValueError(f"time_function must be one of {', '.join(TIME_FUNCTIONS)}")
+    time = np.asarray(time, dtype=np.float64)
+    event = np.asarray(event).astype(bool)
+    treated = np.asarray(treatment).astype(bool)
+
+    entry = np.zeros_like(time) if entry is None else np.asarray(entry, dtype=np.float64)
+    if not (event & ~treated).any() or not (event & treated).any():
+        raise ValueError("Both arms need at least one event")
+
+    detected = breakpoints is None
+    if detected:
+        unsplit = event_time_table(entry, time, event, treated)
+        log_hr = _fit(unsplit, np.ones((1, unsplit['times'].size, 1)))[0][0, 0]
+        breakpoint = _detect_breakpoint(unsplit, log_hr, min_events, refine)
+        breakpoints = np.array([] if breakpoint is None else [breakpoint])
+    else:
+        breakpoints = np.unique(np.asarray(breakpoints, dtype=np.float64))
+        breakpoints = breakpoints[(breakpoints > 0) & (breakpoints < time[event].max())]
+
+    # One table of the split episodes serves all three models
+    episodes = split_episodes(time, event, breakpoints, entry)
+    table = event_time_table(episodes['start'], episodes['stop'], episodes['event'], treated[episodes['subject']])
+    times = table['times']
+    period_design = _period_design(times, breakpoints)
+    deaths_control = table['deaths_control'] @ period_design[0]
+    deaths_treated = table['deaths_treated'] @ period_design[0]
+    bounds = np.concatenate([[0.0], breakpoints, [np.inf]])
+    for k in range(breakpoints.size + 1):
+        if deaths_control[k] == 0 or deaths_treated[k] == 0:
+            raise ValueError(f"Period ({bounds[k]:g}, {bounds[k + 1]:g}] needs a death in both arms to estimate its HR")
+
+    constant = _fit(table, np.ones((1, times.size, 1)))
+    periods = _fit(table, period_design)
+    g = TIME_FUNCTIONS[time_function](times)
+    interaction = _fit(table, np.stack([np.ones_like(g), g], axis=1)[np.newaxis])
+
+    constant_ll = float(constant[1][0])
+    # pinv: a singular information matrix (separation) leaves infinite-looking SEs, not an error
+    period_covariance = np.linalg.pinv(-periods[2][0])
+    period_results: List[Dict] = [
+        {
+            "start": float(bounds[k]),
+            "end": float(bounds[k + 1]) if np.isfinite(bounds[k + 1]) else None,
+            "events_control": int(deaths_control[k]),
+            "events_treated": int(deaths_treated[k]),
+            **_wald(periods[0][0, k], period_covariance[k, k], periods[4][0])
+        }
+        for k in range(breakpoints.size + 1)
+    ]
+    lr_statistic = float(max(2 * (periods[1][0] - constant_ll), 0.0))
+
+    beta, gamma = interaction[0][0]
+    interaction_covariance = np.linalg.pinv(-interaction[2][0])
+    quartiles = np.quantile(times, [0.25, 0.5, 0.75])
+    g_quartiles = TIME_FUNCTIONS[time_function](quartiles)
+    return {
+        "breakpoints": breakpoints.tolist(),
+        "breakpoints_detected": detected,
+        "periods": period_results,
+        "period_lr_test": {
+            "statistic": lr_statistic,
+            "df": int(breakpoints.size),
+            "p_value": float(stats.chi2.sf(lr_statistic, breakpoints.size)) if not detected and breakpoints.size else None
+        },
+        "time_interaction": {
+            "time_function": time_function,
+            "beta": _wald(beta, interaction_covariance[0, 0], interaction[4][0]),
+            "gamma": _wald(gamma, interaction_covariance[1, 1], interaction[4][0]),
+            "hazard_ratio_at": [
+                {"time": float(t), **_wald(beta + gamma * gt,
+                                           np.array([1.0, gt]) @ interaction_covariance @ np.array([1.0, gt]),
+                                           interaction[4][0])}
+                for t, gt in zip(quartiles, g_quartiles)
+            ]
+        },
+        "constant_hazard_ratio": _wald(constant[0][0, 0], -1.0 / constant[2][0, 0, 0], constant[4][0]),
+        "converged": bool(constant[4][0] and periods[4][0] and interaction[4][0]),
+        "n_subjects": int(time.size),
+        "n_episodes": int(episodes['stop'].size),
+        "n_events": int(event.sum())
+    }
@@ -0,0 +1,150 @@
+"""Shared analysis context for a (chemo, pembro) dataset pair
+
+PH testing, its diagnostics and the crossing check all need the same handful
+of fits: both Kaplan-Meier / Nelson-Aalen curves, the treatment-only Cox model,
+the time-varying HR models (time_varying_hr), the log-rank test and
+the scaled Schoenfeld residuals with their Grambsch-Therneau tests.
+TwoArmContext computes each of them lazily on first use and keeps it, and
+contexts are memoised per pair of dataset fingerprints, so a repeated /test-ph
+(PNG and data mode alike) reuses every fit.
+"""
+import os
+import threading
+from collections import OrderedDict
+from functools import cached_property
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from lifelines import CoxPHFitter
+from lifelines.statistics import logrank_test
+
+from curve_crossing import detect_crossings
+from km_kernel import kaplan_meier
+from model_registry import dataset_fingerprint
+from schoenfeld import schoenfeld_diagnostics
+from time_varying_hr import time_varying_hr
+
+TWO_ARM_CONTEXT_SIZE = int(os.environ.get('TWO_ARM_CONTEXT_SIZE', '16'))
+
+_contexts: "OrderedDict[tuple, TwoArmContext]" = OrderedDict()
+_contexts_lock = threading.Lock()
+
+
+def _clean_arm(data: Dict, treatment: int) -> pd.DataFrame:
+    """Numeric time/event rows of one arm with its treatment indicator"""
+    # Keep only time and event columns (e.g. drop the string 'arm' column)
+    df = pd.DataFrame(data)[['time', 'event']].copy()
+    df['time'] = pd.to_numeric(df['time'], errors='coerce')
+    df['event'] = pd.to_numeric(df['event'], errors='coerce')
+    df = df.dropna()
+    df['treatment'] = treatment
+    return df
+
+
+class TwoArmContext:
+    """Lazily computed, memoised fits of one (chemo, pembro) dataset pair"""
+
+    def __init__(self, chemo_data: Dict, pembro_data: Dict):
+        # Chemotherapy = 0, Pembrolizumab = 1
+        self.chemo_df = _clean_arm(chemo_data, 0)
+        self.pembro_df = _clean_arm(pembro_data, 1)
+        self.chemo_fingerprint = dataset_fingerprint(self.chemo_df)
+        self.pembro_fingerprint = dataset_fingerprint(self.pembro_df)
+
+    @cached_property
+    def cph_df(self) -> pd.DataFrame:
+        """Combined time/event/treatment data for the Cox models"""
+        cph_df = pd.concat([self.chemo_df, self.pembro_df], ignore_index=True)[['time', 'event', 'treatment']]
+        return cph_df.astype({'time': float, 'event': int, 'treatment': int})
+
+    @property
+    def km_chemo(self) -> Dict[str, np.ndarray]:
+        return kaplan_meier(self.chemo_df, fingerprint=self.chemo_fingerprint)
+
+    @property
+    def km_pembro(self) -> Dict[str, np.ndarray]:
+        return kaplan_meier(self.pembro_df, fingerprint=self.pembro_fingerprint)
+
+    @cached_property
+    def logrank_pvalue(self) -> float:
+        result = logrank_test(
+            self.chemo_df['time'],
+            self.pembro_df['time'],
+            self.chemo_df['event'],
+            self.pembro_df['event']
+        )
+        return float(result.p_value)
+
+    @cached_property
+    def cox(self) -> CoxPHFitter:
+        """Cox proportional hazards model on treatment only"""
+        cph = CoxPHFitter()
+        cph.fit(self.cph_df, duration_col='time', event_col='event')
+        return cph
+
+    @cached_property
+    def time_varying_hr(self) -> Dict:
+        """Early/late HRs at the detected breakpoint and the treatment x log(t) term (raises if not estimable)"""
+        return time_varying_hr(self.cph_df['time'], self.cph_df['event'], self.cph_df['treatment'])
+
+    @cached_property
+    def schoenfeld_residuals(self) -> Dict:
+        """Scaled Schoenfeld residuals, smoother and Grambsch-Therneau tests (see schoenfeld_residual_data)"""
+        return schoenfeld_residual_data(self.cph_df, self.cox)
+
+    @cached_property
+    def crossings(self) -> Dict:
+        """Exact crossings of the two KM curves (curve_crossing.detect_crossings)"""
+        return detect_crossings(self.km_chemo, self.km_pembro)
+
+
+def two_arm_context(chemo_data: Dict, pembro_data: Dict) -> TwoArmContext:
+    """The memoised context of a dataset pair, built on first request"""
+    context = TwoArmContext(chemo_data, pembro_data)
+    key = (context.chemo_fingerprint, context.pembro_fingerprint)
+    with _contexts_lock:
+        cached = _contexts.get(key)
+        if cached is not None:
+            _contexts.move_to_end(key)
+            return cached
+        _contexts[key] = context
+        while len(_contexts) > TWO_ARM_CONTEXT_SIZE:
+            _contexts.popitem(last=False)
+    return context
+
+
+def pair_time_varying_hr(
+    chemo_data: Dict,
+    pembro_data: Dict,
+    breakpoints: Optional[List[float]] = None,
+    time_function: str = 'log'
+) -> Dict:
+    """time_varying_hr of pembro vs chemo, reusing the pair's context for the default analysis"""
+    context = two_arm_context(chemo_data, pembro_data)
+    if breakpoints is None and time_function == 'log':
+        return context.time_varying_hr
+    cph_df = context.cph_df
+    return time_varying_hr(cph_df['time'], cph_df['event'], cph_df['treatment'],
+                           breakpoints=breakpoints, time_function=time_function)
+
+
+def schoenfeld_residual_data(cph_df: pd.DataFrame, cox: Optional[CoxPHFitter] = None) -> Dict:
+    """Scaled Schoenfeld residuals of the treatment effect, their smoother and PH tests
+    
+    Computed in-process by schoenfeld.schoenfeld_diagnostics from `cox` (a
+    treatment-only Cox fit of cph_df, fitted here when not given). Returns NumPy
+    arrays: residuals, times, smooth_times, smooth_values, ci_lower, ci_upper,
+    plus the Grambsch-Therneau tests per time transform and source.
+    """
+    if cox is None:
+        cox = CoxPHFitter()
+        cox.fit(cph_df[['time', 'event', 'treatment']], duration_col='time', event_col='event')
+    result = schoenfeld_diagnostics(
+        cph_df['time'].to_numpy(),
+        cph_df['event'].to_numpy(),
+        cph_df['treatment'].to_numpy(),
+        cox.params_[['treatment']].to_numpy(),
+        cox.variance_matrix_.loc[['treatment'], ['treatment']].to_numpy()
+    )
+    return {**result, 'source': 'python'}
@@ -22,7 +22,7 @@ export interface ModelFitResult {
   distribution?: string;
   scale?: string;
   knots?: number;
-  cutpoint?: number;
+  cutpoint?: number | number[];
   parameters: Record<string, number>;
   aic?: number;
   bic?: number;
@@ -84,6 +84,38 @@ export async function loadParquetData(chemoPath: string, pembroPath: string): Pr
   return response.json();
 }
 
+export interface DatasetHandle {
+  dataset_id: string;
+  label: string | null;
+  n: number;
+  events: number;
+  max_time: number | null;
+  expires_at: number;
+}
+
+/**
+ * Upload an arm's time/event arrays once. The returned dataset_id can be sent
+ * to the fit endpoints in place of the inline data.
+ */
+export async function uploadDataset(data: ParquetData, label?: string): Promise<DatasetHandle> {
+  const response = await fetch(`${PYTHON_SERVICE_URL}/datasets`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      time: data.time,
+      event: data.event,
+      label,
+    }),
+  });
+
+  if (!response.ok) {
+    const error = await response.text();
+    throw new Error(`Failed to upload dataset: ${error}`);
+  }
+
+  return response.json();
+}
+
 /**
  * Fit Kaplan-Meier curves
  */
@@ -229,6 +261,67 @@ export async function fitSplineModel(
   return response.json();
 }
 
+export interface ModelGridEntry {
+  task: {
+    approach: string;
+    arm: string;
+    distribution?: string;
+    scale?: string;
+    knots?: number;
+    cutpoint?: number | number[];
+  };
+  result: ModelFitResult | null;
+  error: string | null;
+  elapsed_seconds: number;
+}
+
+export interface ModelGridResult {
+  results: ModelGridEntry[];
+  cutpoints: Record<string, number | number[]>;
+  cutpoint_results: Record<string, ChowTestResult>;
+  n_models: number;
+  n_failed: number;
+  workers: number;
+  elapsed_seconds: number;
+}
+
+/**
+ * Fit the whole model grid in one request. The service fans the models out
+ * across a process pool, so the dataset is sent once instead of per model.
+ */
+export async function fitModelGrid(
+  datasets: Record<string, ParquetData>,
+  options: {
+    approaches?: Array<'one-piece' | 'piecewise' | 'spline'>;
+    distributions?: string[];
+    scales?: Array<'hazard' | 'odds' | 'normal'>;
+    knots?: number[];
+    cutpoints?: Record<string, number | number[]>;
+    maxWorkers?: number;
+  } = {}
+): Promise<ModelGridResult> {
+  const response = await fetch(`${PYTHON_SERVICE_URL}/fit-grid`, {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify({
+      datasets,
+      approaches: options.approaches,
+      distributions: options.distributions,
+      scales: options.scales,
+      knots: options.knots,
+      cutpoints: options.cutpoints,
+      max_workers: options.maxWorkers,
+    }),
+  });
+
+  if (!response.ok) {
+    const error = await response.text();
+    throw new Error(`Failed to fit model grid: ${error}`);
+  }
+
+  return response.json();
+}
+
 /**
  * Generate dual plots for a model
  */